@@ -0,0 +1,383 @@
+import os
+import shutil
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Literal
+
+import numpy as np
+import pandas as pd
+
+from config import ConfigHandler, BACKTEST_LOOKBACK_HOURS, BACKTEST_LOOKBACK_DAYS, CHANGE_DETECTION
+from data_process.change_detector import ChangeDetector
+from data_process.sliding_window_max import SlidingWindowMax
+from dataio.bar_cache import HourlyBarCache
+from dataio.csv_handler import CSVReader, make_sure_path_exists
+from dataio.record_store import RecordStore
+from function_handler.day_function_handler import DayFunctionHandler
+from function_handler.hour_function_handler import HourlyFunctionHandler
+from function_handler.minute_function_handler import MinuteFunctionHandler
+from function_handler.new_hour_function_handler import NewHourFunctionHandler
+from function_handler.new_minute_function_handler import NewMinuteFunctionHandler
+from function_handler.rule_engine import RuleEngine
+from function_handler.tick_context import TickContext
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, "log", "backtest.log"))
+BACKTEST_FOLDER_PATH = os.path.join(PROJECT_ROOT_PATH, "result", "backtest")
+
+HANDLER_NAMES = ("hour", "new_hour", "day", "minute", "new_minute")
+BAR_COLUMNS = ['coin_name', 'spider_web', 'coin_price', 'time', 'high', 'low', 'open', 'close', 'change', 'amplitude',
+               'virtual_drop']
+
+
+class HistoryReader(CSVReader):
+    """
+    回测使用的读取器，接口与CSVReader相同。
+    回测开始前把回测区间以及之前lookback的小时K线、天K线一次性读入内存，小时K线保存在HourlyBarCache中，
+    之后函数处理器按时间范围取数据都是在内存中二分查找，不再每个tick读取文件。
+    clock为模拟的当前时间，只返回在这个时间之前已经写入的K线，不会用到未来的数据。
+    """
+
+    def __init__(self, data_region: str = 'China', **kwargs):
+        """
+        :param kwargs: 与CSVReader相同
+        """
+        super().__init__(data_region, **kwargs)
+        # 模拟的当前时间(该地区的时间)
+        self.clock = None
+        self.hour_cache = None
+        self.day_data = pd.DataFrame(columns=BAR_COLUMNS)
+
+    def load(self, start_datetime: datetime, end_datetime: datetime, lookback_hours: int, lookback_days: int):
+        """读取[start_datetime - lookback, end_datetime]内的小时K线和天K线"""
+        hour_start = start_datetime - timedelta(hours=lookback_hours)
+        window_hours = int((end_datetime - hour_start).total_seconds() // 3600) + 1
+        self.hour_cache = HourlyBarCache(self.base_file_path, window_hours)
+        hour_data = self.read_data_between_hours(hour_start, end_datetime)
+        self.hour_cache.seed(hour_data if not hour_data.empty else pd.DataFrame(columns=BAR_COLUMNS), hour_start)
+
+        day_data = super().get_data_between_days(start_datetime - timedelta(days=lookback_days), end_datetime, 'both')
+        self.day_data = day_data.sort_values('time', kind='mergesort').reset_index(drop=True)
+        logger.info(f"{self.base_file_path}: 读取小时K线{len(self.hour_cache.data)}条，天K线{len(self.day_data)}条")
+
+    def get_data_between_hours(self, start_datetime: datetime, end_datetime: datetime,
+                               inclusive: Literal["both", "neither", "left", "right"] = "both"):
+        """从内存中取出小时K线；小时K线在下一个整点写入，只返回时间早于clock的K线"""
+        if not self.hour_cache.covers(start_datetime):
+            logger.warning(f"{start_datetime}早于回测读取的小时K线，请增大lookback_hours")
+        if self.clock is not None and end_datetime >= self.clock:
+            end_datetime = self.clock
+            inclusive = 'left' if inclusive in ('both', 'left') else 'neither'
+        return self.hour_cache.get_between(start_datetime, end_datetime, inclusive)
+
+    def get_data_between_days(self, start_datetime: datetime, end_datetime: datetime,
+                              inclusive: Literal["both", "neither", "left", "right"] = "both"):
+        """从内存中取出天K线；0点写入的天K线时间为前一天的前一个小时，只返回时间不晚于clock前一天的K线"""
+        data = self.day_data
+        if data.empty:
+            return data.copy()
+        time_values = data['time'].values
+        left_side = 'left' if inclusive in ('both', 'left') else 'right'
+        right_side = 'right' if inclusive in ('both', 'right') else 'left'
+        start_index = np.searchsorted(time_values, np.datetime64(pd.Timestamp(start_datetime)), side=left_side)
+        end_index = np.searchsorted(time_values, np.datetime64(pd.Timestamp(end_datetime)), side=right_side)
+        if self.clock is not None:
+            visible_end = np.searchsorted(time_values, np.datetime64(pd.Timestamp(self.clock - timedelta(days=1))),
+                                          side='right')
+            end_index = min(end_index, visible_end)
+        return data.iloc[start_index:end_index].copy()
+
+    def get_bars_at(self, bar_datetime: datetime) -> pd.DataFrame:
+        """某一个时刻的小时K线，即实盘中该时刻的下一个整点计算出的数据"""
+        return self.hour_cache.get_between(bar_datetime, bar_datetime, 'both')
+
+    def get_day_bars_at(self, bar_datetime: datetime) -> pd.DataFrame:
+        """某一个时刻的天K线"""
+        return self.day_data[self.day_data['time'] == pd.Timestamp(bar_datetime)].reset_index(drop=True)
+
+
+@dataclass
+class BacktestReport:
+    """一次回测的结果：按时间排列的提醒、各阶段的耗时"""
+    alerts: pd.DataFrame
+    timings: pd.DataFrame
+    ticks: int
+    wall_seconds: float
+    output_folder: str
+
+    def __str__(self):
+        return (f"回测{self.ticks}个tick，耗时{self.wall_seconds:.1f}秒，提醒{len(self.alerts)}条，"
+                f"结果保存在{self.output_folder}\n{self.timings.head(15).to_string(index=False)}")
+
+
+class Backtester:
+    """
+    回测：用模拟时钟重放data/<地区>中保存的历史K线，驱动与实盘相同的小时、天、分钟函数处理器(v1和v2)，
+    输出每个tick的提醒(send_messages以及函数中发送的邮件)和各阶段的耗时。
+    与实盘的对应关系(与ProgramCotroller相同)：
+    1.每个整点C执行小时函数，数据为时间C-1小时的小时K线；
+    2.国内0点执行国内天函数，国内8点(国际0点)执行国际天函数；
+    3.分钟函数在同一个整点的小时函数之后执行。详情数据(分钟数据)只保存当前小时，
+      没有传入minute_data时每个整点用该小时K线的coin_price(即整点时的价格)作为分钟数据。
+    函数处理器使用单独的记录目录，邮件只收集不发送，不影响实盘的记录。
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: start_datetime: 回测开始时间(国内时间)，取整到整点
+                       end_datetime: 回测结束时间(包含)，取整到整点
+                       config_file: 配置文件，默认为项目中的config.xml
+                       base_file_path: {地区: 数据目录}，默认为data/China和data/Foreign
+                       output_folder: 输出提醒、耗时以及函数运行记录的目录，默认为result/backtest/<开始时间>_<结束时间>
+                       minute_data: 分钟数据，字段为coin_name, spider_web, coin_price, time，为空时使用小时K线的价格
+                       handlers: 需要回测的函数处理器，默认为HANDLER_NAMES中的全部
+                       storage_engine: 小时和天数据的存储引擎
+                       lookback_hours / lookback_days: 回测开始前额外读取的小时数和天数
+                       change_detection: 分钟函数是否只重新计算价格变化的币种
+        """
+        self.start_datetime = kwargs.get('start_datetime').replace(minute=0, second=0, microsecond=0)
+        self.end_datetime = kwargs.get('end_datetime').replace(minute=0, second=0, microsecond=0)
+        if self.start_datetime > self.end_datetime:
+            raise ValueError(f'回测开始时间{self.start_datetime}晚于结束时间{self.end_datetime}')
+        self.handler_names = tuple(kwargs.get('handlers') or HANDLER_NAMES)
+        unknown_names = set(self.handler_names) - set(HANDLER_NAMES)
+        if unknown_names:
+            raise ValueError(f'不支持的函数处理器: {unknown_names}')
+        self.output_folder = kwargs.get('output_folder') or os.path.join(
+            BACKTEST_FOLDER_PATH, f"{self.start_datetime:%Y%m%d%H}_{self.end_datetime:%Y%m%d%H}")
+        self.record_data_folder = os.path.join(self.output_folder, 'record_data')
+        self.minute_data = kwargs.get('minute_data', None)
+        self.lookback_hours = int(kwargs.get('lookback_hours', BACKTEST_LOOKBACK_HOURS))
+        self.lookback_days = int(kwargs.get('lookback_days', BACKTEST_LOOKBACK_DAYS))
+        self.change_detection = kwargs.get('change_detection', CHANGE_DETECTION)
+
+        self.config_handler = ConfigHandler(kwargs.get('config_file') or os.path.join(PROJECT_ROOT_PATH, 'config.xml'))
+        self.config_handler.load_config()
+        base_file_path = kwargs.get('base_file_path') or {
+            region: os.path.join(PROJECT_ROOT_PATH, 'data', region) for region in ("China", "Foreign")}
+        self.readers = {region: HistoryReader(data_region=region, base_file_path=path,
+                                              storage_engine=kwargs.get('storage_engine'))
+                        for region, path in base_file_path.items()}
+
+        self.handlers = {}
+        self.alerts = []
+        # {阶段: [执行次数, 耗时]}
+        self.timings = defaultdict(lambda: [0, 0.0])
+        # 当前tick的时间和正在执行的函数处理器，收集邮件时使用
+        self.clock = None
+        self.cur_handler_name = None
+
+    def record_time(self, stage: str, seconds: float, calls: int = 1):
+        self.timings[stage][0] += calls
+        self.timings[stage][1] += seconds
+
+    def timed(self, stage: str, func):
+        """记录func每次执行的耗时，函数处理器中的函数失败时也记录"""
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record_time(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    def collect_email(self, subject, content, test=True):
+        """代替send_email，把函数中发送的邮件加入提醒"""
+        self.alerts.append(pd.DataFrame({'time': [self.clock], 'handler': [self.cur_handler_name],
+                                         'func': [subject], 'content': [content]}))
+
+    def collect_messages(self, name: str, function_handler):
+        """把函数处理器本次的结果加入提醒"""
+        for key, value in function_handler.send_messages.items():
+            if isinstance(value, pd.DataFrame) and not value.empty:
+                alert = value.copy()
+                alert.insert(0, 'func', key)
+                alert.insert(0, 'handler', name)
+                alert.insert(0, 'time', self.clock)
+                self.alerts.append(alert)
+
+    def prepare_output(self):
+        """清空上一次相同回测的函数运行记录"""
+        if os.path.exists(self.record_data_folder):
+            shutil.rmtree(self.record_data_folder)
+        make_sure_path_exists(self.record_data_folder)
+        RecordStore.clear_all(self.record_data_folder)
+
+    def create_function_handler(self):
+        """与ProgramCotroller.create_function_handler、add_funtion_to_handler相同，记录目录和邮件替换为回测的"""
+        china_reader = self.readers["China"]
+        config = self.config_handler.config
+        rule_engine = RuleEngine(config_handler=self.config_handler)
+        common = {'data': None, 'rule_engine': rule_engine, 'reader': china_reader, 'writer': None,
+                  'datetime': self.start_datetime, 'record_data_folder': self.record_data_folder,
+                  'email_sender': self.collect_email}
+        self.max_price_window = SlidingWindowMax(
+            checkpoint_path=os.path.join(self.record_data_folder, "45_day_max_price_window.csv"),
+            summary_path=os.path.join(self.record_data_folder, "45_day_max_price.csv"),
+            window_days=45,
+        )
+        handlers = {
+            "hour": HourlyFunctionHandler(config=config.get('hour_function'), **common),
+            "new_hour": NewHourFunctionHandler(config=config.get('hour_function'), **common),
+            "day": DayFunctionHandler(config=config.get('day_function'), **common),
+            "minute": MinuteFunctionHandler(config=config.get('minute_function'),
+                                            max_price_window=self.max_price_window, **common),
+            "new_minute": NewMinuteFunctionHandler(config=config.get('minute_function'), **common),
+        }
+        functions = {
+            "hour": ['hour_func_1_base', 'apply_condition_1_to_func_1_base', 'apply_condition_2_to_func_1_base',
+                     'add_filte_in_minute_and_hour'],
+            "new_hour": ['func_1', 'add_filte_in_minute_and_hour'],
+            "day": ['func_1', 'func_2'],
+            "minute": ['minute_func_1_base', 'apply_condition_1_to_func_1_base', 'add_filte_in_minute_and_hour'],
+            "new_minute": ['func_1', 'add_filte_in_minute_and_hour'],
+        }
+        for name in self.handler_names:
+            function_handler = handlers[name]
+            function_handler.add_function([self.timed(f"{name}.{func_name}", getattr(function_handler, func_name))
+                                           for func_name in functions[name]])
+            self.handlers[name] = function_handler
+
+    def get_minute_data(self, cur_datetime: datetime) -> pd.DataFrame:
+        """当前整点的分钟数据"""
+        if self.minute_data is not None:
+            minute_data = self.minute_data[self.minute_data['time'] == pd.Timestamp(cur_datetime)]
+            return minute_data.reset_index(drop=True)
+        bars = self.readers["China"].get_bars_at(cur_datetime - timedelta(hours=1))
+        minute_data = bars[['coin_name', 'spider_web', 'coin_price']].reset_index(drop=True)
+        minute_data['time'] = cur_datetime
+        return minute_data
+
+    def get_tick_times(self) -> list:
+        """模拟时钟的所有tick，有分钟数据时为其中的每一分钟，否则为每个整点"""
+        if self.minute_data is not None:
+            times = pd.to_datetime(self.minute_data['time']).drop_duplicates().sort_values()
+            times = times[times.between(self.start_datetime, self.end_datetime + timedelta(minutes=59))]
+            return [time_value.to_pydatetime() for time_value in times]
+        hours = int((self.end_datetime - self.start_datetime).total_seconds() // 3600)
+        return [self.start_datetime + timedelta(hours=hour) for hour in range(hours + 1)]
+
+    def run_handler(self, name: str, run_func, *args):
+        function_handler = self.handlers.get(name)
+        if function_handler is None:
+            return
+        self.cur_handler_name = name
+        start = time.perf_counter()
+        run_func(function_handler, *args)
+        self.record_time(name, time.perf_counter() - start)
+        self.collect_messages(name, function_handler)
+
+    @staticmethod
+    def reset_handler(function_handler, cur_data, cur_datetime: datetime, tick_context: TickContext = None):
+        function_handler.data = cur_data
+        function_handler.tick_context = tick_context
+        function_handler.datetime = cur_datetime
+        function_handler.price_comparison_results.clear()
+        function_handler.send_messages.clear()
+
+    def execute_hour_handler(self, function_handler, cur_data, cur_datetime: datetime, tick_context: TickContext):
+        """与ProgramCotroller.execute_hour_handler相同"""
+        pre_hour_datetime = cur_datetime - timedelta(hours=1)
+        self.reset_handler(function_handler, cur_data, pre_hour_datetime, tick_context)
+        function_handler.get_range_data_hours(pre_hour_datetime - timedelta(hours=24), cur_datetime, inclusive="left")
+        function_handler.execute_all()
+
+    def execute_day_handler(self, function_handler, data_region: str, cur_datetime: datetime):
+        """与ProgramCotroller.execute_day_function相同，cur_datetime为执行时间(国内时间)"""
+        reader = self.readers[data_region]
+        # 国际0点为国内8点，国际数据的时间比国内早8小时
+        region_datetime = cur_datetime - timedelta(hours=8) if data_region == "Foreign" else cur_datetime
+        cur_data = reader.get_day_bars_at(region_datetime - timedelta(days=1) - timedelta(hours=1))
+        if data_region == "China":
+            binance_data = cur_data[cur_data["spider_web"] == "binance"]
+            self.max_price_window.update(binance_data, cur_datetime - timedelta(days=1))
+        pre_day_datetime = cur_datetime - timedelta(days=1)
+        self.reset_handler(function_handler, cur_data, pre_day_datetime)
+        function_handler.csv_reader = reader
+        function_handler.get_range_data_days(pre_day_datetime - timedelta(days=24), pre_day_datetime, inclusive="left")
+        function_handler.execute_all()
+
+    def execute_minute_handler(self, function_handler, cur_data, cur_datetime: datetime, changes: dict,
+                               tick_context: TickContext):
+        """与ProgramCotroller.execute_minute_handler相同"""
+        self.reset_handler(function_handler, cur_data, cur_datetime, tick_context)
+        function_handler.price_changes = changes
+        function_handler.get_range_data_hours((cur_datetime - timedelta(hours=24)).replace(minute=0), cur_datetime,
+                                              inclusive="left")
+        function_handler.execute_all()
+
+    def run_tick(self, cur_datetime: datetime, change_detector: ChangeDetector = None):
+        """执行一个tick，顺序与实盘的依赖图相同：v1、v2的分钟函数分别在各自的小时函数之后执行"""
+        self.clock = cur_datetime
+        self.readers["China"].clock = cur_datetime
+        if "Foreign" in self.readers:
+            self.readers["Foreign"].clock = cur_datetime - timedelta(hours=8)
+        minute_data = self.get_minute_data(cur_datetime)
+        changes = change_detector.update(minute_data) if change_detector is not None else None
+        tick_context = TickContext(data=minute_data, datetime=cur_datetime, reader=self.readers["China"])
+
+        if cur_datetime.minute == 0:
+            hour_data = self.readers["China"].get_bars_at(cur_datetime - timedelta(hours=1))
+            for name in ("hour", "new_hour"):
+                self.run_handler(name, self.execute_hour_handler, hour_data, cur_datetime, tick_context)
+            if cur_datetime.hour == 0:
+                self.run_handler("day", self.execute_day_handler, "China", cur_datetime)
+            if cur_datetime.hour == 8 and "Foreign" in self.readers:
+                self.run_handler("day", self.execute_day_handler, "Foreign", cur_datetime)
+        if not minute_data.empty:
+            for name in ("minute", "new_minute"):
+                self.run_handler(name, self.execute_minute_handler, minute_data, cur_datetime, changes, tick_context)
+
+        for name, metrics in tick_context.get_metrics().items():
+            self.record_time(f"shared.{name}", metrics.get('seconds', 0), int(metrics.get('misses', 0)))
+
+    def get_timings(self) -> pd.DataFrame:
+        timings = pd.DataFrame([(stage, calls, seconds) for stage, (calls, seconds) in self.timings.items()],
+                               columns=['stage', 'calls', 'seconds'])
+        timings['mean_ms'] = (timings['seconds'] / timings['calls'].clip(lower=1) * 1000).round(2)
+        timings['seconds'] = timings['seconds'].round(3)
+        return timings.sort_values('seconds', ascending=False, kind='mergesort').reset_index(drop=True)
+
+    def run(self) -> BacktestReport:
+        """执行回测，提醒和耗时同时写入输出目录的alerts.csv和timings.csv"""
+        wall_start = time.perf_counter()
+        self.alerts = []
+        self.timings.clear()
+        self.prepare_output()
+
+        start = time.perf_counter()
+        for reader in self.readers.values():
+            reader.load(self.start_datetime, self.end_datetime, self.lookback_hours, self.lookback_days)
+        self.record_time("load", time.perf_counter() - start)
+        self.create_function_handler()
+
+        change_detector = ChangeDetector() if self.change_detection else None
+        tick_times = self.get_tick_times()
+        for index, cur_datetime in enumerate(tick_times):
+            start = time.perf_counter()
+            self.run_tick(cur_datetime, change_detector)
+            self.record_time("tick", time.perf_counter() - start)
+            if cur_datetime.minute == 0 and cur_datetime.hour == 0:
+                logger.info(f"回测进度{index + 1}/{len(tick_times)}，当前时间{cur_datetime}")
+
+        alerts = pd.concat(self.alerts, ignore_index=True) if self.alerts else pd.DataFrame(
+            columns=['time', 'handler', 'func'])
+        timings = self.get_timings()
+        alerts.to_csv(os.path.join(self.output_folder, 'alerts.csv'), index=False, encoding='utf-8')
+        timings.to_csv(os.path.join(self.output_folder, 'timings.csv'), index=False, encoding='utf-8')
+        report = BacktestReport(alerts=alerts, timings=timings, ticks=len(tick_times),
+                                wall_seconds=time.perf_counter() - wall_start, output_folder=self.output_folder)
+        logger.info(str(report))
+        return report
+
+
+if __name__ == "__main__":
+    end_datetime = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+    backtester = Backtester(start_datetime=end_datetime - timedelta(days=30), end_datetime=end_datetime)
+    print(backtester.run())
@@ -38,6 +38,10 @@ class ConfigHandler:
             return {child.tag: self._parse_element(child) for child in element}
         return element.text.strip() if element.text else None
 
+    def get_rules(self) -> dict:
+        """<rules>下定义的规则，{规则名: 规则配置}"""
+        return (self.config or {}).get('rules') or {}
+
     def check_and_reload(self):
         try:
             modified_time = os.path.getmtime(self.file_path)
@@ -74,6 +78,21 @@ configHandler.start_monitoring(5)
 minute_function_config = configHandler.config.get('minute_function')
 hour_function_config = configHandler.config.get('hour_function')
 day_function_config = configHandler.config.get('day_function')
+STORAGE_ENGINE = (configHandler.config.get('dataio') or {}).get('storage_engine', 'csv')
+BAR_CACHE_HOURS = int((configHandler.config.get('dataio') or {}).get('bar_cache_hours') or 0)
+SCHEDULER_OVERRUN_POLICY = (configHandler.config.get('scheduler') or {}).get('overrun_policy') or 'coalesce'
+SCHEDULER_MAX_CATCH_UP = int((configHandler.config.get('scheduler') or {}).get('max_catch_up') or 5)
+PIPELINE_QUEUE_SIZE = int((configHandler.config.get('scheduler') or {}).get('pipeline_queue_size') or 2)
+EVALUATE_WORKERS = int((configHandler.config.get('scheduler') or {}).get('evaluate_workers') or 4)
+NUM_SHARDS = int((configHandler.config.get('function_handler') or {}).get('num_shards') or 0)
+SHARD_MIN_ROWS = int((configHandler.config.get('function_handler') or {}).get('shard_min_rows') or 20000)
+CHANGE_DETECTION = (configHandler.config.get('function_handler') or {}).get('change_detection', '1') == '1'
+BACKTEST_LOOKBACK_HOURS = int((configHandler.config.get('backtest') or {}).get('lookback_hours') or 72)
+BACKTEST_LOOKBACK_DAYS = int((configHandler.config.get('backtest') or {}).get('lookback_days') or 52)
+REQUEST_MAX_CONCURRENCY = int((configHandler.config.get('spider') or {}).get('max_concurrency') or 16)
+REQUEST_TIMEOUT = float((configHandler.config.get('spider') or {}).get('request_timeout') or 10)
+SELENIUM_BULK_EXTRACT = (configHandler.config.get('spider') or {}).get('selenium_bulk_extract', '1') == '1'
+SELENIUM_OBSERVE_MUTATIONS = (configHandler.config.get('spider') or {}).get('selenium_observe_mutations', '1') == '1'
 
 CONFIG_JSON = {
     'coin-stats': {
@@ -89,7 +108,10 @@ CONFIG_JSON = {
         'request_method': 'get',
         'coins_key': ['data'],
         'price_key': 'c',
-        'name_key': 'b'
+        'name_key': 'b',
+        # 只保留计价单位为USDT的数据
+        'quote_key': 'q',
+        'quote': 'USDT'
     },
     'gate': {
         'url': "https://www.gate.io/api-price/api/inner/v2/price/getAllCoinList",
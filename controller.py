@@ -8,6 +8,7 @@ from datetime import datetime, timedelta
 from decimal import Decimal
 from xml.etree import ElementTree
 import collections
+from functools import partial
 
 
 base_folder = os.path.join(os.path.dirname(__file__), "log")
@@ -17,7 +18,15 @@ if not os.path.exists(base_folder):
 from get_data_by_spider.get_data import DataGetter
 from dataio.csv_handler import CSVReader, CSVWriter, make_sure_path_exists
 from data_process.data_process import DataProcess
-from config import SpiderWeb, hour_function_description, minute_function_description, ConfigHandler, day_function_description
+from data_process.bar_accumulator import MinuteBarAccumulator
+from data_process.change_detector import ChangeDetector
+from data_process.sliding_window_max import SlidingWindowMax
+from scheduler import MinuteScheduler
+from pipeline import Pipeline, StageBarrier
+from task_graph import TaskGraph
+from config import SpiderWeb, hour_function_description, minute_function_description, ConfigHandler, day_function_description, \
+    STORAGE_ENGINE, BAR_CACHE_HOURS, SCHEDULER_OVERRUN_POLICY, SCHEDULER_MAX_CATCH_UP, \
+    PIPELINE_QUEUE_SIZE, EVALUATE_WORKERS, NUM_SHARDS, SHARD_MIN_ROWS, CHANGE_DETECTION
 from msg_log.mylog import get_logger
 from function_handler.minute_function_handler import MinuteFunctionHandler
 from function_handler.hour_function_handler import HourlyFunctionHandler
@@ -25,6 +34,9 @@ from function_handler.day_function_handler import DayFunctionHandler
 from msg_log.msg_send import send_email
 from function_handler.new_hour_function_handler import NewHourFunctionHandler
 from function_handler.new_minute_function_handler import NewMinuteFunctionHandler
+from function_handler.shard_executor import ShardExecutor
+from function_handler.tick_context import TickContext
+from function_handler.rule_engine import RuleEngine
 
 PROJECT_ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
 logger = get_logger(
@@ -45,13 +57,35 @@ class ProgramCotroller:
         self.threads = None
         self.foreign_time = None
         self.cur_minute = None
+        self.is_test = kwargs.get('is_test', False)
+        # 调度线程中当前分钟爬取的数据，由prepare_tick生成，submit_tick提交到流水线
+        self.pending_tick = None
+        self.pipeline = None
+        # K线计算阶段写入整点、0点的K线前，等待已交给函数执行阶段的tick全部执行完，
+        # 避免上一分钟的函数读到本分钟才生成的K线
+        self.evaluate_barrier = StageBarrier()
+        # 函数并行执行的线程数
+        self.evaluate_workers = kwargs.get('evaluate_workers', 4)
         logger.info("初始化读写器")
+        storage_engine = kwargs.get('storage_engine', STORAGE_ENGINE)
+        bar_cache_hours = kwargs.get('bar_cache_hours', BAR_CACHE_HOURS)
+        # K线计算使用的读取器，路径随change_data_region改变，只在流水线的K线计算阶段使用
         self.reader = CSVReader(
-            data_region=data_region, base_file_path=self.base_file_path.get(data_region)
-        )
-        self.writer = CSVWriter(
-            data_region=data_region, base_file_path=self.base_file_path.get(data_region)
+            data_region=data_region, base_file_path=self.base_file_path.get(data_region),
+            storage_engine=storage_engine, bar_cache_hours=bar_cache_hours
         )
+        # 写入器每个地区一个，不随change_data_region改变，K线计算和函数执行可以同时写入
+        self.writers = {
+            region: CSVWriter(data_region=region, base_file_path=self.base_file_path.get(region),
+                              storage_engine=storage_engine, bar_cache_hours=bar_cache_hours)
+            for region in ("China", "Foreign")
+        }
+        # 函数处理器使用的读取器，每个地区一个，不随change_data_region改变，多个函数可以同时读取不同地区的数据
+        self.handler_readers = {
+            region: CSVReader(data_region=region, base_file_path=self.base_file_path.get(region),
+                              storage_engine=storage_engine, bar_cache_hours=bar_cache_hours)
+            for region in ("China", "Foreign")
+        }
 
         self.config_handler = ConfigHandler(kwargs.get('config_file'))
         self.cur_datetime = datetime.now().replace(second=0)
@@ -65,21 +99,39 @@ class ProgramCotroller:
         self.coin_stats_data_getter = DataGetter(SpiderWeb.COIN_STATS)
         self.lock = Lock()
         logger.info("初始化数据处理器")
+        self.bar_accumulator = MinuteBarAccumulator(
+            checkpoint_path=os.path.join(self.base_file_path.get("China"), "bar_accumulator.csv")
+        )
+        # 45天最高价的滑动窗口，每天0点更新，分钟函数直接读取
+        self.max_price_window = SlidingWindowMax(
+            checkpoint_path=os.path.join(PROJECT_ROOT_PATH, "function_handler", "record_data",
+                                         "45_day_max_price_window.csv"),
+            summary_path=os.path.join(PROJECT_ROOT_PATH, "function_handler", "record_data", "45_day_max_price.csv"),
+            window_days=45,
+        )
+        # AB时刻的筛选按币种分片在多个进程中执行，分片数为0或1时不使用进程池
+        num_shards = int(kwargs.get('num_shards', NUM_SHARDS))
+        self.shard_executor = ShardExecutor(
+            num_shards=num_shards, min_rows=kwargs.get('shard_min_rows', SHARD_MIN_ROWS)
+        ) if num_shards > 1 else None
+        # 每分钟数据与上一分钟比较，分钟函数只重新计算价格变化的币种
+        self.change_detector = ChangeDetector() if kwargs.get('change_detection', CHANGE_DETECTION) else None
         self.data_processer = DataProcess(
             data=pd.DataFrame(),
             data_region=data_region,
             unit_time="hour",
-            writer=self.writer,
+            writer=self.writers[data_region],
             reader=self.reader,
             time=self.cur_time,
             datetime=self.cur_datetime,
+            bar_accumulator=self.bar_accumulator,
         )
         logger.info("初始化成功")
 
     def change_data_region(self, data_region: Literal["China", "Foreign"]):
-        """改变读写器路径"""
+        """改变K线计算使用的读取器路径和写入器"""
         self.reader.base_file_path = self.base_file_path.get(data_region)
-        self.writer.base_file_path = self.base_file_path.get(data_region)
+        self.data_processer.csv_writer = self.writers[data_region]
 
     def change_data_processer(
             self,
@@ -97,16 +149,16 @@ class ProgramCotroller:
         self.data_processer.data_region = data_region
         self.data_processer.datetime = cur_datetime
 
-    def add_time_column(self, data: pd.DataFrame):
+    def add_time_column(self, data: pd.DataFrame, cur_datetime: datetime = None):
         """为当前数据加上时间列"""
         if not data.empty:
-            data["time"] = self.cur_datetime
+            data["time"] = cur_datetime or self.cur_datetime
         return data
 
     def get_data(self, data_getter: DataGetter, **kwargs):
         """通过爬虫获取数据"""
         try:
-            data_getter.get_data().filter_data()
+            data_getter.get_data()
         except ConnectionError:
             logger.warning("连接失败")
         data = data_getter.data
@@ -153,38 +205,10 @@ class ProgramCotroller:
         self.pre_hour_datetime = cur_datetime - timedelta(hours=1)
         self.pre_day_datetime = cur_datetime - timedelta(days=1)
 
-    @staticmethod
-    def update_45_day_max_price(cur_day_data: pd.DataFrame):
-        file_path = os.path.join(
-            PROJECT_ROOT_PATH, "function_handler", "record_data", "45_day_max_price.csv"
-        )
-        max_price_45_day_data = pd.read_csv(
-            file_path, encoding="utf-8", low_memory=False
-        )
-        max_price_45_day_data["max_price_in_45_day"] = max_price_45_day_data[
-            "max_price_in_45_day"
-        ].apply(Decimal)
-        cur_day_data = cur_day_data[cur_day_data["spider_web"] == "binance"].copy()
-        cur_data_high = (
-            cur_day_data.groupby("coin_name")["high"]
-            .apply("max")
-            .reset_index(drop=False)
-        )
-        # 如果当前最高价高于45天最高价，则更新45天最高价
-        merged_data = max_price_45_day_data.merge(
-            cur_data_high, on="coin_name", how="outer"
-        )
-        merged_data = merged_data.fillna(Decimal("0"))
-        merged_data["max_price_in_45_day"] = merged_data.apply(
-            lambda x: (
-                x["high"]
-                if x["high"] > x["max_price_in_45_day"]
-                else x["max_price_in_45_day"]
-            ),
-            axis=1,
-        )
-        merged_data.drop(columns=["high"], inplace=True)
-        merged_data.to_csv(file_path, index=False, encoding="utf-8")
+    def update_45_day_max_price(self, cur_day_data: pd.DataFrame):
+        """用币安前一天的最高价更新45天最高价，超过45天的最高价会被移出窗口"""
+        cur_day_data = cur_day_data[cur_day_data["spider_web"] == "binance"]
+        self.max_price_window.update(cur_day_data, self.cur_datetime - timedelta(days=1))
 
     def hours_data_process(self, combined_data):
         logger.info("计算国内整点数据")
@@ -200,12 +224,11 @@ class ProgramCotroller:
         pre_time = self.cur_datetime - timedelta(hours=1)
         calculated_data["time"] = pre_time
         logger.info("计算完成，写入数据")
-        self.writer.write_data(calculated_data, unit_time="hour")
+        self.writers["China"].write_data(calculated_data, unit_time="hour")
         logger.info("写入完成，生成国际数据")
         foreign_calculated_data = calculated_data.copy()
         foreign_calculated_data["time"] = self.foreign_datetime - timedelta(hours=1)
-        self.change_data_region("Foreign")
-        self.writer.write_data(foreign_calculated_data, unit_time="hour")
+        self.writers["Foreign"].write_data(foreign_calculated_data, unit_time="hour")
         logger.info("国际数据写入完成")
         return calculated_data
 
@@ -228,44 +251,55 @@ class ProgramCotroller:
                 cur_datetime - timedelta(days=1) - timedelta(hours=1)
         )
         logger.info("计算完成，写入数据")
-        self.writer.write_data(calculated_data_day, unit_time="day")
+        self.writers[data_region].write_data(calculated_data_day, unit_time="day")
         logger.info("写入完成")
         return calculated_data_day
 
     def create_function_handler(self):
         """创建函数处理器"""
+        # 所有函数处理器共用一个规则引擎，规则从config_handler中读取，配置文件变化后重新编译
+        self.rule_engine = RuleEngine(config_handler=self.config_handler)
         self.hourfunctionhandler = HourlyFunctionHandler(
             data=None,
-            reader=self.reader,
-            writer=self.writer,
+            rule_engine=self.rule_engine,
+            reader=self.handler_readers["China"],
+            writer=self.writers["China"],
+            shard_executor=self.shard_executor,
             datetime=self.cur_datetime,
             config=self.config_handler.config.get('hour_function')
         )
         self.new_hour_functionhandler = NewHourFunctionHandler(
             data=None,
-            reader=self.reader,
-            writer=self.writer,
+            rule_engine=self.rule_engine,
+            reader=self.handler_readers["China"],
+            writer=self.writers["China"],
             datetime=self.cur_datetime,
             config=self.config_handler.config.get('hour_function')
         )
         self.dayfunctionhandler = DayFunctionHandler(
             data=None,
-            reader=self.reader,
-            writer=self.writer,
+            rule_engine=self.rule_engine,
+            reader=self.handler_readers["China"],
+            writer=self.writers["China"],
             datetime=self.cur_datetime,
             config=self.config_handler.config.get('day_function')
         )
         self.minutefunctionhandler = MinuteFunctionHandler(
             data=None,
-            reader=self.reader,
-            writer=self.writer,
+            rule_engine=self.rule_engine,
+            reader=self.handler_readers["China"],
+            writer=self.writers["China"],
+            shard_executor=self.shard_executor,
             datetime=self.cur_datetime,
-            config=self.config_handler.config.get('minute_function')
+            config=self.config_handler.config.get('minute_function'),
+            max_price_window=self.max_price_window
         )
         self.new_minute_functionhandler = NewMinuteFunctionHandler(
             data=None,
-            reader=self.reader,
-            writer=self.writer,
+            rule_engine=self.rule_engine,
+            reader=self.handler_readers["China"],
+            writer=self.writers["China"],
+            shard_executor=self.shard_executor,
             datetime=self.cur_datetime,
             config=self.config_handler.config.get('minute_function')
         )
@@ -300,64 +334,80 @@ class ProgramCotroller:
                                                           self.new_minute_functionhandler.add_filte_in_minute_and_hour])
 
     # 执行小时函数
-    def execute_hour_function(self, cur_data):
+    def execute_hour_function(self, cur_data, cur_datetime: datetime = None):
+        self.execute_hour_handler(self.hourfunctionhandler, cur_data, cur_datetime)
+        self.execute_hour_handler(self.new_hour_functionhandler, cur_data, cur_datetime)
+
+    def execute_hour_handler(self, function_handler, cur_data, cur_datetime: datetime = None,
+                             tick_context: TickContext = None):
+        """
+        执行一个小时函数处理器，cur_datetime为当前整点，为空时使用控制器的当前时间
+        :param tick_context: 本tick共享的上下文，为空时中间结果都由该函数处理器自己计算
+        """
+        cur_datetime = cur_datetime or self.cur_datetime
+        pre_hour_datetime = cur_datetime - timedelta(hours=1)
         # 更新数据以及相关信息
-        self.hourfunctionhandler.data = cur_data
-        self.change_data_region("China")
-        self.hourfunctionhandler.price_comparison_results.clear()
-        self.hourfunctionhandler.send_messages.clear()
+        function_handler.data = cur_data
+        function_handler.tick_context = tick_context
+        function_handler.csv_reader = self.handler_readers["China"]
+        function_handler.price_comparison_results.clear()
+        function_handler.send_messages.clear()
         # 时间
-        self.hourfunctionhandler.datetime = self.pre_hour_datetime
+        function_handler.datetime = pre_hour_datetime
         # 数据
-        pre_24_hours_datetime = self.pre_hour_datetime - timedelta(hours=24)
-        self.hourfunctionhandler.get_range_data_hours(
-            pre_24_hours_datetime, self.cur_datetime, inclusive="left"
-        )
-        self.hourfunctionhandler.execute_all()
-
-        self.new_hour_functionhandler.data = cur_data
-        self.new_hour_functionhandler.price_comparison_results.clear()
-        self.new_hour_functionhandler.send_messages.clear()
-        self.new_hour_functionhandler.datetime = self.pre_hour_datetime
-        pre_24_hours_datetime = self.pre_hour_datetime - timedelta(hours=24)
-        self.new_hour_functionhandler.get_range_data_hours(
-            pre_24_hours_datetime, self.cur_datetime, inclusive="left"
+        pre_24_hours_datetime = pre_hour_datetime - timedelta(hours=24)
+        function_handler.get_range_data_hours(
+            pre_24_hours_datetime, cur_datetime, inclusive="left"
         )
-        self.new_hour_functionhandler.execute_all()
+        function_handler.execute_all()
 
     # 执行日函数
-    def execute_day_function(self, cur_data):
+    def execute_day_function(self, cur_data, cur_datetime: datetime = None,
+                             data_region: Literal["China", "Foreign"] = None):
+        """
+        :param cur_datetime: 0点任务执行的时间(国内时间)，为空时使用控制器的当前时间
+        :param data_region: 读取数据的地区，为空时使用读取器当前的路径
+        """
+        pre_day_datetime = cur_datetime - timedelta(days=1) if cur_datetime else self.pre_day_datetime
+        self.dayfunctionhandler.csv_reader = self.handler_readers[data_region] if data_region else self.reader
         self.dayfunctionhandler.data = cur_data
-        self.dayfunctionhandler.datetime = self.pre_day_datetime
+        self.dayfunctionhandler.datetime = pre_day_datetime
 
-        pre_four_days_datetime = self.pre_day_datetime - timedelta(days=24)
+        pre_four_days_datetime = pre_day_datetime - timedelta(days=24)
         self.dayfunctionhandler.get_range_data_days(
-            pre_four_days_datetime, self.pre_day_datetime, inclusive="left"
+            pre_four_days_datetime, pre_day_datetime, inclusive="left"
         )
         self.dayfunctionhandler.execute_all()
 
-    def execute_minute_function(self, cur_data):
-        self.minutefunctionhandler.data = cur_data
-        self.minutefunctionhandler.datetime = self.cur_datetime
-        self.minutefunctionhandler.price_comparison_results.clear()
-        self.minutefunctionhandler.send_messages.clear()
-        pre_24_hours_datetime = (self.cur_datetime - timedelta(hours=24)).replace(minute=0)
-        self.minutefunctionhandler.get_range_data_hours(
-            pre_24_hours_datetime, self.cur_datetime, inclusive="left"
+    def execute_minute_function(self, cur_data, cur_datetime: datetime = None):
+        self.execute_minute_handler(self.minutefunctionhandler, cur_data, cur_datetime)
+        self.execute_minute_handler(self.new_minute_functionhandler, cur_data, cur_datetime)
+
+    def execute_minute_handler(self, function_handler, cur_data, cur_datetime: datetime = None, changes: dict = None,
+                               tick_context: TickContext = None):
+        """
+        执行一个分钟函数处理器
+        :param changes: 本分钟的价格变化集，为空时所有币种都重新计算
+        :param tick_context: 本tick共享的上下文，为空时中间结果都由该函数处理器自己计算
+        """
+        cur_datetime = cur_datetime or self.cur_datetime
+        function_handler.data = cur_data
+        function_handler.price_changes = changes
+        function_handler.tick_context = tick_context
+        function_handler.datetime = cur_datetime
+        function_handler.price_comparison_results.clear()
+        function_handler.send_messages.clear()
+        pre_24_hours_datetime = (cur_datetime - timedelta(hours=24)).replace(minute=0)
+        function_handler.get_range_data_hours(
+            pre_24_hours_datetime, cur_datetime, inclusive="left"
         )
-        self.minutefunctionhandler.execute_all()
-
-        self.new_minute_functionhandler.data = cur_data
-        self.new_minute_functionhandler.price_comparison_results.clear()
-        self.new_minute_functionhandler.send_messages.clear()
-        self.new_minute_functionhandler.datetime = self.cur_datetime
-        pre_24_hours_datetime = (self.cur_datetime - timedelta(hours=24)).replace(minute=0)
-        self.new_minute_functionhandler.get_range_data_hours(
-            pre_24_hours_datetime, self.cur_datetime, inclusive="left"
-        )
-        self.new_minute_functionhandler.execute_all()
+        function_handler.execute_all()
 
-    def result_record(self, unit_time: Literal["hour", "day", "minute", "new_hour", "new_minute"]):
+    def result_record(self, unit_time: Literal["hour", "day", "minute", "new_hour", "new_minute"],
+                      messages: dict = None):
+        """
+        :param messages: 函数结果，为空时使用函数处理器当前的结果
+        """
         make_sure_path_exists(RESULT_FOLDER_PATH)
 
         result_list = list()
@@ -388,21 +438,215 @@ class ProgramCotroller:
             send_messages = self.dayfunctionhandler.send_messages
             func_description = day_function_description
 
+        if messages is not None:
+            send_messages = messages
         for key, value in send_messages.items():
             if not value.empty:
                 cur_func_desc = func_description.get(key)
                 result_list.append(f"\n{cur_func_desc}\n{value.to_string(index=False)}\n")
                 value['func'] = key
-                self.writer.write_result_data(value, function_result_file)
+                CSVWriter.write_result_data(value, function_result_file)
 
         result_str = "\n".join(result_list)
         return result_str
 
+    def prepare_tick(self, cur_datetime: datetime):
+        """
+        爬取数据并转换类型，生成本分钟的tick，爬取失败时返回False，本分钟后面的任务不再执行。
+        只在调度线程中执行，不修改控制器的当前时间，不影响流水线中正在处理的上一个tick
+        """
+        logger.info("爬取数据")
+        self.pending_tick = None
+        self.get_data_by_multithreading()
+
+        if not self.res:
+            logger.warning(f"爬取失败,终止后续操作")
+            return False
+        combined_data = pd.concat(self.res, ignore_index=True)
+        if combined_data.empty:
+            logger.warning(f"当前数据为空,终止后续操作")
+            return False
+
+        logger.info("为数据增加time列")
+        combined_data = self.add_time_column(combined_data, cur_datetime)
+        # 爬取时已转换为Decimal，只有转换失败的数据需要再转换
+        if pd.api.types.infer_dtype(combined_data["coin_price"], skipna=True) != "decimal":
+            combined_data = self.reader.change_column_type_to_Decimal(combined_data, only_price=True)
+        # 生成国际数据
+        foreign_data = combined_data.copy()
+        foreign_data["time"] = cur_datetime - timedelta(hours=8)
+        changes = self.change_detector.update(combined_data) if self.change_detector is not None else None
+        # hour/day_China/day_Foreign为对应任务应执行的时刻，由调度器的整点、0点任务设置
+        self.pending_tick = {
+            "datetime": cur_datetime,
+            "combined_data": combined_data,
+            "foreign_data": foreign_data,
+            "changes": changes,
+            "hour": None,
+            "day_China": None,
+            "day_Foreign": None,
+            "results": [],
+        }
+        return True
+
+    def mark_tick(self, name: str, cur_datetime: datetime):
+        """标记本分钟的tick需要执行整点或0点的任务"""
+        if self.pending_tick is not None:
+            self.pending_tick[name] = cur_datetime
+
+    def submit_tick(self, cur_datetime: datetime):
+        """将本分钟的tick提交到流水线，流水线已满时阻塞"""
+        if self.pending_tick is None:
+            return False
+        self.pipeline.submit(self.pending_tick)
+        self.pending_tick = None
+
+    def build_tick(self, tick: dict):
+        """
+        流水线阶段2：计算小时、天的K线，写入详情数据。
+        控制器的当前时间、K线计算的读取器和数据处理器只在本阶段使用，函数执行阶段使用各自地区的读取器、写入器。
+        只写入详情数据的tick与上一个tick的函数执行同时进行；整点、0点写入的K线和45天最高价会被函数读取，
+        先等待之前的tick全部执行完函数再计算
+        """
+        if any(tick[name] is not None for name in ("hour", "day_China", "day_Foreign")):
+            self.evaluate_barrier.wait()
+        if tick["hour"] is not None:
+            # 国内整点(每小时)
+            self.update_time(tick["hour"])
+            tick["calculated_data"] = self.hours_data_process(combined_data=tick["combined_data"].copy())
+        if tick["day_China"] is not None:
+            # 国内0点
+            self.update_time(tick["day_China"])
+            tick["calculated_data_day_China"] = self.days_data_process(tick["combined_data"].copy(),
+                                                                       data_region="China")
+            self.update_45_day_max_price(tick["calculated_data_day_China"].copy())
+        if tick["day_Foreign"] is not None:
+            # 国际0点（国内8点）
+            self.update_time(tick["day_Foreign"])
+            tick["calculated_data_day_Foreign"] = self.days_data_process(tick["foreign_data"].copy(),
+                                                                         data_region="Foreign")
+
+        self.update_time(tick["datetime"])
+        logger.info("写入详情数据")
+        self.writers["China"].write_detail_data(tick["combined_data"])
+        self.bar_accumulator.update(tick["combined_data"])
+        self.writers["Foreign"].write_detail_data(tick["foreign_data"])
+        logger.info("详情数据写入完成")
+        self.evaluate_barrier.hand_off()
+        return tick
+
+    @staticmethod
+    def snapshot_messages(function_handler) -> dict:
+        """复制函数的结果，下一个tick执行时会清空"""
+        return {key: value.copy() for key, value in function_handler.send_messages.items()}
+
+    def run_hour_task(self, function_handler, cur_data, cur_datetime: datetime,
+                      tick_context: TickContext = None) -> dict:
+        self.execute_hour_handler(function_handler, cur_data, cur_datetime, tick_context)
+        return self.snapshot_messages(function_handler)
+
+    def run_day_task(self, data_region: Literal["China", "Foreign"], cur_data, cur_datetime: datetime) -> dict:
+        self.execute_day_function(cur_data, cur_datetime, data_region)
+        return self.snapshot_messages(self.dayfunctionhandler)
+
+    def run_minute_task(self, function_handler, cur_data, cur_datetime: datetime, changes: dict = None,
+                        tick_context: TickContext = None) -> dict:
+        self.execute_minute_handler(function_handler, cur_data, cur_datetime, changes, tick_context)
+        return self.snapshot_messages(function_handler)
+
+    def evaluate_tick(self, tick: dict):
+        """流水线阶段3：执行函数，执行完(包括失败)后K线计算阶段才能写入下一个整点、0点的K线"""
+        try:
+            return self.run_tick_handlers(tick)
+        finally:
+            self.evaluate_barrier.finish()
+
+    def run_tick_handlers(self, tick: dict):
+        """
+        按依赖图执行小时、天、分钟函数。
+        v1、v2的函数和天函数之间只共享只读的K线数据，并行执行；
+        同一版本的小时函数和分钟函数读写同一个记录文件(minute_and_hour_cnt_le5)，分钟函数在小时函数之后执行。
+        小时、分钟函数共用本tick的上下文，相同的小时K线和中间结果只计算一次
+        """
+        tick["tick_context"] = TickContext(data=tick["combined_data"], datetime=tick["datetime"],
+                                           reader=self.handler_readers["China"])
+        graph = TaskGraph(max_workers=self.evaluate_workers)
+        if tick["hour"] is not None:
+            graph.add_task("hour", partial(self.run_hour_task, self.hourfunctionhandler),
+                           inputs=["calculated_data", "hour", "tick_context"], outputs=["hour_messages"])
+            graph.add_task("new_hour", partial(self.run_hour_task, self.new_hour_functionhandler),
+                           inputs=["calculated_data", "hour", "tick_context"], outputs=["new_hour_messages"])
+        if tick["day_China"] is not None:
+            graph.add_task("day_China", partial(self.run_day_task, "China"),
+                           inputs=["calculated_data_day_China", "day_China"], outputs=["day_China_messages"])
+        if tick["day_Foreign"] is not None:
+            # 国内、国际的天函数使用同一个函数处理器，国际在国内之后执行
+            graph.add_task("day_Foreign", partial(self.run_day_task, "Foreign"),
+                           inputs=["calculated_data_day_Foreign", "day_Foreign"], outputs=["day_Foreign_messages"],
+                           after=["day_China"])
+        graph.add_task("minute", partial(self.run_minute_task, self.minutefunctionhandler),
+                       inputs=["combined_data", "datetime", "changes", "tick_context"], outputs=["minute_messages"],
+                       after=["hour"])
+        graph.add_task("new_minute", partial(self.run_minute_task, self.new_minute_functionhandler),
+                       inputs=["combined_data", "datetime", "changes", "tick_context"],
+                       outputs=["new_minute_messages"],
+                       after=["new_hour"])
+
+        context, report = graph.run(tick)
+        logger.info(f"{tick['datetime']}函数执行完毕，{report}，共享的中间结果: {tick['tick_context'].get_metrics()}")
+
+        results = tick["results"]
+        for name, unit_time, subject in (("hour", "hour", None), ("new_hour", "new_hour", None),
+                                         ("day_China", "day", "每天函数结果-v1"),
+                                         ("day_Foreign", "day", "国际每天函数结果-v1"),
+                                         ("minute", "minute", None), ("new_minute", "new_minute", None)):
+            if f"{name}_messages" in context:
+                results.append((unit_time, context[f"{name}_messages"], subject))
+        tick["evaluate_report"] = report
+        # 后面的阶段只需要结果
+        for key in [key for key in tick if key.startswith("calculated_data")]:
+            del tick[key]
+        del tick["tick_context"]
+        return tick
+
+    def output_tick(self, tick: dict):
+        """流水线阶段4：写入函数结果，发送邮件"""
+        for unit_time, send_messages, subject in tick["results"]:
+            result = self.result_record(unit_time, send_messages)
+            # 小时和分钟函数的结果暂不发送邮件
+            if subject and result:
+                send_email(subject=subject, content=result, test=self.is_test)
+        latency = (datetime.now() - tick["datetime"]).total_seconds()
+        logger.info(f"{tick['datetime']}执行完毕，耗时{latency:.1f}秒，流水线统计: {self.pipeline.get_metrics()}")
+        logging.shutdown()
+
+    def add_jobs_to_scheduler(self, scheduler: MinuteScheduler):
+        """
+        调度线程每分钟只负责爬取数据并提交到流水线，计算在流水线中执行，不会推迟下一分钟的爬取。
+        整点、0点任务只在tick上做标记，合并执行(coalesce)时使用各自到期的时刻。
+        """
+        scheduler.add_job("prepare", self.prepare_tick)
+        scheduler.add_job("hour", lambda cur_datetime: self.mark_tick("hour", cur_datetime), minute=0)
+        scheduler.add_job("day_China", lambda cur_datetime: self.mark_tick("day_China", cur_datetime), minute=0,
+                          hour=0)
+        scheduler.add_job("day_Foreign", lambda cur_datetime: self.mark_tick("day_Foreign", cur_datetime),
+                          minute=0, hour=8)
+        scheduler.add_job("submit", self.submit_tick)
+
+    def start_pipeline(self, queue_size: int = 2):
+        """启动流水线：提交(爬取) -> K线计算 -> 函数执行 -> 结果输出"""
+        self.pipeline = Pipeline(queue_size=queue_size)
+        self.pipeline.add_stage("build", self.build_tick).add_stage("evaluate", self.evaluate_tick).add_stage(
+            "output", self.output_tick)
+        self.pipeline.start()
+
     def clear(self):
+        if self.shard_executor is not None:
+            self.shard_executor.shutdown()
         del self.hourfunctionhandler
         del self.minutefunctionhandler
         del self.dayfunctionhandler
-        del self.writer
+        del self.writers
         del self.reader
         del self.data_processer
 
@@ -410,8 +654,8 @@ class ProgramCotroller:
 if __name__ == "__main__":
 
     logger.info("启动程序")
-    is_Test = False
-    controller = ProgramCotroller("China", config_file=rf'{os.path.join(PROJECT_ROOT_PATH, 'config.xml')}')
+    controller = ProgramCotroller("China", config_file=rf'{os.path.join(PROJECT_ROOT_PATH, 'config.xml')}',
+                                  is_test=False, evaluate_workers=EVALUATE_WORKERS)
     controller.config_handler.load_config()
     # 开启线程监测文件改动
     controller.config_handler.start_monitoring(5)
@@ -419,93 +663,15 @@ if __name__ == "__main__":
     controller.add_funtion_to_handler("minute")
     controller.add_funtion_to_handler("hour")
     controller.add_funtion_to_handler('day')
+    controller.start_pipeline(PIPELINE_QUEUE_SIZE)
+    scheduler = MinuteScheduler(overrun_policy=SCHEDULER_OVERRUN_POLICY, max_catch_up=SCHEDULER_MAX_CATCH_UP)
+    controller.add_jobs_to_scheduler(scheduler)
     try:
-        while True:
-            cur_datetime = datetime.now().replace(microsecond=0)
-            if cur_datetime.second == 0:
-                # 更新时间
-                controller.update_time(cur_datetime)
-                logger.info("爬取数据")
-
-                controller.get_data_by_multithreading()
-
-                if not controller.res:
-                    logger.warning(f"爬取失败,终止后续操作")
-                    continue
-                combined_data = pd.concat(controller.res, ignore_index=True)
-                if combined_data.empty:
-                    logger.warning(f"当前数据为空,终止后续操作")
-                    continue
-
-                logger.info("为数据增加time列")
-                combined_data = controller.add_time_column(combined_data)
-                # print(combined_data)
-                # 改变coin_price字段数据类型
-                combined_data = controller.reader.change_column_type_to_Decimal(combined_data, only_price=True)
-                # 生成国际数据
-                foreign_data = combined_data.copy()
-                foreign_data["time"] = controller.foreign_datetime
-                # 国内整点(每小时)
-                if controller.cur_minute == 0:
-                    # 计算
-                    calculated_data = controller.hours_data_process(
-                        combined_data=combined_data.copy()
-                    )
-
-                    controller.execute_hour_function(calculated_data)
-                    res_hour = controller.result_record("hour")
-                    new_res_hour = controller.result_record("new_hour")
-                    # if res_hour:
-                    #     send_email(subject="每小时函数结果-v1", content=res_hour, test=is_Test)
-                    # if new_res_hour:
-                    #     send_email(subject="(新)每小时函数结果-v2", content=new_res_hour, test=is_Test)
-
-
-                # 国内0点
-                if cur_datetime.hour == 0 and controller.cur_minute == 0:
-                    calculated_data_day = controller.days_data_process(
-                        combined_data.copy(), data_region="China"
-                    )
-                    controller.update_45_day_max_price(calculated_data_day.copy())
-                    controller.execute_day_function(calculated_data_day)
-                    res_day = controller.result_record('day')
-                    if res_day:
-                        send_email(subject="每天函数结果-v1", content=res_day, test=is_Test)
-                # 国际0点（国内8点）
-                if cur_datetime.hour == 8 and controller.cur_minute == 0:
-                    calculated_data_day_foreign = controller.days_data_process(
-                        foreign_data.copy(), data_region="Foreign"
-                    )
-                    controller.execute_day_function(
-                        calculated_data_day_foreign
-                    )
-                    res_day_foreign = controller.result_record('day')
-                    if res_day_foreign:
-                        send_email(
-                            subject="国际每天函数结果-v1",
-                            content=res_day_foreign,
-                            test=is_Test
-                        )
-
-                # 不是整点
-                logger.info("写入详情数据")
-                controller.change_data_region("China")
-                controller.writer.write_detail_data(combined_data)
-                controller.change_data_region("Foreign")
-                controller.writer.is_check = False
-                controller.writer.write_detail_data(foreign_data)
-                logger.info("详情数据写入完成,执行每分钟函数")
-                controller.change_data_region("China")
-                controller.execute_minute_function(combined_data)
-                res_minute = controller.result_record("minute")
-                new_res_minute = controller.result_record("new_minute")
-                # if res_minute:
-                #     send_email(subject="分钟函数结果-v1", content=res_minute, test=is_Test)
-                # if new_res_minute:
-                #     send_email(subject="(新)分钟函数结果-v2", content=new_res_minute, test=is_Test)
-                logger.info("执行完毕")
-                logging.shutdown()
+        scheduler.run_forever()
     except KeyboardInterrupt:
-        logging.shutdown()
+        scheduler.stop()
     finally:
+        # 处理完已经提交的tick后再退出
+        controller.pipeline.stop()
+        logging.shutdown()
         controller.clear()
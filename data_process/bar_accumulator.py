@@ -0,0 +1,146 @@
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from msg_log.mylog import get_logger
+from data_process.bar_builder import GROUP_COLUMNS, BAR_COLUMNS
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'bar_accumulator.log'))
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class MinuteBarAccumulator:
+    """
+    每分钟累计当前小时的K线，整点时直接得到上一个小时的K线，不需要再读取并聚合详细数据。
+    K线的范围与详细数据相同：从上一个整点开始，到当前整点(包含当前整点的价格)。
+    每次更新后保存一个检查点文件，程序重启后可以继续累计。
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: checkpoint_path: 检查点文件路径，为空时不保存
+        """
+        self.checkpoint_path = kwargs.get('checkpoint_path', None)
+        # 当前K线的起始整点
+        self.bar_start = None
+        # 第一次累计数据的时间，等于bar_start时表示K线是完整的
+        self.first_time = None
+        self.bars = pd.DataFrame(columns=BAR_COLUMNS + ['time'],
+                                 index=pd.MultiIndex.from_arrays([[], []], names=GROUP_COLUMNS))
+        self.load_checkpoint()
+
+    @staticmethod
+    def get_bar_start(cur_datetime: datetime) -> datetime:
+        return pd.Timestamp(cur_datetime).floor('h').to_pydatetime()
+
+    @staticmethod
+    def _prepare(data: pd.DataFrame) -> pd.DataFrame:
+        """每个币种只保留最新的一条价格"""
+        data = data[GROUP_COLUMNS + ['coin_price', 'time']]
+        data = data[data['coin_price'].notna()]
+        data = data.drop_duplicates(subset=GROUP_COLUMNS, keep='last')
+        return data.set_index(GROUP_COLUMNS)
+
+    def is_complete(self, bar_start: datetime) -> bool:
+        """是否累计了从bar_start开始的完整K线"""
+        return self.bar_start is not None and self.bar_start == bar_start and self.first_time == bar_start
+
+    def start(self, data: pd.DataFrame, bar_start: datetime):
+        """以当前数据作为开盘价开始新的K线"""
+        data = self._prepare(data)
+        self.bar_start = bar_start
+        self.first_time = pd.Timestamp(data['time'].min()).to_pydatetime() if not data.empty else None
+        prices = data['coin_price']
+        self.bars = pd.DataFrame({'open': prices, 'high': prices, 'low': prices, 'close': prices,
+                                  'time': data['time']}, index=data.index)
+
+    def add(self, data: pd.DataFrame):
+        """将当前数据累计到K线中"""
+        data = self._prepare(data)
+        if data.empty:
+            return
+        if self.first_time is None:
+            self.first_time = pd.Timestamp(data['time'].min()).to_pydatetime()
+        exist_index = data.index.intersection(self.bars.index)
+        if not exist_index.empty:
+            prices = data.loc[exist_index, 'coin_price'].values
+            self.bars.loc[exist_index, 'high'] = np.maximum(self.bars.loc[exist_index, 'high'].values, prices)
+            self.bars.loc[exist_index, 'low'] = np.minimum(self.bars.loc[exist_index, 'low'].values, prices)
+            self.bars.loc[exist_index, 'close'] = prices
+            self.bars.loc[exist_index, 'time'] = data.loc[exist_index, 'time'].values
+        new_index = data.index.difference(self.bars.index)
+        if not new_index.empty:
+            prices = data.loc[new_index, 'coin_price']
+            new_bars = pd.DataFrame({'open': prices, 'high': prices, 'low': prices, 'close': prices,
+                                     'time': data.loc[new_index, 'time']}, index=new_index)
+            self.bars = pd.concat([self.bars, new_bars]) if not self.bars.empty else new_bars
+
+    def update(self, data: pd.DataFrame):
+        """
+        每分钟爬取数据后调用。整点或者进入新的小时时开始新的K线，否则累计到当前K线中。
+        需要在整点计算完成之后调用，保证整点的价格同时作为上一根K线的收盘价和新K线的开盘价。
+        """
+        if data.empty:
+            return
+        cur_datetime = pd.Timestamp(data['time'].iloc[0]).to_pydatetime()
+        bar_start = self.get_bar_start(cur_datetime)
+        if cur_datetime.minute == 0 or self.bar_start != bar_start:
+            self.start(data, bar_start)
+        else:
+            self.add(data)
+        self.save_checkpoint()
+
+    def finalize(self, data: pd.DataFrame, bar_start: datetime):
+        """
+        整点时将当前价格作为收盘价累计后，返回当前数据中每个币种的K线
+        :param data: 当前整点爬取的数据
+        :param bar_start: K线的起始整点
+        :return: K线数据，字段为coin_name, spider_web, open, high, low, close, time；累计不完整时返回None
+        """
+        if not self.is_complete(bar_start):
+            return None
+        self.add(data)
+        current_index = self._prepare(data).index
+        bars = self.bars.loc[self.bars.index.intersection(current_index)]
+        return bars.reset_index()[GROUP_COLUMNS + BAR_COLUMNS + ['time']]
+
+    def save_checkpoint(self):
+        """保存检查点"""
+        if not self.checkpoint_path or self.bar_start is None:
+            return
+        checkpoint = self.bars.reset_index()
+        checkpoint['bar_start'] = self.bar_start
+        checkpoint['first_time'] = self.first_time
+        temp_file_path = f'{self.checkpoint_path}.tmp'
+        try:
+            checkpoint.to_csv(temp_file_path, index=False, encoding='utf-8', date_format=DATE_FORMAT)
+            os.replace(temp_file_path, self.checkpoint_path)
+        except OSError as e:
+            logger.warning(f'{self.checkpoint_path}检查点保存失败: {e}')
+
+    def load_checkpoint(self):
+        """从检查点恢复"""
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        try:
+            checkpoint = pd.read_csv(self.checkpoint_path, low_memory=False, encoding='utf-8', dtype='str')
+        except Exception as e:
+            logger.warning(f'{self.checkpoint_path}检查点读取失败: {e}')
+            return
+        if checkpoint.empty:
+            return
+        # 检查点属于其他小时时，下一次update会重新开始K线，finalize也不会使用它
+        bar_start = pd.to_datetime(checkpoint['bar_start'].iloc[0]).to_pydatetime()
+        for column in BAR_COLUMNS:
+            checkpoint[column] = checkpoint[column].apply(Decimal)
+        checkpoint['time'] = pd.to_datetime(checkpoint['time'])
+        first_time = checkpoint['first_time'].iloc[0]
+        self.bar_start = bar_start
+        self.first_time = pd.to_datetime(first_time).to_pydatetime() if isinstance(first_time, str) else None
+        self.bars = checkpoint.set_index(GROUP_COLUMNS)[BAR_COLUMNS + ['time']]
+        logger.info(f'从检查点恢复{len(self.bars)}个币种的K线，起始时间{self.bar_start}')
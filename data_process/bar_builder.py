@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'bar_builder.log'))
+
+GROUP_COLUMNS = ['coin_name', 'spider_web']
+BAR_COLUMNS = ['open', 'high', 'low', 'close']
+
+
+def build_bars(data: pd.DataFrame, price_column: str = 'coin_price', group_columns: list = None,
+               time_column: str = 'time') -> pd.DataFrame:
+    """
+    将逐条价格数据聚合为每个币种的K线，小时和天的计算共用。
+    先按(币种, 时间)排序一次，再在连续的数组上一次性得到开盘、最高、最低、收盘价，
+    以及每个币种最后一条数据的时间。价格为空的数据不参与价格的计算，收盘价即向前填充后的最新价格，
+    没有任何价格的币种不生成K线。
+    :param data: 包含币种、价格、时间的数据
+    :param price_column: 价格字段
+    :param group_columns: 分组字段，默认为coin_name和spider_web
+    :param time_column: 时间字段
+    :return: 每个币种一行，字段为 group_columns + open/high/low/close + time_column
+    """
+    group_columns = list(group_columns or GROUP_COLUMNS)
+    data = data[data[time_column].notna()]
+    group_ids = data.groupby(group_columns, sort=False).ngroup().to_numpy(dtype=np.int64, na_value=-1)
+    # 分组字段为空的数据不属于任何币种
+    data = data[group_ids >= 0]
+    group_ids = group_ids[group_ids >= 0]
+    has_price = data[price_column].notna().to_numpy()
+    if not has_price.any():
+        return pd.DataFrame(columns=group_columns + BAR_COLUMNS + [time_column])
+
+    time_values = pd.to_datetime(data[time_column]).to_numpy()
+    # 稳定排序，同一币种内按时间升序
+    order = np.lexsort((time_values, group_ids))
+    group_ids = group_ids[order]
+    has_price = has_price[order]
+    # 时间取每个币种最后一条数据(包括价格为空的数据)的时间
+    group_ends = np.r_[np.flatnonzero(group_ids[1:] != group_ids[:-1]), len(group_ids) - 1]
+    last_times = time_values[order][group_ends]
+
+    price_rows = order[has_price]
+    group_ids = group_ids[has_price]
+    prices = data[price_column].to_numpy()[price_rows]
+    starts = np.flatnonzero(np.r_[True, group_ids[1:] != group_ids[:-1]])
+    ends = np.r_[starts[1:], len(group_ids)] - 1
+
+    bars = pd.DataFrame(data[group_columns].to_numpy()[price_rows[starts]], columns=group_columns)
+    bars['open'] = prices[starts]
+    bars['high'] = np.maximum.reduceat(prices, starts)
+    bars['low'] = np.minimum.reduceat(prices, starts)
+    bars['close'] = prices[ends]
+    bars[time_column] = last_times[group_ids[starts]]
+    return bars
+
+if __name__ == '__main__':
+    from decimal import Decimal
+
+    test_data = pd.DataFrame({
+        'coin_name': ['BTC', 'ETH', 'BTC', 'ETH', 'BTC'],
+        'spider_web': ['binance'] * 5,
+        'coin_price': [Decimal('68218.00'), Decimal('2443.51'), Decimal('68300.1'), None, Decimal('68100')],
+        'time': pd.to_datetime(['2024-11-04 01:00:00', '2024-11-04 01:00:00', '2024-11-04 01:01:00',
+                                '2024-11-04 01:01:00', '2024-11-04 01:02:00'])
+    })
+    print(build_bars(test_data))
@@ -0,0 +1,111 @@
+import hashlib
+import os
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'change_detector.log'))
+
+DELTA_COLUMNS = ['coin_name', 'spider_web', 'pre_price', 'coin_price', 'price_delta']
+
+
+class ChangeDetector:
+    """
+    爬取数据的变化检测。每个数据源保存上一次的内容哈希和各币种的价格：
+    内容哈希相同的数据源(例如没有刷新的页面)整体跳过，哈希不同时再逐币种与上一次的价格比较，得到价格变化的币种和变化量。
+    价格按数值比较，Decimal('1.0')与Decimal('1.00')视为没有变化；上一次不存在的币种视为变化。
+    某个数据源本次爬取失败时保留它上一次的价格，下一次爬取成功后仍与上一次的价格比较。
+
+    每次update生成一个版本号，返回的变化集中带有上一个版本号，
+    使用者(分钟函数)只有在上一次处理的正好是上一个版本时才能复用之前的结果，否则需要全部重新计算。
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: source_column: 数据源字段，默认为spider_web
+                       key_column: 币种字段，默认为coin_name
+                       price_column: 价格字段，默认为coin_price
+        """
+        self.source_column = kwargs.get('source_column', 'spider_web')
+        self.key_column = kwargs.get('key_column', 'coin_name')
+        self.price_column = kwargs.get('price_column', 'coin_price')
+        self.version = 0
+        # {数据源: 内容哈希}
+        self.source_hashes = {}
+        # {数据源: 以币种为索引的价格}
+        self.source_prices = {}
+
+    def get_content_hash(self, data: pd.DataFrame) -> str:
+        """数据源内容的哈希，与记录的顺序无关"""
+        rows = sorted(zip(data[self.key_column].tolist(), map(str, data[self.price_column].tolist())))
+        return hashlib.blake2b('\n'.join(f'{key}\t{price}' for key, price in rows).encode('utf-8'),
+                               digest_size=16).hexdigest()
+
+    @staticmethod
+    def compare_prices(pre_prices: pd.Series, prices: pd.Series):
+        """返回(价格变化的掩码, 上一次的价格)，上一次不存在的币种也视为变化"""
+        pre_values = pre_prices.reindex(prices.index).to_numpy(dtype=object)
+        is_new = pd.isna(pre_values)
+        values = prices.to_numpy(dtype=object)
+        changed = is_new.copy()
+        changed[~is_new] = values[~is_new] != pre_values[~is_new]
+        return changed, pre_values
+
+    def update(self, data: pd.DataFrame) -> dict:
+        """
+        与上一次的数据比较，并将本次数据作为下一次比较的基准
+        :return: version: 本次的版本号
+                 previous_version: 上一次的版本号
+                 changed_sources / unchanged_sources: 内容变化/未变化的数据源
+                 changed_coins: 价格变化的(币种, 数据源)集合
+                 deltas: 价格变化的明细，字段为coin_name, spider_web, pre_price, coin_price, price_delta
+                 total_coins: 本次的币种数
+        """
+        changes = {'version': self.version + 1, 'previous_version': self.version, 'changed_sources': [],
+                   'unchanged_sources': [], 'changed_coins': set(), 'deltas': pd.DataFrame(columns=DELTA_COLUMNS),
+                   'total_coins': len(data)}
+        deltas = []
+        for source, source_data in data.groupby(self.source_column, sort=False):
+            content_hash = self.get_content_hash(source_data)
+            if self.source_hashes.get(source) == content_hash:
+                changes['unchanged_sources'].append(source)
+                continue
+            changes['changed_sources'].append(source)
+            prices = source_data.drop_duplicates(subset=[self.key_column], keep='last').set_index(
+                self.key_column)[self.price_column]
+            pre_prices = self.source_prices.get(source, pd.Series(dtype=object))
+            changed, pre_values = self.compare_prices(pre_prices, prices)
+            self.source_hashes[source] = content_hash
+            self.source_prices[source] = prices
+            if not changed.any():
+                continue
+            delta = pd.DataFrame({self.key_column: prices.index[changed], self.source_column: source,
+                                  'pre_price': pre_values[changed], self.price_column: prices.to_numpy()[changed]})
+            delta['price_delta'] = [price - pre_price if isinstance(pre_price, Decimal) else None
+                                    for price, pre_price in zip(delta[self.price_column], delta['pre_price'])]
+            deltas.append(delta)
+            changes['changed_coins'].update(zip(delta[self.key_column], delta[self.source_column]))
+        if deltas:
+            changes['deltas'] = pd.concat(deltas, ignore_index=True)
+        self.version += 1
+        logger.info(f"第{self.version}次数据: {len(changes['changed_coins'])}/{len(data)}个币种价格变化，"
+                    f"内容未变化的数据源: {changes['unchanged_sources']}")
+        return changes
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    coins = [f'COIN{i}' for i in range(3000)]
+    prices = [Decimal(str(round(value, 6))) for value in rng.uniform(0.01, 100, len(coins))]
+    detector = ChangeDetector()
+    detector.update(pd.DataFrame({'coin_name': coins, 'spider_web': 'binance', 'coin_price': prices}))
+    # 10%的币种价格变化
+    prices = [price + Decimal('0.01') if i % 10 == 0 else price for i, price in enumerate(prices)]
+    changes = detector.update(pd.DataFrame({'coin_name': coins, 'spider_web': 'binance', 'coin_price': prices}))
+    print(len(changes['changed_coins']), changes['deltas'].head())
+    changes = detector.update(pd.DataFrame({'coin_name': coins, 'spider_web': 'binance', 'coin_price': prices}))
+    print(changes['unchanged_sources'], len(changes['changed_coins']))
@@ -9,6 +9,8 @@ from datetime import datetime, timedelta
 import os
 
 from dataio.csv_handler import CSVReader, CSVWriter
+from data_process.bar_builder import build_bars
+from data_process import derived_metrics
 from msg_log.mylog import get_logger
 from error_exception.customerror import DataNotExistError
 
@@ -24,6 +26,7 @@ class DataProcess:
         self.previous_all_data = None
         self.detail_data = None
         self.combined_data = None
+        self.bars = None
         self.statistics_table = None
         self.data = data
         default_base_file_path = os.path.join(PROJECT_ROOT_PATH, 'data', data_region)
@@ -32,19 +35,30 @@ class DataProcess:
         self.csv_writer = kwargs.get('writer', CSVWriter(data_region, base_file_path=kwargs.get('base_file_path',
                                                                                                 default_base_file_path)))
         self.datetime = kwargs.get('datetime', datetime.now().replace(second=0))
+        # 每分钟累计的小时K线，整点时直接使用，不再读取详细数据
+        self.bar_accumulator = kwargs.get('bar_accumulator', None)
 
         self.time = kwargs.get('time', self.datetime.strftime('%Y-%m-%d %H:%M:%S'))
         self.unit_time = unit_time
 
     def get_needed_data(self):
         """获取后续处理需要的数据"""
+        self.bars = None
         self.data['coin_price'] = self.data['coin_price'].apply(Decimal)
         self.data = self.data[self.data['coin_price'] != Decimal(0)]
         # 删除coin_price字段为0的数据
 
-        self.detail_data = self.csv_reader.get_detail_data(cur_datetime=self.datetime)
         self.statistics_table = self.csv_reader.get_statistical_table(self.unit_time)
 
+        if self.unit_time == 'hour' and self.bar_accumulator is not None:
+            self.bars = self.bar_accumulator.finalize(self.data, self.datetime - timedelta(hours=1))
+            if self.bars is not None:
+                self.combined_data = pd.DataFrame(columns=['coin_name', 'spider_web', 'coin_price', 'time'])
+                return self
+            logger.info(f'{self.time}累计的K线不完整，从详细数据计算')
+
+        self.detail_data = self.csv_reader.get_detail_data(cur_datetime=self.datetime)
+
         if self.detail_data.empty:
             # self.detail_data = self.detail_data[self.detail_data['coin_name'].isin(self.data['coin_name'])]
             logger.warning(f'{self.time}没有详细数据，无法计算')
@@ -69,24 +83,24 @@ class DataProcess:
         return self
 
     def fill_na(self):
-        """缺失值填充"""
-        self.combined_data.sort_values('time', ascending=True, inplace=True)
-        filled_data = self.combined_data.groupby(['coin_name', 'spider_web'])[['coin_price', 'time']].apply(
-            lambda group: group.ffill()).reset_index(drop=False).set_index('level_2')
-        lasted_data = filled_data.sort_values('time').groupby(['coin_name', 'spider_web']).tail(1)
-        self.data = lasted_data
+        """缺失值填充，每个币种只保留向前填充后的最新价格，同时得到K线"""
+        if self.bars is None:
+            self.bars = build_bars(self.combined_data)
+        self.data = self.bars[['coin_name', 'spider_web', 'close', 'time']].rename(columns={'close': 'coin_price'})
         return self
 
     def get_price_columns(self):
         """获取最高、最低、开盘、收盘价"""
-        data_for_calculate_columns = self.combined_data.copy().sort_values('time', ascending=True)
+        if self.bars is None:
+            self.bars = build_bars(self.combined_data)
+        bars = self.bars.set_index(['coin_name', 'spider_web'])
         # 设置 data 的索引
         data = self.data.copy().set_index(['coin_name', 'spider_web'])
 
-        data['high'] = data_for_calculate_columns.groupby(['coin_name', 'spider_web'])['coin_price'].apply('max')
-        data['low'] = data_for_calculate_columns.groupby(['coin_name', 'spider_web'])['coin_price'].apply('min')
-        data['open'] = data_for_calculate_columns.groupby(['coin_name', 'spider_web'])['coin_price'].apply('first')
-        data['close'] = data_for_calculate_columns.groupby(['coin_name', 'spider_web'])['coin_price'].apply('last')
+        data['high'] = bars['high']
+        data['low'] = bars['low']
+        data['open'] = bars['open']
+        data['close'] = bars['close']
         data['coin_price'] = data['open']
         data = data[data['open'] > Decimal(0)].copy()
         self.data = data.reset_index()
@@ -95,18 +109,19 @@ class DataProcess:
 
     def calculate_change_rate(self):
         """计算跌涨幅,(收盘价-开盘价)/开盘价"""
-        self.data['change'] = (self.data['close'] - self.data['open']) / self.data['open'] * 100
+        self.data['change'] = derived_metrics.calculate_change(self.data['open'], self.data['close'])
         return self
 
     def calculate_amplitude(self):
         """计算振幅"""
-        self.data['amplitude'] = (self.data['high'] - self.data['low']) / self.data['open'] * 100
+        self.data['amplitude'] = derived_metrics.calculate_amplitude(self.data['high'], self.data['low'],
+                                                                     self.data['open'])
         return self
 
     def calculate_virtual_drop(self):
         """计算虚降"""
-        self.data['virtual_drop'] = self.data.apply(lambda x: (x['open'] - x['low']) / x['open'] * 100 \
-            if x['change'] >= 0 else (x['close'] - x['low']) / x['open'] * 100, axis=1)
+        self.data['virtual_drop'] = derived_metrics.calculate_virtual_drop(self.data['open'], self.data['close'],
+                                                                           self.data['low'], self.data['change'])
         return self
 
     def update_statistics_table(self):
@@ -0,0 +1,48 @@
+import os
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'derived_metrics.log'))
+
+HUNDRED = Decimal(100)
+
+
+def calculate_change(open_price: pd.Series, close_price: pd.Series) -> pd.Series:
+    """跌涨幅: (收盘价-开盘价)/开盘价*100"""
+    return (close_price - open_price) / open_price * HUNDRED
+
+
+def calculate_amplitude(high_price: pd.Series, low_price: pd.Series, open_price: pd.Series) -> pd.Series:
+    """振幅: (最高价-最低价)/开盘价*100"""
+    return (high_price - low_price) / open_price * HUNDRED
+
+
+def calculate_virtual_drop(open_price: pd.Series, close_price: pd.Series, low_price: pd.Series,
+                           change: pd.Series = None) -> pd.Series:
+    """
+    虚降: 涨(跌涨幅>=0)时为(开盘价-最低价)/开盘价*100，跌时为(收盘价-最低价)/开盘价*100
+    :param change: 已经计算好的跌涨幅，为空时根据开盘价和收盘价判断涨跌
+    """
+    if change is None:
+        change = calculate_change(open_price, close_price)
+    is_rise = (change >= 0).to_numpy(dtype=bool)
+    # 只取出每一行需要的基准价，再统一做一次减法和除法
+    base_price = pd.Series(np.where(is_rise, open_price.to_numpy(), close_price.to_numpy()), index=open_price.index)
+    return (base_price - low_price) / open_price * HUNDRED
+
+
+def add_derived_metrics(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    为K线数据一次性计算change、amplitude和virtual_drop，可以同时计算任意多根K线，
+    例如补算历史数据时直接传入多天的数据
+    """
+    data['change'] = calculate_change(data['open'], data['close'])
+    data['amplitude'] = calculate_amplitude(data['high'], data['low'], data['open'])
+    data['virtual_drop'] = calculate_virtual_drop(data['open'], data['close'], data['low'], data['change'])
+    return data
+
@@ -0,0 +1,420 @@
+import operator
+import os
+from decimal import Decimal, localcontext, ROUND_CEILING, ROUND_FLOOR
+from typing import Literal
+
+import numpy as np
+
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'fixed_point.log'))
+
+# 价格默认保留的小数位数，不够时会自动增加
+PRICE_SCALE = 12
+# int64能完整表示的最大值，超过后使用python int保存
+INT64_MAX = np.iinfo(np.int64).max
+# 转换时使用的Decimal精度，保证放大后取余不会因为位数过多而报错
+ENCODE_PRECISION = 100
+
+COMPARISON_OPERATORS = {
+    'gt': operator.gt,
+    'lt': operator.lt,
+    'ge': operator.ge,
+    'le': operator.le,
+    'eq': operator.eq,
+    'neq': operator.ne,
+}
+
+
+def _get_operator(comparison: str):
+    try:
+        return COMPARISON_OPERATORS[comparison]
+    except KeyError:
+        raise ValueError(f'不支持的比较运算符: {comparison}')
+
+
+def _fits_int64(mantissa: np.ndarray, factor: int = 1) -> bool:
+    """判断mantissa乘以factor后是否仍能用int64表示"""
+    if mantissa.size == 0:
+        return True
+    max_abs = max(abs(int(mantissa.max())), abs(int(mantissa.min())))
+    return max_abs * abs(factor) <= INT64_MAX
+
+
+def _multiply(mantissa: np.ndarray, factor: int) -> np.ndarray:
+    """整数数组乘以整数，int64溢出时改用python int"""
+    if mantissa.dtype != object and not _fits_int64(mantissa, factor):
+        mantissa = mantissa.astype(object)
+    return mantissa * factor
+
+
+class FixedPoint:
+    """
+    定点数数组，value = mantissa / 10**scale。
+    mantissa一般为int64数组，位数超过int64范围时为python int的object数组，
+    所有运算都是精确的整数运算，与Decimal的比较结果一致。
+    """
+    __slots__ = ('mantissa', 'scale')
+
+    def __init__(self, mantissa: np.ndarray, scale: int):
+        self.mantissa = mantissa
+        self.scale = scale
+
+    def __len__(self):
+        return len(self.mantissa)
+
+    def __repr__(self):
+        return f'FixedPoint(scale={self.scale}, mantissa={self.mantissa!r})'
+
+    def rescale(self, scale: int) -> 'FixedPoint':
+        """转换为更大的小数位数"""
+        if scale < self.scale:
+            raise ValueError(f'定点数不能降低精度: {self.scale} -> {scale}')
+        if scale == self.scale:
+            return self
+        return FixedPoint(_multiply(self.mantissa, 10 ** (scale - self.scale)), scale)
+
+    @staticmethod
+    def align(left: 'FixedPoint', right: 'FixedPoint'):
+        """将两个定点数转换为相同的小数位数"""
+        scale = max(left.scale, right.scale)
+        return left.rescale(scale), right.rescale(scale)
+
+    def __add__(self, other: 'FixedPoint') -> 'FixedPoint':
+        left, right = self.align(self, encode(other))
+        return FixedPoint(_add(left.mantissa, right.mantissa), left.scale)
+
+    def __sub__(self, other: 'FixedPoint') -> 'FixedPoint':
+        left, right = self.align(self, encode(other))
+        return FixedPoint(_add(left.mantissa, -right.mantissa), left.scale)
+
+    def __neg__(self) -> 'FixedPoint':
+        return FixedPoint(-self.mantissa, self.scale)
+
+    def __mul__(self, other) -> 'FixedPoint':
+        other = encode(other, scale=0)
+        if len(other) == 1:
+            return FixedPoint(_multiply(self.mantissa, int(other.mantissa[0])), self.scale + other.scale)
+        left, right = self.mantissa, other.mantissa
+        if left.dtype != object and right.dtype != object and _fits_int64(left, _max_abs(right)):
+            return FixedPoint(left * right, self.scale + other.scale)
+        return FixedPoint(left.astype(object) * right.astype(object), self.scale + other.scale)
+
+    def compare(self, comparison: Literal['gt', 'lt', 'ge', 'le', 'eq', 'neq'], other) -> np.ndarray:
+        """逐个比较，other可以是定点数或者单个数值"""
+        compare_operator = _get_operator(comparison)
+        left, right = self.align(self, encode(other, scale=0))
+        right_mantissa = right.mantissa[0] if len(right) == 1 else right.mantissa
+        return np.asarray(compare_operator(left.mantissa, right_mantissa), dtype=bool)
+
+    def sign(self) -> np.ndarray:
+        """正负号，1、0、-1"""
+        return np.sign(self.mantissa).astype(np.int64)
+
+    def to_decimal(self) -> np.ndarray:
+        """转换为Decimal的object数组"""
+        # np.fromiter不会逐个检查元素是否为序列，比np.array(list)快得多
+        return np.fromiter((Decimal(value).scaleb(-self.scale) for value in self.mantissa.tolist()), dtype=object,
+                           count=len(self.mantissa))
+
+
+def _max_abs(mantissa: np.ndarray) -> int:
+    if mantissa.size == 0:
+        return 0
+    return max(abs(int(mantissa.max())), abs(int(mantissa.min())))
+
+
+def _add(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """整数数组相加，int64溢出时改用python int"""
+    if left.dtype != object and right.dtype != object and _max_abs(left) + _max_abs(right) > INT64_MAX:
+        left, right = left.astype(object), right.astype(object)
+    return left + right
+
+
+# mantissa中每一位数字最多为10**INT64_DIGITS位，保证mantissa不会超过int64
+INT64_DIGITS = 17
+POWERS_OF_TEN = 10 ** np.arange(INT64_DIGITS + 1, dtype=np.int64)
+# encode_int64先试转换的数据量
+ENCODE_SAMPLE_SIZE = 64
+# 字符编码
+CHAR_ZERO, CHAR_NINE, CHAR_PLUS, CHAR_MINUS, CHAR_DOT = ord('0'), ord('9'), ord('+'), ord('-'), ord('.')
+
+
+def _encode_strings(strings: np.ndarray, scale: int):
+    """
+    十进制字符串数组批量转换为定点数。字符串按字符展开为(数量, 宽度)的字符编码矩阵，
+    每个数字的位权由它与小数点(以及指数)的距离得到，mantissa为各位数字乘以位权之和，
+    每一步都是整个矩阵的运算，没有逐个元素的Decimal运算。
+    :return: (mantissa, scale)，位数超过int64时返回None，由调用方改用python int转换
+    """
+    n = len(strings)
+    width = strings.dtype.itemsize // 4
+    if width == 0:
+        raise ValueError(f'无法转换为定点数: {strings[:3]}')
+    codes = np.ascontiguousarray(strings).view(np.uint32).reshape(n, width).astype(np.int32)
+    columns = np.arange(width, dtype=np.int32)
+    digits = codes - CHAR_ZERO
+    is_digit = (digits >= 0) & (digits <= 9)
+    negative = codes[:, 0] == CHAR_MINUS
+    signed = negative | (codes[:, 0] == CHAR_PLUS)
+
+    # 指数(E或e)，一般只有很小的Decimal才会使用，指数部分同样按各位数字的位权计算
+    exponent_mark = (codes == ord('E')) | (codes == ord('e'))
+    has_exponent = exponent_mark.any(axis=1)
+    exponent = np.zeros(n, dtype=np.int64)
+    number_end = np.full(n, width)
+    if has_exponent.any():
+        number_end = np.where(has_exponent, exponent_mark.argmax(axis=1), width)
+        exponent_sign = codes[np.arange(n), np.minimum(number_end + 1, width - 1)]
+        exponent_signed = has_exponent & ((exponent_sign == CHAR_MINUS) | (exponent_sign == CHAR_PLUS))
+        in_exponent = columns >= (number_end + 1 + exponent_signed)[:, None]
+        exponent_digit = is_digit & in_exponent
+        exponent_digit_count = exponent_digit.sum(axis=1)
+        invalid = (in_exponent & ~exponent_digit & (codes != 0)).any(axis=1) | (
+                has_exponent & (exponent_digit_count == 0))
+        if invalid.any():
+            raise ValueError(f'无法转换为定点数: {strings[invalid][:3]}')
+        if exponent_digit_count.max() > INT64_DIGITS // 3:
+            return None
+        weights = POWERS_OF_TEN[exponent_digit_count[:, None] - np.cumsum(exponent_digit, axis=1)]
+        exponent = (np.where(exponent_digit, digits, 0) * weights).sum(axis=1)
+        exponent = np.where(has_exponent & (exponent_sign == CHAR_MINUS), -exponent, exponent)
+    in_number = columns < number_end[:, None]
+    in_number[:, 0] &= ~signed
+
+    # 小数点左边第一位的位权为0，往左依次加1，小数点右边第一位为-1，往右依次减1
+    dot = (codes == CHAR_DOT) & in_number
+    dot_position = np.where(dot.any(axis=1), dot.argmax(axis=1), (is_digit & in_number).sum(axis=1) + signed)
+    number_digit = is_digit & in_number
+    if ((in_number & ~number_digit & ~dot & (codes != 0)).any() or (dot.sum(axis=1) > 1).any() or
+            not number_digit.any(axis=1).all()):
+        invalid = ((in_number & ~number_digit & ~dot & (codes != 0)).any(axis=1) | (dot.sum(axis=1) > 1) |
+                   ~number_digit.any(axis=1))
+        raise ValueError(f'无法转换为定点数: {strings[invalid][:3]}')
+    powers = dot_position[:, None] - columns - (columns < dot_position[:, None]) + exponent[:, None]
+
+    # 非0的数字决定需要的小数位数和是否超过int64
+    nonzero = number_digit & (digits != 0)
+    if not nonzero.any():
+        return np.zeros(n, dtype=np.int64), scale
+    scale = max(scale, -int(np.where(nonzero, powers, INT64_DIGITS).min()))
+    if int(np.where(nonzero, powers, -scale).max()) + scale > INT64_DIGITS:
+        return None
+    weights = POWERS_OF_TEN[np.clip(powers + scale, 0, INT64_DIGITS)]
+    mantissa = (np.where(nonzero, digits, 0) * weights).sum(axis=1)
+    return np.where(negative, -mantissa, mantissa), scale
+
+
+def _encode_decimals(values: np.ndarray, scale: int):
+    """
+    Decimal数组放大10**scale倍后直接转换为int64(逐个元素的转换在numpy内部完成)，
+    再与放大后的值比较确认转换是精确的。
+    :return: (mantissa, scale)，存在超过scale位的小数或超过int64时返回None
+    """
+    with localcontext() as context:
+        context.prec = ENCODE_PRECISION
+        scaled_values = values * Decimal(1).scaleb(scale)
+        try:
+            mantissa = scaled_values.astype(np.int64)
+        except (OverflowError, ValueError):
+            return None
+        if (scaled_values != mantissa).any():
+            return None
+    return mantissa, scale
+
+
+def encode(values, scale: int = PRICE_SCALE) -> FixedPoint:
+    """
+    将Decimal/str/int数组（或单个数值）转换为定点数。
+    scale为默认的小数位数，数据中存在更多小数位时自动增加，保证转换是精确的。
+    float会先转为最短的十进制字符串再转换。
+    字符串数组按字符矩阵批量转换；Decimal数组放大后直接转换为int64；
+    只有小数位数超过scale或位数超过int64时才逐个用Decimal转换为python int。
+    """
+    if isinstance(values, FixedPoint):
+        return values
+    if np.ndim(values) == 0:
+        values = [values]
+    values = np.asarray(values)
+    if values.size == 0:
+        return FixedPoint(np.array([], dtype=np.int64), scale)
+    if values.dtype.kind != 'U':
+        values = values.astype(object)
+        if not isinstance(values[0], Decimal) and all(isinstance(value, str) for value in values):
+            values = values.astype(str)
+
+    if values.dtype.kind == 'U':
+        encoded = _encode_strings(values, scale)
+        if encoded is not None:
+            return FixedPoint(*encoded)
+        values = values.astype(object)
+    if not all(isinstance(value, Decimal) for value in values):
+        values = np.array([value if isinstance(value, Decimal) else Decimal(str(value)) for value in values],
+                          dtype=object)
+    else:
+        encoded = _encode_decimals(values, scale)
+        if encoded is not None:
+            return FixedPoint(*encoded)
+
+    with localcontext() as context:
+        context.prec = ENCODE_PRECISION
+        scaled_values = values * Decimal(1).scaleb(scale)
+        not_integral = scaled_values % 1 != 0
+        if not_integral.any():
+            # 小数位数超过scale的数据，按其中最多的小数位数重新转换
+            if not all(value.is_finite() for value in values[not_integral]):
+                raise ValueError(f'无法转换为定点数: {values[not_integral][:3]}')
+            scale = max(-value.as_tuple().exponent for value in values[not_integral])
+            scaled_values = values * Decimal(1).scaleb(scale)
+
+    mantissa = np.array([int(value) for value in scaled_values], dtype=object)
+    if _fits_int64(mantissa):
+        mantissa = mantissa.astype(np.int64)
+    return FixedPoint(mantissa, scale)
+
+
+def encode_int64(values, scale: int = PRICE_SCALE):
+    """
+    只使用批量转换的encode：Decimal数组先放大后转换，不精确时再按字符串矩阵转换。
+    不能精确地用int64表示(包括NaN/Infinity)时返回None，不会逐个元素转换为python int。
+    :param values: Decimal或十进制字符串数组，不能有空值
+    :return: FixedPoint或None
+    """
+    values = np.asarray(values)
+    if values.size == 0:
+        return FixedPoint(np.array([], dtype=np.int64), scale)
+    # 一部分数据都不能用int64表示时整列也不能，先用前面的数据试转换，避免整列转换后才发现超出范围
+    if len(values) > ENCODE_SAMPLE_SIZE and encode_int64(values[:ENCODE_SAMPLE_SIZE], scale) is None:
+        return None
+    if values.dtype.kind != 'U':
+        encoded = _encode_decimals(values.astype(object), scale)
+        if encoded is not None:
+            return FixedPoint(*encoded)
+        values = values.astype(str)
+    try:
+        encoded = _encode_strings(values, scale)
+    except ValueError:
+        return None
+    return None if encoded is None else FixedPoint(*encoded)
+
+
+def encode_exact(values):
+    """
+    Decimal数组按每个值自己的指数转换为(系数, 指数)两个int64数组，decode_exact转换回的Decimal与原来完全相同
+    (包括末尾的0，例如68218.10)。系数由encode_int64批量转换后的mantissa整除10的幂得到。
+    :param values: Decimal数组，不能有空值
+    :return: (系数, 指数)，NaN/Infinity、-0或系数超过int64时返回None
+    """
+    values = np.asarray(values, dtype=object)
+    prices = encode_int64(values)
+    if prices is None:
+        return None
+    zero = prices.mantissa == 0
+    if zero.any() and any(value.is_signed() for value in values[zero]):
+        return None
+    exponents = np.fromiter((value.as_tuple().exponent for value in values.tolist()), dtype=np.int64,
+                            count=len(values))
+    shifts = prices.scale + exponents
+    # 指数比mantissa的小数位数还小的只有0E-100这样的0
+    if len(shifts) and (shifts.min() < 0 or shifts.max() > INT64_DIGITS):
+        return None
+    return prices.mantissa // POWERS_OF_TEN[shifts], exponents
+
+
+def decode_exact(coefficients: np.ndarray, exponents: np.ndarray) -> np.ndarray:
+    """
+    encode_exact的逆运算，一次生成Decimal的object数组。
+    K线中收盘价与当前价、开盘价与上一个小时的收盘价相同，排序后相同的(系数, 指数)只生成一个Decimal
+    """
+    order = np.lexsort((coefficients, exponents))
+    coefficients, exponents = coefficients[order], exponents[order]
+    first = np.r_[True, (coefficients[1:] != coefficients[:-1]) | (exponents[1:] != exponents[:-1])]
+    unique_coefficients, unique_exponents = coefficients[first], exponents[first]
+    decimals = np.fromiter(map(Decimal.scaleb, map(Decimal, unique_coefficients.tolist()), unique_exponents.tolist()),
+                           dtype=object, count=len(unique_coefficients))
+    result = np.empty(len(order), dtype=object)
+    result[order] = decimals[np.cumsum(first) - 1]
+    return result
+
+
+def compare(values, comparison: Literal['gt', 'lt', 'ge', 'le', 'eq', 'neq'], threshold) -> np.ndarray:
+    """values与阈值比较，返回布尔数组"""
+    return encode(values).compare(comparison, threshold)
+
+
+def compare_ratio(numerator, denominator, comparison: Literal['gt', 'lt', 'ge', 'le', 'eq', 'neq'], threshold,
+                  multiplier=100) -> np.ndarray:
+    """
+    精确判断 numerator / denominator * multiplier 与阈值的关系，不做除法。
+    对于denominator > 0: numerator * multiplier op threshold * denominator，
+    denominator < 0 时比较方向取反，denominator为0的位置返回False。
+    """
+    compare_operator = _get_operator(comparison)
+    numerator, denominator = encode(numerator), encode(denominator)
+    left = numerator * multiplier
+    right = denominator * threshold
+    left, right = FixedPoint.align(left, right)
+    denominator_sign = denominator.sign()
+    result = np.where(denominator_sign > 0,
+                      compare_operator(left.mantissa, right.mantissa),
+                      compare_operator(right.mantissa, left.mantissa))
+    return np.asarray(result, dtype=bool) & (denominator_sign != 0)
+
+
+def change_numerator(open_price, close_price) -> FixedPoint:
+    """跌涨幅的分子: 收盘价-开盘价，分母为开盘价"""
+    return encode(close_price) - encode(open_price)
+
+
+def amplitude_numerator(high_price, low_price) -> FixedPoint:
+    """振幅的分子: 最高价-最低价，分母为开盘价"""
+    return encode(high_price) - encode(low_price)
+
+
+def virtual_drop_numerator(open_price, close_price, low_price) -> FixedPoint:
+    """虚降的分子: 涨时为开盘价-最低价，跌时为收盘价-最低价，分母为开盘价"""
+    open_price, close_price, low_price = encode(open_price), encode(close_price), encode(low_price)
+    scale = max(open_price.scale, close_price.scale, low_price.scale)
+    open_price, close_price, low_price = open_price.rescale(scale), close_price.rescale(scale), low_price.rescale(scale)
+    base_mantissa = np.where(close_price.compare('ge', open_price), open_price.mantissa, close_price.mantissa)
+    if base_mantissa.dtype != object and low_price.mantissa.dtype == object:
+        base_mantissa = base_mantissa.astype(object)
+    return FixedPoint(base_mantissa, scale) - low_price
+
+
+def ratio_to_decimal(numerator, denominator, multiplier=100) -> np.ndarray:
+    """numerator / denominator * multiplier，结果为Decimal数组，与直接用Decimal计算的值相同"""
+    numerator, denominator = FixedPoint.align(encode(numerator), encode(denominator))
+    return numerator.to_decimal() / denominator.to_decimal() * Decimal(multiplier)
+
+
+def integer_limits(thresholds, scale: int):
+    """
+    将阈值放大10**scale倍后分别向下、向上取整。
+    小数位数为scale的定点数与阈值比较时，可以改为mantissa与取整后的整数比较，结果与Decimal比较一致：
+    value > x 等价于 mantissa > floor，value < x 等价于 mantissa < ceil，
+    value >= x 等价于 mantissa >= ceil，value <= x 等价于 mantissa <= floor
+    :return: (floor数组, ceil数组)
+    """
+    floor_limits, ceil_limits = [], []
+    with localcontext() as context:
+        context.prec = ENCODE_PRECISION
+        for threshold in np.asarray(thresholds, dtype=object):
+            if not isinstance(threshold, Decimal):
+                threshold = Decimal(str(threshold))
+            scaled = threshold.scaleb(scale)
+            floor_limits.append(int(scaled.to_integral_value(rounding=ROUND_FLOOR)))
+            ceil_limits.append(int(scaled.to_integral_value(rounding=ROUND_CEILING)))
+    floor_limits = np.array(floor_limits, dtype=object)
+    ceil_limits = np.array(ceil_limits, dtype=object)
+    if _fits_int64(floor_limits) and _fits_int64(ceil_limits):
+        return floor_limits.astype(np.int64), ceil_limits.astype(np.int64)
+    return floor_limits, ceil_limits
+
+
+if __name__ == '__main__':
+    prices = encode([Decimal('68218.00'), Decimal('0.000000339041'), Decimal('2443.51')])
+    print(prices)
+    print(prices.compare('gt', '1'))
+    print(compare_ratio(['-0.5', '1'], ['100', '100'], 'le', '-0.004', multiplier=1))
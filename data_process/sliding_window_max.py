@@ -0,0 +1,206 @@
+import os
+from collections import deque
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+from data_process import fixed_point
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'sliding_window_max.log'))
+
+DAY_FORMAT = '%Y-%m-%d'
+DEFAULT_WINDOW_DAYS = 45
+
+
+class SlidingWindowMax:
+    """
+    按币种维护最近window_days天的最高价。
+    每个币种保存一个单调队列，元素为(日期, 当天最高价)，最高价从队首到队尾严格递减：
+    加入新的一天时先弹出队尾所有不高于它的元素，超出窗口的日期从队首弹出，队首即为窗口内的最高价。
+    每天只更新一次，常驻内存，分钟函数直接读取；每次更新后保存检查点，程序重启后继续使用。
+
+    检查点(checkpoint_path)保存每个队列的元素，字段为coin_name, day, high；
+    同时按原来的格式(coin_name, max_price_in_45_day)写一份汇总文件(summary_path)。
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: checkpoint_path: 检查点文件路径，为空时不保存
+                       summary_path: 汇总文件路径，检查点不存在时从汇总文件恢复
+                       window_days: 窗口天数，默认45天
+                       key_column: 币种字段，默认为coin_name
+                       max_column: 汇总文件中最高价的字段，默认为max_price_in_45_day
+        """
+        self.checkpoint_path = kwargs.get('checkpoint_path', None)
+        self.summary_path = kwargs.get('summary_path', None)
+        self.window_days = kwargs.get('window_days', DEFAULT_WINDOW_DAYS)
+        self.key_column = kwargs.get('key_column', 'coin_name')
+        self.max_column = kwargs.get('max_column', 'max_price_in_45_day')
+        if self.window_days <= 0:
+            raise ValueError(f'窗口天数必须大于0: {self.window_days}')
+        self.windows = dict()
+        # 窗口的当前日期，窗口范围为[cur_day - window_days, cur_day)
+        self.cur_day = None
+        self._max_prices = None
+        # 最高价的定点数，与_max_prices的行对应，每天更新后只转换一次
+        self._encoded_max_prices = None
+        self.lock = Lock()
+        self.load_checkpoint()
+
+    @staticmethod
+    def _to_day(value) -> date:
+        if isinstance(value, str):
+            return datetime.strptime(value[:10], DAY_FORMAT).date()
+        if isinstance(value, datetime):
+            return value.date()
+        return value
+
+    def _push(self, key, day: date, high: Decimal):
+        window = self.windows.setdefault(key, deque())
+        while window and window[-1][1] <= high:
+            window.pop()
+        window.append((day, high))
+
+    def _expire(self, cur_day: date):
+        """删除日期早于cur_day - window_days的元素"""
+        if self.cur_day is not None and cur_day <= self.cur_day:
+            return
+        self.cur_day = cur_day
+        start_day = cur_day - timedelta(days=self.window_days)
+        for key in list(self.windows):
+            window = self.windows[key]
+            while window and window[0][0] < start_day:
+                window.popleft()
+            if not window:
+                del self.windows[key]
+        self._max_prices = None
+
+    def update(self, day_data: pd.DataFrame, day, high_column: str = 'high'):
+        """
+        加入一天的最高价，每天调用一次
+        :param day_data: 当天的日K线数据，同一个币种可以有多行
+        :param day: 日K线的日期
+        :param high_column: 最高价字段
+        """
+        day = self._to_day(day)
+        day_data = day_data[day_data[high_column].notna()]
+        cur_high = day_data.groupby(self.key_column)[high_column].max()
+        with self.lock:
+            for key, high in cur_high.items():
+                self._push(key, day, high if isinstance(high, Decimal) else Decimal(str(high)))
+            # 更新后窗口的当前日期为下一天
+            self._expire(day + timedelta(days=1))
+            self._max_prices = None
+            self.save_checkpoint()
+        logger.info(f'更新{day}的最高价，共{len(cur_high)}个币种，窗口内共{len(self.windows)}个币种')
+
+    def max_prices(self, cur_datetime: datetime = None) -> pd.DataFrame:
+        """
+        窗口内每个币种的最高价
+        :param cur_datetime: 当前时间，不为空时先删除超出窗口的元素(例如程序停止了几天没有更新)
+        :return: 字段为key_column和max_column
+        """
+        with self.lock:
+            if cur_datetime is not None:
+                self._expire(self._to_day(cur_datetime))
+            return self._get_max_prices().copy()
+
+    def _get_max_prices(self) -> pd.DataFrame:
+        """队首即为最高价，结果缓存到下一次更新"""
+        if self._max_prices is None:
+            keys = list(self.windows)
+            self._max_prices = pd.DataFrame({
+                self.key_column: keys,
+                self.max_column: pd.Series([self.windows[key][0][1] for key in keys], dtype=object)})
+            self._encoded_max_prices = None
+        return self._max_prices
+
+    def _get_encoded_max_prices(self) -> fixed_point.FixedPoint:
+        max_prices = self._get_max_prices()
+        if self._encoded_max_prices is None:
+            self._encoded_max_prices = fixed_point.encode(max_prices[self.max_column].to_numpy())
+        return self._encoded_max_prices
+
+    def price_le_max_ratio(self, data: pd.DataFrame, ratio=Decimal('0.5'), price_column: str = 'coin_price',
+                           cur_datetime: datetime = None) -> pd.DataFrame:
+        """
+        筛选出当前价格 <= 窗口内最高价 * ratio 的数据，所有币种一次比较
+        :return: data与最高价合并后满足条件的数据，包含max_column字段
+        """
+        with self.lock:
+            if cur_datetime is not None:
+                self._expire(self._to_day(cur_datetime))
+            max_prices = self._get_max_prices()
+            encoded_max_prices = self._get_encoded_max_prices()
+        merged_data = data.merge(max_prices, on=self.key_column, how='inner')
+        if merged_data.empty:
+            return merged_data
+        prices = merged_data[price_column].to_numpy()
+        # 最高价使用缓存的定点数，只需要转换当前价格
+        max_rows = pd.Index(max_prices[self.key_column]).get_indexer(merged_data[self.key_column])
+        # 空值不满足条件
+        valid = np.array([isinstance(price, Decimal) and price.is_finite() for price in prices], dtype=bool)
+        condition = np.zeros(len(merged_data), dtype=bool)
+        if valid.any():
+            condition[valid] = fixed_point.encode(prices[valid]).compare('le', fixed_point.FixedPoint(
+                encoded_max_prices.mantissa[max_rows[valid]], encoded_max_prices.scale) * ratio)
+        return merged_data[condition].copy()
+
+    def save_checkpoint(self):
+        """保存检查点和汇总文件"""
+        if self.checkpoint_path:
+            rows = [(key, day.strftime(DAY_FORMAT), str(high)) for key, window in self.windows.items()
+                    for day, high in window]
+            checkpoint = pd.DataFrame(rows, columns=[self.key_column, 'day', 'high'])
+            self._write(checkpoint, self.checkpoint_path)
+        if self.summary_path:
+            self._write(self._get_max_prices(), self.summary_path)
+
+    @staticmethod
+    def _write(data: pd.DataFrame, file_path: str):
+        temp_file_path = f'{file_path}.tmp'
+        try:
+            data.to_csv(temp_file_path, index=False, encoding='utf-8')
+            os.replace(temp_file_path, file_path)
+        except OSError as e:
+            logger.warning(f'{file_path}保存失败: {e}')
+
+    def load_checkpoint(self):
+        """从检查点恢复；没有检查点时，把汇总文件中的最高价作为文件修改当天的最高价"""
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            try:
+                checkpoint = pd.read_csv(self.checkpoint_path, low_memory=False, encoding='utf-8', dtype='str')
+            except Exception as e:
+                logger.warning(f'{self.checkpoint_path}检查点读取失败: {e}')
+                return
+            # 检查点中的元素已经是单调的，按顺序重新加入即可
+            for key, day, high in checkpoint[[self.key_column, 'day', 'high']].itertuples(index=False):
+                self._push(key, self._to_day(day), Decimal(high))
+            logger.info(f'从检查点恢复{len(self.windows)}个币种的最高价')
+            return
+        if self.summary_path and os.path.exists(self.summary_path):
+            try:
+                summary = pd.read_csv(self.summary_path, low_memory=False, encoding='utf-8', dtype='str')
+            except Exception as e:
+                logger.warning(f'{self.summary_path}读取失败: {e}')
+                return
+            day = datetime.fromtimestamp(os.path.getmtime(self.summary_path)).date() - timedelta(days=1)
+            for key, high in summary[[self.key_column, self.max_column]].dropna().itertuples(index=False):
+                self._push(key, day, Decimal(high))
+            logger.info(f'从{self.summary_path}恢复{len(self.windows)}个币种的最高价，日期记为{day}')
+
+
+if __name__ == '__main__':
+    window_max = SlidingWindowMax(window_days=3)
+    start_day = date(2024, 12, 1)
+    for i, high in enumerate(['100', '90', '95', '80', '70']):
+        window_max.update(pd.DataFrame({'coin_name': ['BTC'], 'high': [Decimal(high)]}),
+                          start_day + timedelta(days=i))
+        print(start_day + timedelta(days=i), window_max.max_prices())
+    print(window_max.price_le_max_ratio(pd.DataFrame({'coin_name': ['BTC', 'BTC'], 'spider_web': ['binance', 'other'],
+                                                      'coin_price': [Decimal('47.5'), Decimal('47.6')]})))
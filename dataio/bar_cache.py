@@ -0,0 +1,128 @@
+import os
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Literal
+
+import numpy as np
+import pandas as pd
+
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'bar_cache.log'))
+
+# 缓存默认保留的小时数
+DEFAULT_WINDOW_HOURS = 48
+
+
+class HourlyBarCache:
+    """
+    进程内共享的小时数据滚动窗口缓存，每个地区数据目录对应一个实例。
+    缓存保证 covered_start 之后的所有小时数据都在内存中：
+    第一次读取时从文件加载，之后由CSVWriter写入小时数据时直接追加，
+    因此稳定运行时按时间范围取数据不需要再读文件。
+    数据按time排序，time为datetime64，价格字段保持Decimal，与从文件读取的结果一致。
+    """
+    _instances = dict()
+    _instances_lock = Lock()
+
+    def __init__(self, base_file_path: str, window_hours: int = DEFAULT_WINDOW_HOURS):
+        self.base_file_path = base_file_path
+        self.window_hours = window_hours
+        self.data = pd.DataFrame()
+        # 缓存完整覆盖的起始时间，为None表示缓存还未加载
+        self.covered_start = None
+        self.lock = Lock()
+
+    @classmethod
+    def get_instance(cls, base_file_path: str, window_hours: int = DEFAULT_WINDOW_HOURS):
+        """获取某个数据目录对应的缓存，不存在则创建"""
+        key = os.path.abspath(base_file_path)
+        with cls._instances_lock:
+            cache = cls._instances.get(key)
+            if cache is None:
+                cache = cls(key, window_hours)
+                cls._instances[key] = cache
+            elif window_hours > cache.window_hours:
+                cache.window_hours = window_hours
+        return cache
+
+    @classmethod
+    def clear_all(cls):
+        """清空所有缓存"""
+        with cls._instances_lock:
+            cls._instances.clear()
+
+    def covers(self, start_datetime: datetime) -> bool:
+        """判断start_datetime之后的数据是否都在缓存中"""
+        return self.covered_start is not None and pd.Timestamp(start_datetime) >= self.covered_start
+
+    def _time_values(self) -> np.ndarray:
+        return self.data['time'].values
+
+    def _trim(self):
+        """只保留最近window_hours小时的数据"""
+        if self.data.empty:
+            return
+        cutoff = self.data['time'].iloc[-1] - timedelta(hours=self.window_hours)
+        if cutoff > self.covered_start:
+            start_index = np.searchsorted(self._time_values(), np.datetime64(cutoff), side='left')
+            self.data = self.data.iloc[start_index:].reset_index(drop=True)
+            self.covered_start = cutoff
+
+    @staticmethod
+    def _prepare(data: pd.DataFrame) -> pd.DataFrame:
+        data = data.dropna().drop_duplicates().copy()
+        data['time'] = pd.to_datetime(data['time'])
+        return data
+
+    def seed(self, data: pd.DataFrame, start_datetime: datetime):
+        """
+        用从文件中读取的数据初始化缓存
+        :param data: start_datetime之后的所有小时数据，价格字段为Decimal
+        :param start_datetime: 数据完整覆盖的起始时间
+        """
+        data = self._prepare(data)
+        start_datetime = pd.Timestamp(start_datetime)
+        with self.lock:
+            data = data[data['time'] >= start_datetime]
+            self.data = data.sort_values('time', kind='mergesort').reset_index(drop=True)
+            self.covered_start = start_datetime
+            self._trim()
+        logger.info(f'{self.base_file_path}缓存加载完成，共{len(self.data)}条，起始时间{self.covered_start}')
+
+    def append(self, data: pd.DataFrame):
+        """追加新写入的小时数据"""
+        if data.empty:
+            return
+        data = self._prepare(data)
+        with self.lock:
+            if self.covered_start is None:
+                # 还未加载时，新写入时刻之后的数据都来自写入
+                self.covered_start = data['time'].min()
+            if self.data.empty:
+                self.data = data.sort_values('time', kind='mergesort').reset_index(drop=True)
+            else:
+                self.data = pd.concat([self.data, data], ignore_index=True)
+                if not self.data['time'].is_monotonic_increasing:
+                    self.data = self.data.sort_values('time', kind='mergesort').reset_index(drop=True)
+                self.data = self.data.drop_duplicates().reset_index(drop=True)
+            self._trim()
+
+    def get_between(self, start_datetime: datetime, end_datetime: datetime,
+                    inclusive: Literal["both", "neither", "left", "right"] = "both") -> pd.DataFrame:
+        """按时间范围取出数据，边界规则与CSVReader.get_data_between_hours相同"""
+        with self.lock:
+            if self.data.empty:
+                return self.data.copy()
+            time_values = self._time_values()
+            left_side = 'left' if inclusive in ('both', 'left') else 'right'
+            right_side = 'right' if inclusive in ('both', 'right') else 'left'
+            start_index = np.searchsorted(time_values, np.datetime64(pd.Timestamp(start_datetime)), side=left_side)
+            end_index = np.searchsorted(time_values, np.datetime64(pd.Timestamp(end_datetime)), side=right_side)
+            return self.data.iloc[start_index:end_index].copy()
+
+
+def get_hourly_bar_cache(base_file_path: str, window_hours: int = DEFAULT_WINDOW_HOURS) -> HourlyBarCache:
+    """获取数据目录对应的小时数据缓存"""
+    return HourlyBarCache.get_instance(base_file_path, window_hours)
@@ -11,6 +11,9 @@ from datetime import datetime, timedelta
 from typing import Literal
 from decimal import Decimal
 
+from dataio.storage_engine import get_storage_engine
+from dataio.bar_cache import get_hourly_bar_cache
+
 PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', f'csv_handler.log'))
 
@@ -32,10 +35,13 @@ class CSVReader:
 
         :param data_region:表示地区，China表示国内数据，Foreign表示国际数据
         :param spider_web: 爬取数据的网站
-        :param kwargs:
+        :param kwargs: storage_engine: 小时和天数据的存储引擎(csv/npz/parquet/feather)，默认为csv
+                       bar_cache_hours: 小时数据内存缓存保留的小时数，为0时不使用缓存
         """
         self.data_region = data_region
         self.base_file_path = kwargs.get('base_file_path', os.path.join(PROJECT_ROOT_PATH, 'data', self.data_region))
+        self.storage = get_storage_engine(kwargs.get('storage_engine'))
+        self.bar_cache_hours = int(kwargs.get('bar_cache_hours') or 0)
 
     @staticmethod
     def change_column_type_to_Decimal(data: pd.DataFrame, only_price: bool = True):
@@ -52,6 +58,12 @@ class CSVReader:
         # 改变数据类型
         for column in change_columns:
             try:
+                # 二进制存储读出的价格已经是Decimal，不需要再逐个转换
+                if pd.api.types.infer_dtype(data[column], skipna=False) == 'decimal':
+                    continue
+                # 旧版本二进制存储读出的是float64，先转为最短的十进制字符串，避免出现二进制误差
+                if pd.api.types.is_float_dtype(data[column]):
+                    data[column] = data[column].astype(str)
                 data[column] = data[column].apply(Decimal)
             except decimal.InvalidOperation:
                 logger.warning(f"{column}字段数据类型转换失败,例如:{data[column].values[:3]}")
@@ -64,10 +76,10 @@ class CSVReader:
     def get_fillna_data(self, filled_date: datetime):
         """读取用于填充指定网站缺失值的数据"""
         filled_date = filled_date - timedelta(hours=1)
-        filled_data_path = os.path.join(self.base_file_path, f"{filled_date.year}-{filled_date.month}",
-                                        f"{filled_date.day}.csv")
+        filled_data_path = self.storage.get_file_path(
+            os.path.join(self.base_file_path, f"{filled_date.year}-{filled_date.month}"), f"{filled_date.day}")
         try:
-            target_web_data = pd.read_csv(filled_data_path, low_memory=False, encoding='utf-8', dtype='str')
+            target_web_data = self.storage.read(filled_data_path)
             target_web_data.dropna(inplace=True)
             target_web_data.drop_duplicates(inplace=True)
         except FileNotFoundError:
@@ -80,16 +92,16 @@ class CSVReader:
         """读取出前一个单位时间数据所在的文件中所有数据"""
         if unit_time == 'hour':
             previous_datetime = cur_datetime - timedelta(hours=1)
-            target_file_name = f'{previous_datetime.day}.csv'
+            target_file_name = f'{previous_datetime.day}'
         elif unit_time == 'day':
             previous_datetime = cur_datetime - timedelta(days=1)
-            target_file_name = f'all_midnight.csv'
+            target_file_name = f'all_midnight'
         else:
             raise KeyError('unit_time参数只能是hour或day')
-        target_file_path = os.path.join(self.base_file_path, f'{previous_datetime.year}-{previous_datetime.month}',
-                                        target_file_name)
+        target_file_path = self.storage.get_file_path(
+            os.path.join(self.base_file_path, f'{previous_datetime.year}-{previous_datetime.month}'), target_file_name)
         try:
-            target_data = pd.read_csv(target_file_path, low_memory=False, encoding='utf-8', dtype='str')
+            target_data = self.storage.read(target_file_path)
             target_data.dropna(inplace=True)
             target_data.drop_duplicates(inplace=True)
             target_data = self.change_column_type_to_Decimal(target_data, only_price=False)
@@ -115,23 +127,19 @@ class CSVReader:
 
         return detail_data
 
-    def get_data_between_hours(self, start_datetime: datetime, end_datetime: datetime,
-                               inclusive: Literal["both", "neither", "left", "right"] = "both"):
-        """根据起始和终止时间读取数据
-        :param end_datetime:
-        :param start_datetime:
-        :param inclusive: 决定选择文件的边界。both:[], left:[), right: (], neither: ()
-        """
+    def read_data_between_hours(self, start_datetime: datetime, end_datetime: datetime):
+        """从文件中读取start_datetime所在文件到end_datetime所在文件之间的所有小时数据"""
         delta_time = math.ceil((end_datetime - start_datetime).total_seconds() / 3600)
         file_count = math.ceil(delta_time / 24)
         datetime_list = [end_datetime - timedelta(days=i) for i in range(file_count + 1)]
         file_path_list = [
-            os.path.join(self.base_file_path, f'{cur_datetime.year}-{cur_datetime.month}', f'{cur_datetime.day}.csv')
+            self.storage.get_file_path(os.path.join(self.base_file_path, f'{cur_datetime.year}-{cur_datetime.month}'),
+                                       f'{cur_datetime.day}')
             for cur_datetime in datetime_list]
         combined_data = pd.DataFrame()
         for file_path in file_path_list:
             try:
-                target_data = pd.read_csv(file_path, low_memory=False, encoding='utf-8', dtype='str')
+                target_data = self.storage.read(file_path)
                 target_data.dropna(inplace=True)
                 target_data.drop_duplicates(inplace=True)
                 target_data = self.change_column_type_to_Decimal(target_data, only_price=False)
@@ -144,6 +152,27 @@ class CSVReader:
                 combined_data = pd.concat([combined_data, target_data], axis=0, ignore_index=True)
         if not combined_data.empty:
             combined_data['time'] = pd.to_datetime(combined_data['time'], format='%Y-%m-%d %H:%M:%S')
+        return combined_data
+
+    def get_data_between_hours(self, start_datetime: datetime, end_datetime: datetime,
+                               inclusive: Literal["both", "neither", "left", "right"] = "both"):
+        """根据起始和终止时间读取数据，开启缓存时优先从内存中获取
+        :param end_datetime:
+        :param start_datetime:
+        :param inclusive: 决定选择文件的边界。both:[], left:[), right: (], neither: ()
+        """
+        if self.bar_cache_hours:
+            bar_cache = get_hourly_bar_cache(self.base_file_path, self.bar_cache_hours)
+            if bar_cache.covers(start_datetime):
+                return bar_cache.get_between(start_datetime, end_datetime, inclusive)
+            combined_data = self.read_data_between_hours(start_datetime, end_datetime)
+            bar_cache.seed(combined_data, start_datetime)
+            # 请求的时间超出了缓存窗口时直接使用文件中的数据
+            if bar_cache.covers(start_datetime):
+                return bar_cache.get_between(start_datetime, end_datetime, inclusive)
+        else:
+            combined_data = self.read_data_between_hours(start_datetime, end_datetime)
+        if not combined_data.empty:
             combined_data = combined_data[
                 combined_data['time'].between(start_datetime, end_datetime, inclusive=inclusive)]
         return combined_data
@@ -165,12 +194,12 @@ class CSVReader:
         datetime_list = [end_datetime - relativedelta(months=i) for i in range(file_count)]
 
         file_path_list = [
-            os.path.join(self.base_file_path, f'{cur_datetime.year}-{cur_datetime.month}', 'all_midnight.csv') for
-            cur_datetime in datetime_list]
+            self.storage.get_file_path(os.path.join(self.base_file_path, f'{cur_datetime.year}-{cur_datetime.month}'),
+                                       'all_midnight') for cur_datetime in datetime_list]
         combined_data = pd.DataFrame()
         for file_path in file_path_list:
             try:
-                target_data = pd.read_csv(file_path, low_memory=False, encoding='utf-8', dtype='str')
+                target_data = self.storage.read(file_path)
                 target_data.drop_duplicates(subset=['coin_name', 'spider_web', 'time'], inplace=True)
                 target_data.dropna(inplace=True)
             except FileNotFoundError:
@@ -208,6 +237,8 @@ class CSVWriter:
     def __init__(self, data_region: str = 'China', **kwargs):
         self.data_region = data_region
         self.base_file_path = kwargs.get('base_file_path', os.path.join(PROJECT_ROOT_PATH, 'data', self.data_region))
+        self.storage = get_storage_engine(kwargs.get('storage_engine'))
+        self.bar_cache_hours = int(kwargs.get('bar_cache_hours') or 0)
         self.is_check = False
 
     def write_data(self, data: pd.DataFrame, unit_time: Literal['hour', 'day']):
@@ -217,17 +248,17 @@ class CSVWriter:
         target_file_folder = os.path.join(self.base_file_path, f'{cur_timedate.year}-{cur_timedate.month}')
         make_sure_path_exists(target_file_folder)
         if unit_time == 'hour':
-            target_file_name = f'{cur_timedate.day}.csv'
+            target_file_name = f'{cur_timedate.day}'
         elif unit_time == 'day':
-            target_file_name = f'all_midnight.csv'
+            target_file_name = f'all_midnight'
         else:
             raise KeyError('unit_time参数只能是hour或day')
-        target_file_path = os.path.join(target_file_folder, target_file_name)
-        if os.path.exists(target_file_path):
-            data.to_csv(target_file_path, mode='a', header=False, index=False, encoding='utf-8',
-                        date_format='%Y-%m-%d %H:%M:%S')
-        else:
-            data.to_csv(target_file_path, index=False, encoding='utf-8', date_format='%Y-%m-%d %H:%M:%S')
+        target_file_path = self.storage.get_file_path(target_file_folder, target_file_name)
+        self.storage.write(data, target_file_path, mode='a')
+        if unit_time == 'hour' and self.bar_cache_hours:
+            # 写入的小时数据同时追加到缓存中
+            cached_data = CSVReader.change_column_type_to_Decimal(data.copy(), only_price=False)
+            get_hourly_bar_cache(self.base_file_path, self.bar_cache_hours).append(cached_data)
 
     def write_detail_data(self, data: pd.DataFrame):
         """将当前爬取的详细数据写入到detail_data文件中"""
@@ -0,0 +1,275 @@
+import json
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from threading import Lock
+from typing import Literal
+
+import pandas as pd
+
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'record_store.log'))
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 默认每保存多少次压缩一次快照，分钟函数约一小时一次
+DEFAULT_COMPACT_INTERVAL = 60
+FIELD_TYPES = ('str', 'decimal', 'datetime', 'number')
+
+
+def _to_decimal(value):
+    """与原来的 Series.apply(Decimal) 一致，空值转换为Decimal('NaN')"""
+    if isinstance(value, Decimal):
+        return value
+    if value is None or (isinstance(value, float) and value != value) or value == '':
+        return Decimal('NaN')
+    return Decimal(value) if isinstance(value, (str, int)) else Decimal(str(value))
+
+
+def _dump_value(value):
+    """转换为journal中保存的值，空值为None"""
+    if value is None:
+        return None
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+class RecordStore:
+    """
+    函数运行记录(如异常次数、第一次价格)的键值存储，替代record_data目录下每分钟读取并整体重写的csv文件。
+    数据常驻内存，字段按columns中的类型保存，读取时不需要重新转换Decimal。
+    每次保存只把发生变化的键追加到journal文件(json lines)，每保存compact_interval次，
+    把全部数据压缩写入快照文件(即原来的csv文件，格式不变)并清空journal。
+    启动时读取快照再重放journal恢复数据，重放是幂等的，压缩过程中程序中断也不会丢失数据。
+
+    reset为'hour'/'day'时，进入新的小时/天后第一次读取会清空记录；
+    ttl不为空时，ttl_column早于当前时间ttl之前的记录在读取时删除。
+    """
+    _instances = dict()
+    _instances_lock = Lock()
+
+    def __init__(self, file_path: str, columns: dict, key_columns: list = None,
+                 reset: Literal['hour', 'day', None] = None, ttl: timedelta = None, ttl_column: str = None,
+                 compact_interval: int = DEFAULT_COMPACT_INTERVAL):
+        """
+        :param file_path: 快照文件路径
+        :param columns: {字段名: 类型}，类型为str、decimal、datetime、number
+        :param key_columns: 键字段，默认为coin_name和spider_web
+        :param reset: 记录的清空周期
+        :param ttl: 记录的有效时长
+        :param ttl_column: 判断有效时长使用的时间字段
+        :param compact_interval: 每保存多少次压缩一次快照
+        """
+        for column, field_type in columns.items():
+            if field_type not in FIELD_TYPES:
+                raise ValueError(f'不支持的字段类型: {column}: {field_type}')
+        if ttl is not None and ttl_column not in columns:
+            raise ValueError(f'有效时长字段不存在: {ttl_column}')
+        self.file_path = file_path
+        self.journal_path = f'{file_path}.journal'
+        self.columns = dict(columns)
+        self.key_columns = list(key_columns or ['coin_name', 'spider_web'])
+        self.reset = reset
+        self.ttl = ttl
+        self.ttl_column = ttl_column
+        self.compact_interval = compact_interval
+        self.data = self._empty()
+        # 最后一次修改记录的时间，用于判断是否进入了新的小时/天
+        self.last_update = None
+        self.journal_count = 0
+        self.lock = Lock()
+        self._recover()
+
+    @classmethod
+    def get_instance(cls, file_path: str, columns: dict, **kwargs) -> 'RecordStore':
+        """获取文件对应的存储，同一个文件在进程内只有一个实例(例如小时函数和分钟函数共用的记录)"""
+        key = os.path.abspath(file_path)
+        with cls._instances_lock:
+            store = cls._instances.get(key)
+            if store is None:
+                store = cls(key, columns, **kwargs)
+                cls._instances[key] = store
+        return store
+
+    @classmethod
+    def clear_all(cls, folder: str = None):
+        """
+        清空进程内的实例，下一次获取时重新从文件恢复
+        :param folder: 只清空该目录下的文件对应的实例，为空时全部清空
+        """
+        with cls._instances_lock:
+            if folder is None:
+                cls._instances.clear()
+                return
+            folder = os.path.join(os.path.abspath(folder), '')
+            for key in [key for key in cls._instances if key.startswith(folder)]:
+                del cls._instances[key]
+
+    def _empty(self) -> pd.DataFrame:
+        return pd.DataFrame(columns=list(self.columns))
+
+    def _normalize(self, data: pd.DataFrame) -> pd.DataFrame:
+        """只保留定义的字段并转换类型，同一个键只保留最后一条"""
+        data = data.reindex(columns=list(self.columns)).copy()
+        for column, field_type in self.columns.items():
+            if field_type == 'decimal':
+                data[column] = data[column].apply(_to_decimal)
+            elif field_type == 'datetime':
+                data[column] = pd.to_datetime(data[column])
+            elif field_type == 'number':
+                data[column] = pd.to_numeric(data[column])
+        data = data.drop_duplicates(subset=self.key_columns, keep='last')
+        return data.reset_index(drop=True)
+
+    def _row_key(self, row: dict) -> tuple:
+        return tuple(row[column] for column in self.key_columns)
+
+    def _to_rows(self, data: pd.DataFrame) -> dict:
+        """{键: 行}，行的值为journal中保存的形式，用于比较是否变化"""
+        rows = {}
+        for record in data.to_dict('records'):
+            row = {column: _dump_value(record[column]) for column in self.columns}
+            rows[self._row_key(row)] = row
+        return rows
+
+    def _period(self, cur_datetime: datetime):
+        if self.reset == 'hour':
+            return cur_datetime.replace(minute=0, second=0, microsecond=0)
+        if self.reset == 'day':
+            return cur_datetime.replace(hour=0, minute=0, second=0, microsecond=0)
+        return None
+
+    def _recover(self):
+        """读取快照并重放journal"""
+        if os.path.exists(self.file_path):
+            try:
+                snapshot = pd.read_csv(self.file_path, encoding='utf-8', low_memory=False, dtype=str)
+                self.data = self._normalize(snapshot)
+                self.last_update = datetime.fromtimestamp(os.path.getmtime(self.file_path))
+            except Exception as e:
+                logger.warning(f'{self.file_path}快照读取失败: {e}')
+        if not os.path.exists(self.journal_path):
+            return
+        rows = self._to_rows(self.data)
+        with open(self.journal_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 最后一行可能因为程序中断没有写完整
+                    logger.warning(f'{self.journal_path}存在无法解析的记录，已忽略')
+                    continue
+                op = entry.get('op')
+                if op == 'set':
+                    rows[self._row_key(entry['row'])] = entry['row']
+                elif op == 'del':
+                    rows.pop(tuple(entry['key']), None)
+                elif op == 'clear':
+                    rows.clear()
+                if entry.get('time'):
+                    self.last_update = datetime.strptime(entry['time'], DATE_FORMAT)
+                self.journal_count += 1
+        self.data = self._normalize(pd.DataFrame(list(rows.values()), columns=list(self.columns)))
+
+    def _append_journal(self, entries: list):
+        if not entries:
+            return
+        with open(self.journal_path, 'a', encoding='utf-8') as file:
+            file.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+        self.journal_count += 1
+
+    def _expire(self, cur_datetime: datetime):
+        """按清空周期和有效时长删除过期的记录"""
+        if self.reset and self.last_update is not None and self._period(self.last_update) != self._period(
+                cur_datetime):
+            self._clear(cur_datetime)
+        if self.ttl is not None and not self.data.empty:
+            valid = self.data[self.ttl_column] >= cur_datetime - self.ttl
+            if not valid.all():
+                self.data = self.data[valid].reset_index(drop=True)
+
+    def load(self, cur_datetime: datetime) -> pd.DataFrame:
+        """读取当前有效的记录，返回副本"""
+        with self.lock:
+            self._expire(cur_datetime)
+            return self.data.copy()
+
+    def save(self, data: pd.DataFrame, cur_datetime: datetime):
+        """用data替换全部记录，只把新增、修改和删除的键写入journal"""
+        with self.lock:
+            new_data = self._normalize(data)
+            old_rows = self._to_rows(self.data)
+            new_rows = self._to_rows(new_data)
+            time_str = cur_datetime.strftime(DATE_FORMAT)
+            entries = [{'op': 'set', 'row': row, 'time': time_str} for key, row in new_rows.items()
+                       if old_rows.get(key) != row]
+            entries += [{'op': 'del', 'key': list(key), 'time': time_str} for key in old_rows if key not in new_rows]
+            self.data = new_data
+            self.last_update = cur_datetime
+            self._append_journal(entries)
+            if self.journal_count >= self.compact_interval:
+                self._compact()
+
+    def clear(self, cur_datetime: datetime):
+        """清空全部记录"""
+        with self.lock:
+            self._clear(cur_datetime)
+
+    def compact(self):
+        """将当前数据写入快照文件并清空journal"""
+        with self.lock:
+            self._compact()
+
+    def _clear(self, cur_datetime: datetime):
+        """清空全部记录，调用方需持有self.lock(Lock不可重入)"""
+        self.data = self._empty()
+        self.last_update = cur_datetime
+        self._append_journal([{'op': 'clear', 'time': cur_datetime.strftime(DATE_FORMAT)}])
+        self._compact()
+
+    def _compact(self):
+        """将当前数据写入快照文件并清空journal，调用方需持有self.lock"""
+        temp_file_path = f'{self.file_path}.tmp'
+        try:
+            self.data.to_csv(temp_file_path, index=False, encoding='utf-8', date_format=DATE_FORMAT)
+            os.replace(temp_file_path, self.file_path)
+            if self.last_update is not None:
+                # journal中只保留最后修改时间
+                with open(self.journal_path, 'w', encoding='utf-8') as file:
+                    file.write(json.dumps({'op': 'meta', 'time': self.last_update.strftime(DATE_FORMAT)}) + '\n')
+            elif os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.journal_count = 0
+        except OSError as e:
+            logger.warning(f'{self.file_path}快照保存失败: {e}')
+
+
+def get_record_store(file_path: str, columns: dict, **kwargs) -> RecordStore:
+    """获取记录文件对应的存储"""
+    return RecordStore.get_instance(file_path, columns, **kwargs)
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = get_record_store(os.path.join(temp_dir, 'record_store_demo.csv'),
+                                 {'coin_name': 'str', 'spider_web': 'str', 'first_price': 'decimal'}, reset='hour')
+        now = datetime.now().replace(second=0, microsecond=0)
+        records = store.load(now)
+        print(records)
+        records = pd.concat([records, pd.DataFrame({'coin_name': ['BTC'], 'spider_web': ['binance'],
+                                                    'first_price': [Decimal('68218.00')]})])
+        store.save(records, now)
+        print(store.load(now))
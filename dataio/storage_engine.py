@@ -0,0 +1,320 @@
+import os
+import re
+import sys
+from decimal import Decimal, InvalidOperation
+from typing import Literal
+
+import numpy as np
+import pandas as pd
+
+from data_process import fixed_point
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'storage_engine.log'))
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 以Decimal读取的字段，与CSVReader.change_column_type_to_Decimal转换的字段相同
+DECIMAL_COLUMNS = ['coin_price', 'high', 'low', 'open', 'close', 'change', 'amplitude', 'virtual_drop']
+
+
+class StorageEngine:
+    """
+    分区文件的存储引擎基类。
+    分区布局与原来保持一致: {year}-{month}/{day}{suffix} 与 {year}-{month}/all_midnight{suffix}，
+    不同的引擎只决定单个分区文件的格式。
+    name: 引擎名称
+    suffix: 分区文件的后缀
+    typed: 读出的time字段是否已经是时间类型、价格字段是否已经是Decimal（csv读出的都是字符串）
+    """
+    name = None
+    suffix = None
+    typed = False
+
+    def get_file_path(self, folder: str, file_name: str) -> str:
+        """根据目录和不带后缀的文件名得到分区文件路径"""
+        return os.path.join(folder, f'{file_name}{self.suffix}')
+
+    def read(self, file_path: str) -> pd.DataFrame:
+        """读取一个分区文件，文件不存在时抛出FileNotFoundError"""
+        raise NotImplementedError
+
+    def write(self, data: pd.DataFrame, file_path: str, mode: Literal['w', 'a'] = 'a'):
+        """写入一个分区文件，mode为a时追加到已有数据之后"""
+        raise NotImplementedError
+
+
+class CSVStorage(StorageEngine):
+    """原有的csv存储，所有字段按字符串读出"""
+    name = 'csv'
+    suffix = '.csv'
+
+    def read(self, file_path: str) -> pd.DataFrame:
+        return pd.read_csv(file_path, low_memory=False, encoding='utf-8', dtype='str')
+
+    def write(self, data: pd.DataFrame, file_path: str, mode: Literal['w', 'a'] = 'a'):
+        if mode == 'a' and os.path.exists(file_path):
+            data.to_csv(file_path, mode='a', header=False, index=False, encoding='utf-8', date_format=DATE_FORMAT)
+        else:
+            data.to_csv(file_path, index=False, encoding='utf-8', date_format=DATE_FORMAT)
+
+
+class TypedStorage(StorageEngine):
+    """
+    列式二进制存储的基类。time字段以datetime64保存，读取时不需要再解析文本；
+    价格和派生字段(DECIMAL_COLUMNS)按每个值的系数和指数保存为两个int64列，读取时一次转换回Decimal，
+    与csv读出后转换的Decimal完全相同(包括末尾的0)，读取后不需要再逐个解析字符串。
+    不能用int64精确表示的列(例如28位有效数字的change、-0、NaN)整列以十进制字符串保存，读出后与csv一样转换。
+    其余字段以字符串保存，空值另外保存为__null__{字段}布尔列，读出为空值。
+    追加写入时不重写已有分区，而是写入一个新的分段文件{分区文件}.part{n}，
+    读取时按顺序拼接；分段数达到max_segments时合并回分区文件。
+    """
+    typed = True
+    # 一个分区最多的分段文件数，小时数据每天追加24次，合并两次
+    max_segments = 10
+    null_prefix = '__null__'
+    exponent_prefix = '__exponent__'
+
+    @staticmethod
+    def _to_decimals(values: pd.Series):
+        """转换为Decimal数组，不能转换时返回None"""
+        try:
+            return np.fromiter((value if isinstance(value, Decimal) else Decimal(str(value)) for value in values),
+                               dtype=object, count=len(values))
+        except InvalidOperation:
+            return None
+
+    @classmethod
+    def to_typed(cls, data: pd.DataFrame) -> pd.DataFrame:
+        """将数据转换为带类型的列"""
+        columns = {}
+        null_masks = {}
+        for column in data.columns:
+            values = data[column].reset_index(drop=True)
+            if column == 'time':
+                columns[column] = pd.to_datetime(values)
+                continue
+            null_mask = values.isna().to_numpy()
+            if null_mask.any():
+                null_masks[f'{cls.null_prefix}{column}'] = null_mask
+            encoded = None
+            if column in DECIMAL_COLUMNS:
+                decimals = cls._to_decimals(values[~null_mask])
+                encoded = None if decimals is None else fixed_point.encode_exact(decimals)
+            if encoded is not None:
+                coefficients, exponents = np.zeros(len(values), dtype=np.int64), np.zeros(len(values), dtype=np.int64)
+                coefficients[~null_mask], exponents[~null_mask] = encoded
+                columns[column] = coefficients
+                columns[f'{cls.exponent_prefix}{column}'] = exponents
+            else:
+                columns[column] = values.astype(str).astype(object).where(~null_mask, '')
+        return pd.DataFrame({**columns, **null_masks})
+
+    @classmethod
+    def from_typed(cls, typed_data: pd.DataFrame) -> pd.DataFrame:
+        """to_typed的逆转换，系数和指数列转换回Decimal，空值还原为NaN"""
+        columns = [column for column in typed_data.columns
+                   if not column.startswith(cls.null_prefix) and not column.startswith(cls.exponent_prefix)]
+        # 所有按系数和指数保存的列一起转换，不同列中相同的价格只生成一次Decimal
+        decimal_columns = [column for column in columns if f'{cls.exponent_prefix}{column}' in typed_data.columns]
+        decimals = {}
+        if decimal_columns:
+            coefficients = np.concatenate([typed_data[column].to_numpy() for column in decimal_columns])
+            exponents = np.concatenate([typed_data[f'{cls.exponent_prefix}{column}'].to_numpy()
+                                        for column in decimal_columns])
+            decoded = fixed_point.decode_exact(coefficients, exponents).reshape(len(decimal_columns), -1)
+            decimals = dict(zip(decimal_columns, decoded))
+        data = {}
+        for column in columns:
+            values = typed_data[column]
+            if column in decimals:
+                values = pd.Series(decimals[column])
+            elif values.dtype.kind == 'U':
+                values = values.astype(object)
+            null_column = f'{cls.null_prefix}{column}'
+            if null_column in typed_data.columns:
+                values = values.astype(object).where(~typed_data[null_column].to_numpy(), np.nan)
+            data[column] = values
+        return pd.DataFrame(data)
+
+    def _read(self, file_path: str) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def _write(self, data: pd.DataFrame, file_path: str):
+        raise NotImplementedError
+
+    def _replace(self, data: pd.DataFrame, file_path: str):
+        """先写临时文件再替换，避免写入中断导致文件损坏"""
+        temp_file_path = f'{file_path}.tmp{self.suffix}'
+        self._write(data, temp_file_path)
+        os.replace(temp_file_path, file_path)
+
+    @staticmethod
+    def get_segment_paths(file_path: str) -> list:
+        """分区文件已有的分段文件，按写入顺序排列"""
+        folder, file_name = os.path.split(file_path)
+        pattern = re.compile(rf'{re.escape(file_name)}\.part(\d+)')
+        segments = []
+        for name in os.listdir(folder or '.'):
+            match = pattern.fullmatch(name)
+            if match:
+                segments.append((int(match.group(1)), os.path.join(folder, name)))
+        return [segment_path for _, segment_path in sorted(segments)]
+
+    def read(self, file_path: str) -> pd.DataFrame:
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        segment_paths = self.get_segment_paths(file_path)
+        if not segment_paths:
+            return self.from_typed(self._read(file_path))
+        # 每个分段的列可能使用不同的保存方式，分别转换后再拼接
+        return pd.concat([self.from_typed(self._read(path)) for path in [file_path] + segment_paths],
+                         ignore_index=True)
+
+    def write(self, data: pd.DataFrame, file_path: str, mode: Literal['w', 'a'] = 'a'):
+        if mode == 'a' and os.path.exists(file_path):
+            segment_paths = self.get_segment_paths(file_path)
+            if len(segment_paths) + 1 < self.max_segments:
+                segment_number = int(segment_paths[-1].rsplit('.part', 1)[1]) + 1 if segment_paths else 1
+                self._replace(self.to_typed(data), f'{file_path}.part{segment_number}')
+                return
+            # 分段过多时连同本次数据合并回分区文件
+            data = pd.concat([self.read(file_path), data], ignore_index=True)
+        self._replace(self.to_typed(data), file_path)
+        self.remove_segments(file_path)
+
+    def remove_segments(self, file_path: str):
+        """删除分区的分段文件，分区文件已经包含这些数据或整体重写时调用"""
+        for segment_path in self.get_segment_paths(file_path):
+            os.remove(segment_path)
+
+
+class NpzStorage(TypedStorage):
+    """使用numpy的npz格式保存，每一列为一个数组，不依赖第三方库"""
+    name = 'npz'
+    suffix = '.npz'
+
+    def _read(self, file_path: str) -> pd.DataFrame:
+        with np.load(file_path, allow_pickle=False) as npz_file:
+            columns = [str(column) for column in npz_file['__columns__']]
+            return pd.DataFrame({column: npz_file[column] for column in columns})
+
+    def _write(self, data: pd.DataFrame, file_path: str):
+        arrays = {'__columns__': np.array(data.columns, dtype=str)}
+        for column in data.columns:
+            values = data[column]
+            if column == 'time':
+                arrays[column] = values.values.astype('datetime64[s]')
+            elif values.dtype == object:
+                arrays[column] = values.to_numpy().astype(str)
+            else:
+                arrays[column] = values.values
+        with open(file_path, 'wb') as file:
+            np.savez(file, **arrays)
+
+
+class ParquetStorage(TypedStorage):
+    """使用parquet格式保存，需要安装pyarrow"""
+    name = 'parquet'
+    suffix = '.parquet'
+
+    def __init__(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError('parquet存储引擎需要安装pyarrow')
+
+    def _read(self, file_path: str) -> pd.DataFrame:
+        return pd.read_parquet(file_path)
+
+    def _write(self, data: pd.DataFrame, file_path: str):
+        data.to_parquet(file_path, index=False)
+
+
+class FeatherStorage(ParquetStorage):
+    """使用feather格式保存，需要安装pyarrow"""
+    name = 'feather'
+    suffix = '.feather'
+
+    def _read(self, file_path: str) -> pd.DataFrame:
+        return pd.read_feather(file_path)
+
+    def _write(self, data: pd.DataFrame, file_path: str):
+        data.to_feather(file_path)
+
+
+STORAGE_ENGINES = {
+    CSVStorage.name: CSVStorage,
+    NpzStorage.name: NpzStorage,
+    ParquetStorage.name: ParquetStorage,
+    FeatherStorage.name: FeatherStorage,
+}
+
+
+def get_storage_engine(engine=None) -> StorageEngine:
+    """
+    根据名称得到存储引擎对象
+    :param engine: 引擎名称(csv/npz/parquet/feather)或StorageEngine对象，为空时使用csv
+    :return:
+    """
+    if isinstance(engine, StorageEngine):
+        return engine
+    if engine is None:
+        engine = CSVStorage.name
+    engine_class = STORAGE_ENGINES.get(engine)
+    if engine_class is None:
+        raise ValueError(f'不支持的存储引擎 {engine}: 必须为 {list(STORAGE_ENGINES.keys())} 之一')
+    return engine_class()
+
+
+def convert_history(base_file_path: str, target_engine, source_engine=None, remove_source: bool = False):
+    """
+    将已有的历史分区一次性转换为另一种存储格式。
+    只转换小时数据({day}.csv)和天数据(all_midnight.csv)，详细数据和统计表保持不变。
+    :param base_file_path: 地区数据目录，例如 data/China
+    :param target_engine: 目标存储引擎
+    :param source_engine: 源存储引擎，默认为csv
+    :param remove_source: 转换成功后是否删除源文件
+    :return: 转换的文件数
+    """
+    source_engine = get_storage_engine(source_engine)
+    target_engine = get_storage_engine(target_engine)
+    if source_engine.suffix == target_engine.suffix:
+        logger.warning(f'源格式与目标格式相同:{source_engine.name}')
+        return 0
+
+    converted_count = 0
+    for folder_name in sorted(os.listdir(base_file_path)):
+        folder = os.path.join(base_file_path, folder_name)
+        if not os.path.isdir(folder):
+            continue
+        for file_name in sorted(os.listdir(folder)):
+            if not file_name.endswith(source_engine.suffix) or '.tmp' in file_name:
+                continue
+            source_file_path = os.path.join(folder, file_name)
+            partition_name = file_name[:-len(source_engine.suffix)]
+            target_file_path = target_engine.get_file_path(folder, partition_name)
+            try:
+                data = source_engine.read(source_file_path)
+                data.dropna(inplace=True)
+                data.drop_duplicates(inplace=True)
+                target_engine.write(data, target_file_path, mode='w')
+            except Exception as e:
+                logger.exception(f'{source_file_path}转换失败: {e}')
+                continue
+            converted_count += 1
+            if remove_source:
+                os.remove(source_file_path)
+                if isinstance(source_engine, TypedStorage):
+                    source_engine.remove_segments(source_file_path)
+    logger.info(f'{base_file_path}共转换{converted_count}个文件为{target_engine.name}格式')
+    return converted_count
+
+
+if __name__ == '__main__':
+    # python -m dataio.storage_engine data/China npz
+    if len(sys.argv) < 3:
+        print('用法: python -m dataio.storage_engine <地区数据目录> <目标格式>')
+        sys.exit(1)
+    count = convert_history(sys.argv[1], sys.argv[2])
+    print(f'转换完成，共{count}个文件')
@@ -0,0 +1,450 @@
+import os
+from decimal import Decimal
+from typing import Literal
+
+import numpy as np
+import pandas as pd
+
+from data_process import fixed_point
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'ab_pair_engine.log'))
+
+GROUP_COLUMNS = ['coin_name', 'spider_web']
+
+
+def _expand_ranges(starts: np.ndarray, ends: np.ndarray):
+    """将若干个[start, end)区间展开，返回每个元素所属的区间编号和元素位置"""
+    counts = np.maximum(ends - starts, 0)
+    total = int(counts.sum())
+    owners = np.repeat(np.arange(len(starts)), counts)
+    if total == 0:
+        return owners, np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+    return owners, offsets + np.arange(total)
+
+
+def _rank_prices(prices: np.ndarray, magnification):
+    """
+    价格和A的比较阈值(价格 * magnification)统一转换为整数后排名，相等的数值排名相同。
+    :return: (价格排名, 阈值排名, 排名数量)
+    """
+    if not isinstance(magnification, Decimal):
+        magnification = Decimal(magnification)
+    n = len(prices)
+    thresholds = prices * magnification
+    encoded = fixed_point.encode(np.concatenate((prices, thresholds)))
+    _, ranks = np.unique(encoded.mantissa, return_inverse=True)
+    ranks = ranks.astype(np.int64)
+    return ranks[:n], ranks[n:], int(ranks.max()) + 1
+
+
+def _key_ranges(ranks: np.ndarray, group_ids: np.ndarray, rank_count: int, comparison: str):
+    """
+    满足 排名为ranks的数值 (comparison) 另一个数值 时，另一个数值的排名区间，加上分组后作为键区间。
+    :return: [(键的下界, 键的上界)]，上界不包含
+    """
+    base = group_ids * rank_count
+    lower, upper = base + ranks, base + ranks + 1
+    range_map = {
+        'gt': [(base, lower)],
+        'ge': [(base, upper)],
+        'lt': [(upper, base + rank_count)],
+        'le': [(lower, base + rank_count)],
+        'eq': [(lower, upper)],
+        'neq': [(base, lower), (upper, base + rank_count)],
+    }
+    if comparison not in range_map:
+        raise ValueError(f'不支持的比较运算符: {comparison}')
+    return range_map[comparison]
+
+
+class _MergeSortTree:
+    """
+    点(位置, 键)的归并排序树。所有点按(键, 位置)排列，第l层每2**l个点为一个节点，节点内按位置排列。
+    键在[下界, 上界)中的点在第0层是连续的一段，可以拆分为O(log n)个节点，
+    每个节点中位置在某个值之前(或之后)的点又是连续的一段，所以查询只访问满足条件的点，
+    不会先列出位置不满足条件的点再筛选掉。
+    """
+
+    def __init__(self, positions: np.ndarray, keys: np.ndarray, cache_levels: bool = False):
+        """
+        :param cache_levels: 是否保存所有层，多次查询时保存(内存为n*log(n))，只查询一次时只保存当前层
+        """
+        order = np.lexsort((positions, keys))
+        self.keys = keys[order]
+        self.positions = positions[order]
+        self.size = len(order)
+        self.span = int(positions.max()) + 1 if self.size else 1
+        self.cache_levels = cache_levels
+        # {层: (该层按(节点, 位置)排列的点在第0层中的序号, 对应的节点 * span + 位置)}
+        self.levels = {}
+
+    def level(self, level: int):
+        if level not in self.levels:
+            sort_keys = (np.arange(self.size, dtype=np.int64) >> level) * self.span + self.positions
+            order = np.argsort(sort_keys, kind='stable')
+            if not self.cache_levels:
+                self.levels.clear()
+            self.levels[level] = (order, sort_keys[order])
+        return self.levels[level]
+
+    def nodes(self, key_lower: np.ndarray, key_upper: np.ndarray):
+        """把每个查询的键区间拆分为节点，依次返回(层, 查询序号, 节点序号)"""
+        start = np.searchsorted(self.keys, key_lower, side='left')
+        end = np.searchsorted(self.keys, key_upper, side='left')
+        queries = np.arange(len(start))
+        level = 0
+        while True:
+            active = start < end
+            if not active.any():
+                return
+            queries, start, end = queries[active], start[active], end[active]
+            take_start = (start & 1) == 1
+            start = start + take_start
+            take_end = (end & 1) == 1
+            end = end - take_end
+            yield level, np.concatenate((queries[take_start], queries[take_end])), np.concatenate(
+                (start[take_start] - 1, end[take_end]))
+            start, end, level = start >> 1, end >> 1, level + 1
+
+    def ranges(self, key_lower: np.ndarray, key_upper: np.ndarray, bounds: np.ndarray,
+               side: Literal['before', 'after']):
+        """
+        键在[key_lower, key_upper)中，且位置在bounds之前(side='before')或之后(side='after')的点，
+        依次返回(层, 查询序号, 起点, 终点)，这些点为该层排列中的[起点, 终点)
+        """
+        bounds = np.minimum(bounds, self.span)
+        for level, queries, nodes in self.nodes(key_lower, key_upper):
+            _, sort_keys = self.level(level)
+            node_start = nodes << level
+            node_end = np.minimum(node_start + (1 << level), self.size)
+            base = nodes * self.span + bounds[queries]
+            if side == 'before':
+                start, end = node_start, np.searchsorted(sort_keys, base, side='left')
+            else:
+                start, end = np.minimum(np.searchsorted(sort_keys, base, side='right'), node_end), node_end
+            yield level, queries, start, end
+
+    def query(self, key_lower: np.ndarray, key_upper: np.ndarray, bounds: np.ndarray,
+              side: Literal['before', 'after']):
+        """与ranges的条件相同，返回(查询序号数组, 点的位置数组)"""
+        query_list, position_list = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for level, queries, start, end in self.ranges(key_lower, key_upper, bounds, side):
+            owners, index = _expand_ranges(start, end)
+            order, _ = self.level(level)
+            query_list.append(queries[owners])
+            position_list.append(self.positions[order[index]])
+        return np.concatenate(query_list), np.concatenate(position_list)
+
+    def summarize_before(self, key_lower: np.ndarray, key_upper: np.ndarray, bounds: np.ndarray, values: dict,
+                         summary: dict):
+        """
+        键在[key_lower, key_upper)中、位置在bounds之前的点按查询汇总到summary中：
+        数量(count)、最小和最大的位置(first_A、last_A)以及values中各数值的(最小值, 最大值)。
+        每个节点中满足条件的点是按位置排列的前缀，用该层按节点分段的前缀最小值、最大值汇总，不逐个访问点
+        """
+        for level, queries, start, end in self.ranges(key_lower, key_upper, bounds, 'before'):
+            found = end > start
+            if not found.any():
+                continue
+            queries, start, last = queries[found], start[found], end[found] - 1
+            order, _ = self.level(level)
+            positions = self.positions[order]
+            np.add.at(summary['count'], queries, last - start + 1)
+            np.minimum.at(summary['first_A'], queries, positions[start])
+            np.maximum.at(summary['last_A'], queries, positions[last])
+            nodes = np.arange(self.size, dtype=np.int64) >> level
+            for name, value in values.items():
+                prefix_min, prefix_max = _segment_prefix_min_max(value[positions], nodes)
+                np.minimum.at(summary[name][0], queries, prefix_min[last])
+                np.maximum.at(summary[name][1], queries, prefix_max[last])
+
+
+def _segment_prefix_min_max(values: np.ndarray, segments: np.ndarray):
+    """非负整数数组按分段(segments升序)计算段内的前缀最小值和最大值"""
+    top = int(values.max()) if len(values) else 0
+    # 每段加上段号 * (top + 1)后，前面各段的值都小于当前段，累计最大值在每段的开头重新开始
+    offset = segments * (top + 1)
+    prefix_max = np.maximum.accumulate(values + offset) - offset
+    prefix_min = top - (np.maximum.accumulate(top - values + offset) - offset)
+    return prefix_min, prefix_max
+
+
+# A的阈值 (comparison) B的价格 等价于 B的价格 (反向的comparison) A的阈值，以B为查询方时使用
+REVERSED_COMPARISON = {'gt': 'lt', 'ge': 'le', 'lt': 'gt', 'le': 'ge', 'eq': 'eq', 'neq': 'neq'}
+
+
+def _pair_tree(prices: np.ndarray, group_ids: np.ndarray, magnification, comparison: str,
+               cache_levels: bool = False):
+    """
+    以A为查询方：点为所有位置，键为(分组, 价格排名)，
+    位置为i的A对应的B为键在A的键区间中、位置在i之后的点。
+    :return: (归并排序树, [(键的下界数组, 键的上界数组)])
+    """
+    price_ranks, threshold_ranks, rank_count = _rank_prices(prices, magnification)
+    tree = _MergeSortTree(np.arange(len(prices), dtype=np.int64), group_ids * rank_count + price_ranks, cache_levels)
+    return tree, _key_ranges(threshold_ranks, group_ids, rank_count, comparison)
+
+
+def _enumerate_pairs(tree: _MergeSortTree, key_ranges: list, A_positions: np.ndarray):
+    """列出A_positions中每个A的全部B，按A、B的位置升序排列"""
+    A_index_list, B_index_list = [], []
+    for key_lower, key_upper in key_ranges:
+        owners, B_index = tree.query(key_lower[A_positions], key_upper[A_positions], A_positions, 'after')
+        A_index_list.append(A_positions[owners])
+        B_index_list.append(B_index)
+    A_index = np.concatenate(A_index_list)
+    B_index = np.concatenate(B_index_list)
+    pair_order = np.lexsort((B_index, A_index))
+    return A_index[pair_order], B_index[pair_order]
+
+
+def find_ab_pairs(prices, group_ids=None, magnification=1,
+                  comparison: Literal['gt', 'lt', 'ge', 'le', 'eq', 'neq'] = 'gt'):
+    """
+    找出所有满足 `A价格 * magnification (comparison) B价格` 且A在B之前的(A, B)组合。
+    prices需要已经按(分组, 时间)排好序，同一分组内位置靠前的为A。
+    :param prices: 价格数组(Decimal)
+    :param group_ids: 每个价格所属的分组编号，同一分组的数据需要连续，为空时视为同一分组
+    :param magnification: A价格的倍率，乘法与原来一样使用Decimal计算
+    :param comparison: 比较方式
+    :return: (A的位置数组, B的位置数组)，按A、B的位置升序排列
+    """
+    prices = np.asarray(prices, dtype=object)
+    n = len(prices)
+    if n < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    group_ids = np.zeros(n, dtype=np.int64) if group_ids is None else np.asarray(group_ids, dtype=np.int64)
+    tree, key_ranges = _pair_tree(prices, group_ids, magnification, comparison)
+    return _enumerate_pairs(tree, key_ranges, np.arange(n))
+
+
+def find_first_ab_pairs(prices, group_ids=None, magnification=1,
+                        comparison: Literal['gt', 'lt', 'ge', 'le', 'eq', 'neq'] = 'gt', accept=None,
+                        block_size: int = 64):
+    """
+    与find_ab_pairs相同的组合中，每个分组只找出第一个(按A、B的位置)满足accept的组合。
+    每个分组按时间顺序，每轮只列出还没有找到的分组中接下来block_size个A与其之后的B的组合，
+    找到后该分组不再继续，只需要知道是否存在组合(以及一个例子)时不需要列出全部O(n²)个组合。
+    :param accept: accept(A的位置数组, B的位置数组)返回布尔数组，为空时所有组合都满足
+    :param block_size: 每轮每个分组处理的A的数量
+    :return: (A的位置数组, B的位置数组)，每个找到组合的分组一个，按A的位置升序排列
+    """
+    prices = np.asarray(prices, dtype=object)
+    n = len(prices)
+    if n < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    group_ids = np.zeros(n, dtype=np.int64) if group_ids is None else np.asarray(group_ids, dtype=np.int64)
+    tree, key_ranges = _pair_tree(prices, group_ids, magnification, comparison, cache_levels=True)
+
+    # 每个位置所在的分组序号以及在分组中的序号
+    boundaries = np.r_[True, group_ids[1:] != group_ids[:-1]]
+    group_index = np.cumsum(boundaries) - 1
+    rank_in_group = np.arange(n) - np.flatnonzero(boundaries)[group_index]
+    # 按在分组中的序号排列，第k轮的A为其中连续的一段，不需要每轮扫描全部位置
+    by_rank = np.argsort(rank_in_group, kind='stable')
+    round_starts = np.arange(0, int(rank_in_group.max()) + 1, block_size)
+    round_ends = np.searchsorted(rank_in_group[by_rank], round_starts + block_size, side='left')
+    resolved = np.zeros(int(group_index[-1]) + 1, dtype=bool)
+    A_found, B_found = [], []
+    round_start = 0
+    for round_end in round_ends:
+        A_positions = by_rank[round_start:round_end]
+        round_start = round_end
+        # 已经找到组合的分组不再继续
+        A_positions = np.sort(A_positions[~resolved[group_index[A_positions]]])
+        if len(A_positions) == 0:
+            if resolved.all():
+                break
+            continue
+        A_index, B_index = _enumerate_pairs(tree, key_ranges, A_positions)
+        if accept is not None and len(A_index):
+            accepted = np.asarray(accept(A_index, B_index), dtype=bool)
+            A_index, B_index = A_index[accepted], B_index[accepted]
+        if len(A_index) == 0:
+            continue
+        # 组合按A、B的位置排列，同一分组的组合是连续的，每段的第一个即为该分组第一个满足条件的组合
+        groups = group_index[A_index]
+        first = np.r_[True, groups[1:] != groups[:-1]]
+        A_found.append(A_index[first])
+        B_found.append(B_index[first])
+        resolved[groups[first]] = True
+        if resolved.all():
+            break
+    if not A_found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    A_index, B_index = np.concatenate(A_found), np.concatenate(B_found)
+    pair_order = np.argsort(A_index, kind='mergesort')
+    return A_index[pair_order], B_index[pair_order]
+
+
+def summarize_ab_pairs(prices, group_ids=None, magnification=1,
+                       comparison: Literal['gt', 'lt', 'ge', 'le', 'eq', 'neq'] = 'gt', A_values: dict = None):
+    """
+    与find_ab_pairs相同的组合，不返回组合，而是按B汇总：每个B对应的A的数量、第一个和最后一个A的位置，
+    以及A_values中各数值在这些A中的最小值和最大值。
+    以B为查询方在按(分组, A的阈值)排列的归并排序树上汇总，不列出组合，
+    耗时为O(n*log²(n))，内存为O(n)，不会随组合数量(数据量的平方)增长，45天的窗口也只需要保存每个B一行。
+    :param A_values: {名称: 非负整数数组}，一般为数值的排名，汇总每个B对应的A中该数值的最小值和最大值
+    :return: dict，count、first_A、last_A为长度与prices相同的数组(没有A的B的count为0)，
+             以及A_values中每个名称对应的(最小值数组, 最大值数组)
+    """
+    prices = np.asarray(prices, dtype=object)
+    n = len(prices)
+    A_values = {name: np.asarray(values, dtype=np.int64) for name, values in (A_values or {}).items()}
+    summary = {'count': np.zeros(n, dtype=np.int64), 'first_A': np.full(n, n, dtype=np.int64),
+               'last_A': np.full(n, -1, dtype=np.int64)}
+    for name, values in A_values.items():
+        summary[name] = (np.full(n, int(values.max()) + 1 if n else 0, dtype=np.int64), np.full(n, -1, dtype=np.int64))
+    if n < 2:
+        return summary
+    group_ids = np.zeros(n, dtype=np.int64) if group_ids is None else np.asarray(group_ids, dtype=np.int64)
+    price_ranks, threshold_ranks, rank_count = _rank_prices(prices, magnification)
+
+    # 点为A，键为(分组, 阈值排名)；B对应的A为键在B的键区间中、位置在B之前的点
+    positions = np.arange(n, dtype=np.int64)
+    tree = _MergeSortTree(positions, group_ids * rank_count + threshold_ranks)
+    for key_lower, key_upper in _key_ranges(price_ranks, group_ids, rank_count, REVERSED_COMPARISON[comparison]):
+        tree.summarize_before(key_lower, key_upper, positions, A_values, summary)
+    return summary
+
+
+def _rank_values(values: np.ndarray):
+    """将Decimal数组转换为排名，返回(排名数组, 每个排名对应的数值)"""
+    encoded = fixed_point.encode(values)
+    _, first_index, ranks = np.unique(encoded.mantissa, return_index=True, return_inverse=True)
+    return ranks.astype(np.int64), values[first_index]
+
+
+def build_ab_summary(data: pd.DataFrame, price_column: str = 'close', magnification=1,
+                     comparison: Literal['gt', 'lt', 'ge', 'le', 'eq', 'neq'] = 'gt', A_aggregations: dict = None,
+                     group_columns: list = None, time_column: str = 'time') -> pd.DataFrame:
+    """
+    与build_ab_pairs相同的AB组合，按B汇总为一行，不再展开为每个组合一行。
+    结果字段为 group_columns + 其他字段加_B后缀 + A_count(A的数量) + first_{time}_A、last_{time}_A(第一个和最后一个A的时间)
+    + A_aggregations中的汇总字段，只保留至少有一个A的B，按币种、B时间排列。
+    :param A_aggregations: {结果字段: (字段, 'min'或'max')}，例如{'min_low_A': ('low', 'min')}
+    :param group_columns: 分组字段，默认为数据中存在的coin_name和spider_web
+    """
+    group_columns = [column for column in (GROUP_COLUMNS if group_columns is None else group_columns)
+                     if column in data.columns]
+    A_aggregations = A_aggregations or {}
+    for column, how in A_aggregations.values():
+        if how not in ('min', 'max'):
+            raise ValueError(f'不支持的汇总方式: {how}')
+    value_columns = [column for column in data.columns if column not in group_columns]
+    result_columns = group_columns + [f'{column}_B' for column in value_columns] + [
+        'A_count', f'first_{time_column}_A', f'last_{time_column}_A'] + list(A_aggregations)
+    if data.empty:
+        return pd.DataFrame(columns=result_columns)
+
+    data = data.sort_values(group_columns + [time_column], kind='mergesort').reset_index(drop=True)
+    group_ids = data.groupby(group_columns, sort=False).ngroup().to_numpy() if group_columns else None
+    # 数值按排名汇总，最后再换回原来的Decimal
+    ranked = {column: _rank_values(data[column].to_numpy(dtype=object))
+              for column in {column for column, _ in A_aggregations.values()}}
+    summary = summarize_ab_pairs(data[price_column].to_numpy(), group_ids, magnification, comparison,
+                                 {column: ranks for column, (ranks, _) in ranked.items()})
+
+    B_index = np.flatnonzero(summary['count'] > 0)
+    result = {column: data[column].to_numpy()[B_index] for column in group_columns}
+    for column in value_columns:
+        result[f'{column}_B'] = data[column].to_numpy()[B_index]
+    result['A_count'] = summary['count'][B_index]
+    times = data[time_column].to_numpy()
+    result[f'first_{time_column}_A'] = times[summary['first_A'][B_index]]
+    result[f'last_{time_column}_A'] = times[summary['last_A'][B_index]]
+    for name, (column, how) in A_aggregations.items():
+        ranks = summary[column][0 if how == 'min' else 1][B_index]
+        result[name] = ranked[column][1][ranks]
+    return pd.DataFrame(result, columns=result_columns)
+
+
+def expand_ab_summary(data: pd.DataFrame, summary: pd.DataFrame, price_column: str = 'close', magnification=1,
+                      comparison: Literal['gt', 'lt', 'ge', 'le', 'eq', 'neq'] = 'gt', group_columns: list = None,
+                      time_column: str = 'time', A_lower_bounds: dict = None) -> pd.DataFrame:
+    """
+    将build_ab_summary的部分B展开为AB组合，结果与build_ab_pairs中B在summary中的组合相同(包括顺序)。
+    以summary中的B为查询方，只列出这些B的组合，一般先用汇总字段筛选出可能满足条件的B，再展开剩下的少数B。
+    :param data: 生成summary时使用的数据
+    :param summary: 需要展开的B，包含分组字段和{time_column}_B
+    :param A_lower_bounds: {A的字段: summary中的字段}，只展开A的字段大于等于该币种summary中对应值的组合，
+                           同一币种的值需要相同(例如C时刻的价格)，用于提前去掉之后一定会被筛掉的A
+    """
+    group_columns = [column for column in (GROUP_COLUMNS if group_columns is None else group_columns)
+                     if column in data.columns]
+    if group_columns:
+        coins = pd.MultiIndex.from_frame(summary[group_columns].drop_duplicates())
+        data = data[pd.MultiIndex.from_frame(data[group_columns]).isin(coins)]
+    if data.empty:
+        return build_ab_pairs(data, price_column, magnification, comparison, group_columns, time_column)
+
+    data = data.sort_values(group_columns + [time_column], kind='mergesort').reset_index(drop=True)
+    n = len(data)
+    group_ids = data.groupby(group_columns, sort=False).ngroup().to_numpy() if group_columns else np.zeros(
+        n, dtype=np.int64)
+    price_ranks, threshold_ranks, rank_count = _rank_prices(data[price_column].to_numpy(dtype=object), magnification)
+    B_keys = pd.MultiIndex.from_frame(summary[group_columns + [f'{time_column}_B']])
+    B_positions = np.flatnonzero(pd.MultiIndex.from_frame(data[group_columns + [time_column]]).isin(B_keys))
+
+    A_mask = np.ones(n, dtype=bool)
+    for column, bound_column in (A_lower_bounds or {}).items():
+        if group_columns:
+            bounds = data[group_columns].merge(summary[group_columns + [bound_column]].drop_duplicates(
+                subset=group_columns), on=group_columns, how='left')[bound_column].to_numpy()
+        else:
+            bounds = summary[bound_column].iloc[0]
+        A_mask &= (data[column].to_numpy() >= bounds).astype(bool)
+    A_positions = np.flatnonzero(A_mask)
+
+    # 点为满足条件的A，键为(分组, 阈值排名)；B对应的A为键在B的键区间中、位置在B之前的点
+    tree = _MergeSortTree(A_positions, group_ids[A_positions] * rank_count + threshold_ranks[A_positions])
+    A_index_list, B_index_list = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    for key_lower, key_upper in _key_ranges(price_ranks[B_positions], group_ids[B_positions], rank_count,
+                                            REVERSED_COMPARISON[comparison]):
+        owners, A_index = tree.query(key_lower, key_upper, B_positions, 'before')
+        A_index_list.append(A_index)
+        B_index_list.append(B_positions[owners])
+    A_index, B_index = np.concatenate(A_index_list), np.concatenate(B_index_list)
+    pair_order = np.lexsort((B_index, A_index))
+    return take_ab_pairs(data, A_index[pair_order], B_index[pair_order], group_columns)
+
+
+def take_ab_pairs(data: pd.DataFrame, A_index: np.ndarray, B_index: np.ndarray,
+                  group_columns: list) -> pd.DataFrame:
+    """
+    按A、B的位置将数据拼接为一行A、一行B的数据，
+    结果字段为 group_columns + 其他字段加_A后缀 + 其他字段加_B后缀
+    """
+    value_columns = [column for column in data.columns if column not in group_columns]
+    result_columns = group_columns + [f'{column}_A' for column in value_columns] + [f'{column}_B' for column in
+                                                                                    value_columns]
+    result = {column: data[column].to_numpy()[A_index] for column in group_columns}
+    for suffix, index in (('_A', A_index), ('_B', B_index)):
+        for column in value_columns:
+            result[f'{column}{suffix}'] = data[column].to_numpy()[index]
+    return pd.DataFrame(result, columns=result_columns)
+
+
+def build_ab_pairs(data: pd.DataFrame, price_column: str = 'close', magnification=1,
+                   comparison: Literal['gt', 'lt', 'ge', 'le', 'eq', 'neq'] = 'gt',
+                   group_columns: list = None, time_column: str = 'time') -> pd.DataFrame:
+    """
+    按币种找出所有满足价格比较条件的AB组合，并按列拼接为一行A、一行B的数据。
+    结果字段为 group_columns + 其他字段加_A后缀 + 其他字段加_B后缀，按币种、A时间、B时间排列。
+    :param group_columns: 分组字段，默认为数据中存在的coin_name和spider_web
+    """
+    # 数据中没有分组字段时(例如groupby后的单个分组)，视为同一个分组
+    group_columns = [column for column in (GROUP_COLUMNS if group_columns is None else group_columns)
+                     if column in data.columns]
+    if data.empty:
+        value_columns = [column for column in data.columns if column not in group_columns]
+        return pd.DataFrame(columns=group_columns + [f'{column}_A' for column in value_columns] +
+                                    [f'{column}_B' for column in value_columns])
+
+    data = data.sort_values(group_columns + [time_column], kind='mergesort').reset_index(drop=True)
+    group_ids = data.groupby(group_columns, sort=False).ngroup().to_numpy() if group_columns else None
+    A_index, B_index = find_ab_pairs(data[price_column].to_numpy(), group_ids, magnification, comparison)
+    return take_ab_pairs(data, A_index, B_index, group_columns)
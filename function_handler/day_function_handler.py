@@ -1,13 +1,15 @@
-import numpy as np
 import os
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from decimal import Decimal
 from typing import Literal
-from collections import defaultdict
 
 from dataio.csv_handler import CSVReader, CSVWriter
 from function_handler.functionhandler import FunctionHandler
+from function_handler.ab_pair_engine import build_ab_pairs
+from function_handler.dip_recover_index import DipRecoverIndex
+from function_handler.range_query_index import WindowMaxIndex
 from msg_log.mylog import get_logger
 from config import ConfigHandler
 
@@ -25,7 +27,7 @@ class DayFunctionHandler(FunctionHandler):
         self.results = []
         logger.info('执行每日函数')
         for func in self.functions:
-            logger.info('执行函数', func.__name__)
+            logger.info(f'执行函数{func.__name__}')
             try:
                 res = func()
                 if res:
@@ -83,27 +85,13 @@ class DayFunctionHandler(FunctionHandler):
         return data
 
     @staticmethod
-    def filter_AB_by_colse_price(group, magnification=Decimal(0.99)):
+    def filter_AB_by_colse_price(data, magnification=Decimal(0.99)):
         """
         通过收盘价比较初步筛选出A和B时刻数据
-        A时刻收盘价的magnification倍大于B时刻收盘价
+        A时刻收盘价的magnification倍大于B时刻收盘价，按币种分别比较
         :return:
         """
-        if not isinstance(magnification, Decimal):
-            magnification = Decimal(magnification)
-        group.sort_values(by='time', ascending=True, inplace=True)
-        close_price = group['close'].values
-        group_values = group.values
-        result = []
-        for i in range(len(close_price) - 1):
-            for j in range(i + 1, len(close_price)):
-                if close_price[i] * magnification > close_price[j]:
-                    # 将两个结果横向拼接起来加入result
-                    combiend_row = np.concatenate((group_values[i], group_values[j]), axis=None)
-                    result.append(combiend_row)
-        columns = [f'{col}_A' for col in group.columns] + [f'{col}_B' for col in group.columns]
-        result_data = pd.DataFrame(result, columns=columns)
-        return result_data
+        return build_ab_pairs(data, 'close', magnification, 'gt')
 
     @staticmethod
     def filter_by_after_B_price(A2B_data: pd.DataFrame, total_data: pd.DataFrame,
@@ -113,50 +101,12 @@ class DayFunctionHandler(FunctionHandler):
         然后再有开盘价高于此B时刻`最低价*(虚降 * 0.005 + 1)`的时刻，则该B废弃不用。
         :return:
         """
-        # 找出每一个B时刻后面对应的数据
-
         if not isinstance(magnification, Decimal):
             magnification = Decimal(magnification)
-        after_B_data = defaultdict(pd.DataFrame)
-        total_data = total_data[['coin_name', 'spider_web', 'coin_price', 'time']]
-        indexs = A2B_data[['coin_name', 'spider_web', 'time_B']].drop_duplicates().values
-        for coin_name, spider_web, time_B in indexs:
-            after_B_data[(coin_name, spider_web, time_B)] = total_data[(total_data['coin_name'] == coin_name) &
-                                                                       (total_data['spider_web'] == spider_web) &
-                                                                       (total_data['time'] > time_B)]
-
-        # 按照coin_name,spider_web,time_B进行分组
-        group_data = A2B_data[['coin_name', 'spider_web', 'low_B', 'virtual_drop_B', 'time_B']].drop_duplicates(
-            subset=['coin_name', 'spider_web', 'time_B'])
-        group_data['compare_price'] = group_data['low_B'] * (group_data['virtual_drop_B'] * magnification + Decimal(1))
-
-        def filte(row):
-            coin_name = row['coin_name']
-            spider_web = row['spider_web']
-            time_B = row['time_B']
-            after_data = after_B_data[(coin_name, spider_web, time_B)]
-            if after_data.empty:
-                return True
-            after_data.sort_values(by='time', ascending=True, inplace=True)
-            # 找出价格低于compare_price的数据
-            low_price_data = after_data[after_data['coin_price'] < row['compare_price']]
-            if low_price_data.empty:
-                return True
-            # 获取第一个索引
-            first_index = low_price_data.index[0]
-
-            # 再找出价格高于compare_price的数据
-            high_price_data = after_data[
-                (after_data['coin_price'] > row['compare_price']) & (after_data.index > first_index)]
-            if high_price_data.empty:
-                return True
-            return False
-
-        group_data['condition_met'] = group_data.apply(lambda row: filte(row), axis=1)
-        group_data = group_data[group_data['condition_met'] == True].copy().dropna().drop(columns='compare_price')
-        result_data = A2B_data.merge(group_data[['coin_name', 'spider_web', 'time_B']],
-                                     on=['coin_name', 'spider_web', 'time_B'], how='inner')
-        return result_data
+        compare_price = A2B_data['low_B'] * (A2B_data['virtual_drop_B'] * magnification + Decimal(1))
+        dip_recover_index = DipRecoverIndex(total_data)
+        invalid_B = dip_recover_index.dip_then_recover(A2B_data, A2B_data['time_B'], compare_price)
+        return A2B_data[~invalid_B].reset_index(drop=True)
 
     def filter_by_AB_before_6_days(self, A2B_data: pd.DataFrame, total_data: pd.DataFrame, config: dict) -> pd.DataFrame:
         """
@@ -196,44 +146,16 @@ class DayFunctionHandler(FunctionHandler):
         A2B_data['time_start_A'] = A2B_data['time_A'] - timedelta(days=6)
         A2B_data['time_start_B'] = A2B_data['time_B'] - timedelta(days=6)
 
-        # 每个coin_name,spider_web的数据
-        indexs = A2B_data[['coin_name', 'spider_web']].drop_duplicates().values
-        group_data = defaultdict(pd.DataFrame)
-        total_data.sort_values(by='time', ascending=True, inplace=True)
-
-        for coin_name, spider_web in indexs:
-            group_data[(coin_name, spider_web)] = total_data[(total_data['coin_name'] == coin_name) &
-                                                             (total_data['spider_web'] == spider_web)]
-
-        def filte(row):
-            coin_name = row['coin_name']
-            spider_web = row['spider_web']
-            time_start_A = row['time_start_A']
-            time_start_B = row['time_start_B']
-            cur_data = group_data[(coin_name, spider_web)]
-            if cur_data.empty:
-                return False
-            # A时刻之前
-            # A max(收盘价，开盘价)
-            max_A = max(row['open_A'], row['close_A'])
-            before_A_data = cur_data[cur_data['time'].between(time_start_A, row['time_A'], inclusive='left')]
-            condition_2_A_data = before_A_data[
-                (before_A_data['change'] < BEFORE_CHANGE) & (before_A_data['coin_price'] >= max_A)]
-
-            result_A = not condition_2_A_data.empty
-
-            # B时刻之前
-            max_B = max(row['open_B'], row['close_B'])
-            before_B_data = cur_data[cur_data['time'].between(time_start_B, row['time_B'], inclusive='left')]
-            condition_2_B_data = before_B_data[
-                (before_B_data['change'] < BEFORE_CHANGE) & (before_B_data['coin_price'] >= max_B)]
-            result_B = not condition_2_B_data.empty
-
-            if result_A or result_B:
-                return True
-            return False
-
-        A2B_data['comdition_met'] = A2B_data.apply(lambda row: filte(row), axis=1)
+        # 窗口内跌幅 < BEFORE_CHANGE的时刻中，最高的价格 >= A或者B时刻`max(收盘价, 开盘价)`即满足条件
+        before_change_data = total_data[total_data['change'] < BEFORE_CHANGE]
+        window_max_price_index = WindowMaxIndex(before_change_data, 'coin_price')
+        result_A = window_max_price_index.window_max_ge(
+            A2B_data, A2B_data['time_start_A'], A2B_data['time_A'],
+            np.maximum(A2B_data['open_A'].to_numpy(), A2B_data['close_A'].to_numpy()))
+        result_B = window_max_price_index.window_max_ge(
+            A2B_data, A2B_data['time_start_B'], A2B_data['time_B'],
+            np.maximum(A2B_data['open_B'].to_numpy(), A2B_data['close_B'].to_numpy()))
+        A2B_data['comdition_met'] = result_A | result_B
 
         conform_condition_2_data = A2B_data[A2B_data['comdition_met'] == True].drop(columns=['time_start_A', 'time_start_B'])
         conform_condition_2_data.drop(columns=['comdition_met'], inplace=True)
@@ -321,10 +243,7 @@ class DayFunctionHandler(FunctionHandler):
             return
 
         # 初步选择出AB时刻：A时刻收盘价的0.99大于B时刻收盘价
-        A2B_data_groupby_coin_web = A2B_data.groupby(['coin_name', 'spider_web'])
-        A2B_filter_by_close_data = A2B_data_groupby_coin_web.apply(lambda group: self.filter_AB_by_colse_price(group),
-                                                                   include_groups=False).reset_index(drop=False).drop(
-            columns=['level_2'])
+        A2B_filter_by_close_data = self.filter_AB_by_colse_price(A2B_data)
         A2B_data = A2B_filter_by_close_data
 
         total_data = self.synchronous_data(A2B_data.drop_duplicates(subset=['coin_name', 'spider_web']).copy(),
@@ -411,11 +330,7 @@ class DayFunctionHandler(FunctionHandler):
                                                    total_data)
 
         # A时刻收盘价的0.95大于B时刻收盘价
-        A2B_data_groupby_coin_web = A2B_data.groupby(['coin_name', 'spider_web'])
-        A2B_filter_by_close_data = A2B_data_groupby_coin_web.apply(
-            lambda group: self.filter_AB_by_colse_price(group, 0.95),
-            include_groups=False).reset_index(drop=False).drop(
-            columns=['level_2'])
+        A2B_filter_by_close_data = self.filter_AB_by_colse_price(A2B_data, 0.95)
         A2B_data = A2B_filter_by_close_data
         if A2B_data.empty:
             logger.info('当前时刻没有满足条件：A时刻收盘价的0.95大于B时刻收盘价')
@@ -0,0 +1,92 @@
+import os
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from data_process import fixed_point
+from function_handler.range_query_index import GroupedSparseTable
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'dip_recover_index.log'))
+
+
+class DipRecoverIndex(GroupedSparseTable):
+    """
+    判断某个时刻之后价格是否先跌破X、之后又涨回X以上。
+    每个tick根据价格数据构建一次：按(币种, 时间)排序后建立区间最小值、最大值的稀疏表，
+    每次查询通过倍增找到时刻之后第一个跌破X的位置，再用区间最大值判断之后是否涨回X以上，
+    单次查询为O(log n)，不需要每个B时刻重新扫描后面的全部数据。
+    """
+
+    def __init__(self, data: pd.DataFrame, price_column: str = 'coin_price', group_columns: list = None,
+                 time_column: str = 'time'):
+        """
+        :param data: 价格数据，包含币种、价格、时间
+        :param price_column: 价格字段
+        :param group_columns: 分组字段，默认为coin_name和spider_web
+        :param time_column: 时间字段
+        """
+        super().__init__(data, price_column, group_columns, time_column, with_min=True)
+
+    def _first_below(self, starts: np.ndarray, ends: np.ndarray, limits: np.ndarray) -> np.ndarray:
+        """[start, end)内第一个价格小于等于limit的位置，不存在时返回end"""
+        positions = starts.copy()
+        for k in range(len(self.min_table) - 1, -1, -1):
+            step = 1 << k
+            can_jump = positions + step <= ends
+            if not can_jump.any():
+                continue
+            table = self.min_table[k]
+            jump_index = np.flatnonzero(can_jump)
+            # 跳过的这一段全部高于limit时才能跳过
+            all_above = table[positions[jump_index]] > limits[jump_index]
+            positions[jump_index[all_above]] += step
+        return positions
+
+    def dip_then_recover(self, keys: pd.DataFrame, times, thresholds, inclusive: bool = False) -> np.ndarray:
+        """
+        批量查询：time之后是否存在低于threshold的价格，且在它之后又存在高于threshold的价格
+        :param keys: 每个查询的分组字段
+        :param times: 每个查询的时间，只考虑该时间之后的数据
+        :param thresholds: 每个查询的价格阈值
+        :param inclusive: 为True时价格等于阈值也算作跌破
+        :return: 布尔数组，True表示先跌破后又涨回
+        """
+        result = np.zeros(len(keys), dtype=bool)
+        if len(keys) == 0 or self.is_empty():
+            return result
+        group_ids = self.get_group_ids(keys)
+        found = np.flatnonzero(group_ids >= 0)
+        if found.size == 0:
+            return result
+        group_ids = group_ids[found]
+        floor_limits, ceil_limits = fixed_point.integer_limits(np.asarray(thresholds, dtype=object)[found], self.scale)
+        below_limits = floor_limits if inclusive else ceil_limits - 1
+
+        group_end = self.group_end[group_ids]
+        # 只考虑时间大于查询时间的数据
+        starts = self.search_times(group_ids, np.asarray(times)[found], side='right')
+        below_positions = self._first_below(starts, group_end, below_limits)
+        # 跌破的位置之后还有数据时，判断区间最大值是否高于阈值
+        has_after = below_positions + 1 < group_end
+        recover = np.zeros(len(found), dtype=bool)
+        if has_after.any():
+            after_max = self.range_max(below_positions[has_after] + 1, group_end[has_after])
+            recover[has_after] = after_max > floor_limits[has_after]
+        result[found] = recover
+        return result
+
+
+if __name__ == '__main__':
+    test_data = pd.DataFrame({
+        'coin_name': ['BTC'] * 5,
+        'spider_web': ['binance'] * 5,
+        'coin_price': [Decimal('100'), Decimal('98'), Decimal('97'), Decimal('99.5'), Decimal('96')],
+        'time': pd.date_range('2024-11-04 01:00:00', periods=5, freq='h')
+    })
+    index = DipRecoverIndex(test_data)
+    query = pd.DataFrame({'coin_name': ['BTC', 'BTC'], 'spider_web': ['binance', 'binance']})
+    print(index.dip_then_recover(query, pd.to_datetime(['2024-11-04 01:00:00', '2024-11-04 03:00:00']),
+                                 [Decimal('99'), Decimal('99')]))
@@ -2,10 +2,17 @@ from typing import Literal
 from datetime import datetime, timedelta
 from collections import defaultdict
 from dataio.csv_handler import CSVReader, CSVWriter
-import pandas as pd
+from dataio.record_store import get_record_store
 import numpy as np
+import pandas as pd
 import os
 from msg_log.mylog import get_logger
+from msg_log.msg_send import send_email
+from data_process import fixed_point
+from function_handler.ab_pair_engine import build_ab_pairs, build_ab_summary, expand_ab_summary
+from function_handler.dip_recover_index import DipRecoverIndex
+from function_handler.range_query_index import WindowMaxIndex
+from function_handler.rule_engine import RuleEngine
 from decimal import Decimal, ROUND_HALF_UP
 import warnings
 
@@ -14,6 +21,18 @@ PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'function_handler.log'))
 warnings.filterwarnings("ignore", category=FutureWarning)
 
+# record_data目录下各记录文件的字段和类型
+FIRST_PRICE_RECORD_COLUMNS = {'coin_name': 'str', 'spider_web': 'str', 'first_price': 'decimal'}
+CNT_RECORD_COLUMNS = {'coin_name': 'str', 'spider_web': 'str', 'cnt': 'number', 'lasted_price': 'decimal'}
+MAX_PRICE_CNT_RECORD_COLUMNS = {'coin_name': 'str', 'spider_web': 'str', 'cnt': 'number'}
+HOUR_AND_MINUTE_RECORD_COLUMNS = {'coin_name': 'str', 'spider_web': 'str', 'time_A': 'datetime', 'time_B': 'datetime',
+                                  'lasted_price_C_minute': 'decimal', 'lasted_price_C_hour': 'decimal',
+                                  'first_record_time': 'datetime', 'cnt': 'number'}
+# A收盘价大于B收盘价时A收盘价的倍率
+AB_CLOSE_MAGNIFICATION = '0.99'
+# AB组合按B汇总时，每个B对应的A的汇总字段：{结果字段: (字段, 汇总方式)}
+AB_SUMMARY_AGGREGATIONS = {'min_low_A': ('low', 'min'), 'max_low_A': ('low', 'max'), 'max_open_A': ('open', 'max')}
+
 
 class FunctionHandler:
     def __init__(self, **kwargs):
@@ -28,6 +47,23 @@ class FunctionHandler:
         self.csv_writer = kwargs.get('writer', CSVWriter("China"))
         self.price_comparison_results = defaultdict(pd.DataFrame)
         self.send_messages = defaultdict(str)
+        # 只依赖小时K线的中间结果，{名称: (缓存键, 结果)}
+        self.hourly_cache = {}
+        # 按币种分片在多进程中执行的执行器，为空时在当前进程中执行
+        self.shard_executor = kwargs.get('shard_executor', None)
+        # 本分钟的价格变化集(由ChangeDetector生成)，为空时所有币种都重新计算
+        self.price_changes = kwargs.get('price_changes', None)
+        # 逐币种计算的结果，{名称: (缓存键, 版本号, 已计算的币种, 通过的币种)}
+        self.coin_verdicts = {}
+        # 本tick中与其他函数处理器共享的上下文(TickContext)，为空时所有中间结果都由自己计算
+        self.tick_context = kwargs.get('tick_context', None)
+        # 执行config.xml中<rules>下定义的规则，为空时第一次使用时按默认配置创建
+        self.rule_engine = kwargs.get('rule_engine', None)
+        # 函数运行记录所在的目录，回测时使用单独的目录，不影响实盘的记录
+        self.record_data_floder_path = kwargs.get('record_data_folder', None) or os.path.join(
+            PROJECT_ROOT_PATH, 'function_handler', 'record_data')
+        # 发送邮件的函数，参数与msg_send.send_email相同，回测时替换为收集结果的函数
+        self.email_sender = kwargs.get('email_sender', None) or send_email
 
     @staticmethod
     def round_decimal(val, decimals=2):
@@ -39,9 +75,130 @@ class FunctionHandler:
 
     def get_range_data_hours(self, start_datetime: datetime, end_datetime: datetime,
                              inclusive: Literal['both', 'neither', 'left', 'right'] = 'both'):
-        self.range_data_hours = self.csv_reader.get_data_between_hours(start_datetime, end_datetime, inclusive)
+        self.range_data_hours = self.read_range_data_hours(start_datetime, end_datetime, inclusive)
         return self.range_data_hours
 
+    def read_range_data_hours(self, start_datetime: datetime, end_datetime: datetime,
+                              inclusive: Literal['both', 'neither', 'left', 'right'] = 'both'):
+        """读取小时K线，不修改range_data_hours；有tick上下文时同一范围在一个tick中只读取一次"""
+        if self.tick_context is not None:
+            return self.tick_context.get_range_data_hours(start_datetime, end_datetime, inclusive)
+        return self.csv_reader.get_data_between_hours(start_datetime, end_datetime, inclusive)
+
+    def get_shared(self, name: str, key, build_func):
+        """
+        获取本tick中与其他函数处理器共享的中间结果，同一个tick中名称和参数相同的结果只计算一次。
+        结果可能被其他函数处理器使用，不能修改；没有tick上下文时直接计算
+        :param key: 计算用到的全部参数(时间范围、阈值等)，参数不同的结果不会共享
+        """
+        if self.tick_context is None:
+            return build_func()
+        return self.tick_context.get(name, key, build_func)
+
+    def get_shared_pre_hours_min_low(self, start_datetime: datetime, end_datetime: datetime, dropna: bool = False):
+        """
+        [start_datetime, end_datetime]内每个币种收盘价和开盘价中的最小值，即"C小于前n小时最小值"的阈值
+        :param dropna: 是否先去掉有空值的K线
+        """
+        def build():
+            pre_hours_data = self.read_range_data_hours(start_datetime, end_datetime, 'both')
+            if dropna:
+                pre_hours_data = pre_hours_data.dropna(how='any')
+            return self.get_pre_hours_min_low(pre_hours_data)
+
+        return self.get_shared('pre_hours_min_low', (start_datetime, end_datetime, dropna), build)
+
+    def run_rule(self, name: str, enumerate_all: bool = False) -> pd.DataFrame:
+        """
+        对当前数据执行config.xml中<rules>下名称为name的规则，返回满足全部条件的AB组合
+        :param enumerate_all: 为True时列出全部AB组合(排查问题时使用)，否则按规则配置的模式执行
+        """
+        if self.rule_engine is None:
+            self.rule_engine = RuleEngine()
+        return self.rule_engine.run(name, self, enumerate_all)
+
+    def get_hourly_cache(self, name: str, cache_key, build_func):
+        """
+        获取以小时为单位缓存的中间结果。小时K线只在整点更新，
+        分钟函数中只依赖小时K线的部分在同一个小时内结果不变，cache_key变化(进入新的小时或者配置变化)时重新计算
+        :param name: 缓存名称
+        :param cache_key: 缓存键，一般为计算用到的时间范围和配置
+        :param build_func: 重新计算的函数
+        """
+        cached = self.hourly_cache.get(name)
+        if cached is not None and cached[0] == cache_key:
+            return cached[1]
+        result = build_func()
+        self.hourly_cache[name] = (cache_key, result)
+        return result
+
+    def evaluate_changed_coins(self, name: str, cache_key, data: pd.DataFrame, evaluate_func):
+        """
+        执行只与各币种自己的当前价格和小时K线有关的计算 evaluate_func(data)。
+        上一个版本已经计算过、价格没有变化且上次没有通过的币种直接沿用上次的结果，不再计算；
+        价格变化的币种、新出现的币种以及上次通过的币种重新计算(结果中的C时刻字段需要使用本分钟的数据)。
+        cache_key变化、没有价格变化集或者上一次处理的不是上一个版本时全部重新计算。
+        :param name: 计算的名称
+        :param cache_key: 计算用到的小时K线和配置，一般与get_hourly_cache的缓存键相同
+        :param evaluate_func: 返回DataFrame或DataFrame元组，每行属于一个币种
+        """
+        keys = list(zip(data['coin_name'], data['spider_web']))
+        changes = self.price_changes
+        previous = self.coin_verdicts.get(name)
+        if changes is None or previous is None or previous[0] != cache_key or \
+                previous[1] != changes['previous_version']:
+            to_evaluate = data
+        else:
+            _, _, evaluated_coins, passed_coins = previous
+            changed_coins = changes['changed_coins']
+            mask = [key in changed_coins or key not in evaluated_coins or key in passed_coins for key in keys]
+            to_evaluate = data[mask]
+            logger.info(f"{name}: {len(data)}个币种中重新计算{len(to_evaluate)}个")
+        result = evaluate_func(to_evaluate)
+        passed_coins = set()
+        for frame in (result if isinstance(result, tuple) else (result,)):
+            passed_coins.update(zip(frame['coin_name'], frame['spider_web']))
+        version = changes['version'] if changes is not None else None
+        self.coin_verdicts[name] = (cache_key, version, set(keys), passed_coins)
+        return result
+
+    def get_shared_AB_data(self, datetime_at_A: datetime, datetime_at_B: datetime, AB_CHANGE, AB_VIRTUAL_DROP):
+        """
+        A到B范围内满足虚降和跌涨幅条件、A收盘价大于B收盘价且B时刻未废弃的AB组合(compute_AB_data)
+        """
+        def build():
+            range_A_to_B_data = self.read_range_data_hours(datetime_at_A, datetime_at_B, 'both')
+            range_A_to_B_data = range_A_to_B_data.dropna(how='any')
+            # A和B时刻的筛选只用到各币种自己的数据，可以按币种分片执行
+            return self.run_by_shard(self.compute_AB_data, [range_A_to_B_data], AB_CHANGE, AB_VIRTUAL_DROP)
+
+        return self.get_shared('compute_AB_data', (datetime_at_A, datetime_at_B, AB_CHANGE, AB_VIRTUAL_DROP), build)
+
+    def get_shared_AB_summary(self, datetime_at_A: datetime, datetime_at_B: datetime, AB_CHANGE, AB_VIRTUAL_DROP):
+        """
+        与get_shared_AB_data相同的AB组合按B汇总后的结果(compute_AB_summary)，以及生成汇总使用的K线。
+        保存的数据只与K线数量有关，需要具体组合时用expand_AB_summary展开
+        :return: (按B汇总的数据, 满足虚降和跌涨幅条件的K线)
+        """
+        def build():
+            range_A_to_B_data = self.read_range_data_hours(datetime_at_A, datetime_at_B, 'both')
+            range_A_to_B_data = range_A_to_B_data.dropna(how='any')
+            AB_summary = self.run_by_shard(self.compute_AB_summary, [range_A_to_B_data], AB_CHANGE, AB_VIRTUAL_DROP)
+            return AB_summary, self.filter_AB_bars(range_A_to_B_data, AB_CHANGE, AB_VIRTUAL_DROP)
+
+        return self.get_shared('compute_AB_summary', (datetime_at_A, datetime_at_B, AB_CHANGE, AB_VIRTUAL_DROP),
+                               build)
+
+    def run_by_shard(self, func, frames: list, *args):
+        """
+        执行按币种互不影响的计算 func(*frames, *args)，设置了shard_executor时按币种分片在多个进程中执行
+        :param func: 静态方法或模块级函数，返回DataFrame
+        :param frames: 需要按币种分片的数据
+        """
+        if self.shard_executor is None:
+            return func(*frames, *args)
+        return self.shard_executor.map(func, frames, *args)
+
     def get_range_data_days(self, start_datetime: datetime, end_datetime: datetime,
                             inclusive: Literal['both', 'neither', 'left', 'right'] = 'both'):
         self.range_data_days = self.csv_reader.get_data_between_days(start_datetime, end_datetime, inclusive)
@@ -107,6 +264,7 @@ class FunctionHandler:
 
         该函数根据给定的比较运算符（如 'gt', 'lt' 等），对指定列（`filter_column`）中每对数据行进行比较。
         比较只考虑时间顺序上，`A` 时刻的价格与 `B` 时刻的价格的关系。最终返回符合比较条件的所有数据对。
+        数据中包含coin_name和spider_web时按币种分别比较，可以直接传入所有币种的数据。
 
         参数：
         - group (pd.DataFrame): 输入的 DataFrame，其中包含多个时刻的价格数据。
@@ -117,112 +275,76 @@ class FunctionHandler:
         返回：
         - pd.DataFrame: 返回一个 DataFrame，包含符合条件的所有 A 时刻和 B 时刻的配对数据。
         """
-        MAGNIFICATION = '0.99'
-        # 升序排列，A时刻在前，B时刻在后
-        group.sort_values(by='time', ascending=True, inplace=True)
+        magnification = AB_CLOSE_MAGNIFICATION if comparison == 'gt' else 1
+        return build_ab_pairs(group, filter_column, magnification, comparison)
 
-        # 获取价格列，转换为 numpy 数组
-        total_price_list = group[filter_column].values
-        n = len(group)
-
-        # 获取所有列的 NumPy 数组
-        group_values = group.values  # 直接获取整个数据框的 NumPy 数组
-
-        # 创建一个比较矩阵，仅考虑上三角部分 (i < j)
-        comparison_matrix = np.triu(np.ones((n, n), dtype=bool), k=1)
+    @staticmethod
+    def filter_B_data_with_following_conditions(filter_data, range_data):
+        """B时刻后面有价格低于等于B，且再有价格高于B，则该B时刻废弃"""
+        if filter_data.empty:
+            return filter_data
+        MAGANIFICATION = filter_data['virtual_drop_B'] * Decimal('0.005') + Decimal('1')
+        # MAGANIFICATION = 1
+        min_B = filter_data['low_B'] * MAGANIFICATION
+        dip_recover_index = DipRecoverIndex(range_data)
+        invalid_B = dip_recover_index.dip_then_recover(filter_data, filter_data['time_B'], min_B, inclusive=True)
+        return filter_data[~invalid_B]
 
-        # 根据不同的比较条件生成一个逻辑矩阵
-        comparison_map = {
-            'gt': total_price_list[:, None] * Decimal(MAGNIFICATION) > total_price_list,
-            'lt': total_price_list[:, None] < total_price_list,
-            'ge': total_price_list[:, None] >= total_price_list,
-            'le': total_price_list[:, None] <= total_price_list,
-            'eq': total_price_list[:, None] == total_price_list,
-            'neq': total_price_list[:, None] != total_price_list
+    @staticmethod
+    def filter_AB_bars(range_A_to_B_data: pd.DataFrame, AB_CHANGE, AB_VIRTUAL_DROP) -> pd.DataFrame:
+        """可以作为A或B时刻的K线：虚降>=AB_VIRTUAL_DROP%,且跌涨幅<=AB_CHANGE%"""
+        filter_columns_and_thresholds = {
+            'virtual_drop': ('ge', AB_VIRTUAL_DROP),
+            'change': ('le', AB_CHANGE)
         }
+        return FunctionHandler.filter_by_multiple_conditions(range_A_to_B_data, filter_columns_and_thresholds)
 
-        valid_combinations = comparison_map[comparison]
-
-        # 将逻辑矩阵和比较矩阵按位与（&），保留满足条件的组合
-        valid_combinations = np.logical_and(valid_combinations, comparison_matrix)
-
-        # 获取符合条件的索引
-        valid_indices = np.where(valid_combinations)
-
-        # 存储最终结果
-        merged_results = []
-
-        # 创建一个空的结果数组，预分配内存
-        merged_results_array = np.empty((len(valid_indices[0]), 2 * len(group.columns)), dtype=object)
-
-        # 批量处理符合条件的组合，减少每次拼接的开销
-        for idx, (i, j) in enumerate(zip(*valid_indices)):
-            # 提取 A 和 B 行
-            A_row = group_values[i]
-            B_row = group_values[j]
-
-            # 将 A 和 B 的行数据直接赋值到结果数组中
-            merged_results_array[idx, :len(A_row)] = A_row
-            merged_results_array[idx, len(A_row):] = B_row
-
-        # 创建列名列表，给每列加上 _A 和 _B 后缀
-        column_names = [f"{col}_A" for col in group.columns if col not in ['coin_name', 'spider_web']] + [f"{col}_B" for
-                                                                                                          col in
-                                                                                                          group.columns
-                                                                                                          if
-                                                                                                          col not in [
-                                                                                                              'coin_name',
-                                                                                                              'spider_web']]
-
-        # 将结果数组转换为 DataFrame
-        result_df = pd.DataFrame(merged_results_array, columns=column_names)
+    @staticmethod
+    def compute_AB_data(range_A_to_B_data: pd.DataFrame, AB_CHANGE, AB_VIRTUAL_DROP) -> pd.DataFrame:
+        """
+        A和B时刻均要满足虚降>=AB_VIRTUAL_DROP%,且跌涨幅<=AB_CHANGE%，A时刻收盘价大于B时刻收盘价，并去掉废弃的B时刻。
+        只用到各币种自己的数据，可以按币种分片执行
+        """
+        filter_by_virtual_drop_and_change_data = FunctionHandler.filter_AB_bars(range_A_to_B_data, AB_CHANGE,
+                                                                                AB_VIRTUAL_DROP)
+        # A时刻收盘价大于B时刻收盘价
+        A_close_gt_B_close_data = FunctionHandler.filter_by_price_comparison(filter_by_virtual_drop_and_change_data,
+                                                                             'close', 'gt')
+        A_close_gt_B_close_data = A_close_gt_B_close_data.dropna().reset_index(drop=True)
+        return FunctionHandler.filter_B_data_with_following_conditions(A_close_gt_B_close_data.copy(),
+                                                                       range_A_to_B_data.copy())
 
-        return result_df
+    @staticmethod
+    def compute_AB_summary(range_A_to_B_data: pd.DataFrame, AB_CHANGE, AB_VIRTUAL_DROP) -> pd.DataFrame:
+        """
+        与compute_AB_data相同的AB组合，每个B只保留一行：B时刻的字段(_B后缀)、A的数量(A_count)、
+        第一个和最后一个A的时间(first_time_A、last_time_A)、A的最低价的最小值和最大值(min_low_A、max_low_A)、
+        A的开盘价的最大值(max_open_A)。45天的窗口中组合数量是K线数量的平方，汇总后只与K线数量有关。
+        只用到各币种自己的数据，可以按币种分片执行
+        """
+        AB_bars = FunctionHandler.filter_AB_bars(range_A_to_B_data, AB_CHANGE, AB_VIRTUAL_DROP)
+        AB_summary = build_ab_summary(AB_bars, 'close', AB_CLOSE_MAGNIFICATION, 'gt', AB_SUMMARY_AGGREGATIONS)
+        # 废弃的B时刻只与B有关，在汇总后的数据上筛选
+        return FunctionHandler.filter_B_data_with_following_conditions(AB_summary, range_A_to_B_data.copy())
 
     @staticmethod
-    def filter_B_data_with_following_conditions(filter_data, range_data):
-        """B时刻后面有价格低于B，且再有价格高于B，则该B时刻废弃"""
-        # 添加索引以加速条件筛选
-        range_data.set_index(['coin_name', 'spider_web', 'time'], inplace=True)
-        range_data.sort_index(ascending=True, inplace=True)
-        # 存储符合条件的 B 时刻数据
-        filter_B_data = []
-
-        # 矢量化操作：按 coin_name 和 spider_web 分组处理
-        grouped_data = filter_data.groupby(['coin_name', 'spider_web'])
-        for (coin_name, spider_web), group in grouped_data:
-            # 获取对应范围数据
-            full_data = range_data.loc[(coin_name, spider_web)]
-            if full_data.empty:
-                continue
-            # 遍历 B 时刻的每一行
-            for _, row in group.iterrows():
-                MAGANIFICATION = row['virtual_drop_B'] * Decimal('0.005') + Decimal('1')
-                # MAGANIFICATION = 1
-                time_B, min_B = row['time_B'], row['low_B'] * MAGANIFICATION
-
-                # 筛选 B 时刻之后的数据
-                following_data = full_data.loc[full_data.index > time_B]
-                if following_data.empty:
-                    filter_B_data.append(row)
-                    continue
-
-                # 找到第一个低于或等于 min_B 的时刻
-                below_min_B_mask = following_data['coin_price'] <= min_B
-                if not below_min_B_mask.any():
-                    filter_B_data.append(row)
-                    continue
-
-                first_time = following_data[below_min_B_mask].index[0]
-
-                # 检查该时刻后是否存在价格高于 min_B 的数据
-                after_first_time = following_data.loc[following_data.index > first_time]
-                if not (after_first_time['coin_price'] > min_B).any():
-                    filter_B_data.append(row)
-
-        filter_data = pd.DataFrame(filter_B_data)
-
-        return filter_data
+    def expand_AB_summary(AB_summary: pd.DataFrame, AB_bars: pd.DataFrame, C_data: pd.DataFrame,
+                          price_column: str) -> pd.DataFrame:
+        """
+        展开C时刻价格同时小于等于A最低价和B最低价的组合，结果与compute_AB_data中满足该条件的组合相同。
+        C价格大于B最低价或大于全部A最低价(max_low_A)的B不可能满足条件，不需要展开；
+        展开时也只列出最低价大于等于C价格的A，结果中C价格大于A最低价的组合已经去掉
+        :param AB_summary: compute_AB_summary的结果
+        :param AB_bars: 生成汇总使用的K线
+        :param C_data: C时刻数据，包含币种和price_column
+        :param price_column: C时刻与A、B最低价比较的价格字段
+        """
+        merged_data = AB_summary.merge(C_data[['coin_name', 'spider_web', price_column]],
+                                       on=['coin_name', 'spider_web'], how='inner')
+        candidate_mask = (merged_data[price_column] <= merged_data['low_B']) & (
+                merged_data[price_column] <= merged_data['max_low_A'])
+        return expand_ab_summary(AB_bars, merged_data[candidate_mask], 'close', AB_CLOSE_MAGNIFICATION, 'gt',
+                                 A_lower_bounds={'low': price_column})
 
     def round_and_simple_data(self, data: pd.DataFrame, decimals=3) -> pd.DataFrame:
         """处理结果"""
@@ -243,10 +365,8 @@ class FunctionHandler:
         return data
 
     @staticmethod
-    def filter_C_by_price_lt_pre_hours_low_price(cur_data, pre_three_hours_data,
-                                                 unit_time: Literal['hour', 'day', 'minute']):
-        """C小于前n小时内最低价的最小值"""
-
+    def get_pre_hours_min_low(pre_three_hours_data) -> pd.Series:
+        """前n小时内每个币种收盘价和开盘价中的最小值，字段名为min_low"""
         # 对前n小时数据进行分组
         pre_three_hours_group_data = pre_three_hours_data.groupby(['coin_name', 'spider_web'])
 
@@ -254,7 +374,17 @@ class FunctionHandler:
         min_low = pre_three_hours_group_data[['close', 'open']].apply(lambda group: group.min().min())
 
         # 更改字段名
-        min_low = min_low.rename('min_low')
+        return min_low.rename('min_low')
+
+    @staticmethod
+    def filter_C_by_price_lt_pre_hours_low_price(cur_data, pre_three_hours_data,
+                                                 unit_time: Literal['hour', 'day', 'minute'], min_low=None):
+        """
+        C小于前n小时内最低价的最小值
+        :param min_low: 已经计算好的前n小时最小值，为空时根据pre_three_hours_data计算
+        """
+        if min_low is None:
+            min_low = FunctionHandler.get_pre_hours_min_low(pre_three_hours_data)
 
         # 拼接
         combined_data = cur_data.merge(min_low, left_on=['coin_name', 'spider_web'], right_index=True,
@@ -305,64 +435,22 @@ class FunctionHandler:
         change_le_A_OR_B_CHANGE_data = FunctionHandler.filter_by_column(total_data, 'change', 'le',
                                                                         A_OR_B_CHANGE).copy()
 
-        change_le_A_OR_B_CHANGE_data.sort_values('time', ascending=True, inplace=True)
+        if base_data.empty:
+            return
 
         # 计算A和B前6小时的范围
         base_data['time_window_A_start'] = base_data['time_A'] - timedelta(hours=6)
         base_data['time_window_B_start'] = base_data['time_B'] - timedelta(hours=6)
 
-        unique_coin_spider = base_data[['coin_name', 'spider_web']].drop_duplicates()
-
-        # 为了提高效率，我们提前为每个 coin_name 和 spider_web 提取符合条件的变化数据
-        valid_changes = defaultdict(pd.DataFrame)
-        for _, row in unique_coin_spider.iterrows():
-            coin_name = row['coin_name']
-            cur_spider_web = row['spider_web']
-
-            # 提取符合条件的前6小时数据
-            valid_changes[(coin_name, cur_spider_web)] = change_le_A_OR_B_CHANGE_data[
-                (change_le_A_OR_B_CHANGE_data['coin_name'] == coin_name) &
-                (change_le_A_OR_B_CHANGE_data['spider_web'] == cur_spider_web)
-                ]
-
-        if not valid_changes:
-            return
-
-        # 判断 A 和 B 时刻前6小时内是否存在符合条件的数据
-        def check_change_in_window(row):
-            coin_name = row['coin_name']
-            spider_web = row['spider_web']
-            time_window_A_start = row['time_window_A_start']
-            time_window_B_start = row['time_window_B_start']
-
-            # 从预先筛选好的数据中提取 A 和 B 时间窗口内的符合条件数据
-            condition_A = valid_changes.get((coin_name, spider_web), pd.DataFrame())
-            condition_A = condition_A[
-                (condition_A['time'] >= time_window_A_start) & (condition_A['time'] < row['time_A'])]
-
-            # 找出A中开盘价的最大值
-            if not condition_A.empty:
-                max_open_price_A = condition_A['open'].max()
-                conform_A = max_open_price_A >= max(row['close_A'], row['open_A'])
-            else:
-                conform_A = False
-
-            condition_B = valid_changes.get((coin_name, spider_web), pd.DataFrame())
-            condition_B = condition_B[
-                (condition_B['time'] >= time_window_B_start) & (condition_B['time'] < row['time_B'])]
-
-            if not condition_B.empty:
-                # 找出B中开盘价的最大值
-                max_open_price_B = condition_B['open'].max()
-                conform_B = max_open_price_B >= max(row['close_B'], row['open_B'])
-            else:
-                conform_B = False
-
-            res = conform_A or conform_B
-            return res
-
-        # 向量化操作，使用 pandas 内置的 `apply` 处理每一行
-        base_data['condition_met'] = base_data.apply(check_change_in_window, axis=1)
+        # 判断 A 和 B 时刻前6小时内是否存在符合条件的数据：窗口内符合条件数据的最高开盘价 >= max(收盘价, 开盘价)
+        window_max_open_index = WindowMaxIndex(change_le_A_OR_B_CHANGE_data, 'open')
+        conform_A = window_max_open_index.window_max_ge(
+            base_data, base_data['time_window_A_start'], base_data['time_A'],
+            np.maximum(base_data['close_A'].to_numpy(), base_data['open_A'].to_numpy()))
+        conform_B = window_max_open_index.window_max_ge(
+            base_data, base_data['time_window_B_start'], base_data['time_B'],
+            np.maximum(base_data['close_B'].to_numpy(), base_data['open_B'].to_numpy()))
+        base_data['condition_met'] = conform_A | conform_B
 
         # 满足条件1
         conform_condition_1_data = base_data[condition_1].copy()
@@ -411,10 +499,15 @@ class FunctionHandler:
         merged_data = base_data[['coin_name', 'spider_web', 'coin_price_C']].drop_duplicates().merge(
             international_data[['coin_name', 'spider_web', 'coin_price']],
             on=['coin_name', 'spider_web'], how='left', suffixes=('_close', '_open'))
-        merged_data['change'] = (merged_data['coin_price_C'] - merged_data['coin_price']) / merged_data[
-            'coin_price'] * Decimal(100)
-
-        conform_condition_data = merged_data[merged_data['change'] <= CHANGE_ON_INTERNATIONAL_TIME].copy()
+        merged_data = merged_data.dropna(subset=['coin_price']).reset_index(drop=True)
+        # 使用定点数交叉相乘判断跌涨幅，不需要逐个做除法
+        change_numerator = fixed_point.change_numerator(merged_data['coin_price'].values,
+                                                        merged_data['coin_price_C'].values)
+        conform_mask = fixed_point.compare_ratio(change_numerator, merged_data['coin_price'].values, 'le',
+                                                 CHANGE_ON_INTERNATIONAL_TIME)
+        conform_condition_data = merged_data[conform_mask].copy()
+        conform_condition_data['change'] = (conform_condition_data['coin_price_C'] - conform_condition_data[
+            'coin_price']) / conform_condition_data['coin_price'] * Decimal(100)
         return conform_condition_data
 
     def filter_by_hour_and_minute(self, cur_data: pd.DataFrame, unit_time: str, file_path: str):
@@ -434,22 +527,11 @@ class FunctionHandler:
         else:
             price_column = 'lasted_price_C_minute'
 
-        # 读取文件
-        try:
-            record_data = pd.read_csv(file_path, encoding='utf-8', low_memory=False)
-        except FileNotFoundError:
-            record_data = pd.DataFrame(
-                columns=['coin_name', 'spider_web', 'time_A', 'time_B', 'lasted_price_C_minute', 'lasted_price_C_hour',
-                         'first_record_time', 'cnt'])
-
-        record_data['first_record_time'] = pd.to_datetime(record_data['first_record_time'])
-        record_data['time_A'] = pd.to_datetime(record_data['time_A'])
-        record_data['time_B'] = pd.to_datetime(record_data['time_B'])
-        record_data['lasted_price_C_minute'] = record_data['lasted_price_C_minute'].apply(Decimal)
-        record_data['lasted_price_C_hour'] = record_data['lasted_price_C_hour'].apply(Decimal)
-        # 过滤掉时间超出23小时的数据
-        pre_datetime = self.datetime - timedelta(hours=23)
-        record_data = record_data[record_data['first_record_time'] >= pre_datetime].copy()
+        # 读取记录，时间超出23小时的数据在读取时过滤掉；小时函数和分钟函数共用同一个记录
+        record_store = get_record_store(file_path, HOUR_AND_MINUTE_RECORD_COLUMNS,
+                                        key_columns=['coin_name', 'spider_web', 'time_A', 'time_B'],
+                                        ttl=timedelta(hours=23), ttl_column='first_record_time')
+        record_data = record_store.load(self.datetime)
 
         # 分批处理
         merged_data = record_data.merge(cur_data, on=['coin_name', 'spider_web', 'time_A', 'time_B'],
@@ -487,7 +569,7 @@ class FunctionHandler:
         write_to_file = write_to_file[
             ['coin_name', 'spider_web', 'time_A', 'time_B', 'lasted_price_C_minute', 'lasted_price_C_hour',
              'first_record_time', 'cnt']].copy()
-        write_to_file.to_csv(file_path, mode='w', index=False, encoding='utf-8', header=True)
+        record_store.save(write_to_file, self.datetime)
 
         abnormal_data = self.round_and_simple_data(abnormal_data, 2)
         return abnormal_data.copy()
@@ -3,7 +3,6 @@ from decimal import Decimal, ROUND_HALF_UP
 import pandas as pd
 from datetime import timedelta, datetime
 from collections import Counter
-from msg_log.msg_send import send_email
 from config import ConfigHandler
 from function_handler.functionhandler import FunctionHandler
 from msg_log.mylog import get_logger
@@ -26,8 +25,7 @@ class HourlyFunctionHandler(FunctionHandler):
 
     def update_func_1_cnt(self, original_data: pd.DataFrame, additional_data: pd.DataFrame):
         """更新函数1的记录数据并返回,每隔24小时清空"""
-        count_file_path = os.path.join(PROJECT_ROOT_PATH, 'function_handler', 'record_data',
-                                       'hour_func_1_coin_count.csv')
+        count_file_path = os.path.join(self.record_data_floder_path, 'hour_func_1_coin_count.csv')
         # 统计出现次数
         try:
             count_data = pd.read_csv(count_file_path, encoding='utf-8')
@@ -147,34 +145,15 @@ class HourlyFunctionHandler(FunctionHandler):
         # A到B时间范围的数据
         datetime_at_A = self.datetime - timedelta(hours=int(MAX_TIME_INTERVAL))  # A时间
         datetime_at_B = self.datetime - timedelta(hours=1)  # B时间
-        range_A_to_B_data = self.filter_by_datetime(self.range_data_hours.copy(), start_datetime=datetime_at_A,
-                                                    end_datetime=datetime_at_B, inclusive='both')
-        range_A_to_B_data.dropna(how='any', inplace=True)
-
         # 前n小时数据
         pre_datetime = self.datetime - timedelta(hours=C_PRE_TIME_INTERVAL)
-        pre_hours_data = self.filter_by_datetime(range_A_to_B_data.copy(), start_datetime=pre_datetime,
-                                                 end_datetime=datetime_at_B, inclusive='both')
-        change_lt_0_data = self.filter_C_by_price_lt_pre_hours_low_price(change_lt_0_data, pre_hours_data, 'hour')
-
-        # A和B时刻均要满足虚降>=AB_VIRTUAL_DROP%,且跌涨幅<=AB_CHANGE%
-        filter_columns_and_thresholds = {
-            'virtual_drop': ('ge', AB_VIRTUAL_DROP),
-            'change': ('le', AB_CHANGE)
-        }
-        filter_by_virtual_drop_and_change_data = self.filter_by_multiple_conditions(range_A_to_B_data,
-                                                                                    filter_columns_and_thresholds)
-
-        # A时刻收盘价大于B时刻收盘价
-        A_close_gt_B_close_data = pd.DataFrame()
-        group_by_coin_name_and_spider_web = filter_by_virtual_drop_and_change_data.groupby(
-            ['coin_name', 'spider_web'])
-        A_close_gt_B_close_data = group_by_coin_name_and_spider_web.apply(lambda group: self.filter_by_price_comparison(
-            group, 'close', 'gt'), include_groups=False)
-        A_close_gt_B_close_data = A_close_gt_B_close_data.dropna().reset_index(drop=False).drop(columns='level_2')
-
-        filtered_B_data = self.filter_B_data_with_following_conditions(A_close_gt_B_close_data.copy(),
-                                                                       range_A_to_B_data.copy())
+        pre_hours_min_low = self.get_shared_pre_hours_min_low(pre_datetime, datetime_at_B, dropna=True)
+        change_lt_0_data = self.filter_C_by_price_lt_pre_hours_low_price(change_lt_0_data, None, 'hour',
+                                                                         min_low=pre_hours_min_low)
+
+        # AB组合按B汇总，只展开C时刻收盘价可能同时小于A和B最低价的B
+        AB_summary, AB_bars = self.get_shared_AB_summary(datetime_at_A, datetime_at_B, AB_CHANGE, AB_VIRTUAL_DROP)
+        filtered_B_data = self.expand_AB_summary(AB_summary, AB_bars, change_lt_0_data, 'close')
 
         if filtered_B_data.empty:
             filtered_B_data = pd.DataFrame(
@@ -206,8 +185,7 @@ class HourlyFunctionHandler(FunctionHandler):
         config = self.config.get(f'{self.apply_condition_1_to_func_1_base.__name__}')
         # CLOSE_PRICE_THRESHOLD = '0.96'
         CLOSE_PRICE_THRESHOLD = config.get('CLOSE_PRICE_THRESHOLD')
-        record_file_path = os.path.join(PROJECT_ROOT_PATH, 'function_handler', 'record_data',
-                                        'hour_func_1_coin_frequency_in_24_hours.csv')
+        record_file_path = os.path.join(self.record_data_floder_path, 'hour_func_1_coin_frequency_in_24_hours.csv')
         func_1_base_data = self.price_comparison_results['hour_func_1_base']
         if func_1_base_data.empty:
             return
@@ -323,8 +301,7 @@ class HourlyFunctionHandler(FunctionHandler):
         :return:
         """
         logger.info('开始执行每分钟函数3：add_filte_in_minute_and_hour')
-        minute_and_hour_cnt_file_path = os.path.join(PROJECT_ROOT_PATH, 'function_handler', 'record_data',
-                                                     'minute_and_hour_cnt_le5.csv')
+        minute_and_hour_cnt_file_path = os.path.join(self.record_data_floder_path, 'minute_and_hour_cnt_le5.csv')
         data = self.price_comparison_results[f'{self.apply_condition_2_to_func_1_base.__name__}'].copy()
 
         if data.empty:
@@ -337,7 +314,7 @@ class HourlyFunctionHandler(FunctionHandler):
             logger.info("无结果")
             return
         self.price_comparison_results[f'{self.add_filte_in_minute_and_hour.__name__}'] = result_data.copy()
-        send_email("[小时]小时-分钟记录——V1", result_data.to_string(index=False), False)
+        self.email_sender("[小时]小时-分钟记录——V1", result_data.to_string(index=False), False)
 
 
 if __name__ == "__main__":
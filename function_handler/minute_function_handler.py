@@ -1,14 +1,16 @@
 import os
 from collections import defaultdict
-from msg_log.msg_send import send_email
 
 import pandas as pd
 from datetime import timedelta, datetime
 from decimal import Decimal
 
 from config import ConfigHandler
+from data_process.sliding_window_max import SlidingWindowMax
 from dataio.csv_handler import CSVReader
-from function_handler.functionhandler import FunctionHandler
+from dataio.record_store import get_record_store
+from function_handler.functionhandler import FunctionHandler, FIRST_PRICE_RECORD_COLUMNS, CNT_RECORD_COLUMNS, \
+    MAX_PRICE_CNT_RECORD_COLUMNS
 from msg_log.mylog import get_logger
 
 PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -19,8 +21,13 @@ logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'm
 class MinuteFunctionHandler(FunctionHandler):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.record_data_floder_path = os.path.join(PROJECT_ROOT_PATH, 'function_handler', 'record_data')
         os.makedirs(self.record_data_floder_path, exist_ok=True)
+        # 45天最高价的滑动窗口，由控制器每天更新
+        self.max_price_window = kwargs.get('max_price_window', None)
+        if self.max_price_window is None:
+            self.max_price_window = SlidingWindowMax(
+                checkpoint_path=os.path.join(self.record_data_floder_path, '45_day_max_price_window.csv'),
+                summary_path=os.path.join(self.record_data_floder_path, '45_day_max_price.csv'))
 
     @staticmethod
     def filter_and_update_func_1_data(abnormal_data: pd.DataFrame, record_data: pd.DataFrame):
@@ -139,6 +146,49 @@ class MinuteFunctionHandler(FunctionHandler):
                            on=['coin_name', 'spider_web'], how='inner'))
         return results[0] if len(results) == 1 else results
 
+    def prepare_func_1_AB_data(self, datetime_at_A: datetime, datetime_at_B: datetime, pre_datetime: datetime,
+                               AB_CHANGE, AB_VIRTUAL_DROP):
+        """
+        计算基础版函数1中只依赖小时K线的部分：
+        A和B时刻均要满足虚降>=AB_VIRTUAL_DROP%,且跌涨幅<=AB_CHANGE%，A时刻收盘价大于B时刻收盘价，并去掉废弃的B时刻；
+        以及前n小时收盘价和开盘价中的最小值。
+        AB组合按B汇总后保存，一个小时内只保存与K线数量有关的数据
+        :return: (按B汇总的AB数据, AB时刻的K线, 前n小时最小值)
+        """
+        pre_hours_min_low = self.get_shared_pre_hours_min_low(pre_datetime, datetime_at_B, dropna=True)
+        AB_summary, AB_bars = self.get_shared_AB_summary(datetime_at_A, datetime_at_B, AB_CHANGE, AB_VIRTUAL_DROP)
+        return AB_summary, AB_bars, pre_hours_min_low
+
+    @staticmethod
+    def filter_C_by_AB_low(current_data: pd.DataFrame, AB_summary: pd.DataFrame, AB_bars: pd.DataFrame,
+                           pre_hours_min_low: pd.Series):
+        """
+        C时刻价格小于前n小时最低价的最小值，并且同时小于A的最低价和B的最低价，C时刻的字段后缀为'_C'。
+        只展开可能满足条件的B的AB组合
+        """
+        current_data = FunctionHandler.filter_C_by_price_lt_pre_hours_low_price(current_data, None, unit_time='minute',
+                                                                                min_low=pre_hours_min_low)
+        filtered_B_data = FunctionHandler.expand_AB_summary(AB_summary, AB_bars, current_data, 'coin_price')
+        if filtered_B_data.empty:
+            filtered_B_data = pd.DataFrame(
+                columns=['coin_name', 'spider_web', 'coin_price_A', 'time_A', 'high_A', 'low_A',
+                         'open_A', 'close_A', 'change_A', 'amplitude_A', 'virtual_drop_A',
+                         'coin_price_B', 'time_B', 'high_B', 'low_B', 'open_B', 'close_B',
+                         'change_B', 'amplitude_B', 'virtual_drop_B'])
+
+        # 将C时刻数据与AB范围内的数据合并，C时刻数据后缀为'_C'
+        data_C = current_data.rename(
+            columns={col: f'{col}_C' if col != 'coin_name' and col != 'spider_web' else col for col in
+                     current_data.columns})
+        merged_ABC_data = filtered_B_data.merge(data_C, on=['coin_name', 'spider_web'],
+                                                how='inner', suffixes=('', '_C'))
+
+        # C时刻收盘价同时小于A的最低价和B的最低价。
+
+        C_coin_price_lt_A_low_and_B_low_condition = (merged_ABC_data['coin_price_C'] <= merged_ABC_data['low_A']) & (
+                merged_ABC_data['coin_price_C'] <= merged_ABC_data['low_B'])
+        return merged_ABC_data[C_coin_price_lt_A_low_and_B_low_condition]
+
     def minute_func_1_base(self):
         """
         有ABC三个时刻。其中C为当前时刻（当前分钟）
@@ -165,76 +215,33 @@ class MinuteFunctionHandler(FunctionHandler):
         # A到B时间范围的数据
         datetime_at_A = (self.datetime - timedelta(hours=int(MAX_TIME_INTERVAL))).replace(minute=0)  # A时间
         datetime_at_B = (self.datetime - timedelta(hours=1)).replace(minute=0)  # B时间
-        range_A_to_B_data = self.filter_by_datetime(self.range_data_hours.copy(), start_datetime=datetime_at_A,
-                                                    end_datetime=datetime_at_B, inclusive='both')
-        range_A_to_B_data.dropna(how='any', inplace=True)
         # 前n小时数据
         pre_datetime = (self.datetime - timedelta(hours=C_PRE_TIME_INTERVAL)).replace(minute=0)
-        pre_hours_data = self.filter_by_datetime(range_A_to_B_data.copy(), start_datetime=pre_datetime,
-                                                 end_datetime=datetime_at_B, inclusive='both')
-        current_data = self.filter_C_by_price_lt_pre_hours_low_price(current_data, pre_hours_data, unit_time='minute')
-        # A和B时刻均要满足虚降>=AB_VIRTUAL_DROP%,且跌涨幅<=AB_CHANGE%
-        filter_columns_and_thresholds = {
-            'virtual_drop': ('ge', AB_VIRTUAL_DROP),
-            'change': ('le', AB_CHANGE)
-        }
-        filter_by_virtual_drop_and_change_data = self.filter_by_multiple_conditions(range_A_to_B_data,
-                                                                                    filter_columns_and_thresholds)
-        # A时刻收盘价大于B时刻收盘价
-        A_close_gt_B_close_data = pd.DataFrame()
-        group_by_coin_name_and_spider_web = filter_by_virtual_drop_and_change_data.groupby(
-            ['coin_name', 'spider_web'])
-        A_close_gt_B_close_data = group_by_coin_name_and_spider_web.apply(lambda group: self.filter_by_price_comparison(
-            group, 'close', 'gt'), include_groups=False)
-        A_close_gt_B_close_data = A_close_gt_B_close_data.dropna().reset_index(drop=False).drop(columns='level_2')
-        filtered_B_data = self.filter_B_data_with_following_conditions(A_close_gt_B_close_data.copy(),
-                                                                       range_A_to_B_data.copy())
-
-        if filtered_B_data.empty:
-            filtered_B_data = pd.DataFrame(
-                columns=['coin_name', 'spider_web', 'coin_price_A', 'time_A', 'high_A', 'low_A',
-                         'open_A', 'close_A', 'change_A', 'amplitude_A', 'virtual_drop_A',
-                         'coin_price_B', 'time_B', 'high_B', 'low_B', 'open_B', 'close_B',
-                         'change_B', 'amplitude_B', 'virtual_drop_B'])
-
-        # 将C时刻数据与AB范围内的数据合并，C时刻数据后缀为'_C'
-        data_C = current_data.rename(
-            columns={col: f'{col}_C' if col != 'coin_name' and col != 'spider_web' else col for col in
-                     current_data.columns})
-        merged_ABC_data = filtered_B_data.merge(data_C, on=['coin_name', 'spider_web'],
-                                                how='inner', suffixes=('', '_C'))
 
-        # C时刻收盘价同时小于A的最低价和B的最低价。
+        # AB时刻只依赖小时K线，同一个小时内只计算一次
+        cache_key = (datetime_at_A, datetime_at_B, pre_datetime, AB_CHANGE, AB_VIRTUAL_DROP)
+        AB_summary, AB_bars, pre_hours_min_low = self.get_hourly_cache(
+            'minute_func_1_base', cache_key,
+            lambda: self.prepare_func_1_AB_data(datetime_at_A, datetime_at_B, pre_datetime, AB_CHANGE, AB_VIRTUAL_DROP))
 
-        C_coin_price_lt_A_low_and_B_low_condition = (merged_ABC_data['coin_price_C'] <= merged_ABC_data['low_A']) & (
-                merged_ABC_data['coin_price_C'] <= merged_ABC_data['low_B'])
-        C_coin_price_lt_A_low_and_B_low_data = merged_ABC_data[C_coin_price_lt_A_low_and_B_low_condition]
+        # C时刻的筛选只与各币种的当前价格有关，价格没有变化的币种沿用上一分钟的结果
+        C_coin_price_lt_A_low_and_B_low_data = self.evaluate_changed_coins(
+            'minute_func_1_base', cache_key, current_data,
+            lambda data: self.filter_C_by_AB_low(data, AB_summary, AB_bars, pre_hours_min_low))
 
         if C_coin_price_lt_A_low_and_B_low_data.empty:
             self.price_comparison_results['minute_func_1_base'] = C_coin_price_lt_A_low_and_B_low_data.copy()
             return
 
-        # 筛选出后面价格低于第一次价格的数据
-        try:
-            record_data = pd.read_csv(record_data_file_path, encoding='utf-8', low_memory=False)
-            last_modified_datetime = datetime.fromtimestamp(os.path.getmtime(record_data_file_path))
-        except FileNotFoundError:
-            record_data = pd.DataFrame(columns=['coin_name', 'spider_web', 'first_price'])
-            last_modified_datetime = self.datetime
-
-        if self.datetime.minute == 0 or last_modified_datetime.hour != datetime.now().hour:
-            try:
-                os.remove(record_data_file_path)
-            except FileNotFoundError:
-                pass
-            record_data = pd.DataFrame(columns=['coin_name', 'spider_web', 'first_price'])
-        record_data['first_price'] = record_data['first_price'].apply(Decimal)
+        # 筛选出后面价格低于第一次价格的数据，记录每小时清空一次
+        record_store = get_record_store(record_data_file_path, FIRST_PRICE_RECORD_COLUMNS, reset='hour')
+        record_data = record_store.load(self.datetime)
 
         filtered_data, record_data = self.filter_and_update_func_1_data(C_coin_price_lt_A_low_and_B_low_data,
                                                                         record_data)
         if not record_data.empty:
             record_data.dropna(inplace=True)
-            record_data.to_csv(record_data_file_path, mode='w', index=False, encoding='utf-8')
+            record_store.save(record_data, self.datetime)
 
         self.price_comparison_results['minute_func_1_base'] = filtered_data.copy()
 
@@ -308,27 +315,15 @@ class MinuteFunctionHandler(FunctionHandler):
         self.price_comparison_results['apply_condition_1_to_func_1_base'] = result_data.copy()
 
         # 筛选出当前小时异常次数小于等于3次的数据
-        try:
-            record_data = pd.read_csv(record_data_file_path, encoding='utf-8')
-            last_modified_datetime = datetime.fromtimestamp(os.path.getmtime(record_data_file_path))
-        except FileNotFoundError:
-            record_data = pd.DataFrame(columns=['coin_name', 'spider_web', 'cnt', 'lasted_price'])
-            last_modified_datetime = self.datetime
-
-        if self.datetime.minute == 0 or last_modified_datetime.hour != datetime.now().hour:
-            try:
-                os.remove(record_data_file_path)
-            except FileNotFoundError:
-                pass
-            record_data = pd.DataFrame(columns=['coin_name', 'spider_web', 'cnt', 'lasted_price'])
-        record_data['lasted_price'] = record_data['lasted_price'].apply(Decimal)
+        record_store = get_record_store(record_data_file_path, CNT_RECORD_COLUMNS, reset='hour')
+        record_data = record_store.load(self.datetime)
 
         filter_data, record_data = self.filter_cnt_lt_3_on_condition_1(conform_condition_1_and_2_data.copy(),
                                                                        record_data.copy())
 
         if not record_data.empty:
             record_data.dropna(inplace=True, how='any')
-            record_data.to_csv(record_data_file_path, index=False, mode='w', header=True)
+            record_store.save(record_data, self.datetime)
 
         self.price_comparison_results[
             f'{self.apply_condition_1_to_func_1_base.__name__}'] = filter_data.copy()
@@ -345,39 +340,23 @@ class MinuteFunctionHandler(FunctionHandler):
         """
         logger.info('开始执行每分钟函数2：current_price_compare_with_45_day_max_price')
         data = self.data.copy()
-        max_price_data_file_path = os.path.join(PROJECT_ROOT_PATH, 'function_handler', 'record_data',
-                                                '45_day_max_price.csv')
-        max_price_data = pd.read_csv(max_price_data_file_path, encoding='utf-8', low_memory=False,
-                                     index_col='coin_name')
-        max_price_data['max_price_in_45_day'] = max_price_data['max_price_in_45_day'].apply(Decimal)
-
-        # 合并两张表
-        merged_data = data.merge(max_price_data, on='coin_name', how='inner')
-
-        # 条件
-        condition = (merged_data['coin_price'] <= merged_data['max_price_in_45_day'] * Decimal('0.5'))
-        # 筛选
-        conform_condition_data = merged_data[condition].copy()
+        # 与45天最高价合并后筛选
+        conform_condition_data = self.max_price_window.price_le_max_ratio(data, Decimal('0.5'),
+                                                                          cur_datetime=self.datetime)
 
         # 发送次数筛选
-        record_data_file_path = os.path.join(PROJECT_ROOT_PATH, 'function_handler', 'record_data',
+        record_data_file_path = os.path.join(self.record_data_floder_path,
                                              'current_price_compare_with_45_day_max_price.csv')
-        try:
-            record_data = pd.read_csv(record_data_file_path, encoding='utf-8', low_memory=False)
-            last_modified_datetime = datetime.fromtimestamp(os.path.getmtime(record_data_file_path))
-        except FileNotFoundError:
-            record_data = pd.DataFrame(columns=['coin_name', 'spider_web', 'cnt'])
-            last_modified_datetime = self.datetime
+        record_store = get_record_store(record_data_file_path, MAX_PRICE_CNT_RECORD_COLUMNS)
+        record_data = record_store.load(self.datetime)
+        last_modified_datetime = record_store.last_update or self.datetime
 
         filter_data, update_data = self.filter_from_45_day_max_price_data(conform_condition_data, record_data)
 
-        if self.datetime.minute == 0 and last_modified_datetime.hour != datetime.now().hour:
-            try:
-                os.remove(record_data_file_path)
-            except FileNotFoundError:
-                pass
+        if self.datetime.minute == 0 and last_modified_datetime.hour != self.datetime.hour:
+            record_store.clear(self.datetime)
         else:
-            update_data.to_csv(record_data_file_path, index=False, encoding='utf-8')
+            record_store.save(update_data, self.datetime)
 
         res_list = []
         if not filter_data.empty:
@@ -403,8 +382,7 @@ class MinuteFunctionHandler(FunctionHandler):
         """
         logger.info('开始执行每分钟函数3：add_filte_in_minute_and_hour')
         # 文件路径
-        minute_and_hour_cnt_file_path = os.path.join(PROJECT_ROOT_PATH, 'function_handler', 'record_data',
-                                                     'minute_and_hour_cnt_le5.csv')
+        minute_and_hour_cnt_file_path = os.path.join(self.record_data_floder_path, 'minute_and_hour_cnt_le5.csv')
         data = self.price_comparison_results[f'{self.apply_condition_1_to_func_1_base.__name__}'].copy()
         if data.empty:
             logger.info("数据为空,结束函数")
@@ -416,7 +394,7 @@ class MinuteFunctionHandler(FunctionHandler):
             logger.info("无结果")
             return
         self.price_comparison_results[f'{self.add_filte_in_minute_and_hour.__name__}'] = result_data.copy()
-        send_email("[分钟]小时-分钟记录——V1", result_data.to_string(index=False), False)
+        self.email_sender("[分钟]小时-分钟记录——V1", result_data.to_string(index=False), False)
 
 
 
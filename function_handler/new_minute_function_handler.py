@@ -1,19 +1,21 @@
 import collections
 
 
-from msg_log.msg_send import send_email
 
-import numpy as np
 import os
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from decimal import Decimal
 from typing import Literal
-from collections import defaultdict
 
 
 from dataio.csv_handler import CSVReader, CSVWriter
-from function_handler.functionhandler import FunctionHandler
+from dataio.record_store import get_record_store
+from function_handler.functionhandler import FunctionHandler, FIRST_PRICE_RECORD_COLUMNS, CNT_RECORD_COLUMNS
+from function_handler.ab_pair_engine import build_ab_pairs
+from function_handler.dip_recover_index import DipRecoverIndex
+from function_handler.range_query_index import WindowMaxIndex
 from msg_log.mylog import get_logger
 
 PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -166,27 +168,13 @@ class NewMinuteFunctionHandler(FunctionHandler):
         return data
 
     @staticmethod
-    def filter_AB_by_colse_price(group, magnification=Decimal(0.99)):
+    def filter_AB_by_colse_price(data, magnification=Decimal(0.99)):
         """
         通过收盘价比较初步筛选出A和B时刻数据
-        A时刻收盘价的magnification倍大于B时刻收盘价
+        A时刻收盘价的magnification倍大于等于B时刻收盘价，按币种分别比较
         :return:
         """
-        if not isinstance(magnification, Decimal):
-            magnification = Decimal(magnification)
-        group.sort_values(by='time', ascending=True, inplace=True)
-        close_price = group['close'].values
-        group_values = group.values
-        result = []
-        for i in range(len(close_price) - 1):
-            for j in range(i + 1, len(close_price)):
-                if close_price[i] * magnification >= close_price[j]:
-                    # 将两个结果横向拼接起来加入result
-                    combiend_row = np.concatenate((group_values[i], group_values[j]), axis=None)
-                    result.append(combiend_row)
-        columns = [f'{col}_A' for col in group.columns] + [f'{col}_B' for col in group.columns]
-        result_data = pd.DataFrame(result, columns=columns)
-        return result_data
+        return build_ab_pairs(data, 'close', magnification, 'ge')
 
     @staticmethod
     def filter_by_after_B_price(A2B_data: pd.DataFrame, total_data: pd.DataFrame,
@@ -196,51 +184,12 @@ class NewMinuteFunctionHandler(FunctionHandler):
         然后再有开盘价高于此B时刻`最低价*(虚降 * 0.005 + 1)`的时刻，则该B废弃不用。
         :return:
         """
-        # 找出每一个B时刻后面对应的数据
-
         if not isinstance(magnification, Decimal):
             magnification = Decimal(magnification)
-        after_B_data = defaultdict(pd.DataFrame)
-        total_data = total_data[['coin_name', 'spider_web', 'coin_price', 'time']]
-        indexs = A2B_data[['coin_name', 'spider_web', 'time_B']].drop_duplicates().values
-        for coin_name, spider_web, time_B in indexs:
-            after_B_data[(coin_name, spider_web, time_B)] = total_data[(total_data['coin_name'] == coin_name) &
-                                                                       (total_data['spider_web'] == spider_web) &
-                                                                       (total_data['time'] > time_B)]
-
-        # 按照coin_name,spider_web,time_B进行分组
-        group_data = A2B_data[['coin_name', 'spider_web', 'low_B', 'virtual_drop_B', 'time_B']].drop_duplicates(
-            subset=['coin_name', 'spider_web', 'time_B'])
-        group_data['compare_price'] = group_data['low_B'] * (group_data['virtual_drop_B'] * magnification + Decimal(1))
-
-        def filte(row):
-            coin_name = row['coin_name']
-            spider_web = row['spider_web']
-            time_B = row['time_B']
-            after_data = after_B_data[(coin_name, spider_web, time_B)]
-            if after_data.empty:
-                return True
-            after_data.sort_values(by='time', ascending=True, inplace=True)
-            # 找出价格低于compare_price的数据
-            low_price_data = after_data[after_data['coin_price'] < row['compare_price']]
-            if low_price_data.empty:
-                return True
-            # 获取第一个索引
-            first_index = low_price_data.index[0]
-
-            # 再找出价格高于compare_price的数据
-            high_price_data = after_data[
-                (after_data['coin_price'] > row['compare_price']) & (after_data.index > first_index)]
-            if high_price_data.empty:
-                return True
-            return False
-
-        group_data['condition_met'] = group_data.apply(lambda row: filte(row), axis=1)
-        group_data = group_data[group_data['condition_met'] == True].copy()
-        group_data.dropna().drop(columns='compare_price', inplace=True)
-        result_data = A2B_data.merge(group_data[['coin_name', 'spider_web', 'time_B']],
-                                     on=['coin_name', 'spider_web', 'time_B'], how='inner')
-        return result_data
+        compare_price = A2B_data['low_B'] * (A2B_data['virtual_drop_B'] * magnification + Decimal(1))
+        dip_recover_index = DipRecoverIndex(total_data)
+        invalid_B = dip_recover_index.dip_then_recover(A2B_data, A2B_data['time_B'], compare_price)
+        return A2B_data[~invalid_B].reset_index(drop=True)
 
     def filter_by_AB_before_6_days(self, A2B_data: pd.DataFrame, total_data: pd.DataFrame,
                                    spider_web: str) -> pd.DataFrame:
@@ -284,44 +233,16 @@ class NewMinuteFunctionHandler(FunctionHandler):
         A2B_data['time_start_A'] = A2B_data['time_A'] - timedelta(hours=6)
         A2B_data['time_start_B'] = A2B_data['time_B'] - timedelta(hours=6)
 
-        # 每个coin_name,spider_web的数据
-        indexs = A2B_data[['coin_name', 'spider_web']].drop_duplicates().values
-        group_data = defaultdict(pd.DataFrame)
-        total_data.sort_values(by='time', ascending=True, inplace=True)
-
-        for coin_name, cur_spider_web in indexs:
-            group_data[(coin_name, cur_spider_web)] = total_data[(total_data['coin_name'] == coin_name) &
-                                                                 (total_data['spider_web'] == cur_spider_web)]
-
-        def filte(row):
-            coin_name = row['coin_name']
-            cur_spider_web = row['spider_web']
-            time_start_A = row['time_start_A']
-            time_start_B = row['time_start_B']
-            cur_data = group_data[(coin_name, cur_spider_web)]
-            if cur_data.empty:
-                return False
-            # A时刻之前
-            # A max(收盘价，开盘价)
-            max_A = max(row['open_A'], row['close_A'])
-            before_A_data = cur_data[cur_data['time'].between(time_start_A, row['time_A'], inclusive='left')]
-            condition_2_A_data = before_A_data[
-                (before_A_data['change'] < BEFORE_CHANGE) & (before_A_data['coin_price'] >= max_A)]
-
-            result_A = not condition_2_A_data.empty
-
-            # B时刻之前
-            max_B = max(row['open_B'], row['close_B'])
-            before_B_data = cur_data[cur_data['time'].between(time_start_B, row['time_B'], inclusive='left')]
-            condition_2_B_data = before_B_data[
-                (before_B_data['change'] < BEFORE_CHANGE) & (before_B_data['coin_price'] >= max_B)]
-            result_B = not condition_2_B_data.empty
-
-            if result_A or result_B:
-                return True
-            return False
-
-        A2B_data['condition_met'] = A2B_data.apply(lambda row: filte(row), axis=1)
+        # 窗口内跌幅 < BEFORE_CHANGE的时刻中，最高的价格 >= A或者B时刻`max(收盘价, 开盘价)`即满足条件
+        before_change_data = total_data[total_data['change'] < BEFORE_CHANGE]
+        window_max_price_index = WindowMaxIndex(before_change_data, 'coin_price')
+        result_A = window_max_price_index.window_max_ge(
+            A2B_data, A2B_data['time_start_A'], A2B_data['time_A'],
+            np.maximum(A2B_data['open_A'].to_numpy(), A2B_data['close_A'].to_numpy()))
+        result_B = window_max_price_index.window_max_ge(
+            A2B_data, A2B_data['time_start_B'], A2B_data['time_B'],
+            np.maximum(A2B_data['open_B'].to_numpy(), A2B_data['close_B'].to_numpy()))
+        A2B_data['condition_met'] = result_A | result_B
         conform_condition_2_data = A2B_data[A2B_data['condition_met'] == True].copy()
         conform_condition_2_data.drop(columns=['time_start_A', 'time_start_B', 'condition_met'], inplace=True)
         conform_condition_2_data[
@@ -368,132 +289,89 @@ class NewMinuteFunctionHandler(FunctionHandler):
         conform_condition_data = merged_data[merged_data['change'] <= CHANGE_ON_INTERNATIONAL_TIME].copy()
         return conform_condition_data
 
-    def func_1(self):
+    def prepare_func_1_AB_data(self, cur_datetime: datetime, MAX_TIME_INTERVAL, AB_CHANGE, AB_VIRTUAL_DROP,
+                               C_PRE_TIME_INTERVAL, AFTER_B_VIRTUAL_DROP_MAGNIFICATION):
         """
-        1.C为当前时刻，A与C时刻不超过24天
-        2.A时刻在B时刻之前
-        3.C时刻开盘价同时小于最近两天收盘价的最小值
-        4.C时刻开盘价小于A的最低价和B的最低价
-        5.AB均为跌且虚降大于等于5%
-        6.（1）A或者B虚降大于1.5倍跌幅，且跌幅 <= -5%
-           （2）A或者B前6天存在跌幅 < -10% 的时刻，且该时刻的开盘价大于等于A或者B时刻`max(收盘价, 开盘价)`
-        条件6满足其中一个即可
-        7.A时刻收盘价的0.99大于B时刻收盘价
-        8.某一个B时刻后面存在一个低于B时刻`最低价*(虚降 * 0.005 + 1)`的时刻，然后再有高于此B时刻`最低价*(虚降 * 0.005 + 1)`的时刻，则���B废弃不用。
-        :return:
+        计算函数1中只依赖小时K线的部分，C时刻的筛选只需要再比较 C价格 <= min(A最低价, B最低价)：
+        AB均为跌且虚降大于等于AB_VIRTUAL_DROP%，A时刻收盘价的0.99大于等于B时刻收盘价，并去掉废弃的B时刻。
+        AB组合的筛选只与A、B两行数据有关，先不考虑C，得到的组合再按C的价格筛选，结果与先按C筛选A、B再组合相同。
+        :return: (A之前6小时到B的全部数据, 最近两小时收盘价和开盘价的最小值, AB组合)
         """
-        MAX_TIME_INTERVAL = 24
-        AB_CHANGE = 1
-        AB_VIRTUAL_DROP = 1.1
-        C_PRE_TIME_INTERVAL = 2
-        AFTER_B_VIRTUAL_DROP_MAGNIFICATION = 0.005
-
-        C_data = self.data.copy()
-
-        if C_data.empty:
-            logger.info("C数据为空,结束当前函数")
-            return
-        cur_datetime = self.datetime.replace(minute=0)
         A_datetime = cur_datetime - timedelta(hours=MAX_TIME_INTERVAL)
         B_datetime = cur_datetime - timedelta(hours=1)
         start_datetime = A_datetime - timedelta(hours=6)  # A之前6天
         # 获取 24 + 6 天的数据
         total_data = self.get_range_data_hours(start_datetime=start_datetime, end_datetime=B_datetime)
-        # 筛选
-        total_data = self.synchronous_data(C_data, total_data)
         # A到B的数据
         A2B_data = total_data[total_data['time'].between(A_datetime, B_datetime, inclusive='both')]
 
-        # C开盘价小于最近两天收盘价的最小值
-        # 近两天数据
-        last_two_days_datetime = (
-            cur_datetime - timedelta(hours=C_PRE_TIME_INTERVAL), cur_datetime - timedelta(hours=1))
-        last_two_days_data = A2B_data[
-            A2B_data['time'].between(last_two_days_datetime[0], last_two_days_datetime[1], inclusive='both')]
-        groupby_coin_web = last_two_days_data.groupby(['coin_name', 'spider_web'])
-        min_low = groupby_coin_web[['open', 'close']].apply(lambda group: group.min().min())
-        min_low.rename('min_low', inplace=True)
-        C_data = C_data.merge(min_low, on=['coin_name', 'spider_web'], how='inner')
-        C_data = C_data[C_data['coin_price'] < C_data['min_low']].copy()
-
-        if C_data.empty:
-            logger.info('当前时刻没有满足条件：C开盘价小于近两小时最低价的数据')
-            return
-        C_data.drop(columns=['min_low'], inplace=True)
+        # 近两天数据中收盘价和开盘价的最小值
+        min_low = self.get_shared_pre_hours_min_low(cur_datetime - timedelta(hours=C_PRE_TIME_INTERVAL),
+                                                    cur_datetime - timedelta(hours=1))
 
-        A2B_data, total_data = self.synchronous_data(C_data, A2B_data, total_data)
+        # AB组合的筛选只用到各币种自己的数据，可以按币种分片执行
+        A2B_data = self.get_shared(
+            'compute_func_1_AB_data',
+            (start_datetime, A_datetime, B_datetime, AB_CHANGE, AB_VIRTUAL_DROP, AFTER_B_VIRTUAL_DROP_MAGNIFICATION),
+            lambda: self.run_by_shard(self.compute_func_1_AB_data, [A2B_data, total_data], AB_CHANGE,
+                                      AB_VIRTUAL_DROP, AFTER_B_VIRTUAL_DROP_MAGNIFICATION))
+        return total_data, min_low, A2B_data
 
+    @staticmethod
+    def compute_func_1_AB_data(A2B_data: pd.DataFrame, total_data: pd.DataFrame, AB_CHANGE, AB_VIRTUAL_DROP,
+                               AFTER_B_VIRTUAL_DROP_MAGNIFICATION) -> pd.DataFrame:
+        """函数1中AB组合的筛选"""
         # 对AB进行筛选——AB均为跌且虚降大于等于5%
         A2B_change_and_virtual_drop_condition = {
             'change': ('lt', AB_CHANGE, 1),
             'virtual_drop': ('ge', AB_VIRTUAL_DROP, 1)
         }
-        A2B_data = self.filter_by_figure_columns(A2B_data, A2B_change_and_virtual_drop_condition)
-
-        # C开盘价小于A的最低价和B的最低价
-        C_open_lt_AB_low_data = A2B_data.merge(C_data[['coin_name', 'spider_web', 'coin_price']],
-                                               on=['coin_name', 'spider_web'],
-                                               suffixes=['', '_C'], how='inner')
-        C_open_lt_AB_low_data = C_open_lt_AB_low_data[
-            C_open_lt_AB_low_data['coin_price_C'] <= C_open_lt_AB_low_data['low']].copy()
-        A2B_data = C_open_lt_AB_low_data.drop(columns=['coin_price_C'])
-
-        if A2B_data.empty:
-            logger.info('当前时刻没有满足条件：C开盘价小于A的最低价和B的最低价的数据')
-            return
+        A2B_data = NewMinuteFunctionHandler.filter_by_figure_columns(A2B_data, A2B_change_and_virtual_drop_condition)
 
         # 初步选择出AB时刻：A时刻收盘价的0.99大于B时刻收盘价
-        A2B_data_groupby_coin_web = A2B_data.groupby(['coin_name', 'spider_web'])
-        A2B_filter_by_close_data = A2B_data_groupby_coin_web.apply(lambda group: self.filter_AB_by_colse_price(group),
-                                                                   include_groups=False).reset_index(drop=False).drop(
-            columns=['level_2'])
-        A2B_data = A2B_filter_by_close_data
-
-        total_data = self.synchronous_data(A2B_data.drop_duplicates(subset=['coin_name', 'spider_web']).copy(),
-                                           total_data)
+        A2B_data = NewMinuteFunctionHandler.filter_AB_by_colse_price(A2B_data)
 
         # 某一个B时刻后面存在一个低于B时刻`最低价*(虚降 * 0.005 + 1)`的时刻，
         # 然后再有高于此B时刻`最低价*(虚降 * 0.005 + 1)`的时刻，则该B废弃不用。
-        A2B_data = self.filter_by_after_B_price(A2B_data, total_data, magnification=AFTER_B_VIRTUAL_DROP_MAGNIFICATION)
+        return NewMinuteFunctionHandler.filter_by_after_B_price(A2B_data, total_data,
+                                                                magnification=AFTER_B_VIRTUAL_DROP_MAGNIFICATION)
+
+    def filter_func_1_C_data(self, C_data: pd.DataFrame, total_data: pd.DataFrame, min_low: pd.Series,
+                             A2B_data: pd.DataFrame):
+        """
+        函数1中只与各币种的C价格和小时K线有关的筛选(条件3、4、6)
+        :return: (C价格满足条件3、4的AB组合，coin_price_C为C时刻价格, 同时满足条件6和国际时间跌涨幅的数据)
+        """
+        empty_result = (pd.DataFrame(columns=['coin_name', 'spider_web', 'coin_price_C']),
+                        pd.DataFrame(columns=['coin_name', 'spider_web']))
+        # C开盘价小于最近两天收盘价的最小值
+        C_data = C_data.merge(min_low, on=['coin_name', 'spider_web'], how='inner')
+        C_data = C_data[C_data['coin_price'] < C_data['min_low']].copy()
+
+        if C_data.empty:
+            logger.info('当前时刻没有满足条件：C开盘价小于近两小时最低价的数据')
+            return empty_result
+        C_data.drop(columns=['min_low'], inplace=True)
+
+        # C开盘价小于A的最低价和B的最低价
+        C_open_lt_AB_low_data = A2B_data.merge(C_data[['coin_name', 'spider_web', 'coin_price']].rename(
+            columns={'coin_price': 'coin_price_C'}), on=['coin_name', 'spider_web'], how='inner')
+        C_open_lt_AB_low_data = C_open_lt_AB_low_data[
+            (C_open_lt_AB_low_data['coin_price_C'] <= C_open_lt_AB_low_data['low_A']) &
+            (C_open_lt_AB_low_data['coin_price_C'] <= C_open_lt_AB_low_data['low_B'])]
+        A2B_data = C_open_lt_AB_low_data.drop(columns=['coin_price_C']).reset_index(drop=True)
 
         if A2B_data.empty:
-            logger.info(
-                '当前时刻没有满足条件：某一个B时刻后面存在一个开盘价低于B时刻`最低价*(虚降 * 0.005 + 1)`的时刻，且之后再存在开盘价高于此数据的时刻')
-            return
+            logger.info('当前时刻没有满足条件：C开盘价小于A的最低价和B的最低价，且B时刻未废弃的数据')
+            return empty_result
 
-        record_data_file_path = os.path.join(PROJECT_ROOT_PATH, 'function_handler', 'record_data',
-                                             'new_minute_record_data.csv')
-
-        # 筛选出后面价格低于第一次价格的数据
-        try:
-            record_data = pd.read_csv(record_data_file_path, encoding='utf-8', low_memory=False)
-            last_modified_datetime = datetime.fromtimestamp(os.path.getmtime(record_data_file_path))
-        except FileNotFoundError:
-            record_data = pd.DataFrame(columns=['coin_name', 'spider_web', 'first_price'])
-            last_modified_datetime = self.datetime
-
-        if self.datetime.minute == 0 or last_modified_datetime.hour != datetime.now().hour:
-            try:
-                os.remove(record_data_file_path)
-            except FileNotFoundError:
-                pass
-            record_data = pd.DataFrame(columns=['coin_name', 'spider_web', 'first_price'])
-        record_data['first_price'] = record_data['first_price'].apply(Decimal)
+        total_data = self.synchronous_data(A2B_data.drop_duplicates(subset=['coin_name', 'spider_web']).copy(),
+                                           total_data)
 
         A2B_data = A2B_data.merge(C_data[['coin_name', 'spider_web', 'coin_price']],
                                   on=['coin_name', 'spider_web'], how='left', suffixes=['', '_C']).rename(columns={
             'coin_price': 'coin_price_C'})
 
-        filtered_data, record_data = self.filter_and_update_func_1_data(A2B_data.copy(),
-                                                                        record_data)
-        if not record_data.empty:
-            record_data.dropna(inplace=True)
-            record_data.to_csv(record_data_file_path, mode='w', index=False, encoding='utf-8')
-
-        if filtered_data.empty:
-            logger.info('当前时刻没有满足条件：筛选出后面价格低于第一次价格的数据')
-            return
-
         # （1）A或者B虚降大于1.5倍跌幅，且跌幅 <= -5%
         # （2）A或者B前6天存在跌幅 < -10% 的时刻，且该时刻的开盘价大于等于A或者B时刻`max(收盘价, 开盘价)`
         # 满足其中一个即可
@@ -522,34 +400,79 @@ class NewMinuteFunctionHandler(FunctionHandler):
         combined_data = combined_data.merge(
             combined_international_change_data[['coin_name', 'spider_web']].drop_duplicates(),
             on=['coin_name', 'spider_web'], how='inner')
+        return A2B_data, combined_data
+
+    def func_1(self):
+        """
+        1.C为当前时刻，A与C时刻不超过24天
+        2.A时刻在B时刻之前
+        3.C时刻开盘价同时小于最近两天收盘价的最小值
+        4.C时刻开盘价小于A的最低价和B的最低价
+        5.AB均为跌且虚降大于等于5%
+        6.（1）A或者B虚降大于1.5倍跌幅，且跌幅 <= -5%
+           （2）A或者B前6天存在跌幅 < -10% 的时刻，且该时刻的开盘价大于等于A或者B时刻`max(收盘价, 开盘价)`
+        条件6满足其中一个即可
+        7.A时刻收盘价的0.99大于B时刻收盘价
+        8.某一个B时刻后面存在一个低于B时刻`最低价*(虚降 * 0.005 + 1)`的时刻，然后再有高于此B时刻`最低价*(虚降 * 0.005 + 1)`的时刻，则���B废弃不用。
+        :return:
+        """
+        MAX_TIME_INTERVAL = 24
+        AB_CHANGE = 1
+        AB_VIRTUAL_DROP = 1.1
+        C_PRE_TIME_INTERVAL = 2
+        AFTER_B_VIRTUAL_DROP_MAGNIFICATION = 0.005
+
+        C_data = self.data.copy()
+
+        if C_data.empty:
+            logger.info("C数据为空,结束当前函数")
+            return
+        cur_datetime = self.datetime.replace(minute=0)
+        # AB时刻只依赖小时K线，同一个小时内只计算一次，每分钟只需要用C的价格与缓存的阈值比较
+        cache_key = (cur_datetime, MAX_TIME_INTERVAL, AB_CHANGE, AB_VIRTUAL_DROP, C_PRE_TIME_INTERVAL,
+                     AFTER_B_VIRTUAL_DROP_MAGNIFICATION)
+        total_data, min_low, A2B_data = self.get_hourly_cache(
+            'func_1', cache_key,
+            lambda: self.prepare_func_1_AB_data(cur_datetime, MAX_TIME_INTERVAL, AB_CHANGE, AB_VIRTUAL_DROP,
+                                                C_PRE_TIME_INTERVAL, AFTER_B_VIRTUAL_DROP_MAGNIFICATION))
+
+        # C时刻的筛选只与各币种的当前价格有关，价格没有变化的币种沿用上一分钟的结果
+        A2B_data, combined_data = self.evaluate_changed_coins(
+            'func_1', cache_key, C_data, lambda data: self.filter_func_1_C_data(data, total_data, min_low, A2B_data))
+        if A2B_data.empty:
+            return
+
+        record_data_file_path = os.path.join(self.record_data_floder_path, 'new_minute_record_data.csv')
+
+        # 筛选出后面价格低于第一次价格的数据，记录每小时清空一次
+        record_store = get_record_store(record_data_file_path, FIRST_PRICE_RECORD_COLUMNS, reset='hour')
+        record_data = record_store.load(self.datetime)
+
+        filtered_data, record_data = self.filter_and_update_func_1_data(A2B_data.copy(),
+                                                                        record_data)
+        if not record_data.empty:
+            record_data.dropna(inplace=True)
+            record_store.save(record_data, self.datetime)
+
+        if filtered_data.empty:
+            logger.info('当前时刻没有满足条件：筛选出后面价格低于第一次价格的数据')
+            return
+
         if combined_data.empty:
             logger.info('当前没有满足所有条件的数据')
             return
 
         # 筛选出前小时异常次数小于等于3次的数据
-        record_data_file_path = os.path.join(PROJECT_ROOT_PATH, 'function_handler', 'record_data',
-                                             'new_minute_record_data_cnt.csv')
-        try:
-            record_data = pd.read_csv(record_data_file_path, encoding='utf-8')
-            last_modified_datetime = datetime.fromtimestamp(os.path.getmtime(record_data_file_path))
-        except FileNotFoundError:
-            record_data = pd.DataFrame(columns=['coin_name', 'spider_web', 'cnt', 'lasted_price'])
-            last_modified_datetime = self.datetime
-
-        if self.datetime.minute == 0 or last_modified_datetime.hour != datetime.now().hour:
-            try:
-                os.remove(record_data_file_path)
-            except FileNotFoundError:
-                pass
-            record_data = pd.DataFrame(columns=['coin_name', 'spider_web', 'cnt', 'lasted_price'])
-        record_data['lasted_price'] = record_data['lasted_price'].apply(Decimal)
+        record_data_file_path = os.path.join(self.record_data_floder_path, 'new_minute_record_data_cnt.csv')
+        record_store = get_record_store(record_data_file_path, CNT_RECORD_COLUMNS, reset='hour')
+        record_data = record_store.load(self.datetime)
 
         filter_data, record_data = self.filter_cnt_lt_3_on_condition_1(combined_data.copy(),
                                                                        record_data.copy())
 
         if not record_data.empty:
             record_data.dropna(inplace=True, how='any')
-            record_data.to_csv(record_data_file_path, index=False, mode='w', header=True)
+            record_store.save(record_data, self.datetime)
         if filtered_data.empty:
             logger.info('当前没有满足所有条件的数据')
             return
@@ -567,8 +490,7 @@ class NewMinuteFunctionHandler(FunctionHandler):
         columns = coin_name spider_web time_A time_B lasted_price_C_minute lasted_price_C_hour first_record_time  cnt
         :return:
         """
-        minute_and_hour_cnt_file_path = os.path.join(PROJECT_ROOT_PATH, 'function_handler', 'record_data',
-                                                     'new_minute_and_hour_cnt_le5.csv')
+        minute_and_hour_cnt_file_path = os.path.join(self.record_data_floder_path, 'new_minute_and_hour_cnt_le5.csv')
         logger.info('开始执行每分钟函数3：add_filte_in_minute_and_hour')
         data = self.price_comparison_results[f'{self.func_1.__name__}'].copy()
 
@@ -582,7 +504,7 @@ class NewMinuteFunctionHandler(FunctionHandler):
             logger.info("无结果")
             return
         self.price_comparison_results[f'{self.add_filte_in_minute_and_hour.__name__}'] = result_data.copy()
-        send_email("[分钟]小时-分钟记录——V2", result_data.to_string(index=False), False)
+        self.email_sender("[分钟]小时-分钟记录——V2", result_data.to_string(index=False), False)
 
 
 if __name__ == '__main__':
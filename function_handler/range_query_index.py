@@ -0,0 +1,137 @@
+import os
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from data_process import fixed_point
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'range_query_index.log'))
+
+GROUP_COLUMNS = ['coin_name', 'spider_web']
+
+
+class GroupedSparseTable:
+    """
+    按(币种, 时间)排序后的数值稀疏表，同一币种的数据在数组中连续且按时间升序。
+    max_table[k][i]为[i, i + 2**k)内的最大值，任意区间的最大值只需要查两次表。
+    数值转换为定点数后比较，结果与Decimal比较一致。
+    """
+
+    def __init__(self, data: pd.DataFrame, value_column: str, group_columns: list = None,
+                 time_column: str = 'time', with_min: bool = False):
+        """
+        :param data: 包含币种、数值、时间的数据
+        :param value_column: 建立索引的数值字段
+        :param group_columns: 分组字段，默认为coin_name和spider_web
+        :param time_column: 时间字段
+        :param with_min: 是否同时建立最小值的稀疏表
+        """
+        self.group_columns = list(group_columns or GROUP_COLUMNS)
+        data = data[data[value_column].notna() & data[time_column].notna()]
+        data = data.sort_values(self.group_columns + [time_column], kind='mergesort')
+
+        self.groups = pd.MultiIndex.from_frame(data[self.group_columns].drop_duplicates())
+        group_ids = self.groups.get_indexer(pd.MultiIndex.from_frame(data[self.group_columns]))
+        times = pd.to_datetime(data[time_column]).to_numpy(dtype='datetime64[ns]')
+        # 组合键为 分组编号 * span + 时间排名，整个数组按组合键升序，一次searchsorted即可定位所有查询。
+        # 用时间排名而不是纳秒数，币种多、时间跨度长时也不会超出int64
+        self.unique_times, time_ranks = np.unique(times, return_inverse=True)
+        self.span = len(self.unique_times) + 1
+        self.keys = group_ids.astype(np.int64) * self.span + time_ranks.reshape(-1)
+        boundaries = np.flatnonzero(np.r_[True, group_ids[1:] != group_ids[:-1]]) if len(group_ids) else []
+        self.group_start = np.asarray(boundaries, dtype=np.int64)
+        self.group_end = np.r_[self.group_start[1:], len(group_ids)].astype(np.int64)
+
+        values = fixed_point.encode(data[value_column].to_numpy())
+        self.scale = values.scale
+        self.max_table = [values.mantissa]
+        self.min_table = [values.mantissa] if with_min else None
+        length = 1
+        while length * 2 <= len(values):
+            last_max = self.max_table[-1]
+            self.max_table.append(np.maximum(last_max[:-length], last_max[length:]))
+            if with_min:
+                last_min = self.min_table[-1]
+                self.min_table.append(np.minimum(last_min[:-length], last_min[length:]))
+            length *= 2
+
+    def is_empty(self) -> bool:
+        return len(self.group_start) == 0
+
+    def get_group_ids(self, keys: pd.DataFrame) -> np.ndarray:
+        """每个查询所属的分组编号，数据中没有该币种时为-1"""
+        return self.groups.get_indexer(pd.MultiIndex.from_frame(keys[self.group_columns]))
+
+    def search_times(self, group_ids: np.ndarray, times, side: str = 'left') -> np.ndarray:
+        """
+        查询时间在所属分组中的位置(整个数组中的下标)，与在分组的时间上searchsorted(side=side)相同。
+        side='left'时排在时间<查询时间的K线之后，side='right'时排在时间<=查询时间的K线之后
+        """
+        query_times = pd.to_datetime(pd.Series(np.asarray(times))).to_numpy(dtype='datetime64[ns]')
+        query_ranks = np.searchsorted(self.unique_times, query_times, side=side)
+        query_keys = np.asarray(group_ids, dtype=np.int64) * self.span + query_ranks
+        return np.searchsorted(self.keys, query_keys, side='left').astype(np.int64)
+
+    def range_max(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """[start, end)区间内的最大值(mantissa)，区间必须非空"""
+        level = np.floor(np.log2(ends - starts)).astype(np.int64)
+        result = np.empty(len(starts), dtype=self.max_table[0].dtype)
+        for k in np.unique(level):
+            mask = level == k
+            table = self.max_table[k]
+            result[mask] = np.maximum(table[starts[mask]], table[ends[mask] - (1 << k)])
+        return result
+
+
+class WindowMaxIndex(GroupedSparseTable):
+    """
+    时间窗口内最大值的批量查询，例如A、B时刻前6小时(天)内满足条件的K线的最高开盘价。
+    需要先筛选出满足条件的K线(如跌幅<=-2.5%)再建立索引，
+    “窗口内存在满足条件且价格>=Y的K线”等价于“窗口内满足条件的K线的最高价格>=Y”。
+    """
+
+    def window_max_ge(self, keys: pd.DataFrame, starts, ends, thresholds) -> np.ndarray:
+        """
+        批量查询[start, end)时间窗口内的最大值是否大于等于threshold，窗口内没有数据时为False
+        :param keys: 每个查询的分组字段
+        :param starts: 窗口开始时间(包含)
+        :param ends: 窗口结束时间(不包含)
+        :param thresholds: 每个查询的阈值
+        :return: 布尔数组
+        """
+        result = np.zeros(len(keys), dtype=bool)
+        if len(keys) == 0 or self.is_empty():
+            return result
+        group_ids = self.get_group_ids(keys)
+        found = np.flatnonzero(group_ids >= 0)
+        if found.size == 0:
+            return result
+        group_ids = group_ids[found]
+        start_positions = self.search_times(group_ids, np.asarray(starts)[found], side='left')
+        end_positions = self.search_times(group_ids, np.asarray(ends)[found], side='left')
+        _, ceil_limits = fixed_point.integer_limits(np.asarray(thresholds, dtype=object)[found], self.scale)
+
+        not_empty = start_positions < end_positions
+        conform = np.zeros(len(found), dtype=bool)
+        if not_empty.any():
+            window_max = self.range_max(start_positions[not_empty], end_positions[not_empty])
+            conform[not_empty] = window_max >= ceil_limits[not_empty]
+        result[found] = conform
+        return result
+
+
+if __name__ == '__main__':
+    test_data = pd.DataFrame({
+        'coin_name': ['BTC'] * 5,
+        'spider_web': ['binance'] * 5,
+        'open': [Decimal('100'), Decimal('98'), Decimal('97'), Decimal('99.5'), Decimal('96')],
+        'time': pd.date_range('2024-11-04 01:00:00', periods=5, freq='h')
+    })
+    index = WindowMaxIndex(test_data, 'open')
+    query = pd.DataFrame({'coin_name': ['BTC', 'BTC'], 'spider_web': ['binance', 'binance']})
+    print(index.window_max_ge(query, pd.to_datetime(['2024-11-04 02:00:00', '2024-11-04 03:00:00']),
+                              pd.to_datetime(['2024-11-04 05:00:00', '2024-11-04 05:00:00']),
+                              [Decimal('99.5'), Decimal('99.6')]))
@@ -0,0 +1,515 @@
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+from config import ConfigHandler
+from data_process import fixed_point
+from function_handler.ab_pair_engine import build_ab_pairs, find_first_ab_pairs, take_ab_pairs
+from function_handler.dip_recover_index import DipRecoverIndex
+from function_handler.range_query_index import WindowMaxIndex
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'rule_engine.log'))
+
+KEY_COLUMNS = ['coin_name', 'spider_web']
+# C时刻的条件中可以引用的阈值：前pre_window个单位时间开盘价、收盘价的最小值
+PRE_MIN_LOW = 'pre_min_low'
+# A、B时刻的条件中引用C时刻字段的前缀，例如C.open
+C_PREFIX = 'C.'
+# 各类条件的估计代价：与常数比较最便宜，引用C时刻字段需要按币种对齐，前n小时最小值需要读取K线并分组计算
+PREDICATE_COSTS = {'constant': 1, 'C': 2, PRE_MIN_LOW: 4}
+# 不在其他数据源分组中的币种都属于other
+OTHER_SOURCE = 'other'
+# exists: 每个币种只找出一个满足全部条件的AB组合；full: 列出全部AB组合
+RULE_MODES = ('exists', 'full')
+UNIT_NAMES = {'hour': '小时', 'day': '天'}
+
+
+def parse_number(name: str, text) -> Decimal:
+    """配置中的数值直接由字符串转换为Decimal，不经过float"""
+    try:
+        return Decimal(str(text).strip())
+    except (InvalidOperation, ValueError):
+        raise ValueError(f'规则配置{name}不是数值: {text}')
+
+
+class Predicate:
+    """
+    一个比较条件: 字段 comparison 阈值。
+    阈值为常数、C时刻的字段(C.open)或者前n小时最小值(pre_min_low)，按币种对齐后逐行比较，阈值为空的行不满足条件。
+    同时记录执行时的计算行数和通过行数，用于估计选择率。
+    """
+
+    def __init__(self, column: str, text: str):
+        """
+        :param column: 比较的字段
+        :param text: "运算符 阈值"，例如"lt 0"、"ge C.open"、"lt pre_min_low"
+        """
+        parts = str(text or '').split()
+        if len(parts) != 2 or parts[0] not in fixed_point.COMPARISON_OPERATORS:
+            raise ValueError(f'无法解析条件{column}: {text}，格式应为"运算符 阈值"')
+        self.column = column
+        self.comparison, operand = parts
+        if operand == PRE_MIN_LOW:
+            self.kind, self.operand = PRE_MIN_LOW, operand
+        elif operand.startswith(C_PREFIX):
+            self.kind, self.operand = 'C', operand[len(C_PREFIX):]
+        else:
+            self.kind, self.operand = 'constant', parse_number(column, operand)
+        self.evaluated = 0
+        self.passed = 0
+
+    @property
+    def signature(self) -> tuple:
+        return self.column, self.comparison, self.kind, str(self.operand)
+
+    @property
+    def cost(self) -> int:
+        return PREDICATE_COSTS[self.kind]
+
+    @property
+    def selectivity(self) -> float:
+        """通过率的估计值，没有执行过时为0.5"""
+        return (self.passed + 1) / (self.evaluated + 2)
+
+    @property
+    def rank(self) -> float:
+        """
+        合取条件的执行顺序按rank升序：代价越低、过滤掉的行越多越先执行。
+        cost / (1 - selectivity)为每过滤掉一行的代价
+        """
+        return self.cost / max(1 - self.selectivity, 1e-6)
+
+    def evaluate(self, data: pd.DataFrame, operands=None) -> np.ndarray:
+        """
+        :param operands: 与data逐行对齐的阈值，阈值为常数时为空
+        :return: 布尔数组
+        """
+        values = data[self.column].to_numpy(dtype=object)
+        compare_operator = fixed_point.COMPARISON_OPERATORS[self.comparison]
+        valid = ~pd.isna(values)
+        if operands is None:
+            operands = self.operand
+        else:
+            valid &= ~pd.isna(operands)
+            operands = operands[valid]
+        result = np.zeros(len(values), dtype=bool)
+        if valid.any():
+            result[valid] = np.asarray(compare_operator(values[valid], operands), dtype=bool)
+        return result
+
+    def __repr__(self):
+        operand = f'{C_PREFIX}{self.operand}' if self.kind == 'C' else self.operand
+        return f'{self.column} {self.comparison} {operand}'
+
+
+class RulePlan:
+    """
+    由一条规则配置编译得到的执行计划，分为四个阶段：
+    1. C时刻: 当前数据逐币种的合取条件
+    2. A、B时刻: A到B范围内每根K线都需满足的合取条件，之后按价格比较组成AB组合，并去掉废弃的B
+    3. 按数据源分组的条件: A或者B虚降大于跌幅的倍数 / A、B之前存在大跌，两者满足其一
+    4. 按数据源分组的国际时间(8点)跌涨幅
+    前两个阶段的结果以输入条件的签名为键，签名相同的规则共享同一份结果。
+    mode为exists时后三个阶段合并为逐币种的搜索，每个币种找到第一个满足全部条件的AB组合后即停止；
+    结果需要全部AB组合时(例如按AB时刻记录次数)配置为full。
+    """
+
+    def __init__(self, name: str, spec: dict):
+        """
+        :param name: 规则名称
+        :param spec: config.xml中<rules>下该规则的配置
+        """
+        if not isinstance(spec, dict):
+            raise ValueError(f'规则{name}的配置为空')
+        self.name = name
+        self.spec = spec
+        self.mode = spec.get('mode') or 'exists'
+        if self.mode not in RULE_MODES:
+            raise ValueError(f'规则{name}不支持的模式: {self.mode}，应为{RULE_MODES}')
+        self.unit_time = spec.get('unit_time') or 'hour'
+        if self.unit_time not in UNIT_NAMES:
+            raise ValueError(f'规则{name}不支持的时间单位: {self.unit_time}')
+        self.window = int(parse_number('window', spec.get('window')))
+        self.history = int(parse_number('history', spec.get('history') or 0))
+        self.pre_window = int(parse_number('pre_window', spec.get('pre_window') or 0))
+
+        self.C_predicates = [Predicate(column, text) for column, text in (spec.get('C') or {}).items()]
+        self.AB_predicates = [Predicate(column, text) for column, text in (spec.get('AB') or {}).items()]
+        if any(predicate.kind == 'C' for predicate in self.C_predicates):
+            raise ValueError(f'规则{name}中C时刻的条件不能引用C时刻的字段')
+        if any(predicate.kind == PRE_MIN_LOW for predicate in self.AB_predicates):
+            raise ValueError(f'规则{name}中A、B时刻的条件不能引用{PRE_MIN_LOW}')
+        if any(predicate.kind == PRE_MIN_LOW for predicate in self.C_predicates) and self.pre_window <= 0:
+            raise ValueError(f'规则{name}引用了{PRE_MIN_LOW}，需要配置pre_window')
+
+        pair = str(spec.get('pair') or '').split()
+        if len(pair) != 3 or pair[1] not in fixed_point.COMPARISON_OPERATORS:
+            raise ValueError(f'无法解析规则{name}的pair: {spec.get("pair")}，格式应为"字段 运算符 倍率"')
+        self.pair = (pair[0], pair[1], parse_number('pair', pair[2]))
+        self.after_B = parse_number('after_B', spec['after_B']) if spec.get('after_B') else None
+
+        # {数据源分组: {配置名: (配置字符串, Decimal)}}，配置字符串用于生成条件说明
+        self.sources = {}
+        for source, source_spec in (spec.get('sources') or {}).items():
+            self.sources[source] = {key: (str(value), parse_number(f'{source}.{key}', value))
+                                    for key, value in (source_spec or {}).items()}
+        self.lock = Lock()
+
+    @property
+    def unit(self) -> timedelta:
+        return timedelta(**{f'{self.unit_time}s': 1})
+
+    @property
+    def C_signature(self) -> tuple:
+        return self.unit_time, self.pre_window, tuple(sorted(predicate.signature for predicate in self.C_predicates))
+
+    @property
+    def bars_signature(self) -> tuple:
+        return (self.C_signature, self.window, self.history,
+                tuple(sorted(predicate.signature for predicate in self.AB_predicates)))
+
+    @property
+    def pairs_signature(self) -> tuple:
+        return self.bars_signature, self.pair, self.after_B
+
+    def order(self, predicates: list) -> list:
+        """按估计的代价和选择率排列合取条件"""
+        with self.lock:
+            return sorted(predicates, key=lambda predicate: predicate.rank)
+
+    def record(self, predicate: Predicate, evaluated: int, passed: int):
+        with self.lock:
+            predicate.evaluated += evaluated
+            predicate.passed += passed
+
+    def describe(self) -> str:
+        C_predicates = ', '.join(map(repr, self.order(self.C_predicates)))
+        AB_predicates = ', '.join(map(repr, self.order(self.AB_predicates)))
+        return (f'{self.name}({self.mode}): C[{C_predicates}] -> AB[{AB_predicates}] -> pair[{" ".join(map(str, self.pair))}] '
+                f'-> after_B[{self.after_B}] -> sources{list(self.sources)}')
+
+
+class RuleEngine:
+    """
+    执行config.xml中<rules>下定义的规则。每条规则编译为RulePlan后缓存，配置变化时重新编译。
+    同一个tick中的中间结果(K线、前n小时最小值、满足C条件的数据、AB组合)通过函数处理器的get_shared共享，
+    签名相同的部分在多条规则、多个函数处理器之间只计算一次。
+    合取条件的执行顺序根据代价和之前执行时统计的通过率决定，越早过滤掉越多的行越好，结果与顺序无关。
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: rules: 规则配置{规则名: 配置}，为空时每次执行从config_handler中读取
+                       config_handler: 读取规则配置的ConfigHandler，默认读取项目根目录的config.xml
+                       source_coins: {数据源分组: 币种集合}，默认binance分组为data/binance_coins_USDT.csv中的币种
+        """
+        self.rules = kwargs.get('rules', None)
+        self.config_handler = kwargs.get('config_handler', None)
+        if self.rules is None and self.config_handler is None:
+            self.config_handler = ConfigHandler(file_path=os.path.join(PROJECT_ROOT_PATH, 'config.xml'))
+            self.config_handler.load_config()
+        self.source_coins = kwargs.get('source_coins', None)
+        if self.source_coins is None:
+            with open(os.path.join(PROJECT_ROOT_PATH, 'data', 'binance_coins_USDT.csv'), 'r') as file:
+                self.source_coins = {'binance': set(file.read().splitlines())}
+        # {规则名: RulePlan}
+        self.plans = {}
+        self.lock = Lock()
+
+    def get_rules(self) -> dict:
+        if self.rules is not None:
+            return self.rules
+        return self.config_handler.get_rules()
+
+    def compile(self, name: str) -> RulePlan:
+        """获取规则的执行计划，配置没有变化时沿用之前的计划(以及统计的通过率)"""
+        spec = self.get_rules().get(name)
+        if spec is None:
+            raise ValueError(f'config.xml中没有规则{name}')
+        with self.lock:
+            plan = self.plans.get(name)
+            if plan is None or plan.spec != spec:
+                plan = self.plans[name] = RulePlan(name, spec)
+                logger.info(f'编译规则 {plan.describe()}')
+            return plan
+
+    @staticmethod
+    def read_bars(handler, unit_time: str, start_datetime: datetime, end_datetime: datetime) -> pd.DataFrame:
+        """[start_datetime, end_datetime]内的K线，返回副本"""
+        if unit_time == 'hour':
+            return handler.read_range_data_hours(start_datetime, end_datetime, 'both')
+        return handler.get_shared('range_data_days', (start_datetime, end_datetime), lambda: (
+            handler.csv_reader.get_data_between_days(start_datetime, end_datetime, 'both'))).copy()
+
+    @staticmethod
+    def get_pre_min_low(handler, unit_time: str, start_datetime: datetime, end_datetime: datetime) -> pd.Series:
+        if unit_time == 'hour':
+            return handler.get_shared_pre_hours_min_low(start_datetime, end_datetime, dropna=False)
+        return handler.get_shared('pre_days_min_low', (start_datetime, end_datetime), lambda: (
+            handler.get_pre_hours_min_low(RuleEngine.read_bars(handler, unit_time, start_datetime, end_datetime))))
+
+    @staticmethod
+    def align(series: pd.Series, data: pd.DataFrame) -> np.ndarray:
+        """按(coin_name, spider_web)将series对齐到data的每一行，没有对应值的为空"""
+        return series.reindex(pd.MultiIndex.from_frame(data[KEY_COLUMNS])).to_numpy(dtype=object)
+
+    @staticmethod
+    def filter_by_keys(data: pd.DataFrame, keys: pd.DataFrame) -> pd.DataFrame:
+        """只保留keys中存在的币种，保持原来的顺序"""
+        index = pd.MultiIndex.from_frame(data[KEY_COLUMNS])
+        return data[index.isin(pd.MultiIndex.from_frame(keys[KEY_COLUMNS]))]
+
+    def apply_predicates(self, plan: RulePlan, predicates: list, data: pd.DataFrame, references: dict):
+        """
+        依次执行合取条件，每个条件只计算前面的条件保留下来的行，没有数据时提前结束
+        :param references: {引用名: 返回以币种为索引的Series的函数}，用到时才计算
+        """
+        for predicate in plan.order(predicates):
+            if data.empty:
+                break
+            operands = None
+            if predicate.kind != 'constant':
+                reference = PRE_MIN_LOW if predicate.kind == PRE_MIN_LOW else predicate.operand
+                operands = self.align(references[reference](), data)
+            mask = predicate.evaluate(data, operands)
+            plan.record(predicate, len(mask), int(mask.sum()))
+            data = data[mask]
+        return data
+
+    def run_C_stage(self, plan: RulePlan, handler) -> pd.DataFrame:
+        """满足C时刻条件的当前数据"""
+        cur_datetime = handler.datetime
+        pre_range = (cur_datetime - plan.pre_window * plan.unit, cur_datetime - plan.unit)
+        references = {PRE_MIN_LOW: lambda: self.get_pre_min_low(handler, plan.unit_time, *pre_range)}
+        return self.apply_predicates(plan, plan.C_predicates, handler.data.copy(), references).copy()
+
+    def run_bars_stage(self, plan: RulePlan, handler, C_data: pd.DataFrame):
+        """
+        A到B范围内满足A、B时刻条件的K线(按币种、时间排序)，以及满足C条件的币种的全部K线
+        :return: (A2B_data, total_data)
+        """
+        cur_datetime = handler.datetime
+        A_datetime = cur_datetime - plan.window * plan.unit
+        B_datetime = cur_datetime - plan.unit
+        total_data = self.read_bars(handler, plan.unit_time, A_datetime - plan.history * plan.unit, B_datetime)
+        total_data = self.filter_by_keys(total_data, C_data)
+        A2B_data = total_data[total_data['time'].between(A_datetime, B_datetime, inclusive='both')]
+
+        C_values = C_data.drop_duplicates(subset=KEY_COLUMNS).set_index(KEY_COLUMNS)
+        references = {column: (lambda column=column: C_values[column]) for column in C_values.columns}
+        A2B_data = self.apply_predicates(plan, plan.AB_predicates, A2B_data, references)
+        A2B_data = A2B_data.sort_values(KEY_COLUMNS + ['time'], kind='mergesort').reset_index(drop=True)
+        return A2B_data, total_data
+
+    def run_pairs_stage(self, plan: RulePlan, A2B_data: pd.DataFrame, total_data: pd.DataFrame,
+                        C_data: pd.DataFrame) -> pd.DataFrame:
+        """全部满足价格比较且B时刻未废弃的AB组合，带C时刻的coin_price"""
+        column, comparison, magnification = plan.pair
+        A2B_data = build_ab_pairs(A2B_data, column, magnification, comparison)
+        A2B_data = A2B_data[~self.get_invalid_B(plan, A2B_data, total_data)].reset_index(drop=True)
+        return A2B_data.merge(C_data[KEY_COLUMNS + ['coin_price']], on=KEY_COLUMNS, how='inner')
+
+    def get_invalid_B(self, plan: RulePlan, data: pd.DataFrame, total_data: pd.DataFrame,
+                      suffix: str = '_B') -> np.ndarray:
+        """某一个B时刻后面存在一个开盘价低于B时刻`最低价*(虚降 * after_B + 1)`的时刻，之后又高于此价格，则该B废弃"""
+        if plan.after_B is None or data.empty:
+            return np.zeros(len(data), dtype=bool)
+        compare_price = data[f'low{suffix}'] * (data[f'virtual_drop{suffix}'] * plan.after_B + Decimal(1))
+        return DipRecoverIndex(total_data).dip_then_recover(data, data[f'time{suffix}'], compare_price)
+
+    def get_source_groups(self, plan: RulePlan, data: pd.DataFrame) -> dict:
+        """按数据源分组，配置的顺序即结果的顺序"""
+        groups, assigned = {}, np.zeros(len(data), dtype=bool)
+        for source in plan.sources:
+            if source == OTHER_SOURCE:
+                continue
+            mask = data['coin_name'].isin(self.source_coins.get(source, set())).to_numpy() & ~assigned
+            groups[source] = data[mask]
+            assigned |= mask
+        if OTHER_SOURCE in plan.sources:
+            groups[OTHER_SOURCE] = data[~assigned]
+        return {source: groups[source] for source in plan.sources}
+
+    @staticmethod
+    def get_international_time(cur_datetime: datetime) -> datetime:
+        """国际时间：大于等于当天8点时为当天的8点，否则为前一天的8点"""
+        international_time = cur_datetime.replace(hour=8, minute=0)
+        if cur_datetime < international_time:
+            international_time -= timedelta(days=1)
+        return international_time
+
+    def get_source_conditions(self, plan: RulePlan, source: str, data: pd.DataFrame, total_data: pd.DataFrame,
+                              suffixes: tuple = ('_A', '_B')) -> list:
+        """
+        数据源分组的条件，两个条件满足其一即可：
+        (1) 虚降 >= 跌幅的MAGNIFICATION倍，且跌幅 <= CHANGE
+        (2) 之前BEFORE_WINDOW个单位时间内存在跌幅 < BEFORE_CHANGE的时刻，且该时刻的价格 >= 该时刻`max(收盘价, 开盘价)`
+        :param suffixes: 对AB组合为('_A', '_B')，任一时刻满足即可；对K线为('',)
+        :return: [(条件说明, 布尔数组)]，只包含配置了的条件
+        """
+        config = plan.sources[source]
+        conditions = []
+        if 'CHANGE' in config and 'MAGNIFICATION' in config:
+            (change_text, change), (magnification_text, magnification) = config['CHANGE'], config['MAGNIFICATION']
+            condition_1 = np.zeros(len(data), dtype=bool)
+            for suffix in suffixes:
+                data_change = data[f'change{suffix}']
+                condition_1 |= ((data_change <= change) & (
+                        data[f'virtual_drop{suffix}'] >= data_change.abs() * magnification)).to_numpy(dtype=bool)
+            conditions.append((f'A或者B虚降大于{magnification_text}倍跌幅，且跌幅 <= {change_text}({source})%',
+                               condition_1))
+        if 'BEFORE_CHANGE' in config and 'BEFORE_WINDOW' in config:
+            (before_change_text, before_change), (before_window_text, before_window) = (config['BEFORE_CHANGE'],
+                                                                                        config['BEFORE_WINDOW'])
+            before_window = int(before_window) * plan.unit
+            before_change_data = total_data[total_data['change'] < before_change]
+            window_max_price_index = WindowMaxIndex(before_change_data, 'coin_price')
+            condition_2 = np.zeros(len(data), dtype=bool)
+            for suffix in suffixes:
+                condition_2 |= window_max_price_index.window_max_ge(
+                    data, data[f'time{suffix}'] - before_window, data[f'time{suffix}'],
+                    np.maximum(data[f'open{suffix}'].to_numpy(), data[f'close{suffix}'].to_numpy()))
+            conditions.append((f'A/B前{before_window_text}{UNIT_NAMES[plan.unit_time]}跌幅<{before_change_text}%,'
+                               f'该时刻的开盘价>=A/B时刻`max(开盘, 收盘)`{source}', condition_2))
+        return conditions
+
+    def get_international_mask(self, plan: RulePlan, source: str, data: pd.DataFrame, base_price: np.ndarray,
+                               total_data: pd.DataFrame, cur_datetime: datetime) -> np.ndarray:
+        """当前价格base_price相较于国际时间价格的跌涨幅 <= INTERNATIONAL_CHANGE，没有配置时全部满足"""
+        conform = np.ones(len(data), dtype=bool)
+        if 'INTERNATIONAL_CHANGE' not in plan.sources[source] or data.empty:
+            return conform
+        threshold = plan.sources[source]['INTERNATIONAL_CHANGE'][1]
+        international_data = total_data[total_data['time'] == self.get_international_time(cur_datetime)]
+        international_price = international_data.drop_duplicates(subset=KEY_COLUMNS, keep='last').set_index(
+            KEY_COLUMNS)['coin_price']
+        open_price = self.align(international_price, data)
+        valid = ~pd.isna(open_price) & ~pd.isna(base_price)
+        conform[:] = False
+        if valid.any():
+            conform[valid] = fixed_point.compare_ratio(
+                fixed_point.change_numerator(open_price[valid], base_price[valid]), open_price[valid], 'le', threshold)
+        return conform
+
+    def filter_by_sources(self, plan: RulePlan, A2B_data: pd.DataFrame, total_data: pd.DataFrame,
+                          cur_datetime: datetime) -> pd.DataFrame:
+        """
+        按数据源分组筛选全部AB组合，每个条件的结果依次拼接，condition字段为满足的条件；
+        同时满足两个条件的组合出现两次。没有配置数据源分组时不筛选
+        """
+        if not plan.sources:
+            return A2B_data.copy()
+        results = []
+        for source, source_data in self.get_source_groups(plan, A2B_data).items():
+            international = self.get_international_mask(plan, source, source_data,
+                                                        source_data['coin_price'].to_numpy(dtype=object),
+                                                        total_data, cur_datetime)
+            conditions = self.get_source_conditions(plan, source, source_data, total_data)
+            if not conditions:
+                results.append(source_data[international])
+            for label, condition in conditions:
+                conform_data = source_data[condition & international].copy()
+                conform_data['condition'] = label
+                results.append(conform_data)
+        return pd.concat(results, ignore_index=True)
+
+    def find_witnesses(self, plan: RulePlan, A2B_data: pd.DataFrame, total_data: pd.DataFrame,
+                       C_data: pd.DataFrame, cur_datetime: datetime) -> pd.DataFrame:
+        """
+        每个币种只找出第一个(按A、B时间)满足全部条件的AB组合。
+        B时刻的废弃、数据源分组的条件和国际时间的跌涨幅都可以分解为A或B时刻K线各自的条件，
+        先对每根K线计算一次，再在逐币种搜索AB组合时判断，找到后该币种不再继续，不需要列出全部组合。
+        满足的币种与full模式相同；组合为满足(1)或(2)的第一个组合，满足(1)时condition为(1)
+        """
+        row_count = len(A2B_data)
+        B_valid = ~self.get_invalid_B(plan, A2B_data, total_data, suffix='')
+        C_price = C_data.drop_duplicates(subset=KEY_COLUMNS).set_index(KEY_COLUMNS)['coin_price']
+        base_price = self.align(C_price, A2B_data)
+        # 不属于任何数据源分组的币种不满足条件
+        international = np.zeros(row_count, dtype=bool) if plan.sources else np.ones(row_count, dtype=bool)
+        unconditioned = ~international
+        # 每根K线满足的第1、第2个条件及其说明
+        condition_flags = [np.zeros(row_count, dtype=bool), np.zeros(row_count, dtype=bool)]
+        condition_labels = [np.full(row_count, None, dtype=object), np.full(row_count, None, dtype=object)]
+        for source, source_data in self.get_source_groups(plan, A2B_data).items():
+            positions = source_data.index.to_numpy()
+            international[positions] = self.get_international_mask(plan, source, source_data, base_price[positions],
+                                                                   total_data, cur_datetime)
+            conditions = self.get_source_conditions(plan, source, source_data, total_data, suffixes=('',))
+            unconditioned[positions] = not conditions
+            for slot, (label, condition) in enumerate(conditions):
+                condition_flags[slot][positions] = condition
+                condition_labels[slot][positions] = label
+
+        def accept(A_index, B_index):
+            qualified = unconditioned[A_index].copy()
+            for flags in condition_flags:
+                qualified |= flags[A_index] | flags[B_index]
+            return B_valid[B_index] & international[A_index] & qualified
+
+        column, comparison, magnification = plan.pair
+        group_ids = A2B_data.groupby(KEY_COLUMNS, sort=False).ngroup().to_numpy()
+        A_index, B_index = find_first_ab_pairs(A2B_data[column].to_numpy(), group_ids, magnification, comparison,
+                                               accept)
+        witnesses = take_ab_pairs(A2B_data, A_index, B_index, KEY_COLUMNS)
+        witnesses = witnesses.merge(C_data[KEY_COLUMNS + ['coin_price']], on=KEY_COLUMNS, how='inner')
+        if not unconditioned.all():
+            first_condition = condition_flags[0][A_index] | condition_flags[0][B_index]
+            witnesses['condition'] = np.where(first_condition, condition_labels[0][A_index],
+                                              condition_labels[1][A_index])
+        if not plan.sources:
+            return witnesses
+        return pd.concat(list(self.get_source_groups(plan, witnesses).values()), ignore_index=True)
+
+    def run(self, name: str, handler, enumerate_all: bool = False) -> pd.DataFrame:
+        """
+        对函数处理器当前的数据(C时刻)执行规则
+        :param handler: 提供data、datetime以及K线读取和共享中间结果的函数处理器
+        :param enumerate_all: 为True时不论规则的模式都列出全部AB组合，用于排查问题
+        :return: 满足全部条件的AB组合，没有时为空的DataFrame
+        """
+        plan = self.compile(name)
+        if handler.data is None or handler.data.empty:
+            logger.info(f'{name}: C数据为空')
+            return pd.DataFrame()
+        # 同一个tick中不同的函数处理器可能使用不同的当前数据，共享的键中需要区分
+        data_key = (handler.datetime, id(handler.data))
+        C_data = handler.get_shared('rule_C_data', (data_key, plan.C_signature),
+                                    lambda: self.run_C_stage(plan, handler))
+        if C_data.empty:
+            logger.info(f'{name}: 没有满足C时刻条件的数据')
+            return pd.DataFrame()
+
+        A2B_data, total_data = handler.get_shared('rule_AB_bars', (data_key, plan.bars_signature),
+                                                  lambda: self.run_bars_stage(plan, handler, C_data))
+        if A2B_data.empty:
+            logger.info(f'{name}: 没有满足A、B时刻条件的数据')
+            return pd.DataFrame()
+
+        if plan.mode == 'exists' and not enumerate_all:
+            return self.find_witnesses(plan, A2B_data, total_data, C_data, handler.datetime)
+        A2B_data = handler.get_shared('rule_AB_pairs', (data_key, plan.pairs_signature),
+                                      lambda: self.run_pairs_stage(plan, A2B_data, total_data, C_data))
+        if A2B_data.empty:
+            logger.info(f'{name}: 没有满足价格比较且B时刻未废弃的AB组合')
+            return pd.DataFrame()
+        return self.filter_by_sources(plan, A2B_data, total_data, handler.datetime)
+
+
+if __name__ == '__main__':
+    from dataio.csv_handler import CSVReader
+    from function_handler.functionhandler import FunctionHandler
+
+    cur_datetime = datetime(2024, 12, 4, 17, 0, 0)
+    reader = CSVReader('China')
+    handler = FunctionHandler(data=reader.get_data_between_hours(cur_datetime, cur_datetime), datetime=cur_datetime,
+                              reader=reader, writer=None)
+    engine = RuleEngine()
+    print(engine.run('new_hour_func_1', handler))
+    print(engine.compile('new_hour_func_1').describe())
@@ -0,0 +1,324 @@
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from data_process import fixed_point
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'shard_executor.log'))
+
+GROUP_COLUMNS = ['coin_name', 'spider_web']
+
+
+def _decode_text(words: np.ndarray) -> np.ndarray:
+    """(8字节的个数, 行数)的int64矩阵还原为Decimal，每一列为一个十进制字符串的字节"""
+    strings = words.T.copy().view(f'S{words.shape[0] * 8}').reshape(-1).astype(str)
+    return np.fromiter(map(Decimal, strings.tolist()), dtype=object, count=len(strings))
+
+
+class SharedFrame:
+    """
+    将DataFrame的各列转换为int64后放入同一块共享内存，形状为(字段数, 行数)。
+    Decimal列整列批量转换为定点数(data_process.fixed_point)，共享int64的mantissa，scale随描述信息传递；
+    超过int64的Decimal(如28位有效数字的派生字段)共享十进制字符串的字节；有空值时另外共享空值标记。
+    时间列保存为纳秒时间戳，字符串列保存为编码(类别列表随描述信息传递)，不能转换的列随描述信息直接序列化。
+    子进程只需要共享内存的名称和行范围即可还原出其中的一段数据。
+    子进程还原出的Decimal与原值相等，但小数位数统一为scale；每个Decimal单元格在cells中有一个编号，
+    结果中原样取自输入的Decimal以编号返回，父进程再从cells中取回原来的对象(包括原来的小数位数)。
+    """
+
+    def __init__(self, data: pd.DataFrame, cell_offset: int = 0):
+        """
+        :param data: 需要共享的数据
+        :param cell_offset: 本数据第一个Decimal单元格的编号，多个数据共用一套编号
+        """
+        self.columns = []
+        self.cells = []
+        fields = []
+        for column in data.columns:
+            values = data[column].to_numpy()
+            kind, extra = self.encode_column(values, fields)
+            if kind in ('fixed', 'text'):
+                extra = extra + (cell_offset + len(self.cells) * len(data),)
+                self.cells.append(values)
+            self.columns.append((column, kind, extra))
+        self.shape = (len(fields), len(data))
+        nbytes = max(int(np.prod(self.shape)) * 8, 1)
+        self.shared_memory = SharedMemory(create=True, size=nbytes)
+        if fields:
+            array = np.ndarray(self.shape, dtype=np.int64, buffer=self.shared_memory.buf)
+            array[:] = np.vstack(fields)
+            del array
+
+    @staticmethod
+    def encode_column(values: np.ndarray, fields: list):
+        """将一列数据转换为int64追加到fields中，返回(类型, 还原需要的信息)"""
+        if np.issubdtype(values.dtype, np.datetime64):
+            fields.append(values.astype('datetime64[ns]').view(np.int64))
+            return 'datetime', len(fields) - 1
+        if values.dtype.kind in 'iufb' and values.dtype.itemsize == 8:
+            fields.append(values.view(np.int64))
+            return 'number', (len(fields) - 1, values.dtype.str)
+        if values.dtype == object and len(values) and pd.api.types.infer_dtype(values, skipna=True) == 'decimal':
+            is_null = pd.isna(values)
+            if is_null.any():
+                values = np.where(is_null, Decimal(0), values)
+            null_field = None
+            encoded = fixed_point.encode_int64(values)
+            if encoded is not None:
+                fields.append(encoded.mantissa)
+                kind, extra = 'fixed', (len(fields) - 1, encoded.scale)
+            else:
+                strings = values.astype(str).astype('S')
+                width = -(-strings.dtype.itemsize // 8) * 8
+                words = strings.astype(f'S{width}').view(np.int64).reshape(len(values), width // 8)
+                fields.extend(words.T)
+                kind, extra = 'text', (len(fields) - width // 8, width // 8)
+            if is_null.any():
+                fields.append(is_null.astype(np.int64))
+                null_field = len(fields) - 1
+            return kind, extra + (null_field,)
+        if values.dtype == object and all(value is None or isinstance(value, str) for value in values):
+            codes, categories = pd.factorize(values)
+            fields.append(codes.astype(np.int64))
+            return 'category', (len(fields) - 1, categories.tolist())
+        return 'object', values
+
+    def get_spec(self, start: int, stop: int) -> dict:
+        """子进程还原[start, stop)行数据需要的信息"""
+        columns = [(column, kind, extra[start:stop] if kind == 'object' else extra)
+                   for column, kind, extra in self.columns]
+        return {'name': self.shared_memory.name, 'shape': self.shape, 'start': start, 'stop': stop,
+                'columns': columns}
+
+    def close(self):
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+    @staticmethod
+    def read(spec: dict, cell_ids: list = None) -> pd.DataFrame:
+        """
+        根据描述信息从共享内存中还原数据
+        :param cell_ids: 传入时追加还原出的每一列Decimal对象的(id数组, 单元格编号数组)
+        """
+        start, stop = spec['start'], spec['stop']
+        # 共享内存由父进程创建和释放，子进程只读取
+        shared_memory = SharedMemory(name=spec['name'])
+        try:
+            array = np.ndarray(spec['shape'], dtype=np.int64, buffer=shared_memory.buf)
+            result = {}
+            for column, kind, extra in spec['columns']:
+                if kind in ('fixed', 'text'):
+                    field_index, scale_or_words, null_field, cell_offset = extra
+                    if kind == 'fixed':
+                        values = fixed_point.FixedPoint(array[field_index, start:stop], scale_or_words).to_decimal()
+                    else:
+                        values = _decode_text(array[field_index:field_index + scale_or_words, start:stop])
+                    if null_field is not None:
+                        values[array[null_field, start:stop] == 1] = None
+                    if cell_ids is not None:
+                        cell_ids.append((np.fromiter(map(id, values), dtype=np.int64, count=len(values)),
+                                         np.arange(cell_offset + start, cell_offset + stop, dtype=np.int64)))
+                    result[column] = values
+                elif kind == 'datetime':
+                    result[column] = array[extra, start:stop].copy().view('datetime64[ns]')
+                elif kind == 'number':
+                    field_index, dtype = extra
+                    result[column] = array[field_index, start:stop].copy().view(dtype)
+                elif kind == 'category':
+                    field_index, categories = extra
+                    codes = array[field_index, start:stop]
+                    values = np.array(categories + [None], dtype=object)
+                    result[column] = values[np.where(codes < 0, len(categories), codes)]
+                else:
+                    result[column] = extra
+            del array
+        finally:
+            shared_memory.close()
+        return pd.DataFrame(result, columns=[column for column, _, _ in spec['columns']])
+
+
+def _to_cell_result(data: pd.DataFrame, cell_ids: list):
+    """
+    结果中原样取自输入的Decimal列换成单元格编号(空值为-1)，不再序列化Decimal对象；
+    存在新计算出的Decimal的列保持不变。输入的Decimal对象在子进程中一直存在，id不会重复
+    :param cell_ids: SharedFrame.read记录的(id数组, 单元格编号数组)
+    :return: (其他字段的数据, {字段: 单元格编号}, 原来的字段顺序)
+    """
+    cell_columns = {}
+    if cell_ids:
+        ids = np.concatenate([column_ids for column_ids, _ in cell_ids])
+        order = np.argsort(ids, kind='stable')
+        ids = ids[order]
+        cell_numbers = np.concatenate([numbers for _, numbers in cell_ids])[order]
+    for column in data.columns:
+        values = data[column].to_numpy()
+        if (not cell_ids or values.dtype != object or not len(values) or
+                pd.api.types.infer_dtype(values, skipna=True) != 'decimal'):
+            continue
+        value_ids = np.fromiter(map(id, values), dtype=np.int64, count=len(values))
+        positions = np.minimum(np.searchsorted(ids, value_ids), len(ids) - 1)
+        found = ids[positions] == value_ids
+        if not (found | pd.isna(values)).all():
+            continue
+        cell_columns[column] = np.where(found, cell_numbers[positions], -1)
+    return data.drop(columns=list(cell_columns)).reset_index(drop=True), cell_columns, list(data.columns)
+
+
+def _from_cell_result(result: tuple, cells: np.ndarray) -> pd.DataFrame:
+    """按单元格编号从父进程的cells(最后一个为None)中取回原来的Decimal对象"""
+    data, cell_columns, columns = result
+    for column, index in cell_columns.items():
+        data[column] = cells[index]
+    return data[columns]
+
+
+def _run_shard(func: Callable, specs: list, args: tuple):
+    """在子进程中执行：从共享内存还原本分片的数据后调用func，结果中的Decimal以单元格编号返回"""
+    cell_ids = []
+    frames = [SharedFrame.read(spec, cell_ids) for spec in specs]
+    return _to_cell_result(func(*frames, *args), cell_ids)
+
+
+class ShardExecutor:
+    """
+    按币种将数据分片，在进程池中分别执行同一个函数后合并结果。
+    只适用于各币种之间互不影响、且不读写处理器状态的计算(例如AB时刻的筛选)，func需要是可以被pickle的模块级函数或静态方法。
+    K线数据通过共享内存传给子进程，不做pickle；结果中原样取自输入的Decimal以单元格编号返回，其他字段直接返回，
+    合并后按sort_columns稳定排序，与不分片时的顺序一致。数据量小于min_rows或者只有一个分片时直接在当前进程中执行。
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: num_shards: 分片数，默认为CPU核数
+                       max_workers: 进程数，默认与分片数相同
+                       min_rows: 数据少于该行数时不分片，默认为20000
+                       start_method: 子进程启动方式，默认为spawn(不继承父进程的线程和锁)
+                       group_columns: 分片依据的字段，默认为coin_name和spider_web
+        """
+        self.num_shards = int(kwargs.get('num_shards') or os.cpu_count() or 1)
+        self.max_workers = int(kwargs.get('max_workers') or self.num_shards)
+        self.min_rows = int(kwargs.get('min_rows', 20000))
+        self.start_method = kwargs.get('start_method', 'spawn')
+        self.group_columns = list(kwargs.get('group_columns', GROUP_COLUMNS))
+        self.executor = None
+        self.executor_lock = Lock()
+        self.metrics = {}
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                    mp_context=get_context(self.start_method))
+            return self.executor
+
+    def shutdown(self):
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+                self.executor = None
+
+    def get_shard_ids(self, data: pd.DataFrame) -> np.ndarray:
+        """每行数据所属的分片，同一币种在任何进程中都分到同一个分片"""
+        if data.empty:
+            return np.empty(0, dtype=np.int64)
+        # 先对币种去重，只对不同的币种计算哈希
+        codes, uniques = pd.MultiIndex.from_frame(data[self.group_columns].astype(str)).factorize()
+        key_shards = np.array([zlib.crc32('|'.join(key).encode('utf-8')) % self.num_shards for key in uniques],
+                              dtype=np.int64)
+        return key_shards[codes]
+
+    def split(self, data: pd.DataFrame):
+        """按分片稳定排序，返回(排序后的数据, 每个分片的起止位置)"""
+        shard_ids = self.get_shard_ids(data)
+        order = np.argsort(shard_ids, kind='stable')
+        bounds = np.searchsorted(shard_ids[order], np.arange(self.num_shards + 1), side='left')
+        return data.iloc[order].reset_index(drop=True), bounds
+
+    def map(self, func: Callable, frames: list, *args, sort_columns: list = None):
+        """
+        将frames中的每个数据按币种分片，在子进程中执行 func(*分片后的frames, *args)，合并各分片的结果
+        :param func: 返回DataFrame的函数
+        :param frames: 同一批币种的一个或多个数据，按相同的规则分片
+        :param sort_columns: 合并后按这些字段稳定排序，默认为分片字段
+        """
+        sort_columns = self.group_columns if sort_columns is None else sort_columns
+        total_rows = sum(len(frame) for frame in frames)
+        if self.num_shards <= 1 or total_rows < self.min_rows:
+            return func(*frames, *args)
+
+        start = time.perf_counter()
+        split_frames = [self.split(frame) for frame in frames]
+        shared_frames = []
+        try:
+            cell_count = 0
+            for frame, _ in split_frames:
+                shared_frames.append(SharedFrame(frame, cell_count))
+                cell_count += len(shared_frames[-1].cells) * len(frame)
+            encode_seconds = time.perf_counter() - start
+            shard_specs = []
+            for shard in range(self.num_shards):
+                specs = [shared_frame.get_spec(int(bounds[shard]), int(bounds[shard + 1]))
+                         for shared_frame, (_, bounds) in zip(shared_frames, split_frames)]
+                if any(spec['stop'] > spec['start'] for spec in specs):
+                    shard_specs.append(specs)
+            try:
+                executor = self.get_executor()
+                futures = [executor.submit(_run_shard, func, specs, args) for specs in shard_specs]
+                cells = np.concatenate([values for shared_frame in shared_frames for values in shared_frame.cells] +
+                                       [np.array([None], dtype=object)])
+                results = [_from_cell_result(future.result(), cells) for future in futures]
+            except BrokenProcessPool:
+                logger.exception("进程池异常退出，本次改为在当前进程中执行")
+                self.shutdown()
+                return func(*frames, *args)
+        finally:
+            for shared_frame in shared_frames:
+                shared_frame.close()
+
+        results = [result for result in results if not result.empty]
+        if not results:
+            return func(*[frame.iloc[0:0] for frame in frames], *args)
+        merged = pd.concat(results, ignore_index=True)
+        if sort_columns:
+            merged = merged.sort_values(sort_columns, kind='mergesort').reset_index(drop=True)
+        self.metrics = {'rows': total_rows, 'shards': len(shard_specs), 'encode_seconds': round(encode_seconds, 3),
+                        'total_seconds': round(time.perf_counter() - start, 3)}
+        logger.info(f"{getattr(func, '__qualname__', func)}分片执行完成: {self.metrics}")
+        return merged
+
+
+if __name__ == '__main__':
+    from function_handler.ab_pair_engine import build_ab_pairs
+
+    rng = np.random.default_rng(0)
+    rows = 50000
+    bars = pd.DataFrame({
+        'coin_name': [f'coin{i % 500}' for i in range(rows)],
+        'spider_web': 'binance',
+        'time': pd.date_range('2024-10-01', periods=rows, freq='min'),
+        'close': [Decimal(str(round(value, 4))) for value in rng.uniform(1, 2, rows)],
+    })
+    # 与单进程执行的耗时对比，至少需要4个CPU核才有加速效果
+    start = time.perf_counter()
+    inline = build_ab_pairs(bars, 'close', Decimal('0.9'), 'gt')
+    inline_seconds = time.perf_counter() - start
+    shard_executor = ShardExecutor(num_shards=4, min_rows=0)
+    shard_executor.map(build_ab_pairs, [bars.head(1000)], 'close', Decimal('0.9'), 'gt')
+    start = time.perf_counter()
+    sharded = shard_executor.map(build_ab_pairs, [bars], 'close', Decimal('0.9'), 'gt')
+    sharded_seconds = time.perf_counter() - start
+    print(sharded.equals(inline), shard_executor.metrics)
+    print(f'单进程: {inline_seconds:.3f}秒, 分片: {sharded_seconds:.3f}秒, CPU核数: {os.cpu_count()}')
+    shard_executor.shutdown()
@@ -0,0 +1,107 @@
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from threading import Lock
+from typing import Callable, Literal
+
+import pandas as pd
+
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'tick_context.log'))
+
+
+class _Entry:
+    """一个中间结果，第一个请求的线程计算，其他线程等待计算完成后直接使用"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.done = False
+        self.value = None
+
+
+class TickContext:
+    """
+    一个tick中所有函数处理器共享的只读上下文：本分钟的数据、时间、读取器，以及按名称和参数缓存的中间结果。
+    同一个tick中v1、v2的小时函数和分钟函数会用到相同的中间结果(例如同一时间范围的小时K线、前n小时的最小值)，
+    每个中间结果在一个tick中只计算一次，多个线程同时请求时只有一个线程计算。
+    缓存的结果由多个函数处理器共享，使用者不能修改；DataFrame按需要返回副本(例如get_range_data_hours)。
+    创建后不能再修改属性，每个tick创建一个新的上下文。
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: data: 本分钟的数据
+                       datetime: 本分钟的时间
+                       reader: 读取小时K线的读取器
+        """
+        object.__setattr__(self, '_data', kwargs.get('data', None))
+        object.__setattr__(self, '_datetime', kwargs.get('datetime', None))
+        object.__setattr__(self, '_reader', kwargs.get('reader', None))
+        object.__setattr__(self, '_entries', {})
+        object.__setattr__(self, '_entries_lock', Lock())
+        object.__setattr__(self, '_metrics', defaultdict(lambda: defaultdict(float)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'TickContext是只读的，不能修改{name}')
+
+    @property
+    def data(self) -> pd.DataFrame:
+        return self._data
+
+    @property
+    def datetime(self) -> datetime:
+        return self._datetime
+
+    @property
+    def reader(self):
+        return self._reader
+
+    def get(self, name: str, key, build_func: Callable):
+        """
+        获取名称为name、参数为key的中间结果，本tick中第一次请求时调用build_func计算。
+        计算失败时不缓存，下一次请求重新计算
+        """
+        with self._entries_lock:
+            entry = self._entries.get((name, key))
+            if entry is None:
+                entry = self._entries[(name, key)] = _Entry()
+        with entry.lock:
+            if entry.done:
+                self.record(name, 'hits')
+                return entry.value
+            start = time.perf_counter()
+            entry.value = build_func()
+            entry.done = True
+            self.record(name, 'misses', time.perf_counter() - start)
+            return entry.value
+
+    def record(self, name: str, key: str, seconds: float = 0):
+        with self._entries_lock:
+            self._metrics[name][key] += 1
+            self._metrics[name]['seconds'] += seconds
+
+    def get_range_data_hours(self, start_datetime: datetime, end_datetime: datetime,
+                             inclusive: Literal['both', 'neither', 'left', 'right'] = 'both') -> pd.DataFrame:
+        """时间范围内的小时K线，每个范围只读取一次，返回副本"""
+        data = self.get('range_data_hours', (start_datetime, end_datetime, inclusive),
+                        lambda: self.reader.get_data_between_hours(start_datetime, end_datetime, inclusive))
+        return data.copy()
+
+    def get_metrics(self) -> dict:
+        """各中间结果的计算次数(misses)、复用次数(hits)和计算耗时"""
+        with self._entries_lock:
+            return {name: {key: round(value, 3) for key, value in metrics.items()}
+                    for name, metrics in self._metrics.items()}
+
+
+if __name__ == '__main__':
+    from dataio.csv_handler import CSVReader
+
+    context = TickContext(datetime=datetime.now().replace(minute=0, second=0, microsecond=0),
+                          reader=CSVReader('China'))
+    for _ in range(2):
+        context.get_range_data_hours(context.datetime - pd.Timedelta(hours=24), context.datetime, 'left')
+    print(context.get_metrics())
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', 'async_fetcher.log'))
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 10
+
+
+class AsyncFetcher:
+    """
+    每个数据源一个连接池：同一个requests.Session复用keep-alive连接，并声明支持gzip压缩。
+    分页数据通过asyncio同时请求，同时进行的请求数由信号量限制，每个请求单独设置超时时间，
+    一次完整的爬取只需要大约一个请求的往返时间。
+    requests是阻塞的，每个请求在线程池中执行，线程池大小与最大并发数相同。
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: headers: 请求头
+                       max_concurrency: 最大并发请求数，默认为8
+                       timeout: 每个请求的超时时间(秒)，默认为10
+        """
+        self.max_concurrency = int(kwargs.get('max_concurrency') or DEFAULT_MAX_CONCURRENCY)
+        self.timeout = float(kwargs.get('timeout') or DEFAULT_TIMEOUT)
+        self.session = requests.Session()
+        self.session.headers.update(kwargs.get('headers') or {})
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='fetcher')
+
+    def fetch_json(self, request_method: str, url: str, data: dict = None):
+        """发送一个请求，返回解析后的json，状态码不是2xx时抛出requests.HTTPError"""
+        if request_method == 'get':
+            response = self.session.get(url, timeout=self.timeout)
+        elif request_method == 'post':
+            response = self.session.post(url, data=data, timeout=self.timeout)
+        else:
+            raise ValueError(f'不支持的请求模式 {request_method}: 必须为 "get" 或 "post"')
+        response.raise_for_status()
+        return response.json()
+
+    async def fetch_many(self, request_method: str, url: str, data_list: list) -> list:
+        """同时发送多个请求，按data_list的顺序返回结果，失败的请求返回对应的异常"""
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch(data):
+            async with semaphore:
+                return await loop.run_in_executor(self.executor, self.fetch_json, request_method, url, data)
+
+        return await asyncio.gather(*(fetch(data) for data in data_list), return_exceptions=True)
+
+    def fetch_all(self, request_method: str, url: str, data_list: list) -> list:
+        """fetch_many的同步版本，在当前线程中创建事件循环执行"""
+        start = time.perf_counter()
+        results = asyncio.run(self.fetch_many(request_method, url, data_list))
+        failed = sum(isinstance(result, Exception) for result in results)
+        logger.info(f'{url} 共{len(data_list)}个请求，失败{failed}个，耗时{time.perf_counter() - start:.2f}秒')
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+if __name__ == '__main__':
+    url = 'https://api.binance.com/api/v3/ping'
+    fetcher = AsyncFetcher(max_concurrency=4, timeout=5)
+    # 与逐个请求的耗时对比
+    start = time.perf_counter()
+    pages = [fetcher.fetch_json('get', url) for _ in range(4)]
+    sequential_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    pages = fetcher.fetch_all('get', url, [None] * 4)
+    concurrent_seconds = time.perf_counter() - start
+    print(pages)
+    print(f'逐个请求: {sequential_seconds:.2f}秒, 同时请求: {concurrent_seconds:.2f}秒')
+    fetcher.close()
@@ -1,6 +1,7 @@
 import logging
 import math
 from datetime import datetime
+from decimal import InvalidOperation
 
 import pandas as pd
 from pandas import DataFrame
@@ -9,6 +10,7 @@ from socks import method
 import os
 from get_data_by_spider.requests_spider import SpiderByRequests
 from get_data_by_spider.selenium_spider import SpiderBySelenium
+from get_data_by_spider.spider_base import excluded_coins, to_decimal_price
 from msg_log.mylog import get_logger
 from error_exception.customerror import KeyNotFound, SpiderFailedError
 from config import BLACKLIST_FILEPATH, CONFIG_JSON, SpiderWeb
@@ -65,6 +67,10 @@ class DataGetter:
     def get_data(self):
         """获取数据"""
         logger.info("爬取数据")
+        self.spider.reset()
+        # requests爬取的数据在列式解析时过滤黑名单
+        self.blacklist = read_blacklist(BLACKLIST_FILEPATH)
+        self.spider.blacklist = set(self.blacklist)
         if self.method == 'selenium':
             self.get_data_by_selenium()
         elif self.method == 'requests':
@@ -88,28 +94,30 @@ class DataGetter:
 
     def get_data_by_requests(self):
         """通过requests获取数据"""
-        cnt = 1
         if self.spider_web_name == 'gate':
+            # 分页的数据同时请求
             data = CONFIG_JSON.get('gate').get('data')
             total_nums = CONFIG_JSON.get('gate').get('total_nums')
             pagesize = CONFIG_JSON.get('gate').get('pageSize')
             cnt = math.ceil(total_nums / pagesize)
-        for page in range(cnt):
-            try:
-                data.update({'page': page})
-            except Exception as e:
-                data = dict()
-            self.spider.get_content(data=data)
+            self.spider.get_pages([{**data, 'page': page} for page in range(cnt)])
+        else:
+            self.spider.get_content()
             self.spider.parse()
 
     def filter_data(self):
-        """过滤数据"""
-        self.blacklist = read_blacklist(BLACKLIST_FILEPATH)
+        """
+        过滤数据。requests爬取的数据已在列式解析时过滤并转为Decimal；
+        selenium爬取的数据在这里去除黑名单和以$符号开头的币种，并将价格转为Decimal
+        """
         if not self.spider.coin_data.empty:
             data = self.spider.coin_data
-            data = data[~data['coin_name'].isin(self.blacklist)]
-            # 去除所有以$符号开头的币种
-            data = data[~data['coin_name'].str.startswith('$')].copy()
+            if self.method != 'requests':
+                data = data[~excluded_coins(data['coin_name'], self.blacklist)].copy()
+                try:
+                    data['coin_price'] = to_decimal_price(data['coin_price'].to_numpy(dtype=object))
+                except InvalidOperation:
+                    logger.warning(f"coin_price字段数据类型转换失败,例如:{data['coin_price'].values[:3]}")
             self.data = data
         else:
             logger.warning("数据为空")
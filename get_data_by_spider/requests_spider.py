@@ -1,9 +1,10 @@
 import requests
 import os
-from config import CONFIG_JSON, SpiderWeb
-from get_data_by_spider.spider_base import Spider
+from config import CONFIG_JSON, SpiderWeb, REQUEST_MAX_CONCURRENCY, REQUEST_TIMEOUT
+from get_data_by_spider.async_fetcher import AsyncFetcher
+from get_data_by_spider.spider_base import Spider, parse_records
 from msg_log.mylog import get_logger
-from error_exception.customerror import KeyNotFound, SpiderFailedError
+from error_exception.customerror import KeyNotFound
 
 PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', f'requests_spider.log'))
@@ -28,34 +29,41 @@ class SpiderByRequests(Spider):
         self.price_key = self.web_info.get('price_key')
         self.name_key = self.web_info.get('name_key')
         self.request_method = self.web_info.get('request_method')
+        # 同一个数据源的所有请求复用一个连接池
+        self.fetcher = AsyncFetcher(headers=self.headers,
+                                    max_concurrency=kwargs.get('max_concurrency', REQUEST_MAX_CONCURRENCY),
+                                    timeout=kwargs.get('timeout', REQUEST_TIMEOUT))
 
     def get_content(self, **kwargs):
         """获取网页内容，将内容解析为json格式存储在变量self.res_json中"""
         try:
-            if self.request_method == 'get':
-                responses = requests.get(self.url, headers=self.headers, timeout=10)
-            elif self.request_method == 'post':
-                data = kwargs.get('data')
-                responses = requests.post(self.url, headers=self.headers, data=data, timeout=10)
-            else:
-                raise ValueError(f'不支持的请求模式 {self.request_method}: 必须为 "get" 或 "post"')
-
-            # 检查响应状态码
-            responses.raise_for_status()  # 如果响应代码不是200-299, 抛出HTTPError异常
-
-            self.res_json = responses.json()
-
-        except requests.exceptions.RequestException as e:
-            logger.exception(f'请求失败: {e}')
-
-        except ValueError as value_err:
-            logger.exception(f'{self.url} 返回的内容不是 JSON 格式: {value_err}')
+            self.res_json = self.fetcher.fetch_json(self.request_method, self.url, kwargs.get('data'))
         except Exception as e:
-            logger.exception(f'未知错误: {e}')
+            self.log_request_error(e)
         return self
 
+    def get_pages(self, data_list: list):
+        """同时请求多页数据，按页的顺序依次解析，失败的页记录日志后跳过"""
+        results = self.fetcher.fetch_all(self.request_method, self.url, data_list)
+        for page, result in enumerate(results):
+            if isinstance(result, Exception):
+                self.log_request_error(result, page)
+                continue
+            self.res_json = result
+            self.parse()
+        return self
+
+    def log_request_error(self, error: Exception, page: int = None):
+        page_info = '' if page is None else f'第{page}页'
+        if isinstance(error, requests.exceptions.RequestException):
+            logger.error(f'{self.url} {page_info}请求失败: {error}')
+        elif isinstance(error, ValueError):
+            logger.error(f'{self.url} {page_info}返回的内容不是 JSON 格式: {error}')
+        else:
+            logger.error(f'{self.url} {page_info}未知错误: {error!r}')
+
     def parse(self):
-        """从通过处理的json数据中拿到想要的数据，将币种和价格分别存在self.coins和self.prices中"""
+        """从通过处理的json数据中拿到想要的数据，币种和价格转换为DataFrame后存在self.frames中"""
         # 检验能否正常取出数据
         try:
             for key in self.coins_key:
@@ -76,33 +84,9 @@ class SpiderByRequests(Spider):
             logger.exception(e)
             return
 
-        # 如果是binance的数据，需要过滤掉其他单位的数据，只保留单位为USDT的数据
-        if self.spider_web == SpiderWeb.BINANCE.value:
-            self.filte_binance_data_unit_USDT()
-
-        # 遍历记录，提取并处理币种和价格数据
-        for record in self.records:
-            self.process_record(record)
-
-    def process_record(self, record):
-        coin = record.get(self.name_key).upper()
-        price = record.get(self.price_key)
-
-        if isinstance(price, str):
-            price = price.replace('$', '').replace(',', '')
-
-        if coin and price:
-            self.coins.append(coin)
-            self.prices.append(price)
-        else:
-            raise SpiderFailedError('爬取失败')
-
-    def filte_binance_data_unit_USDT(self):
-        records = []
-        for record in self.records:
-            if record['q'] == 'USDT':
-                records.append(record)
-        self.records = records
+        # 列式解析，binance等数据只保留计价单位为quote的数据(USDT)
+        self.frames.append(parse_records(self.records, self.name_key, self.price_key,
+                                         self.web_info.get('quote_key'), self.web_info.get('quote'), self.blacklist))
 
 
 if __name__ == '__main__':
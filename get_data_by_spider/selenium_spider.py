@@ -12,17 +12,65 @@ import time
 import random
 import os
 from msg_log.mylog import get_logger
-from config import CONFIG_JSON_SELENIUM, SpiderWeb
+from config import CONFIG_JSON_SELENIUM, SpiderWeb, SELENIUM_BULK_EXTRACT, SELENIUM_OBSERVE_MUTATIONS
 from get_data_by_spider.spider_base import Spider
 from decimal import Decimal
 
 PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 logging = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', f'selenium_spider.log'))
 
+# 在页面中一次取出整个表格的币种和价格，参数依次为币种xpath、币种css、价格xpath、价格css、是否监听页面变化。
+# xpath找不到元素时使用css。监听页面变化时，页面没有变化就直接返回上一次取出的表格，
+# 同时返回两次读取之间页面变化的次数。
+EXTRACT_TABLE_SCRIPT = """
+const [nameXpath, nameCss, priceXpath, priceCss, observe] = arguments;
+function findAll(xpath, css) {
+    if (xpath) {
+        const snapshot = document.evaluate(xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        const nodes = [];
+        for (let i = 0; i < snapshot.snapshotLength; i++) {
+            nodes.push(snapshot.snapshotItem(i));
+        }
+        if (nodes.length) {
+            return nodes;
+        }
+    }
+    return css ? Array.from(document.querySelectorAll(css)) : [];
+}
+function extract() {
+    const text = node => (node.innerText || node.textContent || '').trim();
+    return {names: findAll(nameXpath, nameCss).map(text), prices: findAll(priceXpath, priceCss).map(text)};
+}
+if (!observe) {
+    return extract();
+}
+if (!window.__spiderBuffer) {
+    // 刚开始监听时还不知道页面是否变化，mutations为null
+    const buffer = {dirty: true, mutations: null, table: null};
+    new MutationObserver(records => {
+        buffer.dirty = true;
+        buffer.mutations += records.length;
+    }).observe(document.body, {subtree: true, childList: true, characterData: true});
+    window.__spiderBuffer = buffer;
+}
+const buffer = window.__spiderBuffer;
+if (buffer.dirty || !buffer.table) {
+    buffer.table = extract();
+    buffer.dirty = false;
+}
+const result = {names: buffer.table.names, prices: buffer.table.prices, mutations: buffer.mutations};
+buffer.mutations = 0;
+return result;
+"""
+
 
 class SpiderBySelenium(Spider):
     """通过selenium获取数据"""
-    def __init__(self, spider_web: SpiderWeb):
+    def __init__(self, spider_web: SpiderWeb, **kwargs):
+        """
+        :param kwargs: bulk_extract: 是否通过一次execute_script取出整个表格，否则逐个元素读取
+                       observe_mutations: 整表提取时是否在页面中监听数据变化
+        """
         super().__init__(spider_web.value)
         self.coins = []
         self.prices = []
@@ -30,6 +78,8 @@ class SpiderBySelenium(Spider):
         self.url = self.web_info.get('url')
         self.method = self.web_info.get('method')
         self.options = Options()
+        self.bulk_extract = kwargs.get('bulk_extract', SELENIUM_BULK_EXTRACT)
+        self.observe_mutations = kwargs.get('observe_mutations', SELENIUM_OBSERVE_MUTATIONS)
 
 
     def get_headless_driver(self):
@@ -95,7 +145,33 @@ class SpiderBySelenium(Spider):
             self.driver.execute_script(
                 "window.scrollTo({ top: document.body.scrollHeight, behavior: 'smooth' });")
     def crawl_data(self):
-        """从网页爬取数据"""
+        """从网页爬取数据，整表提取失败时改为逐个元素读取"""
+        if self.bulk_extract:
+            try:
+                self.crawl_data_by_script()
+                return
+            except Exception as e:
+                logging.exception(f'{self.spider_web}整表提取失败，改为逐个元素读取: {e}')
+        self.crawl_data_by_elements()
+
+    def crawl_data_by_script(self):
+        """通过一次execute_script取出整个表格，不需要对每个元素单独请求WebDriver"""
+        selectors = [self.web_info.get(key) for key in
+                     ('coin_name_xpath', 'coin_name_css', 'coin_price_xpath', 'coin_price_css')]
+
+        def extract_table(driver):
+            table = driver.execute_script(EXTRACT_TABLE_SCRIPT, *selectors, bool(self.observe_mutations))
+            # 表格还没有加载出来时返回False，继续等待
+            return table if table and table.get('names') and table.get('prices') else False
+
+        table = self.wait.until(extract_table)
+        if self.observe_mutations and table.get('mutations') == 0:
+            logging.warning(f'{self.spider_web}页面在两次读取之间没有任何变化，数据可能已经停止更新')
+        self.coins = table['names']
+        self.prices = [price.replace('$', '').replace(',', '') for price in table['prices']]
+
+    def crawl_data_by_elements(self):
+        """逐个元素读取数据"""
         try:
             coin_names = self.wait.until(EC.presence_of_all_elements_located((By.XPATH, self.web_info.get('coin_name_xpath'))))
         except Exception as e:
@@ -126,7 +202,7 @@ class SpiderBySelenium(Spider):
 
 
 if __name__ == '__main__':
-    spider = SpiderBySelenium(SpiderWeb.INVERSTING)
+    spider = SpiderBySelenium(SpiderWeb.INVERSTING, bulk_extract=True)
     # spider.get_headless_driver()
     spider.get_driver()
     spider.load_page()
@@ -1,8 +1,11 @@
 import os
 import random
+from decimal import Decimal, InvalidOperation
+import numpy as np
 import pandas as pd
 from config import USER_AGENTS
 from msg_log.mylog import get_logger
+from error_exception.customerror import SpiderFailedError
 
 PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, 'log', f'spider_base.log'))
@@ -16,6 +19,52 @@ DROP_DUPLICATES_WEB = {
     'keep': 'last'
 }
 
+def _to_decimal_price(price) -> Decimal:
+    if isinstance(price, str):
+        return Decimal(price.replace('$', '').replace(',', ''))
+    return Decimal(str(price))
+
+
+# 逐个元素转换并直接生成object数组(Decimal放入list后再转为数组很慢)
+to_decimal_price = np.frompyfunc(_to_decimal_price, 1, 1)
+to_upper = np.frompyfunc(str.upper, 1, 1)
+
+
+def excluded_coins(names, blacklist) -> np.ndarray:
+    """黑名单中的币种和以'$'开头的币种，整列比较"""
+    names = pd.Index(names, dtype=object)
+    return np.asarray(names.isin(list(blacklist))) | np.asarray(names.str.startswith('$'), dtype=bool)
+
+
+def parse_records(records: list, name_key: str, price_key: str, quote_key: str = None,
+                  quote: str = None, blacklist=()) -> pd.DataFrame:
+    """
+    列式解析：将json中的记录列表按字段各取一次转换为数组，校验和转换都是对整列进行，不逐条处理。
+    quote_key不为空时只保留计价单位为quote的数据(例如binance的USDT)；
+    币种转为大写，去掉黑名单中的币种和以'$'开头的币种，价格去掉'$'和','后转为Decimal(float先转为最短的十进制字符串)。
+    与逐条解析相同，存在币种或价格为空的记录时视为爬取失败
+    :return: 包含coin_name和coin_price的DataFrame
+    """
+    if quote_key:
+        records = [record for record in records if record.get(quote_key) == quote]
+    names = np.array([record.get(name_key) for record in records], dtype=object)
+    prices = np.array([record.get(price_key) for record in records], dtype=object)
+
+    invalid = pd.isna(names) | (names == '') | pd.isna(prices) | (prices == '') | (prices == 0)
+    if invalid.any():
+        raise SpiderFailedError(f'爬取失败，{int(invalid.sum())}条记录的币种或价格为空，例如: '
+                                f'{list(zip(names[invalid], prices[invalid]))[:3]}')
+    names = to_upper(names)
+    # 先过滤再转换价格，被过滤的币种不转换为Decimal
+    kept = ~excluded_coins(names, blacklist)
+    names, prices = names[kept], prices[kept]
+    try:
+        decimal_prices = to_decimal_price(prices)
+    except InvalidOperation:
+        raise SpiderFailedError(f'爬取失败，价格无法转换为数值，例如: {prices[:3].tolist()}')
+    return pd.DataFrame({'coin_name': names, 'coin_price': decimal_prices})
+
+
 class Spider:
     """
     爬虫的基类
@@ -30,6 +79,16 @@ class Spider:
         self.headers = {'User-Agent': get_random_user_agents()}
         self.coins: list = []
         self.prices: list = []
+        # 列式解析得到的数据，每页一个DataFrame
+        self.frames: list = []
+        # 列式解析时过滤的黑名单，由DataGetter在每次爬取前设置
+        self.blacklist: set = set()
+
+    def reset(self):
+        """清空上一次爬取的数据"""
+        self.coins = []
+        self.prices = []
+        self.frames = []
 
     def get_content(self):
         """获取网页内容,将内容存储在self.res_json中"""
@@ -43,6 +102,13 @@ class Spider:
 
     def transform_dataframe(self):
         """生成DataFrame数据"""
+        if self.frames:
+            coin_data = pd.concat(self.frames, ignore_index=True)
+            coin_data['spider_web'] = self.spider_web
+            if self.spider_web in DROP_DUPLICATES_WEB.get('spider_web'):
+                coin_data = coin_data.drop_duplicates(subset='coin_name', keep=DROP_DUPLICATES_WEB.get('keep'))
+            self.coin_data = coin_data
+            return self.coin_data
         if not self.coins or not self.prices:
             self.coin_data = pd.DataFrame(columns=['coin_name', 'coin_price', 'spider_web'])
             return self.coin_data
@@ -60,8 +126,35 @@ class Spider:
 
 
 if __name__ == '__main__':
-    spider = Spider('binance')
-    spider.coins = ['BTC', 'ETH', 'USDT', 'BTC']
-    spider.prices = None
-    data = spider.transform_dataframe()
-    pass
\ No newline at end of file
+    import timeit
+
+    def parse_by_loop(records, name_key, price_key, quote_key=None, quote=None):
+        """原来的逐条解析，用于对比"""
+        coins, prices = [], []
+        for record in records:
+            if quote_key and record[quote_key] != quote:
+                continue
+            price = record.get(price_key)
+            if isinstance(price, str):
+                price = price.replace('$', '').replace(',', '')
+            coins.append(record.get(name_key).upper())
+            prices.append(price)
+        # 原来在生成DataFrame后才转换为Decimal
+        data = pd.DataFrame({'coin_name': coins, 'coin_price': prices})
+        if pd.api.types.is_float_dtype(data['coin_price']):
+            data['coin_price'] = data['coin_price'].astype(str)
+        data['coin_price'] = data['coin_price'].apply(Decimal)
+        return data
+
+    # 与各数据源返回格式相同的数据: binance(字符串价格, 按计价单位过滤)、coin-stats(float价格)、gate(每页20条)
+    payloads = {
+        'binance': ([{'b': f'coin{i}', 'c': f'{random.uniform(0, 1000):.8f}', 'q': random.choice(['USDT', 'BTC', 'BNB'])}
+                     for i in range(3000)], 'b', 'c', 'q', 'USDT'),
+        'coin-stats': ([{'s': f'coin{i}', 'pu': random.uniform(0, 1000)} for i in range(900)], 's', 'pu', None, None),
+        'gate': ([{'coin_short_name': f'coin{i}', 'price': f'${random.uniform(0, 1000):,.4f}'} for i in range(20)],
+                 'coin_short_name', 'price', None, None),
+    }
+    for web, (records, *keys) in payloads.items():
+        loop_seconds = timeit.timeit(lambda: parse_by_loop(records, *keys), number=20) / 20
+        columnar_seconds = timeit.timeit(lambda: parse_records(records, *keys), number=20) / 20
+        print(f'{web}: {len(records)}条记录，逐条解析{loop_seconds * 1000:.2f}ms，列式解析{columnar_seconds * 1000:.2f}ms')
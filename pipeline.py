@@ -0,0 +1,167 @@
+import os
+import time
+from collections import defaultdict
+from queue import Queue
+from threading import Condition, Thread, Lock
+from typing import Callable
+
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, "log", "pipeline.log"))
+
+DEFAULT_QUEUE_SIZE = 2
+# 停止信号，依次传给每个阶段
+_STOP = object()
+
+
+class Stage:
+    """
+    流水线中的一个阶段：一个线程从有界队列中依次取出数据处理，结果放入下一个阶段的队列。
+    func返回None时丢弃该数据，后面的阶段不再处理。
+    """
+
+    def __init__(self, name: str, func: Callable, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.name = name
+        self.func = func
+        self.queue = Queue(maxsize=queue_size)
+        self.next_stage = None
+        self.thread = None
+        # 等待时间: 在本阶段队列中等待的时间；处理时间: func的执行时间；阻塞时间: 下一个阶段队列已满时等待的时间
+        self.metrics = defaultdict(float)
+        self.metrics_lock = Lock()
+
+    def record(self, key: str, seconds: float):
+        with self.metrics_lock:
+            self.metrics[f"{key}_last"] = round(seconds, 3)
+            self.metrics[f"{key}_max"] = max(self.metrics[f"{key}_max"], round(seconds, 3))
+            self.metrics[f"{key}_total"] += seconds
+
+    def count(self, key: str):
+        with self.metrics_lock:
+            self.metrics[key] += 1
+
+    def put(self, item) -> float:
+        """放入队列，队列已满时阻塞(背压)，返回阻塞的时间"""
+        start = time.perf_counter()
+        self.queue.put((time.perf_counter(), item))
+        return time.perf_counter() - start
+
+    def run(self):
+        while True:
+            put_time, item = self.queue.get()
+            if item is _STOP:
+                if self.next_stage is not None:
+                    self.next_stage.put(_STOP)
+                return
+            self.record("wait", time.perf_counter() - put_time)
+            start = time.perf_counter()
+            try:
+                result = self.func(item)
+            except Exception:
+                logger.exception(f"阶段{self.name}处理失败，丢弃该数据")
+                self.count("failed")
+                continue
+            finally:
+                self.record("process", time.perf_counter() - start)
+            self.count("processed")
+            if result is None or self.next_stage is None:
+                continue
+            blocked_seconds = self.next_stage.put(result)
+            self.record("blocked", blocked_seconds)
+            if blocked_seconds > 1:
+                logger.warning(f"阶段{self.next_stage.name}的队列已满，{self.name}阻塞{blocked_seconds:.1f}秒")
+
+
+class StageBarrier:
+    """
+    两个阶段之间的屏障：前一个阶段交出数据时计数(hand_off)，后一个阶段处理完该数据(包括失败)时计数(finish)。
+    前一个阶段要修改后一个阶段会读取的数据时先调用wait，等待已交出的数据全部处理完，
+    其余时间两个阶段仍然同时执行
+    """
+
+    def __init__(self):
+        self.condition = Condition()
+        self.handed_off = 0
+        self.finished = 0
+
+    def hand_off(self):
+        with self.condition:
+            self.handed_off += 1
+
+    def finish(self):
+        with self.condition:
+            self.finished += 1
+            self.condition.notify_all()
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待已交出的数据全部处理完，超时返回False"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.finished >= self.handed_off, timeout)
+
+
+class Pipeline:
+    """
+    多阶段流水线，每个阶段一个线程，阶段之间为有界队列。
+    前一个阶段处理下一份数据的同时，后面的阶段处理上一份数据；
+    某个阶段处理慢时队列会被填满，前面的阶段阻塞在put上，最终submit阻塞，不会无限积压。
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: queue_size: 每个阶段的队列长度，默认为2
+        """
+        self.queue_size = int(kwargs.get("queue_size", DEFAULT_QUEUE_SIZE))
+        self.stages = []
+        self.submit_metrics = defaultdict(float)
+
+    def add_stage(self, name: str, func: Callable):
+        stage = Stage(name, func, self.queue_size)
+        if self.stages:
+            self.stages[-1].next_stage = stage
+        self.stages.append(stage)
+        return self
+
+    def start(self):
+        for stage in self.stages:
+            stage.thread = Thread(target=stage.run, name=f"pipeline-{stage.name}", daemon=True)
+            stage.thread.start()
+        logger.info(f"流水线启动: {' -> '.join(stage.name for stage in self.stages)}")
+        return self
+
+    def submit(self, item) -> float:
+        """提交数据到第一个阶段，返回因背压阻塞的时间"""
+        blocked_seconds = self.stages[0].put(item)
+        self.submit_metrics["submitted"] += 1
+        self.submit_metrics["blocked_last"] = round(blocked_seconds, 3)
+        self.submit_metrics["blocked_max"] = max(self.submit_metrics["blocked_max"], round(blocked_seconds, 3))
+        if blocked_seconds > 1:
+            logger.warning(f"流水线已满，提交阻塞{blocked_seconds:.1f}秒")
+        return blocked_seconds
+
+    def stop(self, timeout: float = None):
+        """处理完已提交的数据后停止"""
+        if not self.stages:
+            return
+        self.stages[0].put(_STOP)
+        for stage in self.stages:
+            if stage.thread is not None:
+                stage.thread.join(timeout)
+        logger.info(f"流水线停止，统计信息: {self.get_metrics()}")
+
+    def get_metrics(self) -> dict:
+        metrics = {"submit": dict(self.submit_metrics)}
+        for stage in self.stages:
+            with stage.metrics_lock:
+                metrics[stage.name] = dict(stage.metrics)
+            metrics[stage.name]["queue_size"] = stage.queue.qsize()
+        return metrics
+
+
+if __name__ == "__main__":
+    pipeline = Pipeline(queue_size=1)
+    pipeline.add_stage("double", lambda x: x * 2).add_stage("print", lambda x: print(x)).start()
+    for i in range(5):
+        pipeline.submit(i)
+    pipeline.stop()
+    print(pipeline.get_metrics())
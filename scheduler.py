@@ -0,0 +1,178 @@
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from threading import Event
+from typing import Callable, Literal
+
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, "log", "scheduler.log"))
+
+OVERRUN_POLICIES = ("catch_up", "coalesce", "skip")
+
+
+@dataclass
+class Job:
+    """
+    定时任务，minute/hour为空时表示每分钟/每小时都执行。
+    例如 minute=0 为每个整点执行，hour=0, minute=0 为每天0点执行。
+    func接收任务应执行的时刻，返回False时本次tick中后面的任务不再执行。
+    """
+    name: str
+    func: Callable[[datetime], object]
+    minute: int = None
+    hour: int = None
+
+    def is_due(self, cur_datetime: datetime) -> bool:
+        return (self.minute is None or cur_datetime.minute == self.minute) and (
+                self.hour is None or cur_datetime.hour == self.hour)
+
+
+class MinuteScheduler:
+    """
+    每分钟的定时调度器：睡眠到下一个整分钟，按添加顺序执行到期的任务。
+    执行时间超过一分钟(超时)时，错过的整分钟按overrun_policy处理：
+        catch_up: 立即依次补执行错过的每一分钟，最多补max_catch_up次，更早的直接跳过
+        coalesce: 立即执行一次，错过的整分钟中到期的任务(如整点任务)都在这一次中执行，
+                  每个任务使用它最后一次到期的时刻
+        skip:     跳过错过的整分钟，等待下一个整分钟
+    超时和跳过的次数记录在metrics中并写入日志。
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: overrun_policy: 超时处理方式，默认为coalesce
+                       max_catch_up: catch_up时最多补执行的次数，默认为5
+                       now: 获取当前时间的函数，默认为datetime.now
+        """
+        self.overrun_policy = kwargs.get("overrun_policy", "coalesce")
+        if self.overrun_policy not in OVERRUN_POLICIES:
+            raise ValueError(f"不支持的超时处理方式: {self.overrun_policy}")
+        self.max_catch_up = int(kwargs.get("max_catch_up", 5))
+        self.now = kwargs.get("now", datetime.now)
+        self.jobs = []
+        self.metrics = defaultdict(int)
+        self.stop_event = Event()
+
+    def add_job(self, name: str, func: Callable[[datetime], object], minute: int = None, hour: int = None):
+        self.jobs.append(Job(name, func, minute, hour))
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    @staticmethod
+    def floor_minute(cur_datetime: datetime) -> datetime:
+        return cur_datetime.replace(second=0, microsecond=0)
+
+    def wait_until(self, target: datetime) -> bool:
+        """睡眠到target，被stop时返回False"""
+        while not self.stop_event.is_set():
+            seconds = (target - self.now()).total_seconds()
+            if seconds <= 0:
+                return True
+            self.stop_event.wait(seconds)
+        return False
+
+    def run_jobs(self, jobs: list, tick_datetimes: dict):
+        """依次执行任务，tick_datetimes为每个任务应执行的时刻"""
+        start = time.perf_counter()
+        for job in jobs:
+            job_start = time.perf_counter()
+            try:
+                result = job.func(tick_datetimes[job.name])
+            except Exception:
+                logger.exception(f"任务{job.name}({tick_datetimes[job.name]})执行失败，终止本次执行")
+                self.metrics["failed_ticks"] += 1
+                break
+            finally:
+                self.metrics[f"{job.name}_seconds"] = round(time.perf_counter() - job_start, 3)
+            if result is False:
+                logger.info(f"任务{job.name}返回False，终止本次执行")
+                break
+        duration = time.perf_counter() - start
+        self.metrics["ticks"] += 1
+        self.metrics["last_tick_seconds"] = round(duration, 3)
+        self.metrics["max_tick_seconds"] = max(self.metrics["max_tick_seconds"], round(duration, 3))
+
+    def run_tick(self, tick_datetime: datetime):
+        """执行某一分钟到期的全部任务"""
+        jobs = [job for job in self.jobs if job.is_due(tick_datetime)]
+        self.run_jobs(jobs, {job.name: tick_datetime for job in jobs})
+
+    def run_coalesced(self, tick_list: list):
+        """错过的多个整分钟合并为一次执行"""
+        tick_datetimes = dict()
+        for tick_datetime in tick_list:
+            for job in self.jobs:
+                if job.is_due(tick_datetime):
+                    tick_datetimes[job.name] = tick_datetime
+        self.run_jobs([job for job in self.jobs if job.name in tick_datetimes], tick_datetimes)
+
+    def get_missed_ticks(self, last_tick: datetime) -> list:
+        """上一次执行的整分钟之后、当前时间之前(包含当前整分钟)错过的整分钟"""
+        cur_minute = self.floor_minute(self.now())
+        missed = []
+        tick_datetime = last_tick + timedelta(minutes=1)
+        while tick_datetime <= cur_minute:
+            missed.append(tick_datetime)
+            tick_datetime += timedelta(minutes=1)
+        return missed
+
+    def handle_overrun(self, last_tick: datetime) -> datetime:
+        """
+        处理超时错过的整分钟
+        :return: 最后一次执行(或跳过)的整分钟
+        """
+        missed = self.get_missed_ticks(last_tick)
+        if not missed:
+            return last_tick
+        self.metrics["overruns"] += 1
+        self.metrics["missed_ticks"] += len(missed)
+        logger.warning(f"{last_tick}之后超时，错过{len(missed)}个整分钟: {missed[0]} ~ {missed[-1]}，"
+                       f"处理方式: {self.overrun_policy}")
+        if self.overrun_policy == "skip":
+            self.metrics["skipped_ticks"] += len(missed)
+            return missed[-1]
+        if self.overrun_policy == "coalesce":
+            self.metrics["coalesced_ticks"] += len(missed)
+            self.run_coalesced(missed)
+            return missed[-1]
+        if len(missed) > self.max_catch_up:
+            self.metrics["skipped_ticks"] += len(missed) - self.max_catch_up
+            missed = missed[-self.max_catch_up:]
+        for tick_datetime in missed:
+            if self.stop_event.is_set():
+                break
+            self.metrics["caught_up_ticks"] += 1
+            self.run_tick(tick_datetime)
+        return missed[-1]
+
+    def run_forever(self):
+        """从下一个整分钟开始执行，直到stop"""
+        last_tick = self.floor_minute(self.now())
+        while self.wait_until(last_tick + timedelta(minutes=1)):
+            if self.floor_minute(self.now()) == last_tick + timedelta(minutes=1):
+                last_tick += timedelta(minutes=1)
+                self.run_tick(last_tick)
+            # 否则是睡眠本身超过了一分钟(如系统休眠)，同样按超时处理
+            # 超时错过的整分钟，处理后可能再次超时
+            while not self.stop_event.is_set():
+                handled_tick = self.handle_overrun(last_tick)
+                if handled_tick == last_tick:
+                    break
+                last_tick = handled_tick
+        logger.info(f"调度器停止，统计信息: {dict(self.metrics)}")
+
+
+if __name__ == "__main__":
+    scheduler = MinuteScheduler(overrun_policy="coalesce")
+    scheduler.add_job("minute", lambda cur_datetime: print("每分钟", cur_datetime))
+    scheduler.add_job("hour", lambda cur_datetime: print("整点", cur_datetime), minute=0)
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        scheduler.stop()
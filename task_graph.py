@@ -0,0 +1,176 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Callable
+
+from msg_log.mylog import get_logger
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+logger = get_logger(__name__, filename=os.path.join(PROJECT_ROOT_PATH, "log", "task_graph.log"))
+
+
+@dataclass
+class Task:
+    """
+    依赖图中的一个任务。func按inputs的顺序接收输入，
+    只有一个输出时直接返回结果，有多个输出时按outputs的顺序返回tuple。
+    after为没有数据依赖、但需要在其之后执行的任务(例如读写同一个记录文件)，只决定顺序：
+    这些任务执行完(包括失败和跳过)后本任务照常执行。
+    dependencies为全部依赖的任务，data_dependencies为其中产生输入的任务。
+    """
+    name: str
+    func: Callable
+    inputs: tuple = ()
+    outputs: tuple = ()
+    after: tuple = ()
+    dependencies: set = field(default_factory=set)
+    data_dependencies: set = field(default_factory=set)
+
+
+@dataclass
+class TaskGraphReport:
+    """一次执行的耗时统计，critical_path为按实际耗时计算的关键路径"""
+    durations: dict
+    failed: list
+    skipped: list
+    wall_seconds: float
+    critical_path: list
+    critical_path_seconds: float
+
+    def __str__(self):
+        serial_seconds = sum(self.durations.values())
+        return (f"总耗时{self.wall_seconds:.2f}秒(串行{serial_seconds:.2f}秒)，"
+                f"关键路径{' -> '.join(self.critical_path)}耗时{self.critical_path_seconds:.2f}秒，"
+                f"各任务耗时: { {name: round(seconds, 2) for name, seconds in self.durations.items()} }"
+                + (f"，失败: {self.failed}" if self.failed else "")
+                + (f"，跳过: {self.skipped}" if self.skipped else ""))
+
+
+class TaskGraph:
+    """
+    根据每个任务声明的输入和输出建立依赖关系，没有依赖关系的任务在线程池中并行执行。
+    某个任务失败时记录日志，需要它的输出的任务跳过，其余任务(包括after中指定它的任务)照常执行。
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: max_workers: 线程数，默认为4
+        """
+        self.max_workers = int(kwargs.get("max_workers", 4))
+        self.tasks = dict()
+
+    def add_task(self, name: str, func: Callable, inputs=(), outputs=(), after=()):
+        if name in self.tasks:
+            raise ValueError(f"任务名称重复: {name}")
+        self.tasks[name] = Task(name, func, tuple(inputs), tuple(outputs), tuple(after))
+        return self
+
+    def _resolve(self, context: dict):
+        """由输入输出得到每个任务依赖的任务"""
+        producers = dict()
+        for task in self.tasks.values():
+            for output in task.outputs:
+                if output in producers:
+                    raise ValueError(f"输出{output}同时由{producers[output]}和{task.name}产生")
+                producers[output] = task.name
+        for task in self.tasks.values():
+            task.data_dependencies = set()
+            for key in task.inputs:
+                if key in producers:
+                    task.data_dependencies.add(producers[key])
+                elif key not in context:
+                    raise ValueError(f"任务{task.name}的输入{key}不存在")
+            # after中不在本次执行的任务直接忽略
+            task.dependencies = task.data_dependencies | {name for name in task.after if name in self.tasks}
+
+    def _run_task(self, task: Task, context: dict):
+        start = time.perf_counter()
+        result = task.func(*[context[key] for key in task.inputs])
+        duration = time.perf_counter() - start
+        if len(task.outputs) == 1:
+            result = (result,)
+        elif not task.outputs:
+            result = ()
+        return dict(zip(task.outputs, result)), duration
+
+    def _critical_path(self, durations: dict):
+        """按实际耗时计算依赖图中最长的路径"""
+        finish = dict()
+        previous = dict()
+
+        def get_finish(name):
+            if name not in finish:
+                best = max(self.tasks[name].dependencies, key=get_finish, default=None)
+                previous[name] = best
+                finish[name] = durations.get(name, 0) + (finish[best] if best is not None else 0)
+            return finish[name]
+
+        if not self.tasks:
+            return [], 0
+        last = max(self.tasks, key=get_finish)
+        path = []
+        while last is not None:
+            path.append(last)
+            last = previous[last]
+        return path[::-1], finish[path[0]]
+
+    def run(self, context: dict = None):
+        """
+        执行全部任务
+        :param context: 初始输入
+        :return: (包含全部输出的context, TaskGraphReport)
+        """
+        context = dict(context or {})
+        self._resolve(context)
+        start = time.perf_counter()
+        durations, failed, skipped = dict(), [], []
+        pending = dict(self.tasks)
+        done = set()
+        running = dict()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="task-graph") as executor:
+            while pending or running:
+                # 跳过一个任务后，需要它的输出的任务也要跳过，重复检查直到没有新跳过的任务
+                skipping = True
+                while skipping:
+                    skipping = False
+                    for name, task in list(pending.items()):
+                        if task.data_dependencies & set(failed + skipped):
+                            skipped.append(name)
+                            del pending[name]
+                            skipping = True
+                finished_tasks = done | set(failed + skipped)
+                for name, task in list(pending.items()):
+                    if task.dependencies <= finished_tasks:
+                        running[executor.submit(self._run_task, task, context)] = name
+                        del pending[name]
+                if not running:
+                    if pending:
+                        raise ValueError(f"存在循环依赖: {list(pending)}")
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        outputs, durations[name] = future.result()
+                    except Exception:
+                        logger.exception(f"任务{name}执行失败")
+                        failed.append(name)
+                        continue
+                    context.update(outputs)
+                    done.add(name)
+        critical_path, critical_path_seconds = self._critical_path(durations)
+        report = TaskGraphReport(durations, failed, skipped, time.perf_counter() - start, critical_path,
+                                 critical_path_seconds)
+        return context, report
+
+
+if __name__ == "__main__":
+    graph = TaskGraph(max_workers=4)
+    graph.add_task("hour_bars", lambda data: time.sleep(0.2) or data * 2, inputs=["data"], outputs=["bars"])
+    graph.add_task("hour_v1", lambda bars: time.sleep(0.3) or bars + 1, inputs=["bars"], outputs=["result_v1"])
+    graph.add_task("hour_v2", lambda bars: time.sleep(0.1) or bars + 2, inputs=["bars"], outputs=["result_v2"])
+    graph.add_task("minute_v1", lambda: time.sleep(0.1), after=["hour_v1"])
+    result, graph_report = graph.run({"data": 1})
+    print(result)
+    print(graph_report)
@@ -0,0 +1,55 @@
+import operator
+import time
+import tracemalloc
+import unittest
+from decimal import Decimal
+
+import numpy as np
+
+from function_handler.ab_pair_engine import find_ab_pairs
+
+COMPARISON_OPERATORS = {'gt': operator.gt, 'ge': operator.ge, 'lt': operator.lt, 'le': operator.le,
+                        'eq': operator.eq, 'neq': operator.ne}
+
+
+def brute_force_pairs(prices, group_ids, magnification, comparison):
+    """逐个比较同一分组中A在B之前的组合"""
+    compare_operator = COMPARISON_OPERATORS[comparison]
+    pairs = [(A, B) for A in range(len(prices)) for B in range(A + 1, len(prices))
+             if group_ids[A] == group_ids[B] and compare_operator(prices[A] * magnification, prices[B])]
+    return np.array([A for A, _ in pairs], dtype=np.int64), np.array([B for _, B in pairs], dtype=np.int64)
+
+
+class ABPairEngineTest(unittest.TestCase):
+    def test_same_as_brute_force(self):
+        rng = np.random.default_rng(0)
+        for _ in range(30):
+            n = int(rng.integers(0, 60))
+            prices = np.array([Decimal(int(value)) for value in rng.integers(1, 15, n)], dtype=object)
+            group_ids = np.sort(rng.integers(0, 4, n))
+            for comparison in COMPARISON_OPERATORS:
+                for magnification in (Decimal('0.9'), Decimal('1')):
+                    expected = brute_force_pairs(prices, group_ids, magnification, comparison)
+                    result = find_ab_pairs(prices, group_ids, magnification, comparison)
+                    np.testing.assert_array_equal(result[0], expected[0])
+                    np.testing.assert_array_equal(result[1], expected[1])
+
+    def test_no_pairs_not_quadratic(self):
+        """价格一直上涨时没有组合，不会先列出时间在A之前的B再筛选掉(n=20000时为4亿个位置)"""
+        n = 20000
+        prices = np.array([Decimal(value) for value in range(1, n + 1)], dtype=object)
+        tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            A_index, B_index = find_ab_pairs(prices, None, Decimal('0.99'), 'gt')
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(A_index), 0)
+        self.assertLess(peak, 64 * 1024 * 1024)
+        self.assertLess(seconds, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
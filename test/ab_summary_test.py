@@ -0,0 +1,110 @@
+import sys
+import time
+import tracemalloc
+import unittest
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from function_handler.ab_pair_engine import (build_ab_pairs, build_ab_summary, expand_ab_summary, find_ab_pairs,
+                                             summarize_ab_pairs)
+from function_handler.functionhandler import FunctionHandler
+
+sys.path.insert(0, __file__.rsplit('/', 1)[0])
+from shard_executor_test import make_hour_data
+
+
+class ABSummaryTest(unittest.TestCase):
+    def setUp(self):
+        self.bars = make_hour_data(coin_count=20, hours=48)
+
+    def test_summarize_same_as_pairs(self):
+        """按B汇总的结果与列出全部组合后再汇总相同，与每轮处理的A的数量无关"""
+        rng = np.random.default_rng(3)
+        prices = np.array([Decimal(int(value)) for value in rng.integers(1, 20, 300)], dtype=object)
+        group_ids = np.repeat(np.arange(6), 50)
+        values = rng.integers(0, 10, 300)
+        for comparison in ('gt', 'le', 'neq'):
+            A_index, B_index = find_ab_pairs(prices, group_ids, Decimal('0.9'), comparison)
+            expected = pd.DataFrame({'A': A_index, 'B': B_index, 'value': values[A_index]}).groupby('B').agg(
+                count=('A', 'size'), first_A=('A', 'min'), last_A=('A', 'max'), min_value=('value', 'min'),
+                max_value=('value', 'max'))
+            summary = summarize_ab_pairs(prices, group_ids, Decimal('0.9'), comparison, {'value': values})
+            B_positions = np.flatnonzero(summary['count'] > 0)
+            np.testing.assert_array_equal(B_positions, expected.index.to_numpy())
+            for name in ('count', 'first_A', 'last_A'):
+                np.testing.assert_array_equal(summary[name][B_positions], expected[name].to_numpy())
+            np.testing.assert_array_equal(summary['value'][0][B_positions], expected['min_value'].to_numpy())
+            np.testing.assert_array_equal(summary['value'][1][B_positions], expected['max_value'].to_numpy())
+
+    def test_summarize_not_quadratic(self):
+        """价格一直下跌时组合数量为n²/2(n=20000时为2亿个)，按B汇总不列出组合"""
+        n = 20000
+        prices = np.array([Decimal(n - value) for value in range(n)], dtype=object)
+        values = np.arange(n)[::-1] % 97
+        tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            summary = summarize_ab_pairs(prices, None, Decimal(1), 'gt', {'value': values})
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        np.testing.assert_array_equal(summary['count'], np.arange(n))
+        np.testing.assert_array_equal(summary['first_A'][1:], np.zeros(n - 1))
+        np.testing.assert_array_equal(summary['last_A'][1:], np.arange(n - 1))
+        np.testing.assert_array_equal(summary['value'][1][1:], np.maximum.accumulate(values)[:-1])
+        self.assertLess(peak, 64 * 1024 * 1024)
+        self.assertLess(seconds, 20)
+
+    def test_build_and_expand(self):
+        """汇总字段换回原来的Decimal，展开部分B后与全部组合中这些B的组合相同(包括顺序)"""
+        pairs = build_ab_pairs(self.bars, 'close', '0.99', 'gt')
+        summary = build_ab_summary(self.bars, 'close', '0.99', 'gt', {'min_low_A': ('low', 'min')})
+        expected = pairs.groupby(['coin_name', 'spider_web', 'time_B']).agg(
+            A_count=('time_A', 'size'), first_time_A=('time_A', 'min'), min_low_A=('low_A', 'min')).reset_index()
+        self.assertEqual(len(summary), len(expected))
+        self.assertLess(len(summary), len(pairs))
+        pd.testing.assert_frame_equal(summary[expected.columns.tolist()], expected, check_dtype=False)
+        self.assertTrue(all(isinstance(value, Decimal) for value in summary['min_low_A']))
+
+        selected = summary.iloc[::5]
+        keys = pd.MultiIndex.from_frame(selected[['coin_name', 'spider_web', 'time_B']])
+        expected_pairs = pairs[pd.MultiIndex.from_frame(pairs[['coin_name', 'spider_web', 'time_B']]).isin(keys)]
+        pd.testing.assert_frame_equal(expand_ab_summary(self.bars, selected, 'close', '0.99', 'gt'),
+                                      expected_pairs.reset_index(drop=True))
+        # 只展开A的最低价大于等于该币种下界的组合
+        bounds = selected.assign(bound=selected['low_B'])
+        expected_pairs = expected_pairs.merge(bounds[['coin_name', 'spider_web', 'bound']].drop_duplicates(
+            subset=['coin_name', 'spider_web']), on=['coin_name', 'spider_web'], how='left')
+        expected_pairs = expected_pairs[expected_pairs['low_A'] >= expected_pairs['bound']].drop(columns=['bound'])
+        result = expand_ab_summary(self.bars, bounds, 'close', '0.99', 'gt', A_lower_bounds={'low': 'bound'})
+        self.assertFalse(result.empty)
+        pd.testing.assert_frame_equal(result, expected_pairs.reset_index(drop=True))
+        with self.assertRaises(ValueError):
+            build_ab_summary(self.bars, 'close', '0.99', 'gt', {'low_A': ('low', 'mean')})
+
+    def test_same_as_compute_AB_data(self):
+        """汇总后再按C时刻价格展开的组合与compute_AB_data中满足C时刻条件的组合相同"""
+        AB_data = FunctionHandler.compute_AB_data(self.bars, Decimal(1), Decimal(1))
+        AB_summary = FunctionHandler.compute_AB_summary(self.bars, Decimal(1), Decimal(1))
+        AB_bars = FunctionHandler.filter_AB_bars(self.bars, Decimal(1), Decimal(1))
+        self.assertEqual(len(AB_summary), AB_data[['coin_name', 'spider_web', 'time_B']].drop_duplicates().shape[0])
+        self.assertEqual(AB_summary['A_count'].sum(), len(AB_data))
+
+        C_data = self.bars[self.bars['time'] == self.bars['time'].max()][['coin_name', 'spider_web', 'coin_price']]
+        C_data = C_data.assign(coin_price=C_data['coin_price'] - Decimal('0.5'))
+        expanded = FunctionHandler.expand_AB_summary(AB_summary, AB_bars, C_data, 'coin_price')
+        self.assertFalse(expanded.empty)
+        merged_data = AB_data.merge(C_data, on=['coin_name', 'spider_web'], how='inner')
+        expected = merged_data[(merged_data['coin_price'] <= merged_data['low_A']) &
+                               (merged_data['coin_price'] <= merged_data['low_B'])]
+        merged_data = expanded.merge(C_data, on=['coin_name', 'spider_web'], how='inner')
+        result = merged_data[(merged_data['coin_price'] <= merged_data['low_A']) &
+                             (merged_data['coin_price'] <= merged_data['low_B'])]
+        pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
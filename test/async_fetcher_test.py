@@ -0,0 +1,96 @@
+import gzip
+import importlib.util
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+REQUEST_DELAY = 0.3
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    本地测试服务器：每个请求延迟REQUEST_DELAY秒后返回请求的页码，/slow 延迟更久，支持gzip时压缩返回，
+    同时记录最多有多少个请求在同时处理
+    """
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        page = parse_qs(self.rfile.read(length).decode()).get('page', ['0'])[0]
+        with FixtureHandler.lock:
+            FixtureHandler.in_flight += 1
+            FixtureHandler.max_in_flight = max(FixtureHandler.max_in_flight, FixtureHandler.in_flight)
+        try:
+            time.sleep(REQUEST_DELAY * (10 if self.path == '/slow' else 1))
+        finally:
+            with FixtureHandler.lock:
+                FixtureHandler.in_flight -= 1
+        body = json.dumps({'list': [{'coin_short_name': f'coin{page}', 'price': page}]}).encode()
+        gzipped = 'gzip' in (self.headers.get('Accept-Encoding') or '')
+        if gzipped:
+            body = gzip.compress(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipUnless(importlib.util.find_spec('requests'), '未安装requests')
+class AsyncFetcherTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def fetch_pages(self, max_concurrency: int, pages: int) -> list:
+        """请求pages页数据，返回结果以及服务器上最多同时处理的请求数"""
+        from get_data_by_spider.async_fetcher import AsyncFetcher
+        FixtureHandler.max_in_flight = 0
+        fetcher = AsyncFetcher(max_concurrency=max_concurrency, timeout=5)
+        try:
+            results = fetcher.fetch_all('post', self.url, [{'page': page} for page in range(pages)])
+        finally:
+            fetcher.close()
+        return results, FixtureHandler.max_in_flight
+
+    def test_pages_fetched_concurrently_in_order(self):
+        """10页数据同时请求，结果按页的顺序返回"""
+        results, max_in_flight = self.fetch_pages(max_concurrency=10, pages=10)
+        self.assertEqual(max_in_flight, 10)
+        self.assertEqual([result['list'][0]['price'] for result in results], [str(i) for i in range(10)])
+
+    def test_concurrency_limited(self):
+        """同时进行的请求数不超过max_concurrency"""
+        results, max_in_flight = self.fetch_pages(max_concurrency=3, pages=9)
+        self.assertEqual(max_in_flight, 3)
+        self.assertEqual([result['list'][0]['price'] for result in results], [str(i) for i in range(9)])
+
+    def test_timeout_only_fails_slow_request(self):
+        from get_data_by_spider.async_fetcher import AsyncFetcher
+        fetcher = AsyncFetcher(max_concurrency=2, timeout=REQUEST_DELAY * 3)
+        results = fetcher.fetch_all('post', self.url + '/slow', [{'page': 1}])
+        results += fetcher.fetch_all('post', self.url, [{'page': 2}])
+        fetcher.close()
+        self.assertIsInstance(results[0], Exception)
+        self.assertEqual(results[1]['list'][0]['coin_short_name'], 'coin2')
+
+
+if __name__ == '__main__':
+    unittest.main()
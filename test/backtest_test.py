@@ -0,0 +1,120 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pandas as pd
+
+from backtest import Backtester, HistoryReader
+from config import ConfigHandler
+from dataio.storage_engine import get_storage_engine
+from function_handler.new_hour_function_handler import NewHourFunctionHandler
+from function_handler.rule_engine import RuleEngine
+
+sys.path.insert(0, __file__.rsplit('/', 1)[0])
+from shard_executor_test import make_hour_data
+from tick_context_test import BarReader
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 函数处理器按数据源分组时读取的币种列表，为运行时数据
+BINANCE_COINS_FILE = os.path.join(PROJECT_ROOT_PATH, 'data', 'binance_coins_USDT.csv')
+
+
+def write_history(base_file_path: str, bars: pd.DataFrame, unit_time: str):
+    """按CSVWriter的目录结构写入小时(每天一个文件)或天(每月一个all_midnight文件)数据"""
+    storage = get_storage_engine('csv')
+    key = bars['time'].dt.strftime('%Y-%-m/%-d') if unit_time == 'hour' else bars['time'].dt.strftime('%Y-%-m')
+    for name, group in bars.groupby(key):
+        folder, file_name = name.split('/') if unit_time == 'hour' else (name, 'all_midnight')
+        os.makedirs(os.path.join(base_file_path, folder), exist_ok=True)
+        storage.write(group, storage.get_file_path(os.path.join(base_file_path, folder), file_name), mode='w')
+
+
+class BacktestTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.bars = make_hour_data(coin_count=40, hours=40)
+        self.last_bar_datetime = self.bars['time'].max().to_pydatetime()
+        # 3/4的币种最后一个小时在跌且开盘价低于之前所有的价格，v2的小时函数会产生提醒
+        falling = (self.bars['time'] == self.last_bar_datetime) & (self.bars['coin_name'].str[4:].astype(int) % 4 != 3)
+        self.bars.loc[falling, ['open', 'close', 'coin_price', 'change']] = [
+            Decimal('0.99'), Decimal('0.97'), Decimal('0.97'), Decimal('-2')]
+        day_bars = make_hour_data(coin_count=40, hours=30)
+        day_bars['time'] = pd.Timestamp('2024-09-01 23:00:00') + pd.to_timedelta(
+            day_bars.groupby('coin_name').cumcount(), unit='D')
+
+        self.base_file_path = {region: os.path.join(self.temp_dir.name, region) for region in ('China', 'Foreign')}
+        write_history(self.base_file_path['China'], self.bars, 'hour')
+        write_history(self.base_file_path['China'], day_bars, 'day')
+        write_history(self.base_file_path['Foreign'], self.bars.assign(time=self.bars['time'] - timedelta(hours=8)),
+                      'hour')
+        write_history(self.base_file_path['Foreign'], day_bars.assign(time=day_bars['time'] - timedelta(hours=8)),
+                      'day')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_backtester(self, **kwargs):
+        return Backtester(start_datetime=datetime(2024, 10, 2, 0), end_datetime=self.last_bar_datetime + timedelta(hours=1),
+                          base_file_path=self.base_file_path, output_folder=os.path.join(self.temp_dir.name, 'output'),
+                          **kwargs)
+
+    def test_no_future_data(self):
+        """模拟时钟之后写入的K线不可见"""
+        reader = HistoryReader('China', base_file_path=self.base_file_path['China'])
+        reader.load(datetime(2024, 10, 2), self.last_bar_datetime, 24, 52)
+        reader.clock = datetime(2024, 10, 2, 10)
+        data = reader.get_data_between_hours(datetime(2024, 10, 1), datetime(2024, 10, 3), 'both')
+        self.assertEqual(data['time'].max(), pd.Timestamp(2024, 10, 2, 9))
+        self.assertEqual(data['time'].min(), pd.Timestamp(2024, 10, 1))
+        days = reader.get_data_between_days(datetime(2024, 9, 1), datetime(2024, 10, 3), 'both')
+        self.assertEqual(days['time'].max(), pd.Timestamp('2024-09-30 23:00:00'))
+
+    def test_tick_times(self):
+        """没有分钟数据时每个整点一个tick，有分钟数据时为其中回测范围内的每一分钟"""
+        self.assertEqual(len(self.make_backtester().get_tick_times()), 17)
+        minute_data = pd.DataFrame({'coin_name': 'coin0', 'spider_web': 'binance', 'coin_price': Decimal(1),
+                                    'time': pd.date_range('2024-10-01 23:58', periods=6, freq='min')})
+        tick_times = self.make_backtester(minute_data=minute_data).get_tick_times()
+        self.assertEqual(tick_times, [datetime(2024, 10, 2, 0, minute) for minute in range(4)])
+
+    @unittest.skipUnless(os.path.exists(BINANCE_COINS_FILE), '缺少运行数据binance_coins_USDT.csv')
+    def test_replay(self):
+        """每个整点执行全部函数处理器，提醒与直接执行函数处理器的结果相同，记录写入回测目录"""
+        backtester = self.make_backtester()
+        report = backtester.run()
+        self.assertEqual(report.ticks, 17)
+        stages = set(report.timings['stage'])
+        for stage in ('load', 'tick', 'hour.hour_func_1_base', 'new_hour.func_1', 'day.func_1',
+                      'minute.minute_func_1_base', 'new_minute.func_1', 'shared.range_data_hours'):
+            self.assertIn(stage, stages)
+        day_calls = report.timings.set_index('stage').loc['day.func_1', 'calls']
+        self.assertEqual(day_calls, 2)
+        self.assertTrue(os.path.exists(os.path.join(report.output_folder, 'alerts.csv')))
+        self.assertTrue(os.listdir(backtester.record_data_folder))
+
+        config_handler = ConfigHandler(os.path.join(PROJECT_ROOT_PATH, 'config.xml'))
+        config_handler.load_config()
+        handler = NewHourFunctionHandler(data=self.bars[self.bars['time'] == self.last_bar_datetime].reset_index(drop=True),
+                                         datetime=self.last_bar_datetime, reader=BarReader(self.bars), writer=None,
+                                         rule_engine=RuleEngine(config_handler=config_handler))
+        handler.func_1()
+        expected = handler.send_messages['apply_condition_2_to_func_1_base']
+        self.assertFalse(expected.empty)
+        alerts = report.alerts
+        alerts = alerts[(alerts['handler'] == 'new_hour') & (alerts['time'] == self.last_bar_datetime + timedelta(hours=1))
+                        & (alerts['func'] == 'apply_condition_2_to_func_1_base')]
+        pd.testing.assert_frame_equal(alerts[expected.columns].reset_index(drop=True), expected.reset_index(drop=True),
+                                      check_dtype=False)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            self.make_backtester(handlers=['week'])
+        with self.assertRaises(ValueError):
+            Backtester(start_datetime=datetime(2024, 10, 3), end_datetime=datetime(2024, 10, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
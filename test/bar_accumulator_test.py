@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from data_process.bar_accumulator import MinuteBarAccumulator
+from data_process.data_process import DataProcess
+from dataio.csv_handler import CSVReader, CSVWriter
+
+BAR_START = datetime(2024, 11, 4, 1)
+COINS = [('BTC', 'binance'), ('ETH', 'binance'), ('PEPE', 'binance'), ('BTC', 'coin-stats'), ('DOGE', 'coin-stats')]
+
+
+def make_minute_data(cur_datetime: datetime, rng) -> pd.DataFrame:
+    """一分钟爬取的数据，部分币种某些分钟没有数据，DOGE从20分才开始有数据"""
+    rows = []
+    for coin_name, spider_web in COINS:
+        if (coin_name == 'DOGE' and cur_datetime.minute < 20 and cur_datetime.hour == BAR_START.hour) or \
+                rng.random() < 0.1:
+            continue
+        price = Decimal(f'{rng.uniform(0.5, 2):.{int(rng.integers(1, 6))}f}')
+        rows.append({'coin_name': coin_name, 'coin_price': price, 'spider_web': spider_web, 'time': cur_datetime})
+    return pd.DataFrame(rows, columns=['coin_name', 'coin_price', 'spider_web', 'time'])
+
+
+def baseline_bars(detail_data: pd.DataFrame, data: pd.DataFrame) -> pd.DataFrame:
+    """原来DataProcess整点时的计算：详细数据与当前数据合并后按时间排序，每个币种取开盘、最高、最低、收盘价"""
+    combined_data = pd.concat([detail_data, data], ignore_index=True).drop_duplicates()
+    combined_data = combined_data.merge(data[['coin_name', 'spider_web']], on=['coin_name', 'spider_web'], how='inner')
+    combined_data = combined_data.sort_values('time', ascending=True)
+    groups = combined_data.groupby(['coin_name', 'spider_web'])['coin_price']
+    bars = pd.DataFrame({'open': groups.apply('first'), 'high': groups.apply('max'), 'low': groups.apply('min'),
+                         'close': groups.apply('last')})
+    return bars.reset_index().sort_values(['coin_name', 'spider_web'], ignore_index=True)
+
+
+class MinuteBarAccumulatorTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_path = os.path.join(self.temp_dir.name, 'bar_accumulator.csv')
+        rng = np.random.default_rng(3)
+        # 01:00到02:00(包含)每分钟的数据
+        self.minutes = [make_minute_data(BAR_START + timedelta(minutes=minute), rng) for minute in range(61)]
+        self.detail_data = pd.concat(self.minutes[:60], ignore_index=True)
+        self.current_data = self.minutes[60]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def accumulate(self, minutes: list, accumulator: MinuteBarAccumulator = None) -> MinuteBarAccumulator:
+        accumulator = accumulator or MinuteBarAccumulator(checkpoint_path=self.checkpoint_path)
+        for data in minutes:
+            accumulator.update(data.copy())
+        return accumulator
+
+    def process_hour(self, accumulator: MinuteBarAccumulator = None) -> DataProcess:
+        """整点时DataProcess得到的K线，累计不完整时从详细数据文件计算"""
+        self.detail_data.to_csv(os.path.join(self.temp_dir.name, 'detail_data.csv'), index=False)
+        cur_datetime = BAR_START + timedelta(hours=1)
+        data_process = DataProcess(self.current_data.copy(), data_region='China', unit_time='hour',
+                                   reader=CSVReader(base_file_path=self.temp_dir.name),
+                                   writer=CSVWriter(base_file_path=self.temp_dir.name), datetime=cur_datetime,
+                                   bar_accumulator=accumulator)
+        data_process.get_needed_data().fill_na().get_price_columns()
+        return data_process
+
+    def assert_same_as_baseline(self, data: pd.DataFrame):
+        expected = baseline_bars(self.detail_data, self.current_data)
+        columns = ['coin_name', 'spider_web', 'open', 'high', 'low', 'close']
+        result = data[columns].sort_values(['coin_name', 'spider_web'], ignore_index=True)
+        pd.testing.assert_frame_equal(result, expected[columns], check_dtype=False)
+        # Decimal的表示(包括末尾的0)不变
+        self.assertEqual(result['close'].map(str).tolist(), expected['close'].map(str).tolist())
+
+    def test_finalize_same_as_detail_data(self):
+        """累计一个小时后整点直接得到K线，与原来读取详细数据聚合的结果相同"""
+        accumulator = self.accumulate(self.minutes[:60])
+        self.assertTrue(accumulator.is_complete(BAR_START))
+        data_process = self.process_hour(accumulator)
+        self.assertIsNone(data_process.detail_data)
+        self.assert_same_as_baseline(data_process.data)
+        self.assertTrue((data_process.data['time'] == pd.Timestamp(BAR_START + timedelta(hours=1))).all())
+
+        # 整点的价格同时作为新K线的开盘价
+        accumulator.update(self.current_data.copy())
+        self.assertEqual(accumulator.bar_start, BAR_START + timedelta(hours=1))
+        self.assertTrue(accumulator.is_complete(BAR_START + timedelta(hours=1)))
+
+    def test_incomplete_hour_uses_detail_data(self):
+        """程序在小时中途启动时累计不完整，整点时从详细数据文件计算"""
+        accumulator = self.accumulate(self.minutes[17:60])
+        self.assertFalse(accumulator.is_complete(BAR_START))
+        self.assertIsNone(accumulator.finalize(self.current_data.copy(), BAR_START))
+        data_process = self.process_hour(accumulator)
+        self.assertFalse(data_process.detail_data.empty)
+        self.assert_same_as_baseline(data_process.data)
+
+    def test_restart_from_checkpoint(self):
+        """重启后从检查点恢复相同的状态，继续累计的结果与不中断时相同"""
+        accumulator = self.accumulate(self.minutes[:31])
+        restarted = MinuteBarAccumulator(checkpoint_path=self.checkpoint_path)
+        self.assertEqual((restarted.bar_start, restarted.first_time), (accumulator.bar_start, accumulator.first_time))
+        pd.testing.assert_frame_equal(restarted.bars.sort_index(), accumulator.bars.sort_index(), check_dtype=False)
+        self.assertEqual(restarted.bars['low'].map(str).sort_index().tolist(),
+                         accumulator.bars['low'].map(str).sort_index().tolist())
+
+        self.accumulate(self.minutes[31:60], restarted)
+        self.assert_same_as_baseline(self.process_hour(restarted).data)
+
+        # 检查点属于之前的小时时不使用
+        later = MinuteBarAccumulator(checkpoint_path=self.checkpoint_path)
+        self.assertFalse(later.is_complete(BAR_START + timedelta(hours=1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
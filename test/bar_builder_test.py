@@ -0,0 +1,78 @@
+import unittest
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from data_process.bar_builder import build_bars
+
+GROUP_COLUMNS = ['coin_name', 'spider_web']
+
+
+def baseline_fill_na(combined_data: pd.DataFrame) -> pd.DataFrame:
+    """原来的DataProcess.fill_na：每个币种向前填充后取最新的一条"""
+    combined_data = combined_data.sort_values('time', ascending=True)
+    filled_data = combined_data.groupby(GROUP_COLUMNS)[['coin_price', 'time']].apply(
+        lambda group: group.ffill()).reset_index(drop=False).set_index('level_2')
+    return filled_data.sort_values('time').groupby(GROUP_COLUMNS).tail(1)
+
+
+def baseline_price_columns(combined_data: pd.DataFrame) -> pd.DataFrame:
+    """原来的DataProcess.get_price_columns：按时间排序后分别计算最高、最低、开盘、收盘价"""
+    data_for_calculate_columns = combined_data.sort_values('time', ascending=True)
+    groups = data_for_calculate_columns.groupby(GROUP_COLUMNS)['coin_price']
+    return pd.DataFrame({'open': groups.apply('first'), 'high': groups.apply('max'), 'low': groups.apply('min'),
+                         'close': groups.apply('last')})
+
+
+def make_combined_data(rng) -> pd.DataFrame:
+    """随机的逐条价格数据，同一币种内时间不重复，部分价格为空，部分币种没有任何价格或者spider_web为空"""
+    rows = []
+    for coin in range(int(rng.integers(1, 8))):
+        # spider_web为空的数据不属于任何币种(原来的fill_na在全部为空时无法执行，所以第一个币种不为空)
+        spider_web = ['coin-stats', None][int(rng.integers(0, 2))] if coin and rng.random() < 0.3 else 'binance'
+        minutes = rng.choice(120, size=int(rng.integers(1, 15)), replace=False)
+        all_empty = rng.random() < 0.1
+        for minute in minutes:
+            price = None if all_empty or rng.random() < 0.2 else Decimal(int(rng.integers(1, 30))) / 8
+            rows.append({'coin_name': f'coin{coin}', 'spider_web': spider_web, 'coin_price': price,
+                         'time': pd.Timestamp('2024-11-04 01:00:00') + pd.Timedelta(minutes=int(minute))})
+    return pd.DataFrame(rows).sample(frac=1, random_state=int(rng.integers(0, 1000)), ignore_index=True)
+
+
+class BarBuilderTest(unittest.TestCase):
+    def test_same_as_baseline(self):
+        """随机数据上K线与原来fill_na和get_price_columns的结果相同(包括最后一条价格为空时的时间)"""
+        rng = np.random.default_rng(0)
+        for _ in range(100):
+            combined_data = make_combined_data(rng)
+            bars = build_bars(combined_data).set_index(GROUP_COLUMNS).sort_index()
+            expected = baseline_price_columns(combined_data).join(
+                baseline_fill_na(combined_data).set_index(GROUP_COLUMNS))
+            # 没有任何价格的币种原来开盘价为空，之后被get_price_columns删除
+            expected = expected[expected['open'].notna()].sort_index()
+            if expected.empty:
+                self.assertTrue(bars.empty)
+                continue
+            pd.testing.assert_frame_equal(bars[['open', 'high', 'low', 'close', 'time']],
+                                          expected[['open', 'high', 'low', 'close', 'time']], check_dtype=False)
+            self.assertEqual(bars['close'].tolist(), expected['coin_price'].tolist())
+
+    def test_keep_decimal_objects(self):
+        """直接使用原来的Decimal对象，末尾的0不变"""
+        data = pd.DataFrame({'coin_name': ['BTC', 'BTC'], 'spider_web': ['binance'] * 2,
+                             'coin_price': [Decimal('68218.00'), Decimal('68100.10')],
+                             'time': pd.to_datetime(['2024-11-04 01:01:00', '2024-11-04 01:00:00'])})
+        bars = build_bars(data)
+        self.assertEqual([str(bars.loc[0, column]) for column in ['open', 'high', 'low', 'close']],
+                         ['68100.10', '68218.00', '68100.10', '68218.00'])
+
+    def test_empty(self):
+        data = pd.DataFrame({'coin_name': ['BTC'], 'spider_web': ['binance'], 'coin_price': [None],
+                             'time': pd.to_datetime(['2024-11-04 01:00:00'])})
+        self.assertEqual(list(build_bars(data).columns), GROUP_COLUMNS + ['open', 'high', 'low', 'close', 'time'])
+        self.assertTrue(build_bars(data).empty)
+
+
+if __name__ == '__main__':
+    unittest.main()
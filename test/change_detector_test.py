@@ -0,0 +1,85 @@
+import unittest
+from decimal import Decimal
+
+import pandas as pd
+
+from data_process.change_detector import ChangeDetector
+from function_handler.functionhandler import FunctionHandler
+
+
+def make_data(prices: dict, spider_web='binance'):
+    return pd.DataFrame({'coin_name': list(prices), 'spider_web': spider_web,
+                         'coin_price': [Decimal(price) for price in prices.values()]})
+
+
+class ChangeDetectorTest(unittest.TestCase):
+    def test_price_changes(self):
+        detector = ChangeDetector()
+        changes = detector.update(make_data({'BTC': '100', 'ETH': '10'}))
+        self.assertEqual(changes['changed_coins'], {('BTC', 'binance'), ('ETH', 'binance')})
+        self.assertIsNone(changes['deltas']['price_delta'][0])
+
+        # 数值相同、小数位数不同的价格不算变化，新出现的币种算变化
+        changes = detector.update(make_data({'ETH': '10.0', 'BTC': '101.5', 'SOL': '1'}))
+        self.assertEqual((changes['previous_version'], changes['version']), (1, 2))
+        self.assertEqual(changes['changed_coins'], {('BTC', 'binance'), ('SOL', 'binance')})
+        deltas = changes['deltas'].set_index('coin_name')
+        self.assertEqual(deltas.loc['BTC', 'price_delta'], Decimal('1.5'))
+        self.assertEqual(deltas.loc['BTC', 'pre_price'], Decimal('100'))
+
+    def test_unchanged_source_skipped(self):
+        detector = ChangeDetector()
+        detector.update(pd.concat([make_data({'BTC': '100'}), make_data({'BTC': '99'}, 'coin-stats')]))
+        # 顺序不同但内容相同的数据源视为未变化，本次没有爬到的数据源保留上一次的价格
+        changes = detector.update(pd.concat([make_data({'BTC': '100', 'ETH': '1'}), make_data({'BTC': '99'}, 'coin-stats')]))
+        changes = detector.update(pd.concat([make_data({'ETH': '1', 'BTC': '100'})]))
+        self.assertEqual(changes['unchanged_sources'], ['binance'])
+        self.assertEqual(changes['changed_coins'], set())
+        changes = detector.update(make_data({'BTC': '98'}, 'coin-stats'))
+        self.assertEqual(changes['deltas']['price_delta'].tolist(), [Decimal('-1')])
+
+
+class EvaluateChangedCoinsTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = FunctionHandler.__new__(FunctionHandler)
+        self.handler.price_changes = None
+        self.handler.coin_verdicts = {}
+        self.evaluated = []
+
+    def evaluate(self, data):
+        """价格小于等于10的币种通过"""
+        self.evaluated.append(set(data['coin_name']))
+        return data[data['coin_price'] <= 10].copy()
+
+    def run_tick(self, detector, prices, cache_key='hour-1'):
+        data = make_data(prices)
+        self.handler.price_changes = detector.update(data)
+        return self.handler.evaluate_changed_coins('func', cache_key, data, self.evaluate)
+
+    def test_only_changed_and_passed_coins_evaluated(self):
+        detector = ChangeDetector()
+        result = self.run_tick(detector, {'BTC': '100', 'ETH': '5', 'SOL': '50'})
+        self.assertEqual(set(result['coin_name']), {'ETH'})
+
+        # SOL跌到10以下需要重新计算，BTC没有变化沿用上次未通过的结果，ETH上次通过需要重新计算
+        result = self.run_tick(detector, {'BTC': '100', 'ETH': '5', 'SOL': '8', 'DOGE': '0.1'})
+        self.assertEqual(self.evaluated[-1], {'ETH', 'SOL', 'DOGE'})
+        self.assertEqual(set(result['coin_name']), {'ETH', 'SOL', 'DOGE'})
+        full_result = self.evaluate(make_data({'BTC': '100', 'ETH': '5', 'SOL': '8', 'DOGE': '0.1'}))
+        self.assertEqual(set(result['coin_name']), set(full_result['coin_name']))
+
+        # 小时K线变化(缓存键变化)后全部重新计算
+        self.run_tick(detector, {'BTC': '100', 'ETH': '5', 'SOL': '8', 'DOGE': '0.1'}, cache_key='hour-2')
+        self.assertEqual(self.evaluated[-1], {'BTC', 'ETH', 'SOL', 'DOGE'})
+
+    def test_missed_version_evaluates_all(self):
+        detector = ChangeDetector()
+        self.run_tick(detector, {'BTC': '100', 'ETH': '5'})
+        # 中间有一个版本没有经过函数处理器，不能沿用结果
+        detector.update(make_data({'BTC': '9', 'ETH': '5'}))
+        self.run_tick(detector, {'BTC': '9', 'ETH': '5'})
+        self.assertEqual(self.evaluated[-1], {'BTC', 'ETH'})
+
+
+if __name__ == '__main__':
+    unittest.main()
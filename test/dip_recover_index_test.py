@@ -0,0 +1,126 @@
+import unittest
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from function_handler.dip_recover_index import DipRecoverIndex
+from function_handler.functionhandler import FunctionHandler
+
+START = pd.Timestamp('2024-11-04 00:00:00')
+
+
+def baseline_dip_then_recover(data: pd.DataFrame, coin_name, spider_web, time_B, threshold, inclusive) -> bool:
+    """
+    原来逐个B时刻的判断：time_B之后(不包括time_B)第一个跌破阈值的时刻之后，是否还有高于阈值的价格。
+    inclusive为True时与FunctionHandler一致(小于等于算跌破)，否则与新的处理器一致(小于才算跌破)
+    """
+    following_data = data[(data['coin_name'] == coin_name) & (data['spider_web'] == spider_web) &
+                          (data['time'] > time_B)].sort_values('time')
+    below_mask = following_data['coin_price'] <= threshold if inclusive else following_data['coin_price'] < threshold
+    if not below_mask.any():
+        return False
+    first_time = following_data[below_mask]['time'].iloc[0]
+    after_first_time = following_data[following_data['time'] > first_time]
+    return bool((after_first_time['coin_price'] > threshold).any())
+
+
+def baseline_filter_B_data(filter_data, range_data):
+    """原来的FunctionHandler.filter_B_data_with_following_conditions"""
+    range_data.set_index(['coin_name', 'spider_web', 'time'], inplace=True)
+    range_data.sort_index(ascending=True, inplace=True)
+    filter_B_data = []
+    grouped_data = filter_data.groupby(['coin_name', 'spider_web'])
+    for (coin_name, spider_web), group in grouped_data:
+        full_data = range_data.loc[(coin_name, spider_web)]
+        if full_data.empty:
+            continue
+        for _, row in group.iterrows():
+            MAGANIFICATION = row['virtual_drop_B'] * Decimal('0.005') + Decimal('1')
+            time_B, min_B = row['time_B'], row['low_B'] * MAGANIFICATION
+            following_data = full_data.loc[full_data.index > time_B]
+            if following_data.empty:
+                filter_B_data.append(row)
+                continue
+            below_min_B_mask = following_data['coin_price'] <= min_B
+            if not below_min_B_mask.any():
+                filter_B_data.append(row)
+                continue
+            first_time = following_data[below_min_B_mask].index[0]
+            after_first_time = following_data.loc[following_data.index > first_time]
+            if not (after_first_time['coin_price'] > min_B).any():
+                filter_B_data.append(row)
+    return pd.DataFrame(filter_B_data)
+
+
+def make_price_data(rng, coins: list) -> pd.DataFrame:
+    """随机的每小时价格，同一币种内时间不重复，价格取值较少以便经常等于阈值"""
+    rows = []
+    for coin_name, spider_web in coins:
+        hours = rng.choice(48, size=int(rng.integers(0, 20)), replace=False)
+        for hour in hours:
+            rows.append({'coin_name': coin_name, 'spider_web': spider_web,
+                         'coin_price': Decimal(int(rng.integers(1, 12))) / 4,
+                         'time': START + pd.Timedelta(hours=int(hour))})
+    return pd.DataFrame(rows, columns=['coin_name', 'spider_web', 'coin_price', 'time'])
+
+
+class DipRecoverIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.coins = [('BTC', 'binance'), ('ETH', 'binance'), ('BTC', 'coin-stats')]
+
+    def test_same_as_baseline(self):
+        """随机数据上与原来逐个B时刻的判断一致，包括B时刻本身的价格、等于阈值的价格、没有数据的币种"""
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            data = make_price_data(rng, self.coins)
+            index = DipRecoverIndex(data)
+            queries = pd.DataFrame({
+                'coin_name': rng.choice(['BTC', 'ETH', 'DOGE'], 40),
+                'spider_web': rng.choice(['binance', 'coin-stats'], 40),
+                # 多数查询时间与数据的时间相同，检查只取time_B之后的数据
+                'time_B': [START + pd.Timedelta(hours=int(hour)) for hour in rng.integers(-2, 50, 40)],
+                'threshold': [Decimal(int(value)) / 4 if value % 3 else Decimal(int(value)) / 3
+                              for value in rng.integers(1, 12, 40)],
+            })
+            for inclusive in (True, False):
+                expected = [baseline_dip_then_recover(data, *query, inclusive)
+                            for query in queries.itertuples(index=False)]
+                result = index.dip_then_recover(queries, queries['time_B'], queries['threshold'], inclusive=inclusive)
+                self.assertEqual(result.tolist(), expected)
+
+    def test_strict_recovery(self):
+        """跌破之后价格回到阈值不算涨回，只有高于阈值才算；跌破需要发生在B时刻之后"""
+        data = pd.DataFrame({'coin_name': ['BTC'] * 4, 'spider_web': ['binance'] * 4,
+                             'coin_price': [Decimal('1'), Decimal('2'), Decimal('1'), Decimal('2.0')],
+                             'time': pd.date_range(START, periods=4, freq='h')})
+        index = DipRecoverIndex(data)
+        queries = pd.DataFrame({'coin_name': ['BTC'] * 4, 'spider_web': ['binance'] * 4})
+        times = [START, START, START + pd.Timedelta(hours=2), START + pd.Timedelta(hours=1)]
+        thresholds = [Decimal('2'), Decimal('1.5'), Decimal('1.5'), Decimal('1')]
+        self.assertEqual(index.dip_then_recover(queries, times, thresholds).tolist(), [False, True, False, False])
+        self.assertEqual(index.dip_then_recover(queries, times, thresholds, inclusive=True).tolist(),
+                         [False, True, False, True])
+
+    def test_filter_B_data_same_as_baseline(self):
+        """FunctionHandler.filter_B_data_with_following_conditions与原来iterrows的实现结果相同"""
+        rng = np.random.default_rng(1)
+        for _ in range(20):
+            range_data = make_price_data(rng, self.coins)
+            coins = range_data[['coin_name', 'spider_web']].drop_duplicates().to_numpy()
+            if len(coins) == 0:
+                continue
+            picks = coins[rng.integers(0, len(coins), 15)]
+            filter_data = pd.DataFrame({
+                'coin_name': picks[:, 0], 'spider_web': picks[:, 1],
+                'time_B': [START + pd.Timedelta(hours=int(hour)) for hour in rng.integers(0, 48, 15)],
+                'low_B': [Decimal(int(value)) / 4 for value in rng.integers(1, 12, 15)],
+                'virtual_drop_B': [Decimal(int(value)) for value in rng.integers(0, 20, 15)],
+            })
+            expected = baseline_filter_B_data(filter_data.copy(), range_data.copy())
+            result = FunctionHandler.filter_B_data_with_following_conditions(filter_data.copy(), range_data.copy())
+            self.assertEqual(sorted(result.index), sorted(expected.index))
+
+
+if __name__ == '__main__':
+    unittest.main()
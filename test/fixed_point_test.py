@@ -0,0 +1,97 @@
+import unittest
+from decimal import Decimal
+
+import numpy as np
+
+from data_process import fixed_point
+
+
+class FixedPointTest(unittest.TestCase):
+    def setUp(self):
+        self.open_price = np.array([Decimal('100'), Decimal('0.000000339041'), Decimal('2443.51')], dtype=object)
+        self.close_price = np.array([Decimal('99.3'), Decimal('0.00000034'), Decimal('2443.51')], dtype=object)
+        self.low_price = np.array([Decimal('98'), Decimal('0.0000003'), Decimal('2400')], dtype=object)
+
+    def test_encode_and_decode(self):
+        """转换为定点数后再转换回Decimal，数值不变"""
+        prices = fixed_point.encode(self.open_price)
+        self.assertEqual(prices.mantissa.dtype, np.int64)
+        self.assertTrue((prices.to_decimal() == self.open_price).all())
+
+    def test_encode_overflow(self):
+        """位数超过int64时使用python int"""
+        values = np.array([Decimal(1) / Decimal(3), Decimal('68218')], dtype=object)
+        prices = fixed_point.encode(values)
+        self.assertEqual(prices.mantissa.dtype, object)
+        self.assertTrue((prices.to_decimal() == values).all())
+
+    def test_encode_strings(self):
+        """字符串(包括科学计数法)按字符矩阵批量转换，结果与Decimal相同"""
+        values = ['68218.00', '3.39041E-7', '-2443.510', '+1E+2', '0E-100', '-0.000', '12', '1.0000000000000000']
+        prices = fixed_point.encode(np.array(values))
+        self.assertEqual(prices.mantissa.dtype, np.int64)
+        self.assertEqual(prices.scale, 12)
+        self.assertTrue((prices.to_decimal() == np.array([Decimal(value) for value in values], dtype=object)).all())
+        self.assertEqual(fixed_point.encode(np.array(['0.1234567890123'])).scale, 13)
+        # 超过int64时改用python int
+        self.assertEqual(fixed_point.encode(np.array(['123456789.123456789'])).mantissa.dtype, object)
+        for value in ('1.2.3', '1E', 'NaN', '', '--1', '1-2'):
+            with self.assertRaises(ValueError):
+                fixed_point.encode(np.array([value]))
+
+    def test_encode_int64(self):
+        """只做批量转换，超过int64(包括只有后面的数据超过)或NaN时返回None"""
+        values = np.array([Decimal('682.18'), Decimal('0.12345678901234'), Decimal('-0.000')] * 30, dtype=object)
+        prices = fixed_point.encode_int64(values)
+        self.assertEqual((prices.mantissa.dtype, prices.scale), (np.int64, 14))
+        self.assertTrue((prices.to_decimal() == values).all())
+        change = Decimal('-1.234567890123456789012345678')
+        self.assertIsNone(fixed_point.encode_int64(np.r_[values, [change]]))
+        self.assertIsNone(fixed_point.encode_int64(np.r_[[change], values]))
+        self.assertIsNone(fixed_point.encode_int64(np.array([Decimal('NaN')], dtype=object)))
+
+    def test_encode_exact(self):
+        """按系数和指数转换回的Decimal与原来完全相同(包括末尾的0)，不能用int64精确表示时返回None"""
+        values = np.array([Decimal('68218.10'), Decimal('3.39E-7'), Decimal('1E+2'), Decimal('0.000'),
+                           Decimal('-2443.510'), Decimal('68218.10')], dtype=object)
+        coefficients, exponents = fixed_point.encode_exact(values)
+        self.assertEqual((coefficients[0], exponents[0]), (6821810, -2))
+        result = fixed_point.decode_exact(coefficients, exponents)
+        self.assertEqual([str(value) for value in result], [str(value) for value in values])
+        for value in (Decimal('-0.0'), Decimal('NaN'), Decimal('0E-100'), Decimal('-1.234567890123456789012345678')):
+            self.assertIsNone(fixed_point.encode_exact(np.array([Decimal(1), value], dtype=object)), str(value))
+
+    def test_compare_ratio_same_as_decimal(self):
+        """交叉相乘的比较结果与Decimal计算跌涨幅后比较的结果一致"""
+        change = (self.close_price - self.open_price) / self.open_price * 100
+        numerator = fixed_point.change_numerator(self.open_price, self.close_price)
+        for comparison in fixed_point.COMPARISON_OPERATORS:
+            for threshold in ['-0.7', '0', '0.28', '-5']:
+                expected = fixed_point.COMPARISON_OPERATORS[comparison](change, Decimal(threshold)).astype(bool)
+                result = fixed_point.compare_ratio(numerator, self.open_price, comparison, threshold)
+                self.assertTrue((result == expected).all(), f'{comparison} {threshold}')
+
+    def test_virtual_drop(self):
+        """虚降与原来逐行计算的结果一致"""
+        expected = [(o - l) / o * 100 if c >= o else (c - l) / o * 100
+                    for o, c, l in zip(self.open_price, self.close_price, self.low_price)]
+        numerator = fixed_point.virtual_drop_numerator(self.open_price, self.close_price, self.low_price)
+        result = fixed_point.ratio_to_decimal(numerator, self.open_price)
+        self.assertEqual(list(result), expected)
+
+    def test_integer_limits(self):
+        """mantissa与取整后的阈值比较，结果与Decimal比较一致"""
+        prices = fixed_point.encode(self.open_price)
+        thresholds = [Decimal('99.99999999999999999'), Decimal('0.000000339041'), Decimal(1) / Decimal(3)]
+        for threshold in thresholds:
+            floor_limits, ceil_limits = fixed_point.integer_limits([threshold] * len(prices), prices.scale)
+            self.assertTrue(((prices.mantissa > floor_limits) == (self.open_price > threshold)).all())
+            self.assertTrue(((prices.mantissa >= ceil_limits) == (self.open_price >= threshold)).all())
+
+    def test_unsupported_comparison(self):
+        with self.assertRaises(ValueError):
+            fixed_point.compare(self.open_price, 'between', '1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import threading
+import time
+import unittest
+
+from pipeline import Pipeline, StageBarrier
+
+
+class PipelineTest(unittest.TestCase):
+    def test_order_and_drop(self):
+        """每个阶段按提交顺序处理，返回None的数据不再传给后面的阶段"""
+        results = []
+        pipeline = Pipeline(queue_size=1)
+        pipeline.add_stage("filter", lambda x: x if x % 2 == 0 else None)
+        pipeline.add_stage("double", lambda x: x * 2)
+        pipeline.add_stage("output", results.append).start()
+        for i in range(10):
+            pipeline.submit(i)
+        pipeline.stop()
+        self.assertEqual(results, [0, 4, 8, 12, 16])
+        self.assertEqual(pipeline.get_metrics()["double"]["processed"], 5)
+
+    def test_overlap_and_backpressure(self):
+        """后面的阶段处理上一份数据时，前面的阶段可以继续提交；队列满时提交阻塞"""
+        release = threading.Event()
+        pipeline = Pipeline(queue_size=1)
+        pipeline.add_stage("slow", lambda x: release.wait()).start()
+        # 第1个被取出处理，第2个留在队列中，都不阻塞
+        self.assertLess(pipeline.submit(1), 0.5)
+        time.sleep(0.1)
+        self.assertLess(pipeline.submit(2), 0.5)
+
+        threading.Timer(0.5, release.set).start()
+        self.assertGreater(pipeline.submit(3), 0.3)
+        pipeline.stop()
+        self.assertEqual(pipeline.get_metrics()["slow"]["processed"], 3)
+
+    def test_barrier_between_stages(self):
+        """
+        与控制器的K线计算、函数执行阶段相同：只写详情数据的tick与上一个tick的函数执行重叠，
+        写入整点K线的tick等上一个tick(包括执行失败的)函数执行完后才写入，函数不会读到之后才生成的K线
+        """
+        barrier = StageBarrier()
+        bars = []
+        events = []
+        release = {minute: threading.Event() for minute in (58, 59)}
+        done = {(stage, minute): threading.Event() for stage in ("build", "evaluate") for minute in (58, 59, 60)}
+
+        def build(minute):
+            if minute % 60 == 0:
+                barrier.wait()
+                bars.append(minute)
+            events.append(("build", minute))
+            done["build", minute].set()
+            barrier.hand_off()
+            return minute
+
+        def evaluate(minute):
+            try:
+                release[minute].wait(5) if minute in release else None
+                events.append(("evaluate", minute, list(bars)))
+                done["evaluate", minute].set()
+                if minute == 59:
+                    raise ValueError(minute)
+                return minute
+            finally:
+                barrier.finish()
+
+        pipeline = Pipeline(queue_size=2)
+        pipeline.add_stage("build", build).add_stage("evaluate", evaluate).start()
+        for minute in (58, 59, 60):
+            pipeline.submit(minute)
+        # 58分的函数执行中，59分的详情数据已写入，整点的K线还未写入
+        self.assertTrue(done["build", 59].wait(5))
+        self.assertEqual(events, [("build", 58), ("build", 59)])
+        release[58].set()
+        self.assertTrue(done["evaluate", 58].wait(5))
+        self.assertFalse(done["build", 60].wait(0.1))
+        release[59].set()
+        pipeline.stop(5)
+        self.assertEqual(events, [("build", 58), ("build", 59), ("evaluate", 58, []), ("evaluate", 59, []),
+                                  ("build", 60), ("evaluate", 60, [60])])
+        self.assertEqual(pipeline.get_metrics()["evaluate"]["failed"], 1)
+
+    def test_stage_error(self):
+        """某个数据处理失败时丢弃该数据，不影响后面的数据"""
+        results = []
+        pipeline = Pipeline()
+        pipeline.add_stage("divide", lambda x: 1 / x).add_stage("output", results.append).start()
+        for i in [1, 0, 2]:
+            pipeline.submit(i)
+        pipeline.stop()
+        self.assertEqual(results, [1, 0.5])
+        self.assertEqual(pipeline.get_metrics()["divide"]["failed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from function_handler.range_query_index import WindowMaxIndex
+
+START = pd.Timestamp('2024-11-04 00:00:00')
+
+
+def baseline_window_max_ge(data: pd.DataFrame, coin_name, spider_web, start, end, threshold) -> bool:
+    """原来逐行的判断：[start, end)窗口内的最高开盘价 >= threshold，窗口内没有数据时为False"""
+    cur_data = data[(data['coin_name'] == coin_name) & (data['spider_web'] == spider_web)]
+    window_data = cur_data[cur_data['time'].between(start, end, inclusive='left')]
+    if window_data['open'].isna().all():
+        return False
+    return bool(window_data['open'].max() >= threshold)
+
+
+def make_bar_data(rng, coins: list) -> pd.DataFrame:
+    """随机的每小时K线，同一币种内时间不重复，部分开盘价为空，开盘价的小数位数不同"""
+    rows = []
+    for coin_name, spider_web in coins:
+        hours = rng.choice(48, size=int(rng.integers(0, 25)), replace=False)
+        for hour in hours:
+            open_price = None if rng.random() < 0.1 else Decimal(int(rng.integers(1, 40))) / 8
+            rows.append({'coin_name': coin_name, 'spider_web': spider_web, 'open': open_price,
+                         'time': START + pd.Timedelta(hours=int(hour))})
+    return pd.DataFrame(rows, columns=['coin_name', 'spider_web', 'open', 'time'])
+
+
+class WindowMaxIndexTest(unittest.TestCase):
+    def test_same_as_baseline(self):
+        """随机数据上与原来逐行筛选窗口的结果一致，包括窗口边界上的K线、等于阈值的价格、空窗口和没有数据的币种"""
+        rng = np.random.default_rng(0)
+        coins = [('BTC', 'binance'), ('ETH', 'binance'), ('BTC', 'coin-stats')]
+        for _ in range(50):
+            data = make_bar_data(rng, coins)
+            index = WindowMaxIndex(data, 'open')
+            # 窗口的开始和结束多数与K线的时间相同
+            starts = [START + pd.Timedelta(hours=int(hour)) for hour in rng.integers(-3, 50, 60)]
+            queries = pd.DataFrame({
+                'coin_name': rng.choice(['BTC', 'ETH', 'DOGE'], 60),
+                'spider_web': rng.choice(['binance', 'coin-stats'], 60),
+                'start': starts,
+                'end': [start + pd.Timedelta(hours=int(hours)) for start, hours in
+                        zip(starts, rng.integers(0, 8, 60))],
+                'threshold': [Decimal(int(value)) / 8 if value % 3 else Decimal(int(value)) / 8 + Decimal('1E-20')
+                              for value in rng.integers(1, 40, 60)],
+            })
+            expected = [baseline_window_max_ge(data, *query) for query in queries.itertuples(index=False)]
+            result = index.window_max_ge(queries, queries['start'], queries['end'], queries['threshold'])
+            self.assertEqual(result.tolist(), expected)
+
+    def test_half_open_window(self):
+        """窗口包含开始时间的K线，不包含结束时间的K线"""
+        data = pd.DataFrame({'coin_name': ['BTC'] * 3, 'spider_web': ['binance'] * 3,
+                             'open': [Decimal('3'), Decimal('1'), Decimal('5')],
+                             'time': pd.date_range(START, periods=3, freq='h')})
+        index = WindowMaxIndex(data, 'open')
+        queries = pd.DataFrame({'coin_name': ['BTC'] * 4, 'spider_web': ['binance'] * 4})
+        starts = [START, START + pd.Timedelta(hours=1), START + pd.Timedelta(hours=1), START + pd.Timedelta(hours=2)]
+        ends = [START + pd.Timedelta(hours=1), START + pd.Timedelta(hours=2), START + pd.Timedelta(hours=3), starts[3]]
+        self.assertEqual(index.window_max_ge(queries, starts, ends, [Decimal('3')] * 4).tolist(),
+                         [True, False, True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pandas as pd
+
+from dataio.record_store import RecordStore, get_record_store
+
+CNT_RECORD_COLUMNS = {'coin_name': 'str', 'spider_web': 'str', 'cnt': 'number', 'lasted_price': 'decimal'}
+
+
+class RecordStoreTest(unittest.TestCase):
+    def setUp(self):
+        RecordStore.clear_all()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'record_data_cnt.csv')
+        self.cur_datetime = datetime(2024, 12, 12, 21, 15, 0)
+        self.record_data = pd.DataFrame({'coin_name': ['BTC', 'ETH'], 'spider_web': ['binance', 'binance'],
+                                         'cnt': [1, 2], 'lasted_price': [Decimal('68218.10'), Decimal('0.000000339')]})
+
+    def tearDown(self):
+        RecordStore.clear_all()
+        self.temp_dir.cleanup()
+
+    def reopen(self, **kwargs) -> RecordStore:
+        """模拟程序重启"""
+        RecordStore.clear_all()
+        return get_record_store(self.file_path, CNT_RECORD_COLUMNS, **kwargs)
+
+    def test_recover_from_journal(self):
+        """未压缩快照时，重启后通过journal恢复数据，Decimal数值不变"""
+        store = get_record_store(self.file_path, CNT_RECORD_COLUMNS)
+        store.save(self.record_data, self.cur_datetime)
+        self.assertFalse(os.path.exists(self.file_path))
+
+        record_data = self.reopen().load(self.cur_datetime)
+        self.assertEqual(record_data['cnt'].tolist(), [1, 2])
+        self.assertEqual(record_data['lasted_price'].tolist(), self.record_data['lasted_price'].tolist())
+
+    def test_save_only_changed_rows(self):
+        """只有发生变化的键写入journal，压缩后写入快照"""
+        store = get_record_store(self.file_path, CNT_RECORD_COLUMNS, compact_interval=2)
+        store.save(self.record_data, self.cur_datetime)
+        store.save(self.record_data, self.cur_datetime + timedelta(minutes=1))
+        self.assertEqual(store.journal_count, 1)
+
+        update_data = self.record_data.iloc[[0]].assign(cnt=3)
+        store.save(update_data, self.cur_datetime + timedelta(minutes=2))
+        self.assertTrue(os.path.exists(self.file_path))
+        record_data = self.reopen().load(self.cur_datetime + timedelta(minutes=3))
+        self.assertEqual(record_data[['coin_name', 'cnt']].values.tolist(), [['BTC', 3]])
+
+    def test_reset_by_hour(self):
+        """进入新的小时后记录清空，重启后也不会恢复"""
+        store = get_record_store(self.file_path, CNT_RECORD_COLUMNS, reset='hour')
+        store.save(self.record_data, self.cur_datetime)
+        self.assertEqual(len(store.load(self.cur_datetime + timedelta(minutes=44))), 2)
+        self.assertTrue(store.load(self.cur_datetime + timedelta(minutes=45)).empty)
+        self.assertTrue(self.reopen(reset='hour').load(self.cur_datetime + timedelta(minutes=46)).empty)
+
+    def test_clear_holds_lock(self):
+        """clear持有锁，其他线程正在读写时等待；读取时按周期清空不会重复加锁"""
+        store = get_record_store(self.file_path, CNT_RECORD_COLUMNS, reset='hour')
+        store.save(self.record_data, self.cur_datetime)
+        cleared = threading.Event()
+        with store.lock:
+            thread = threading.Thread(target=lambda: (store.clear(self.cur_datetime), cleared.set()))
+            thread.start()
+            self.assertFalse(cleared.wait(0.2))
+            self.assertEqual(len(store.data), 2)
+        thread.join(5)
+        self.assertTrue(cleared.is_set())
+        self.assertTrue(store.data.empty)
+
+        store.save(self.record_data, self.cur_datetime)
+        self.assertTrue(store.load(self.cur_datetime + timedelta(hours=1)).empty)
+
+    def test_ttl(self):
+        """超过有效时长的记录在读取时删除"""
+        columns = dict(CNT_RECORD_COLUMNS, first_record_time='datetime')
+        store = get_record_store(self.file_path, columns, ttl=timedelta(hours=23), ttl_column='first_record_time')
+        record_data = self.record_data.assign(
+            first_record_time=[self.cur_datetime - timedelta(hours=22), self.cur_datetime])
+        store.save(record_data, self.cur_datetime)
+        self.assertEqual(store.load(self.cur_datetime + timedelta(hours=2))['coin_name'].tolist(), ['ETH'])
+
+    def test_unsupported_field_type(self):
+        with self.assertRaises(ValueError):
+            get_record_store(self.file_path, {'coin_name': 'str', 'cnt': 'int'})
+
+
+if __name__ == '__main__':
+    unittest.main()
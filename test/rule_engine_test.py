@@ -0,0 +1,205 @@
+import os
+import sys
+import tracemalloc
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from config import ConfigHandler
+from function_handler.ab_pair_engine import find_ab_pairs, find_first_ab_pairs
+from function_handler.new_hour_function_handler import NewHourFunctionHandler
+from function_handler.rule_engine import Predicate, RuleEngine, RulePlan
+from function_handler.tick_context import TickContext
+
+sys.path.insert(0, __file__.rsplit('/', 1)[0])
+from shard_executor_test import make_hour_data
+from tick_context_test import BarReader
+
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_rules():
+    config_handler = ConfigHandler(file_path=os.path.join(PROJECT_ROOT_PATH, 'config.xml'))
+    config_handler.load_config()
+    return config_handler.get_rules()
+
+
+def hand_written_func_1(handler: NewHourFunctionHandler, binance_coins: set) -> pd.DataFrame:
+    """规则引擎之前的NewHourFunctionHandler.func_1，阈值与config.xml中的new_hour_func_1相同"""
+    C_data = handler.data[handler.data['change'] < 0].copy()
+    cur_datetime = handler.datetime
+    A_datetime = cur_datetime - timedelta(hours=24)
+    B_datetime = cur_datetime - timedelta(hours=1)
+    total_data = handler.get_range_data_hours(A_datetime - timedelta(hours=6), B_datetime)
+    total_data = handler.synchronous_data(C_data, total_data)
+    A2B_data = total_data[total_data['time'].between(A_datetime, B_datetime, inclusive='both')]
+    last_two_hours_data = A2B_data[A2B_data['time'].between(cur_datetime - timedelta(hours=2), B_datetime)]
+    min_low = last_two_hours_data.groupby(['coin_name', 'spider_web'])[['open', 'close']].apply(
+        lambda group: group.min().min()).rename('min_low')
+    C_data = C_data.merge(min_low, on=['coin_name', 'spider_web'], how='inner')
+    C_data = C_data[C_data['open'] < C_data['min_low']].drop(columns=['min_low'])
+    A2B_data, total_data = handler.synchronous_data(C_data, A2B_data, total_data)
+    A2B_data = handler.filter_by_figure_columns(A2B_data, {'change': ('lt', '1', 1), 'virtual_drop': ('ge', '1.1', 1)})
+    A2B_data = A2B_data.merge(C_data[['coin_name', 'spider_web', 'open']], on=['coin_name', 'spider_web'],
+                              suffixes=['', '_C'], how='inner')
+    A2B_data = A2B_data[A2B_data['open_C'] <= A2B_data['low']].drop(columns=['open_C'])
+    A2B_data = handler.filter_AB_by_colse_price(A2B_data, Decimal('0.99'))
+    total_data = handler.synchronous_data(A2B_data.drop_duplicates(subset=['coin_name', 'spider_web']), total_data)
+    A2B_data = handler.filter_by_after_B_price(A2B_data, total_data, magnification=Decimal('0.005'))
+    config = {'binance': {'CHANGE': Decimal('-0.7'), 'MAGNIFICATION': Decimal('1.7'), 'BEFORE_CHANGE': Decimal('-2')},
+              'other': {'CHANGE': Decimal('-0.7'), 'MAGNIFICATION': Decimal('3'), 'BEFORE_CHANGE': Decimal('-3.5')}}
+    A2B_data = A2B_data.merge(C_data[['coin_name', 'spider_web', 'coin_price']], on=['coin_name', 'spider_web'],
+                              how='inner')
+    results, international = [], []
+    for source, mask in (('binance', A2B_data['coin_name'].isin(binance_coins)),
+                         ('other', ~A2B_data['coin_name'].isin(binance_coins))):
+        results.append(handler.filter_by_AB_before_6_days(A2B_data[mask].copy(), total_data, source, config, 'hour'))
+        international.append(handler.filter_by_international_change(source, A2B_data[mask].copy(), total_data.copy()))
+    combined_data = pd.concat(results, ignore_index=True)
+    return combined_data.merge(pd.concat(international)[['coin_name', 'spider_web']], on=['coin_name', 'spider_web'],
+                               how='inner')
+
+
+class RuleEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.bars = make_hour_data(coin_count=60, hours=40)
+        self.cur_datetime = self.bars['time'].max()
+        # 3/4的币种C时刻在跌且开盘价低于之前所有的价格
+        falling = (self.bars['time'] == self.cur_datetime) & (self.bars['coin_name'].str[4:].astype(int) % 4 != 3)
+        self.bars.loc[falling, ['open', 'close', 'coin_price', 'change']] = [
+            Decimal('0.99'), Decimal('0.97'), Decimal('0.97'), Decimal('-2')]
+        self.binance_coins = {f'coin{i}' for i in range(0, 60, 2)}
+        # 同一个tick中的函数处理器使用同一份当前数据
+        self.data = self.bars[self.bars['time'] == self.cur_datetime].reset_index(drop=True)
+
+    def make_handler(self, engine, reader=None, tick_context=None):
+        return NewHourFunctionHandler(data=self.data, datetime=self.cur_datetime, reader=reader or BarReader(self.bars),
+                                      writer=None, rule_engine=engine, tick_context=tick_context)
+
+    def test_parse_spec(self):
+        self.assertEqual(repr(Predicate('low', 'ge C.open')), 'low ge C.open')
+        self.assertEqual(Predicate('virtual_drop', 'ge 1.1').operand, Decimal('1.1'))
+        for text in ('lt', 'less 1', 'lt abc'):
+            with self.assertRaises(ValueError):
+                Predicate('change', text)
+        spec = dict(load_rules()['new_hour_func_1'])
+        plan = RulePlan('new_hour_func_1', spec)
+        self.assertEqual(plan.pair, ('close', 'gt', Decimal('0.99')))
+        self.assertEqual(plan.sources['other']['MAGNIFICATION'], ('3', Decimal('3')))
+        with self.assertRaises(ValueError):
+            RulePlan('bad', dict(spec, AB={'open': 'lt pre_min_low'}))
+
+    def test_equals_hand_written_func_1(self):
+        """规则引擎的结果(包括顺序)与原来手写的func_1相同"""
+        engine = RuleEngine(rules=load_rules(), source_coins={'binance': self.binance_coins})
+        handler = self.make_handler(engine)
+        expected = hand_written_func_1(self.make_handler(engine), self.binance_coins)
+        result = handler.run_rule('new_hour_func_1')
+        self.assertFalse(expected.empty)
+        columns = [column for column in expected.columns if column != 'condition']
+        pd.testing.assert_frame_equal(result[columns], expected[columns])
+        self.assertEqual(result['condition'].str.endswith('binance').tolist(),
+                         expected['condition'].str.endswith('binance').tolist())
+
+        handler.func_1()
+        self.assertEqual(len(handler.price_comparison_results['func_1']), len(expected))
+
+    def test_shared_across_rules(self):
+        """前两个阶段相同的规则在一个tick中只计算一次，K线只读取一次"""
+        spec = load_rules()['new_hour_func_1']
+        rules = {'rule_a': spec, 'rule_b': dict(spec, sources={'other': {'INTERNATIONAL_CHANGE': '100'}})}
+        engine = RuleEngine(rules=rules, source_coins={'binance': self.binance_coins})
+        reader = BarReader(self.bars)
+        context = TickContext(datetime=self.cur_datetime, reader=reader)
+        self.make_handler(engine, reader, context).run_rule('rule_a')
+        result = self.make_handler(engine, reader, context).run_rule('rule_b')
+        metrics = context.get_metrics()
+        self.assertEqual((metrics['rule_AB_pairs']['misses'], metrics['rule_AB_pairs']['hits']), (1, 1))
+        self.assertEqual(reader.reads, 2)
+        self.assertFalse(result.empty)
+        self.assertNotIn('condition', result.columns)
+
+    def test_predicate_order(self):
+        """通过率低、代价低的条件先执行，执行顺序不影响结果"""
+        spec = dict(load_rules()['new_hour_func_1'], C={'change': 'lt 0', 'open': 'lt pre_min_low', 'close': 'gt 1.9'})
+        engine = RuleEngine(rules={'rule': spec}, source_coins={'binance': self.binance_coins})
+        plan = engine.compile('rule')
+        self.assertEqual([predicate.kind for predicate in plan.order(plan.C_predicates)][-1], 'pre_min_low')
+        first_result = self.make_handler(engine).run_rule('rule')
+        close_predicate = next(predicate for predicate in plan.C_predicates if predicate.column == 'close')
+        self.assertLess(close_predicate.selectivity, 0.5)
+        self.assertIs(plan.order(plan.C_predicates)[0], close_predicate)
+        pd.testing.assert_frame_equal(self.make_handler(engine).run_rule('rule'), first_result)
+        self.assertIs(engine.compile('rule'), plan)
+
+
+class ExistenceModeTest(unittest.TestCase):
+    setUp = RuleEngineTest.setUp
+    make_handler = RuleEngineTest.make_handler
+
+    def test_find_first_ab_pairs(self):
+        """每个分组第一个满足条件的组合与全部组合中第一个满足条件的相同"""
+        rng = np.random.default_rng(2)
+        prices = np.array([Decimal(int(value)) for value in rng.integers(1, 20, 300)], dtype=object)
+        group_ids = np.repeat(np.arange(6), 50)
+        flags = rng.random(300) < 0.05
+
+        def accept(A_index, B_index):
+            return flags[A_index] | flags[B_index]
+
+        for block_size in (1, 7, 64):
+            A_index, B_index = find_ab_pairs(prices, group_ids, Decimal('0.9'), 'gt')
+            accepted = accept(A_index, B_index)
+            A_index, B_index = A_index[accepted], B_index[accepted]
+            first = np.r_[True, group_ids[A_index][1:] != group_ids[A_index][:-1]]
+            result = find_first_ab_pairs(prices, group_ids, Decimal('0.9'), 'gt', accept, block_size)
+            np.testing.assert_array_equal(result[0], A_index[first])
+            np.testing.assert_array_equal(result[1], B_index[first])
+
+    def test_first_pairs_stop_early(self):
+        """找到组合的分组不再继续；没有组合时也只访问时间在A之后的B"""
+        n = 20000
+        prices = np.array([Decimal(n - value) for value in range(n)], dtype=object)
+        accepted_blocks = []
+
+        def accept(A_index, B_index):
+            accepted_blocks.append(len(A_index))
+            return np.ones(len(A_index), dtype=bool)
+
+        result = find_first_ab_pairs(prices, None, Decimal(1), 'gt', accept, 64)
+        self.assertEqual((result[0].tolist(), result[1].tolist()), ([0], [1]))
+        self.assertEqual(len(accepted_blocks), 1)
+
+        # 价格一直上涨时没有组合
+        tracemalloc.start()
+        try:
+            result = find_first_ab_pairs(prices[::-1].copy(), None, Decimal(1), 'gt', None, 64)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(result[0]), 0)
+        self.assertLess(peak, 64 * 1024 * 1024)
+
+    def test_witness_per_coin(self):
+        """exists模式满足条件的币种与列出全部组合时相同，每个币种一个组合且该组合在全部组合中"""
+        spec = dict(load_rules()['new_hour_func_1'], mode='exists')
+        engine = RuleEngine(rules={'rule': spec}, source_coins={'binance': self.binance_coins})
+        context = TickContext(datetime=self.cur_datetime, reader=BarReader(self.bars))
+        witnesses = self.make_handler(engine, tick_context=context).run_rule('rule')
+        self.assertNotIn('rule_AB_pairs', context.get_metrics())
+        full_result = self.make_handler(engine).run_rule('rule', enumerate_all=True)
+        self.assertFalse(witnesses.empty)
+        self.assertLess(len(witnesses), len(full_result))
+
+        keys = ['coin_name', 'spider_web']
+        self.assertFalse(witnesses.duplicated(subset=keys).any())
+        self.assertEqual(set(map(tuple, witnesses[keys].to_numpy())), set(map(tuple, full_result[keys].to_numpy())))
+        matched = witnesses.merge(full_result, on=list(witnesses.columns), how='inner').drop_duplicates(subset=keys)
+        self.assertEqual(len(matched), len(witnesses))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from datetime import datetime, timedelta
+
+from scheduler import MinuteScheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.cur_datetime = datetime(2024, 12, 12, 9, 58, 0)
+        self.calls = []
+
+    def create_scheduler(self, overrun_policy: str, **kwargs) -> MinuteScheduler:
+        scheduler = MinuteScheduler(overrun_policy=overrun_policy, now=lambda: self.cur_datetime, **kwargs)
+        scheduler.add_job("prepare", lambda cur_datetime: self.calls.append(("prepare", cur_datetime)))
+        scheduler.add_job("hour", lambda cur_datetime: self.calls.append(("hour", cur_datetime)), minute=0)
+        scheduler.add_job("minute", lambda cur_datetime: self.calls.append(("minute", cur_datetime)))
+        return scheduler
+
+    def overrun(self, scheduler: MinuteScheduler, minutes: int) -> datetime:
+        """9:58的执行耗时minutes分钟"""
+        last_tick = self.cur_datetime
+        scheduler.run_tick(last_tick)
+        self.calls.clear()
+        self.cur_datetime = last_tick + timedelta(minutes=minutes, seconds=10)
+        return scheduler.handle_overrun(last_tick)
+
+    def test_no_overrun(self):
+        scheduler = self.create_scheduler("coalesce")
+        self.assertEqual(self.overrun(scheduler, 0), datetime(2024, 12, 12, 9, 58, 0))
+        self.assertEqual(self.calls, [])
+        self.assertEqual(scheduler.metrics["overruns"], 0)
+
+    def test_skip(self):
+        scheduler = self.create_scheduler("skip")
+        self.assertEqual(self.overrun(scheduler, 3), datetime(2024, 12, 12, 10, 1, 0))
+        self.assertEqual(self.calls, [])
+        self.assertEqual(scheduler.metrics["skipped_ticks"], 3)
+
+    def test_coalesce(self):
+        """错过的整点任务在合并的一次执行中使用整点时刻执行"""
+        scheduler = self.create_scheduler("coalesce")
+        self.assertEqual(self.overrun(scheduler, 3), datetime(2024, 12, 12, 10, 1, 0))
+        self.assertEqual(self.calls, [("prepare", datetime(2024, 12, 12, 10, 1, 0)),
+                                      ("hour", datetime(2024, 12, 12, 10, 0, 0)),
+                                      ("minute", datetime(2024, 12, 12, 10, 1, 0))])
+        self.assertEqual(scheduler.metrics["coalesced_ticks"], 3)
+
+    def test_catch_up(self):
+        scheduler = self.create_scheduler("catch_up", max_catch_up=2)
+        self.assertEqual(self.overrun(scheduler, 3), datetime(2024, 12, 12, 10, 1, 0))
+        self.assertEqual([call[1].minute for call in self.calls], [0, 0, 0, 1, 1])
+        self.assertEqual(scheduler.metrics["caught_up_ticks"], 2)
+        self.assertEqual(scheduler.metrics["skipped_ticks"], 1)
+
+    def test_job_return_false(self):
+        """任务返回False或者报错时，本次tick后面的任务不再执行"""
+        scheduler = MinuteScheduler(now=lambda: self.cur_datetime)
+        scheduler.add_job("prepare", lambda cur_datetime: False)
+        scheduler.add_job("minute", lambda cur_datetime: self.calls.append(cur_datetime))
+        scheduler.run_tick(self.cur_datetime)
+        self.assertEqual(self.calls, [])
+
+        scheduler = MinuteScheduler(now=lambda: self.cur_datetime)
+        scheduler.add_job("prepare", lambda cur_datetime: 1 / 0)
+        scheduler.add_job("minute", lambda cur_datetime: self.calls.append(cur_datetime))
+        scheduler.run_tick(self.cur_datetime)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(scheduler.metrics["failed_ticks"], 1)
+
+    def test_unsupported_policy(self):
+        with self.assertRaises(ValueError):
+            MinuteScheduler(overrun_policy="wait")
+
+
+if __name__ == "__main__":
+    unittest.main()
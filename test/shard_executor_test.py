@@ -0,0 +1,116 @@
+import os
+import unittest
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from function_handler.functionhandler import FunctionHandler
+from function_handler.shard_executor import ShardExecutor, SharedFrame
+
+
+def make_hour_data(coin_count=30, hours=24):
+    rng = np.random.default_rng(1)
+    rows = []
+    start = pd.Timestamp('2024-10-01 00:00:00')
+    for coin in range(coin_count):
+        for hour in range(hours):
+            open_price = Decimal(str(round(rng.uniform(1, 2), 4)))
+            close_price = Decimal(str(round(rng.uniform(1, 2), 4)))
+            low_price = min(open_price, close_price) - Decimal(str(round(rng.uniform(0, 0.1), 4)))
+            high_price = max(open_price, close_price) + Decimal('0.01')
+            base_price = close_price if close_price < open_price else open_price
+            rows.append({
+                'coin_name': f'coin{coin}', 'spider_web': 'binance' if coin % 3 else 'other',
+                'coin_price': close_price, 'time': start + pd.Timedelta(hours=hour),
+                'high': high_price, 'low': low_price, 'open': open_price, 'close': close_price,
+                'change': (close_price - open_price) / open_price * 100,
+                'amplitude': (high_price - low_price) / open_price * 100,
+                'virtual_drop': (base_price - low_price) / open_price * 100,
+            })
+    return pd.DataFrame(rows)
+
+
+def double_price(data: pd.DataFrame) -> pd.DataFrame:
+    """原样返回输入的Decimal，另外计算一列新的Decimal"""
+    return data.assign(double=[None if pd.isna(price) else price * 2 for price in data['price']])
+
+
+def describe_shard(data: pd.DataFrame) -> pd.DataFrame:
+    """返回执行分片的进程、行数以及分片中的币种"""
+    return pd.DataFrame({'pid': [os.getpid()], 'rows': [len(data)], 'coins': [set(data['coin_name'])]})
+
+
+class ShardExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.data = pd.DataFrame({
+            'coin_name': ['BTC', None, 'ETH'],
+            'price': [Decimal('68218.00'), None, Decimal('-0.000')],
+            'change': [Decimal('-1.234567890123456789012345678'), Decimal('2.5'), None],
+            'time': pd.to_datetime(['2024-10-01 00:00', '2024-10-01 01:00', None]),
+            'cnt': np.array([1, 2, 3], dtype=np.int64),
+            'ratio': [0.5, np.nan, 1.5],
+        })
+
+    def test_shared_frame_round_trip(self):
+        """Decimal(包括超过int64的28位有效数字)、空值以及时间和字符串经过共享内存后保持不变"""
+        shared_frame = SharedFrame(self.data)
+        try:
+            self.assertEqual([kind for _, kind, _ in shared_frame.columns],
+                             ['category', 'fixed', 'text', 'datetime', 'number', 'number'])
+            restored = SharedFrame.read(shared_frame.get_spec(1, 3))
+        finally:
+            shared_frame.close()
+        pd.testing.assert_frame_equal(restored, self.data.iloc[1:3].reset_index(drop=True))
+
+    def test_results_keep_original_decimals(self):
+        """结果中原样取自输入的Decimal取回父进程中原来的对象(包括小数位数和负零)，新计算的Decimal直接返回"""
+        data = pd.concat([self.data] * 10, ignore_index=True).assign(coin_name=[f'coin{i}' for i in range(30)])
+        shard_executor = ShardExecutor(num_shards=2, max_workers=1, min_rows=0, group_columns=['coin_name'])
+        try:
+            result = shard_executor.map(double_price, [data], sort_columns=['coin_name'])
+        finally:
+            shard_executor.shutdown()
+        expected = double_price(data).sort_values('coin_name', kind='mergesort').reset_index(drop=True)
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertEqual(list(map(str, result['price'])), list(map(str, expected['price'])))
+        self.assertIn('-0.000', list(map(str, result['price'])))
+
+    def test_sharded_result_equals_inline(self):
+        """分片后在子进程中执行的结果(包括顺序)与直接执行相同"""
+        data = make_hour_data()
+        expected = FunctionHandler.compute_AB_data(data, Decimal(1), Decimal(1)).reset_index(drop=True)
+        self.assertFalse(expected.empty)
+        shard_executor = ShardExecutor(num_shards=3, max_workers=2, min_rows=0)
+        try:
+            result = shard_executor.map(FunctionHandler.compute_AB_data, [data], Decimal(1), Decimal(1))
+        finally:
+            shard_executor.shutdown()
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertEqual(shard_executor.metrics['shards'], 3)
+
+    def test_shards_run_in_child_processes(self):
+        """每个分片在子进程中执行，各分片的币种互不重叠，合计为全部数据"""
+        data = make_hour_data(coin_count=100, hours=10)
+        shard_executor = ShardExecutor(num_shards=4, max_workers=2, min_rows=0)
+        try:
+            result = shard_executor.map(describe_shard, [data], sort_columns=[])
+        finally:
+            shard_executor.shutdown()
+        self.assertEqual(shard_executor.metrics['shards'], 4)
+        self.assertEqual(len(result), 4)
+        self.assertNotIn(os.getpid(), set(result['pid']))
+        self.assertEqual(result['rows'].sum(), len(data))
+        coins = set().union(*result['coins'])
+        self.assertEqual(sum(map(len, result['coins'])), len(coins))
+        self.assertEqual(len(coins), data['coin_name'].nunique())
+
+    def test_small_data_runs_inline(self):
+        shard_executor = ShardExecutor(num_shards=4, min_rows=1000)
+        result = shard_executor.map(lambda data: data.head(1), [make_hour_data(coin_count=2, hours=3)])
+        self.assertEqual(len(result), 1)
+        self.assertIsNone(shard_executor.executor)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import random
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pandas as pd
+
+from data_process.sliding_window_max import SlidingWindowMax
+
+
+class SlidingWindowMaxTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_path = os.path.join(self.temp_dir.name, '45_day_max_price_window.csv')
+        self.summary_path = os.path.join(self.temp_dir.name, '45_day_max_price.csv')
+        self.start_day = date(2024, 10, 1)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_window(self) -> SlidingWindowMax:
+        return SlidingWindowMax(checkpoint_path=self.checkpoint_path, summary_path=self.summary_path, window_days=45)
+
+    def test_same_as_brute_force(self):
+        """与直接计算最近45天最高价的结果一致，超过45天的最高价被移出"""
+        random.seed(0)
+        window_max = self.create_window()
+        history = []
+        for i in range(120):
+            day = self.start_day + timedelta(days=i)
+            coins = [coin for coin in ['BTC', 'ETH', 'DOGE'] if random.random() < 0.9]
+            day_data = pd.DataFrame({'coin_name': coins,
+                                     'high': [Decimal(random.randint(1, 1000)) / 100 for _ in coins]})
+            history.append((day, day_data))
+            window_max.update(day_data, day)
+
+            start_day = day - timedelta(days=44)
+            window_data = pd.concat([data for data_day, data in history if data_day >= start_day])
+            expected = window_data.groupby('coin_name')['high'].max().to_dict()
+            result = window_max.max_prices().set_index('coin_name')['max_price_in_45_day'].to_dict()
+            self.assertEqual(result, expected, f'{day}')
+
+    def test_recover_from_checkpoint(self):
+        window_max = self.create_window()
+        for i, high in enumerate(['3', '1', '2']):
+            window_max.update(pd.DataFrame({'coin_name': ['BTC'], 'high': [Decimal(high)]}),
+                              self.start_day + timedelta(days=i))
+        expected = window_max.max_prices()
+
+        window_max = self.create_window()
+        self.assertTrue(window_max.max_prices().equals(expected))
+        # 程序停止多天后，读取时按当前时间移出超过45天的最高价
+        cur_datetime = datetime.combine(self.start_day + timedelta(days=46), datetime.min.time())
+        self.assertEqual(window_max.max_prices(cur_datetime)['max_price_in_45_day'].tolist(), [Decimal('2')])
+
+    def test_price_le_max_ratio(self):
+        """价格小于等于最高价的50%，等于时也满足"""
+        window_max = self.create_window()
+        window_max.update(pd.DataFrame({'coin_name': ['BTC', 'ETH'], 'high': [Decimal('0.000000678083'),
+                                                                             Decimal('100')]}), self.start_day)
+        data = pd.DataFrame({'coin_name': ['BTC', 'BTC', 'ETH', 'SOL'], 'spider_web': ['binance', 'other'] * 2,
+                             'coin_price': [Decimal('0.0000003390415'), Decimal('0.0000003390416'), Decimal('50'),
+                                            Decimal('1')]})
+        result = window_max.price_le_max_ratio(data, Decimal('0.5'))
+        self.assertEqual(result[['coin_name', 'spider_web']].values.tolist(), [['BTC', 'binance'], ['ETH', 'binance']])
+
+
+if __name__ == '__main__':
+    unittest.main()
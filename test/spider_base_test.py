@@ -0,0 +1,53 @@
+import unittest
+from decimal import Decimal
+
+from error_exception.customerror import SpiderFailedError
+from get_data_by_spider.spider_base import Spider, parse_records
+
+
+class ParseRecordsTest(unittest.TestCase):
+    def test_binance_payload(self):
+        """只保留USDT计价的数据，币种转为大写，价格为Decimal"""
+        records = [{'b': 'btc', 'c': '68218.00', 'q': 'USDT'},
+                   {'b': 'eth', 'c': '0.05', 'q': 'BTC'},
+                   {'b': 'pepe', 'c': '0.00000987', 'q': 'USDT'}]
+        data = parse_records(records, 'b', 'c', 'q', 'USDT')
+        self.assertEqual(data['coin_name'].tolist(), ['BTC', 'PEPE'])
+        self.assertEqual(data['coin_price'].tolist(), [Decimal('68218.00'), Decimal('0.00000987')])
+        self.assertEqual(str(data['coin_price'][0]), '68218.00')
+
+    def test_formatted_and_float_prices(self):
+        """去掉价格中的'$'和','，float转为最短的十进制表示"""
+        data = parse_records([{'s': 'BTC', 'pu': '$68,218.5'}], 's', 'pu')
+        self.assertEqual(data['coin_price'][0], Decimal('68218.5'))
+        data = parse_records([{'s': 'BTC', 'pu': 0.1}, {'s': 'ETH', 'pu': 2400}], 's', 'pu')
+        self.assertEqual([str(price) for price in data['coin_price']], ['0.1', '2400'])
+
+    def test_blacklist_and_dollar_coins(self):
+        """解析时去掉黑名单中的币种和以'$'开头的币种(币种转为大写后比较)"""
+        records = [{'s': 'btc', 'pu': '1'}, {'s': 'usdt', 'pu': '1'}, {'s': '$pepe', 'pu': 'bad'}, {'s': 'eth', 'pu': '2'}]
+        data = parse_records(records, 's', 'pu', blacklist={'USDT'})
+        self.assertEqual(data['coin_name'].tolist(), ['BTC', 'ETH'])
+        self.assertEqual(data['coin_price'].tolist(), [Decimal('1'), Decimal('2')])
+        self.assertTrue(parse_records(records[1:3], 's', 'pu', blacklist={'USDT'}).empty)
+
+    def test_empty_value_fails(self):
+        with self.assertRaises(SpiderFailedError):
+            parse_records([{'s': 'BTC', 'pu': 1.5}, {'s': 'ETH', 'pu': 0}], 's', 'pu')
+        with self.assertRaises(SpiderFailedError):
+            parse_records([{'s': None, 'pu': '1'}], 's', 'pu')
+
+    def test_transform_and_reset(self):
+        """每页的数据合并后去重，reset后不再包含上一次爬取的数据"""
+        spider = Spider('binance')
+        spider.frames.append(parse_records([{'b': 'BTC', 'c': '1'}, {'b': 'ETH', 'c': '2'}], 'b', 'c'))
+        spider.frames.append(parse_records([{'b': 'BTC', 'c': '3'}], 'b', 'c'))
+        data = spider.transform_dataframe()
+        self.assertEqual(dict(zip(data['coin_name'], data['coin_price'])), {'ETH': Decimal('2'), 'BTC': Decimal('3')})
+        self.assertEqual(set(data['spider_web']), {'binance'})
+        spider.reset()
+        self.assertTrue(spider.transform_dataframe().empty)
+
+
+if __name__ == '__main__':
+    unittest.main()
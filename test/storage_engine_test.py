@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from dataio.csv_handler import CSVReader
+from dataio.storage_engine import get_storage_engine
+
+
+class StorageEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.data = pd.DataFrame({
+            'coin_name': ['BTC', None, 'ETH'], 'spider_web': ['binance', 'binance', np.nan],
+            'coin_price': [Decimal('68218.10'), Decimal('0.000000339'), Decimal('1.5')],
+            'change': [Decimal('-1.234567890123456789012345678'), Decimal('1E-7'),
+                       Decimal('1.100000000000000000000000001')],
+            'time': pd.to_datetime(['2024-10-01 01:00:00', '2024-10-01 02:00:00', '2024-10-01 03:00:00'])
+        })
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_and_read(self, engine_name: str) -> pd.DataFrame:
+        storage = get_storage_engine(engine_name)
+        file_path = storage.get_file_path(self.temp_dir.name, engine_name)
+        storage.write(self.data, file_path, mode='w')
+        return storage.read(file_path)
+
+    def test_same_as_csv(self):
+        """二进制存储读出并转换后的Decimal与csv完全相同(包括末尾的0和28位有效数字的派生字段)，空值保持为空值"""
+        expected = self.write_and_read('csv')
+        result = self.write_and_read('npz')
+        self.assertTrue(result[['coin_name', 'spider_web']].isna().any().all())
+        # 价格读出时已经是Decimal，超过int64的change整列以字符串保存
+        self.assertEqual(pd.api.types.infer_dtype(result['coin_price']), 'decimal')
+        self.assertEqual(pd.api.types.infer_dtype(result['change']), 'string')
+        expected, result = [CSVReader.change_column_type_to_Decimal(data, only_price=False).drop(columns='time')
+                            for data in (expected, result)]
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertEqual(result['coin_price'].map(str).tolist(), ['68218.10', '3.39E-7', '1.5'])
+        self.assertEqual(result['change'].tolist()[0], Decimal('-1.234567890123456789012345678'))
+
+    def test_exact_decimals(self):
+        """读出的Decimal不再逐个转换；空值读出为空值，-0等不能用int64表示的列以字符串保存"""
+        data = pd.DataFrame({'coin_price': [Decimal('68218.10'), None, Decimal('1E+2')],
+                             'open': [Decimal('-0.000'), Decimal('1'), Decimal('2')]})
+        storage = get_storage_engine('npz')
+        file_path = storage.get_file_path(self.temp_dir.name, '1')
+        storage.write(data, file_path, mode='w')
+        result = storage.read(file_path)
+        self.assertEqual(result['coin_price'].map(str).tolist(), ['68218.10', 'nan', '1E+2'])
+        self.assertEqual(result['open'].tolist(), ['-0.000', '1', '2'])
+
+        prices = result['coin_price'].dropna().tolist()
+        converted = CSVReader.change_column_type_to_Decimal(result.dropna().copy(), only_price=False)
+        self.assertTrue(all(new is old for new, old in zip(converted['coin_price'], prices)))
+        self.assertEqual(str(converted['open'].tolist()[0]), '-0.000')
+
+    def test_append_segments(self):
+        """追加写入不重写已有分区，分段过多时合并，整体重写时删除分段"""
+        storage = get_storage_engine('npz')
+        file_path = storage.get_file_path(self.temp_dir.name, '1')
+        for _ in range(storage.max_segments + 2):
+            storage.write(self.data, file_path, mode='a')
+        self.assertEqual(len(storage.get_segment_paths(file_path)), 1)
+        result = storage.read(file_path)
+        self.assertEqual(len(result), len(self.data) * (storage.max_segments + 2))
+        self.assertEqual(result['coin_price'].map(str).tolist()[-3:], ['68218.10', '3.39E-7', '1.5'])
+
+        storage.write(self.data, file_path, mode='w')
+        self.assertEqual(os.listdir(self.temp_dir.name), ['1.npz'])
+        self.assertEqual(len(storage.read(file_path)), len(self.data))
+
+
+if __name__ == '__main__':
+    unittest.main()
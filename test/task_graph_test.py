@@ -0,0 +1,85 @@
+import threading
+import time
+import unittest
+
+from task_graph import TaskGraph
+
+
+class TaskGraphTest(unittest.TestCase):
+    def test_dependencies_and_outputs(self):
+        """按输入输出确定执行顺序，多个输出按顺序返回"""
+        graph = TaskGraph()
+        graph.add_task("split", lambda data: (data[0], data[1]), inputs=["data"], outputs=["left", "right"])
+        graph.add_task("add", lambda left, right: left + right, inputs=["left", "right"], outputs=["total"])
+        context, report = graph.run({"data": (1, 2)})
+        self.assertEqual(context["total"], 3)
+        self.assertEqual(report.critical_path, ["split", "add"])
+
+    def test_independent_tasks_run_concurrently(self):
+        """没有依赖关系的任务同时执行，after指定的任务在其之后执行"""
+        # 两个任务都到达barrier才能继续，顺序执行时会超时报错
+        barrier = threading.Barrier(2, timeout=2)
+        order = []
+
+        def run_hour(name, seconds):
+            barrier.wait()
+            time.sleep(seconds)
+            order.append(name)
+
+        graph = TaskGraph(max_workers=2)
+        graph.add_task("hour", lambda: run_hour("hour", 0))
+        graph.add_task("new_hour", lambda: run_hour("new_hour", 0.1))
+        graph.add_task("new_minute", lambda: order.append("new_minute"), after=["new_hour"])
+        context, report = graph.run()
+        self.assertEqual(order[-1], "new_minute")
+        self.assertEqual(report.critical_path, ["new_hour", "new_minute"])
+        self.assertFalse(report.failed)
+
+    def test_failed_task_skips_dependents(self):
+        graph = TaskGraph()
+        graph.add_task("bars", lambda: 1 / 0, outputs=["bars"])
+        graph.add_task("hour", lambda bars: bars, inputs=["bars"], outputs=["hour_messages"])
+        graph.add_task("minute", lambda: "ok", outputs=["minute_messages"])
+        context, report = graph.run()
+        self.assertEqual(report.failed, ["bars"])
+        self.assertEqual(report.skipped, ["hour"])
+        self.assertEqual(context["minute_messages"], "ok")
+
+    def test_after_only_orders(self):
+        """after只决定顺序：之前的任务失败或跳过时，在其执行完之后照常执行；需要输出的任务按依赖链跳过"""
+        order = []
+
+        def fail_hour():
+            time.sleep(0.1)
+            order.append("hour")
+            raise ValueError("hour")
+
+        graph = TaskGraph(max_workers=2)
+        graph.add_task("summary", lambda hour_messages: hour_messages, inputs=["hour_messages"],
+                       outputs=["summary"])
+        graph.add_task("report", lambda summary: summary, inputs=["summary"], outputs=["report"])
+        graph.add_task("hour", fail_hour, outputs=["hour_messages"])
+        graph.add_task("minute", lambda: order.append("minute") or "ok", outputs=["minute_messages"],
+                       after=["hour"])
+        graph.add_task("day_Foreign", lambda: "ok", outputs=["day_Foreign_messages"], after=["report"])
+        context, report = graph.run()
+        self.assertEqual(order, ["hour", "minute"])
+        self.assertEqual(report.failed, ["hour"])
+        self.assertEqual(sorted(report.skipped), ["report", "summary"])
+        self.assertEqual((context["minute_messages"], context["day_Foreign_messages"]), ("ok", "ok"))
+
+    def test_invalid_graph(self):
+        graph = TaskGraph()
+        graph.add_task("hour", lambda bars: bars, inputs=["bars"])
+        with self.assertRaises(ValueError):
+            graph.run()
+
+        graph = TaskGraph()
+        graph.add_task("a", lambda: None, after=["b"])
+        graph.add_task("b", lambda: None, after=["a"])
+        with self.assertRaises(ValueError):
+            graph.run()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pandas as pd
+
+from function_handler.functionhandler import FunctionHandler
+from function_handler.tick_context import TickContext
+
+sys.path.insert(0, __file__.rsplit('/', 1)[0])
+from shard_executor_test import make_hour_data
+
+
+class BarReader:
+    """从内存中的小时K线读取数据，记录读取次数"""
+
+    def __init__(self, data: pd.DataFrame):
+        self.data = data
+        self.reads = 0
+        self.lock = threading.Lock()
+
+    def get_data_between_hours(self, start_datetime, end_datetime, inclusive='both'):
+        with self.lock:
+            self.reads += 1
+        time.sleep(0.05)
+        return self.data[self.data['time'].between(start_datetime, end_datetime, inclusive=inclusive)]
+
+
+def make_handler(reader, tick_context=None):
+    return FunctionHandler(reader=reader, writer=None, tick_context=tick_context)
+
+
+class TickContextTest(unittest.TestCase):
+    def test_computed_once_across_threads(self):
+        context = TickContext(datetime=datetime(2024, 10, 2))
+        calls = []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.05)
+            return 42
+
+        threads = [threading.Thread(target=context.get, args=('value', ('a', 1), build)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(context.get('value', ('a', 2), lambda: 43), 43)
+        self.assertEqual(context.get_metrics()['value']['hits'], 3)
+        with self.assertRaises(AttributeError):
+            context.data = pd.DataFrame()
+
+    def test_handlers_share_intermediates(self):
+        """两个函数处理器共用一个上下文时K线只读取一次，结果与各自计算相同，修改读取的结果不影响其他处理器"""
+        bars = make_hour_data()
+        start = bars['time'].min()
+        end = start + timedelta(hours=24)
+        reader = BarReader(bars)
+        context = TickContext(datetime=end, reader=reader)
+        v1, v2 = make_handler(reader, context), make_handler(reader, context)
+        v1.get_range_data_hours(start, end, 'left')['open'] = Decimal(0)
+        v2.get_range_data_hours(start, end, 'left')
+        self.assertEqual(reader.reads, 1)
+        self.assertNotEqual(v2.range_data_hours['open'].tolist(), [Decimal(0)] * len(v2.range_data_hours))
+
+        window = (end - timedelta(hours=3), end - timedelta(hours=1))
+        shared = v1.get_shared_pre_hours_min_low(*window, dropna=True)
+        self.assertIs(v2.get_shared_pre_hours_min_low(*window, dropna=True), shared)
+        AB_data = v1.get_shared_AB_data(start, end - timedelta(hours=1), Decimal(1), Decimal(1))
+        self.assertIs(v2.get_shared_AB_data(start, end - timedelta(hours=1), Decimal(1), Decimal(1)), AB_data)
+
+        private = make_handler(BarReader(bars))
+        private.get_range_data_hours(start, end, 'left')
+        pd.testing.assert_series_equal(private.get_shared_pre_hours_min_low(*window, dropna=True), shared)
+        pd.testing.assert_frame_equal(
+            private.get_shared_AB_data(start, end - timedelta(hours=1), Decimal(1), Decimal(1)), AB_data)
+
+
+if __name__ == '__main__':
+    unittest.main()